@@ -0,0 +1,99 @@
+"""
+Asyncio handler of the scheduler agent.
+
+``lambda_handler`` takes the same batches as the one in lambda_function.py but
+runs them on the container's event loop (see aio.py). The batch's invitations
+are grouped as by the coalescer and published concurrently with an asyncio
+SNS client (``notifications.publish_async``), without waiting out
+NOTIFY_WINDOW_MS. Each record's result is then produced as its own awaitable
+delivery, so the batch ends with its slowest record rather than after one
+flush per record.
+
+Deploy it with ``async_handler.lambda_handler`` as the function's handler, or
+run it locally with ``workers/agent_worker.py --asyncio``.
+"""
+import asyncio
+import json
+import os
+
+import aio
+import backends
+import memory_profile
+from lambda_function import INPUT_TOPIC, build_meeting, complete_meeting_info
+from notifications import NOTIFY_GROUP_BY, publish_async
+from resilience import ResilientCall
+from retry_pipeline import route_failure
+from scheduler_agent import NOTIFY_COALESCE, SNS_TIMEOUT_SECONDS, notification_fields, produce_event_to_kafka_async
+
+# SNS publish is not idempotent, so it is never hedged
+_sns_publish_call = ResilientCall("sns-publish", hedge=False, timeout_s=SNS_TIMEOUT_SECONDS)
+
+
+async def get_sns_client():
+    return await aio.shared("sns", lambda: backends.async_aws_client("sns"))
+
+
+async def handle_batch(event):
+    """
+    Notify and answer a batch's meetings.
+
+    Returns:
+        int: Records routed for retry
+    """
+    failed = 0
+
+    async def park(events, e):
+        # Park the record on a retry tier (or the DLQ) and carry on with the batch
+        nonlocal failed
+        await asyncio.to_thread(
+            route_failure, events['payload']['value'], e, INPUT_TOPIC, "scheduler", events['payload'].get('attempt', 0)
+        )
+        failed += 1
+
+    meetings = []
+    for events in event:
+        try:
+            meetings.append((events, build_meeting(events['payload']['value'])))
+        except Exception as e:
+            await park(events, e)
+
+    # Retries whose invitation already went out only need their Kafka result
+    pending = [
+        (events['payload']['value']['message_id'], notification_fields(meeting_info))
+        for events, meeting_info in meetings if not events['payload']['value'].get('notification_id')
+    ]
+    notifications = {}
+    if pending:
+        notifications = await publish_async(
+            await get_sns_client(), os.environ['SNS_ARN'], _sns_publish_call, pending,
+            # NOTIFY_COALESCE=false keeps one message per meeting, still sent in batches
+            NOTIFY_GROUP_BY if NOTIFY_COALESCE else "meeting"
+        )
+
+    async def finish(events, meeting_info):
+        schedule_event = events['payload']['value']
+        if schedule_event.get('notification_id'):
+            notification = (schedule_event['notification_id'], None)
+        else:
+            notification = notifications[schedule_event['message_id']]
+        try:
+            await produce_event_to_kafka_async(
+                meeting_info, *complete_meeting_info(schedule_event, meeting_info, notification)
+            )
+        except Exception as e:
+            await park(events, e)
+
+    await aio.gather_records([finish(events, meeting_info) for events, meeting_info in meetings])
+    return failed
+
+
+def lambda_handler(event, context):
+    # Records interleave, so memory is measured for the batch as a whole
+    with memory_profile.stage("batch"):
+        failed = aio.run(handle_batch(event))
+    memory_profile.report()
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps(f'Lambda executed successfully! ({failed} routed for retry)')
+    }
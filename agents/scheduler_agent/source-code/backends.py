@@ -0,0 +1,90 @@
+"""
+Factories for the external clients used by the scheduler agent.
+
+Agent code obtains the SNS (sync, or asyncio for async_handler.py), Schema
+Registry and Kafka clients through these functions instead of constructing
+them directly, so a local run can swap in in-process fakes with
+``configure()`` (see benchmarks/fakes.py).
+"""
+
+
+def _default_sns_client():
+    import boto3
+    return boto3.client('sns')
+
+
+async def _default_async_aws_client(service_name, region_name=None, config=None):
+    from aiobotocore.session import get_session
+    # Entered once and kept for the container's lifetime, like the boto3 clients
+    return await get_session().create_client(service_name, region_name=region_name, config=config).__aenter__()
+
+
+def _default_schema_registry_client(conf):
+    from confluent_kafka.schema_registry import SchemaRegistryClient
+    return SchemaRegistryClient(conf)
+
+
+def _default_avro_serializer(schema_registry_client, schema_str, to_dict=None):
+    from confluent_kafka.schema_registry.avro import AvroSerializer
+    return AvroSerializer(schema_registry_client=schema_registry_client, schema_str=schema_str, to_dict=to_dict)
+
+
+def _default_producer(conf):
+    from confluent_kafka import Producer
+    return Producer(conf)
+
+
+def _default_serializing_producer(conf):
+    from confluent_kafka import SerializingProducer
+    return SerializingProducer(conf)
+
+
+DEFAULTS = {
+    "sns_client": _default_sns_client,
+    "async_aws_client": _default_async_aws_client,
+    "schema_registry_client": _default_schema_registry_client,
+    "avro_serializer": _default_avro_serializer,
+    "producer": _default_producer,
+    "serializing_producer": _default_serializing_producer,
+}
+
+_factories = dict(DEFAULTS)
+
+
+def configure(**factories):
+    """Replace one or more client factories, e.g. ``configure(sns_client=lambda: fake)``."""
+    unknown = set(factories) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown backend(s): {', '.join(sorted(unknown))}")
+    _factories.update(factories)
+
+
+def reset():
+    """Restore the real client factories."""
+    _factories.clear()
+    _factories.update(DEFAULTS)
+
+
+def sns_client():
+    return _factories["sns_client"]()
+
+
+def async_aws_client(service_name, region_name=None, config=None):
+    """Awaitable of an asyncio AWS client (aiobotocore), for the async handlers."""
+    return _factories["async_aws_client"](service_name, region_name=region_name, config=config)
+
+
+def schema_registry_client(conf):
+    return _factories["schema_registry_client"](conf)
+
+
+def avro_serializer(schema_registry_client, schema_str, to_dict=None):
+    return _factories["avro_serializer"](schema_registry_client, schema_str, to_dict)
+
+
+def producer(conf):
+    return _factories["producer"](conf)
+
+
+def serializing_producer(conf):
+    return _factories["serializing_producer"](conf)
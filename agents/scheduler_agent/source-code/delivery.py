@@ -0,0 +1,125 @@
+"""
+Exactly-once delivery of agent responses.
+
+The Lambda sink connector retries a batch that timed out or failed, and the
+worker retries a whole batch when its handler raises, so the same
+``message_id`` can reach a response topic more than once. Downstream, the
+final response join then fans out every duplicate. With ``EXACTLY_ONCE=true``:
+
+- producers are idempotent (``enable.idempotence``, ``acks=all``), so the
+  client's own retries never write a record twice;
+- responses are keyed ``<message_id>:<agent>`` (``response_key``) instead of
+  by ``PARTITION_KEY``, so any redelivery carries the same key;
+- under ``workers/agent_worker.py --exactly-once`` each batch runs in a Kafka
+  transaction on a producer owned by its input partition
+  (``transactional.id`` = ``<group>-<topic>-<partition>``). The batch's
+  responses, retry-tier records and input offsets commit together. A batch
+  that is retried, or replayed after a crash, aborts its earlier writes
+  instead of duplicating them. Read the response topics with
+  ``isolation.level=read_committed``.
+
+The connector commits offsets itself, so a Lambda handler can't join its
+writes to a transaction. On that path, ``Deduplicator`` drops repeated keys
+in Python consumers of the response topics. The README shows the matching
+Flink deduplication.
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import backends
+
+EXACTLY_ONCE = os.getenv("EXACTLY_ONCE", "false").lower() == "true"
+
+# Transactional producer of the batch being processed in this thread, if any
+current_transaction = contextvars.ContextVar("current_transaction", default=None)
+
+
+def kafka_conf():
+    return {
+        'bootstrap.servers': os.getenv("BOOTSTRAP_ENDPOINT"),
+        'sasl.mechanisms': 'PLAIN',
+        'security.protocol': 'SASL_SSL',
+        'sasl.username': os.getenv("KAFKA_API_KEY"),
+        'sasl.password': os.getenv("KAFKA_API_SECRET"),
+    }
+
+
+def producer_conf(conf):
+    """Producer config, made idempotent when EXACTLY_ONCE is set."""
+    if not EXACTLY_ONCE:
+        return conf
+    return dict(conf, **{'enable.idempotence': True, 'acks': 'all'})
+
+
+def response_key(record, agent, fallback):
+    """
+    Key of a response record.
+
+    Args:
+        record (dict): The response
+        agent (str): Agent name
+        fallback (str): Key used without EXACTLY_ONCE (the PARTITION_KEY key)
+
+    Returns:
+        str: ``<message_id>:<agent>`` when EXACTLY_ONCE is set, else ``fallback``
+    """
+    message_id = record.get("message_id")
+    if EXACTLY_ONCE and message_id:
+        return f"{message_id}:{agent}"
+    return fallback
+
+
+def route(producer):
+    """The producer to write with: the batch's transactional producer, if one is active."""
+    return current_transaction.get() or producer
+
+
+def transactional_producer(transactional_id):
+    """
+    Producer for one input partition's transactions, with its transactions initialised.
+
+    Args:
+        transactional_id (str): Stable id of the input partition, e.g. ``<group>-<topic>-<partition>``
+    """
+    producer = backends.producer(dict(producer_conf(kafka_conf()), **{
+        'enable.idempotence': True,
+        'transactional.id': transactional_id,
+    }))
+    producer.init_transactions()
+    return producer
+
+
+class Deduplicator:
+    """
+    Remembers recently seen response keys so a consumer can drop redeliveries.
+
+    Args:
+        max_entries (int): Keys remembered before the oldest is forgotten
+        ttl_seconds (float): How long a key is remembered
+    """
+    def __init__(self, max_entries=100000, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.seen = OrderedDict()
+        self.lock = threading.Lock()
+        self.duplicates = 0
+
+    def is_duplicate(self, key):
+        """True if ``key`` was seen within the TTL; otherwise remember it and return False."""
+        now = time.monotonic()
+        with self.lock:
+            while self.seen and next(iter(self.seen.values())) < now - self.ttl_seconds:
+                self.seen.popitem(last=False)
+            if key in self.seen:
+                self.duplicates += 1
+                return True
+            self.seen[key] = now
+            if len(self.seen) > self.max_entries:
+                self.seen.popitem(last=False)
+            return False
+
+    def stats(self):
+        return {"keys": len(self.seen), "duplicates": self.duplicates}
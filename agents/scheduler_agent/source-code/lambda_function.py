@@ -1,36 +1,106 @@
 import json
-from scheduler_agent import get_calendar_service_from_aws_secret_manager, schedule_meeting, produce_event_to_kafka, ensure_list_of_strings, sns_publisher
+import os
+from concurrent.futures import Future
+from scheduler_agent import get_calendar_service_from_aws_secret_manager, schedule_meeting, produce_event_to_kafka, ensure_list_of_strings, notify, flush_notifications
+from retry_pipeline import NonRetryableError, route_failure
+import memory_profile
 
-def lambda_handler(event, context):
+INPUT_TOPIC = os.getenv("INPUT_TOPIC", "scheduler_agent_input")
+REQUIRED_FIELDS = ['title', 'description', 'location', 'start', 'end', 'attendees', 'user_email',
+                   'message_id', 'session_id', 'employee_id', 'message', 'timestamp']
 
-    for events in event:
-        schedule_event = events['payload']['value']
 
-        meeting_info = {}
-        meeting_info['title'] = schedule_event['title']
-        meeting_info['description'] = schedule_event['description']
-        meeting_info['location'] = schedule_event['location']
-        meeting_info['start'] = schedule_event['start']
-        meeting_info['end'] = schedule_event['end']
-        meeting_info['attendees'] = ensure_list_of_strings(schedule_event['attendees'])
-        meeting_info['organizer'] = schedule_event['user_email']
+def build_meeting(schedule_event):
+    missing = [field for field in REQUIRED_FIELDS if field not in schedule_event]
+    if missing:
+        raise NonRetryableError(f"Missing fields: {', '.join(missing)}")
+
+    meeting_info = {}
+    meeting_info['title'] = schedule_event['title']
+    meeting_info['description'] = schedule_event['description']
+    meeting_info['location'] = schedule_event['location']
+    meeting_info['start'] = schedule_event['start']
+    meeting_info['end'] = schedule_event['end']
+    meeting_info['attendees'] = ensure_list_of_strings(schedule_event['attendees'])
+    meeting_info['organizer'] = schedule_event['user_email']
+    return meeting_info
+
+
+def send_notification(schedule_event, meeting_info):
+    # calendar_service = get_calendar_service_from_aws_secret_manager()
+
+    if schedule_event.get('notification_id'):
+        # A retry whose invitation already went out: only the Kafka result is missing
+        future = Future()
+        future.set_result((schedule_event['notification_id'], None))
+        return future
+    return notify(schedule_event['message_id'], meeting_info)
+
+
+def complete_meeting_info(schedule_event, meeting_info, notification):
+    """
+    Fill in the result record of a meeting once its invitation resolved.
+
+    Returns:
+        tuple: (is_sns_publish_successful, error_message)
+    """
+    event_link, error_message = notification
+    if error_message is None:
+        schedule_event['notification_id'] = event_link
+
+    is_sns_publish_successful = error_message is None
 
-        # calendar_service = get_calendar_service_from_aws_secret_manager()
+    meeting_info['message_id'] = schedule_event['message_id']
+    meeting_info['user_email'] = schedule_event['user_email']
+    meeting_info['session_id'] = schedule_event['session_id']
+    meeting_info['employee_id'] = schedule_event['employee_id']
+    meeting_info['message'] = schedule_event['message']
+    meeting_info['timestamp'] = schedule_event['timestamp']
+    return is_sns_publish_successful, error_message
 
-        event_link, error_message = sns_publisher(meeting_info)
 
-        is_sns_publish_successful = error_message is None
+def finish_record(schedule_event, meeting_info, notification):
+    produce_event_to_kafka(meeting_info, *complete_meeting_info(schedule_event, meeting_info, notification))
+
+
+def process_record(schedule_event):
+    meeting_info = build_meeting(schedule_event)
+    finish_record(schedule_event, meeting_info, send_notification(schedule_event, meeting_info).result())
+
+
+def lambda_handler(event, context):
+
+    failed = 0
+
+    def park(events, e):
+        # Park the record on a retry tier (or the DLQ) and carry on with the batch
+        nonlocal failed
+        route_failure(events['payload']['value'], e, INPUT_TOPIC, "scheduler", events['payload'].get('attempt', 0))
+        failed += 1
+
+    # Queue every invitation of the batch first so they are coalesced into a few
+    # publish_batch calls, then write each record's result as its invitation resolves
+    pending = []
+    for events in event:
+        schedule_event = events['payload']['value']
+        try:
+            with memory_profile.stage("notify"):
+                meeting_info = build_meeting(schedule_event)
+                pending.append((events, meeting_info, send_notification(schedule_event, meeting_info)))
+        except Exception as e:
+            park(events, e)
+    # Nothing else joins this container's window; publish now instead of waiting it out
+    flush_notifications()
 
-        meeting_info['message_id'] = schedule_event['message_id']
-        meeting_info['user_email'] = schedule_event['user_email']
-        meeting_info['session_id'] = schedule_event['session_id']
-        meeting_info['employee_id'] = schedule_event['employee_id']
-        meeting_info['message'] = schedule_event['message']
-        meeting_info['timestamp'] = schedule_event['timestamp']
+    for events, meeting_info, notification in pending:
+        try:
+            with memory_profile.stage("produce"):
+                finish_record(events['payload']['value'], meeting_info, notification.result())
+        except Exception as e:
+            park(events, e)
+    memory_profile.report()
 
-        produce_event_to_kafka(meeting_info, is_sns_publish_successful, error_message)
-    
     return {
         'statusCode': 200,
-        'body': json.dumps('Lambda executed successfully!')
+        'body': json.dumps(f'Lambda executed successfully! ({failed} routed for retry)')
     }
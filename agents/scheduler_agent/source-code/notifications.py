@@ -0,0 +1,326 @@
+"""
+Coalesced meeting notifications published through the SNS batch API.
+
+Every scheduled meeting used to be one ``sns.publish`` call, and every
+subscriber got one email per meeting. During an all-hands or team-wide burst
+that means dozens of calls and emails within seconds. The coalescer instead
+collects invitations from concurrent handler calls for up to
+``NOTIFY_WINDOW_MS`` (or until ``NOTIFY_MAX_PENDING`` are waiting) and groups
+them:
+
+- ``topic`` (default): one digest per window for the topic's subscribers;
+- ``attendee``: one digest per attendee, with an ``attendee`` message
+  attribute for subscription filter policies;
+- ``meeting``: one message per meeting, as before, but still batched.
+
+Each group is rendered from precompiled templates and becomes one entry of a
+``publish_batch`` call (up to 10 entries and 256 KiB per call). The results of
+each entry, including partial failures, are mapped back to the ``message_id``
+of every meeting in that group.
+
+``publish_async()`` is the same grouping for async_handler.py, where one
+batch's meetings are published together with an asyncio SNS client.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from string import Template
+
+import aio
+
+NOTIFY_GROUP_BY = os.getenv("NOTIFY_GROUP_BY", "topic")
+NOTIFY_WINDOW_MS = float(os.getenv("NOTIFY_WINDOW_MS", "250"))
+NOTIFY_MAX_PENDING = int(os.getenv("NOTIFY_MAX_PENDING", "100"))
+# A Lambda container runs one batch at a time, so no other caller can join the
+# window: the handler flushes once its batch is queued. The worker turns this
+# off when it runs batches on several threads, which then share the window
+NOTIFY_FLUSH_PER_BATCH = os.getenv("NOTIFY_FLUSH_PER_BATCH", "true").lower() == "true"
+# Meetings listed in one digest
+NOTIFY_MAX_GROUP = int(os.getenv("NOTIFY_MAX_GROUP", "20"))
+GROUP_BY_MODES = ("topic", "attendee", "meeting")
+# SNS PublishBatch limits
+MAX_BATCH_ENTRIES = 10
+MAX_BATCH_BYTES = 256 * 1024
+
+INVITATION_TEMPLATE = Template(
+    "Subject: 🗓️ Meeting Invitation: $title\n\n"
+    "You are invited to the following meeting:\n\n"
+    "$details\n\n"
+    "Please add this to your calendar. If you have any questions, feel free to reply to this email.\n\n"
+    "— This message was generated by an AI scheduling agent."
+)
+DIGEST_TEMPLATE = Template(
+    "Subject: 🗓️ $count Meeting Invitations\n\n"
+    "You are invited to the following meetings:\n\n"
+    "$details\n\n"
+    "Please add these to your calendar. If you have any questions, feel free to reply to this email.\n\n"
+    "— This message was generated by an AI scheduling agent."
+)
+DETAILS_TEMPLATE = Template(
+    "Title: $title\n"
+    "Description: $description\n"
+    "Location: $location\n"
+    "Organizer: $organizer\n"
+    "Start Time: $start_time\n"
+    "End Time: $end_time\n\n"
+    "Attendees:\n$attendees"
+)
+
+
+def render(fields_list):
+    """
+    Message for one group of meetings.
+
+    Args:
+        fields_list (list[dict]): Display fields of each meeting (title, description,
+            location, organizer, start_time, end_time, attendees)
+
+    Returns:
+        str: The invitation, or a digest for several meetings
+    """
+    details = [
+        DETAILS_TEMPLATE.substitute(fields, attendees="\n".join(f"- {email}" for email in fields["attendees"]))
+        for fields in fields_list
+    ]
+    if len(details) == 1:
+        return INVITATION_TEMPLATE.substitute(title=fields_list[0]["title"], details=details[0])
+    return DIGEST_TEMPLATE.substitute(count=len(details), details="\n\n----------\n\n".join(details))
+
+
+def group_meetings(items, group_by=NOTIFY_GROUP_BY, max_group=NOTIFY_MAX_GROUP):
+    """
+    Split pending meetings into notification groups.
+
+    Args:
+        items (list[tuple]): (message_id, fields) of each pending meeting
+        group_by (str): topic, attendee or meeting
+        max_group (int): Meetings per group
+
+    Returns:
+        list[tuple]: (attendee or None, [(message_id, fields), ...])
+    """
+    if group_by not in GROUP_BY_MODES:
+        raise ValueError(f"Unknown NOTIFY_GROUP_BY {group_by!r}; use one of {', '.join(GROUP_BY_MODES)}")
+    if group_by == "meeting":
+        return [(None, [item]) for item in items]
+    groups = OrderedDict()
+    for message_id, fields in items:
+        recipients = fields["attendees"] if group_by == "attendee" else [None]
+        for recipient in dict.fromkeys(recipients):
+            groups.setdefault(recipient, []).append((message_id, fields))
+    return [
+        (recipient, members[start:start + max_group])
+        for recipient, members in groups.items()
+        for start in range(0, len(members), max_group)
+    ]
+
+
+def batch_entries(groups):
+    """
+    PublishBatch entries for the groups, split into calls within SNS's limits.
+
+    Returns:
+        list[list[tuple]]: Per call, (entry, message_ids) pairs
+    """
+    calls = []
+    current, size = [], 0
+    for index, (recipient, members) in enumerate(groups):
+        entry = {"Id": f"n{index}", "Message": render([fields for _, fields in members])}
+        if recipient:
+            entry["MessageAttributes"] = {"attendee": {"DataType": "String", "StringValue": recipient}}
+        entry_size = len(json.dumps(entry).encode("utf-8"))
+        if current and (len(current) == MAX_BATCH_ENTRIES or size + entry_size > MAX_BATCH_BYTES):
+            calls.append(current)
+            current, size = [], 0
+        current.append((entry, [message_id for message_id, _ in members]))
+        size += entry_size
+    if current:
+        calls.append(current)
+    return calls
+
+
+def failed_response(call, error):
+    """PublishBatch response failing every entry of a call that raised."""
+    return {"Failed": [{"Id": entry["Id"], "Message": str(error)} for entry, _ in call]}
+
+
+def collect_results(call, response, delivered, errors):
+    """
+    Map a PublishBatch response back onto the meetings of each entry.
+
+    Args:
+        call (list[tuple]): (entry, message_ids) pairs of the call
+        response (dict): The publish_batch response
+        delivered (dict): message_id -> SNS message ids, updated
+        errors (dict): message_id -> first error message, updated
+    """
+    message_ids = {entry["Id"]: ids for entry, ids in call}
+    for success in response.get("Successful", []):
+        for message_id in message_ids[success["Id"]]:
+            delivered.setdefault(message_id, []).append(success["MessageId"])
+    for failure in response.get("Failed", []):
+        for message_id in message_ids[failure["Id"]]:
+            errors.setdefault(message_id, failure.get("Message") or failure.get("Code") or "Publish failed")
+
+
+def notification_result(message_id, delivered, errors):
+    """(SNS message id(s), error message) of a meeting."""
+    if message_id in errors:
+        return None, errors[message_id]
+    return ",".join(delivered.get(message_id, [])) or None, None
+
+
+async def publish_async(sns, topic_arn, publish_call, items, group_by=NOTIFY_GROUP_BY):
+    """
+    Publish the notifications of one batch with an asyncio SNS client.
+
+    The batch is the coalescing window here: its meetings are grouped as by
+    the coalescer and the publish_batch calls are sent concurrently, with no
+    wait for other callers.
+
+    Args:
+        sns: Client from ``backends.async_aws_client("sns")``
+        topic_arn (str): Topic the notifications go to
+        publish_call (ResilientCall): Breaker and timeout around publish_batch
+        items (list[tuple]): (message_id, fields) of each meeting
+        group_by (str): topic, attendee or meeting
+
+    Returns:
+        dict: message_id -> (SNS message id(s), error message)
+    """
+    groups = group_meetings(items, group_by)
+    calls = batch_entries(groups)
+
+    async def send(call):
+        async def publish_batch(**kwargs):
+            async with aio.limit("sns"):
+                return await sns.publish_batch(**kwargs)
+        try:
+            return await publish_call.call_async(
+                publish_batch,
+                TopicArn=topic_arn,
+                PublishBatchRequestEntries=[entry for entry, _ in call]
+            )
+        except Exception as e:
+            return failed_response(call, e)
+
+    delivered = {}
+    errors = {}
+    for call, response in zip(calls, await asyncio.gather(*(send(call) for call in calls))):
+        collect_results(call, response, delivered, errors)
+    print(f"Published {len(items)} meeting notification(s) as {len(groups)} message(s) "
+          f"in {len(calls)} call(s)")
+    return {message_id: notification_result(message_id, delivered, errors) for message_id, _ in items}
+
+
+class NotificationCoalescer:
+    """
+    Collects meeting notifications from concurrent callers and publishes them in batches.
+
+    Args:
+        get_client (callable): Returns the SNS client
+        topic_arn (str): Topic the notifications go to
+        publish_call (ResilientCall): Breaker and timeout around publish_batch
+        group_by (str): topic, attendee or meeting
+        window_ms (float): Time the first pending notification waits for others
+        max_pending (int): Pending notifications that trigger a flush before the window ends
+    """
+    def __init__(self, get_client, topic_arn, publish_call, group_by=NOTIFY_GROUP_BY, window_ms=NOTIFY_WINDOW_MS,
+                 max_pending=NOTIFY_MAX_PENDING):
+        if group_by not in GROUP_BY_MODES:
+            raise ValueError(f"Unknown NOTIFY_GROUP_BY {group_by!r}; use one of {', '.join(GROUP_BY_MODES)}")
+        self.get_client = get_client
+        self.topic_arn = topic_arn
+        self.publish_call = publish_call
+        self.group_by = group_by
+        self.window_s = window_ms / 1000
+        self.max_pending = max_pending
+        self.pending = []
+        self.first_pending_at = None
+        self.condition = threading.Condition()
+        self.thread = None
+        self.meetings = 0
+        self.api_calls = 0
+
+    def submit(self, message_id, fields):
+        """
+        Queue a meeting's notification.
+
+        Args:
+            message_id (str): The scheduling request's message_id
+            fields (dict): Display fields of the meeting
+
+        Returns:
+            Future: Resolves to (SNS message id(s), error message)
+        """
+        future = Future()
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="notification-coalescer", daemon=True)
+                self.thread.start()
+            if not self.pending:
+                self.first_pending_at = time.monotonic()
+            self.pending.append((message_id, fields, future))
+            self.condition.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.pending:
+                        remaining = self.first_pending_at + self.window_s - time.monotonic()
+                        if remaining <= 0 or len(self.pending) >= self.max_pending:
+                            break
+                        self.condition.wait(remaining)
+                    else:
+                        self.condition.wait()
+                pending, self.pending = self.pending, []
+            self._publish_pending(pending)
+
+    def flush(self):
+        """Publish every pending notification now, in the calling thread, instead of waiting out the window."""
+        with self.condition:
+            pending, self.pending = self.pending, []
+        if pending:
+            self._publish_pending(pending)
+
+    def _publish_pending(self, pending):
+        try:
+            self.publish(pending)
+        except Exception as e:
+            for _, _, future in pending:
+                if not future.done():
+                    future.set_result((None, str(e)))
+
+    def publish(self, pending):
+        """Publish pending notifications and resolve each caller's future."""
+        sns = self.get_client()
+        groups = group_meetings([(message_id, fields) for message_id, fields, _ in pending], self.group_by)
+        calls = batch_entries(groups)
+        delivered = {}
+        errors = {}
+        for call in calls:
+            try:
+                response = self.publish_call.call(
+                    sns.publish_batch,
+                    TopicArn=self.topic_arn,
+                    PublishBatchRequestEntries=[entry for entry, _ in call]
+                )
+            except Exception as e:
+                response = failed_response(call, e)
+            self.api_calls += 1
+            collect_results(call, response, delivered, errors)
+
+        self.meetings += len(pending)
+        print(f"Published {len(pending)} meeting notification(s) as {len(groups)} message(s) "
+              f"in {len(calls)} call(s)")
+        for message_id, _, future in pending:
+            future.set_result(notification_result(message_id, delivered, errors))
+
+    def stats(self):
+        return {"meetings": self.meetings, "api_calls": self.api_calls}
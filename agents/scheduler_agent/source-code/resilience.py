@@ -0,0 +1,260 @@
+"""
+Hedged requests and circuit breakers for calls to remote dependencies.
+
+``ResilientCall`` wraps one dependency (e.g. the SNS publish):
+
+- Hedging: if the first attempt hasn't answered by the dependency's recent
+  p95 latency, a second identical attempt is started and whichever finishes
+  first wins. Hedges are capped at a fraction of calls so a slow dependency
+  doesn't receive double the load. Only use it for idempotent reads.
+- Circuit breaker: after ``failure_threshold`` consecutive failures the
+  breaker opens and calls fail fast (or go to the fallback) for
+  ``reset_timeout_s``; then a single half-open probe decides whether to close
+  it again or to stay open.
+
+``call_async()`` does the same for a coroutine function on the running event
+loop (see aio.py); the losing or timed-out attempt is cancelled.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="resilience")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the dependency's breaker is open."""
+
+
+class LatencyTracker:
+    """Sliding window of recent latencies."""
+    def __init__(self, window=200):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, latency_ms):
+        with self.lock:
+            self.samples.append(latency_ms)
+
+    def percentile(self, fraction):
+        with self.lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class CircuitBreaker:
+    """
+    Per-dependency breaker: closed -> open after consecutive failures,
+    open -> half-open after a timeout, half-open -> closed on a successful probe.
+
+    Args:
+        name (str): Dependency name, for logs
+        failure_threshold (int): Consecutive failures that open the breaker
+        reset_timeout_s (float): Time the breaker stays open before probing
+    """
+    def __init__(self, name, failure_threshold=5, reset_timeout_s=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go to the dependency now."""
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout_s:
+                self.state = HALF_OPEN
+                self.probing = False
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != CLOSED:
+                print(f"Circuit for {self.name} closed")
+            self.state = CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    print(f"Circuit for {self.name} opened after {self.failures} failure(s)")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+
+class ResilientCall:
+    """
+    Hedging, timeout and circuit breaking around calls to one dependency.
+
+    Args:
+        name (str): Dependency name, for logs
+        hedge (bool): Send a second attempt after the hedge delay; idempotent calls only
+        hedge_percentile (float): Recent latency percentile used as the hedge delay
+        min_hedge_delay_ms (float): Lower bound of the hedge delay
+        max_hedge_ratio (float): Maximum share of recent calls that may be hedged
+        min_samples (int): Calls observed before hedging starts
+        timeout_s (float): Time after which a call counts as failed
+        failure_threshold (int): Consecutive failures that open the breaker
+        reset_timeout_s (float): Time the breaker stays open before probing
+    """
+    def __init__(self, name, hedge=True, hedge_percentile=0.95, min_hedge_delay_ms=50.0, max_hedge_ratio=0.1,
+                 min_samples=20, timeout_s=10.0, failure_threshold=5, reset_timeout_s=30.0):
+        self.name = name
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay_ms = min_hedge_delay_ms
+        self.max_hedge_ratio = max_hedge_ratio
+        self.min_samples = min_samples
+        self.timeout_s = timeout_s
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout_s)
+        self.latency = LatencyTracker()
+        self.recent_hedges = deque(maxlen=200)
+        self.lock = threading.Lock()
+
+    def hedge_delay_s(self):
+        """Delay before hedging, or None while hedging is off, unwarmed or over budget."""
+        if not self.hedge or len(self.latency) < self.min_samples:
+            return None
+        with self.lock:
+            if self.recent_hedges and sum(self.recent_hedges) / len(self.recent_hedges) >= self.max_hedge_ratio:
+                return None
+        return max(self.min_hedge_delay_ms, self.latency.percentile(self.hedge_percentile)) / 1000.0
+
+    def call(self, fn, *args, fallback=None, **kwargs):
+        """
+        Run ``fn(*args, **kwargs)`` under the breaker.
+
+        Args:
+            fn (callable): The dependency call
+            fallback (callable): Called with the exception when the call fails
+                or the breaker is open; without one the exception is raised
+
+        Returns:
+            The result of ``fn``, or of ``fallback`` when degraded
+        """
+        if not self.breaker.allow():
+            error = CircuitOpenError(f"Circuit for {self.name} is open")
+            if fallback is None:
+                raise error
+            return fallback(error)
+
+        started = time.monotonic()
+        try:
+            result = self._attempt(fn, args, kwargs, started)
+        except Exception as e:
+            self.breaker.record_failure()
+            if fallback is None:
+                raise
+            print(f"{self.name} failed ({e!r}); serving degraded result")
+            return fallback(e)
+        self.breaker.record_success()
+        self.latency.record((time.monotonic() - started) * 1000)
+        return result
+
+    def _attempt(self, fn, args, kwargs, started):
+        attempts = [_executor.submit(fn, *args, **kwargs)]
+        delay_s = self.hedge_delay_s()
+        hedged = False
+        if delay_s is not None:
+            done, _ = wait(attempts, timeout=min(delay_s, self.timeout_s))
+            if not done:
+                attempts.append(_executor.submit(fn, *args, **kwargs))
+                hedged = True
+        with self.lock:
+            self.recent_hedges.append(1 if hedged else 0)
+
+        error = None
+        pending = set(attempts)
+        while pending:
+            remaining = self.timeout_s - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error or TimeoutError(f"{self.name} did not answer within {self.timeout_s}s")
+
+    async def call_async(self, fn, *args, fallback=None, **kwargs):
+        """
+        ``call()`` for a coroutine function, awaited on the running event loop.
+
+        Args:
+            fn (callable): Coroutine function making the dependency call
+            fallback (callable): Called with the exception when the call fails
+                or the breaker is open; without one the exception is raised
+
+        Returns:
+            The result of ``fn``, or of ``fallback`` when degraded
+        """
+        if not self.breaker.allow():
+            error = CircuitOpenError(f"Circuit for {self.name} is open")
+            if fallback is None:
+                raise error
+            return fallback(error)
+
+        started = time.monotonic()
+        try:
+            result = await self._attempt_async(fn, args, kwargs, started)
+        except Exception as e:
+            self.breaker.record_failure()
+            if fallback is None:
+                raise
+            print(f"{self.name} failed ({e!r}); serving degraded result")
+            return fallback(e)
+        self.breaker.record_success()
+        self.latency.record((time.monotonic() - started) * 1000)
+        return result
+
+    async def _attempt_async(self, fn, args, kwargs, started):
+        attempts = [asyncio.ensure_future(fn(*args, **kwargs))]
+        try:
+            delay_s = self.hedge_delay_s()
+            hedged = False
+            if delay_s is not None:
+                done, _ = await asyncio.wait(attempts, timeout=min(delay_s, self.timeout_s))
+                if not done:
+                    attempts.append(asyncio.ensure_future(fn(*args, **kwargs)))
+                    hedged = True
+            with self.lock:
+                self.recent_hedges.append(1 if hedged else 0)
+
+            error = None
+            pending = set(attempts)
+            while pending:
+                remaining = self.timeout_s - (time.monotonic() - started)
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        return attempt.result()
+                    error = attempt.exception()
+            raise error or TimeoutError(f"{self.name} did not answer within {self.timeout_s}s")
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
@@ -0,0 +1,111 @@
+"""
+Per-record failure handling: retry topics with backoff tiers, then a dead-letter topic.
+
+A record that fails is written to ``<input_topic>-retry-<delay>s`` for its
+next attempt, and after the last tier to ``<input_topic>-dlq``. Records that
+can never succeed (``NonRetryableError``) go straight to the dead-letter
+topic. The handler then carries on with the rest of the batch, so one poison
+record neither fails nor replays the records around it.
+
+Retry and dead-letter records are JSON envelopes (the original record plus
+attempt, delay and error metadata), so they don't depend on the input
+topic's schema. ``workers/agent_worker.py --retries`` consumes the retry
+tiers and re-runs the handler once a record's delay has passed. It is the
+only consumer of the tiers: with the Lambda Sink Connector alone, routed
+records wait in them until such a worker runs.
+"""
+import base64
+import json
+import os
+import time
+import traceback
+
+import backends
+from delivery import producer_conf, route
+
+RETRY_TIERS_SECONDS = [int(s) for s in os.getenv("RETRY_TIERS_SECONDS", "30,300,1800").split(",") if s]
+
+_producer = None
+
+
+class NonRetryableError(Exception):
+    """A record that will fail the same way on every attempt, e.g. a malformed payload."""
+
+
+def retry_topic(input_topic, delay_seconds):
+    return f"{input_topic}-retry-{delay_seconds}s"
+
+
+def dead_letter_topic(input_topic):
+    return f"{input_topic}-dlq"
+
+
+def retry_topics(input_topic):
+    return [retry_topic(input_topic, delay) for delay in RETRY_TIERS_SECONDS]
+
+
+def _json_default(value):
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode("ascii")
+    return str(value)
+
+
+def get_producer():
+    global _producer
+    if _producer is None:
+        _producer = backends.producer(producer_conf({
+            'bootstrap.servers': os.getenv("BOOTSTRAP_ENDPOINT"),
+            'sasl.mechanisms': 'PLAIN',
+            'security.protocol': 'SASL_SSL',
+            'sasl.username': os.getenv("KAFKA_API_KEY"),
+            'sasl.password': os.getenv("KAFKA_API_SECRET"),
+        }))
+    return _producer
+
+
+def route_failure(record, error, input_topic, agent, attempt=0):
+    """
+    Send a failed record to its next retry tier, or to the dead-letter topic.
+
+    Args:
+        record (dict): The input record that failed
+        error (Exception): What it failed with
+        input_topic (str): Topic the record was consumed from originally
+        agent (str): Agent name, recorded in the envelope
+        attempt (int): Attempts already retried (0 for a first failure)
+
+    Returns:
+        str: Topic the record was written to
+    """
+    retryable = not isinstance(error, NonRetryableError)
+    if retryable and attempt < len(RETRY_TIERS_SECONDS):
+        delay = RETRY_TIERS_SECONDS[attempt]
+        topic = retry_topic(input_topic, delay)
+    else:
+        delay = None
+        topic = dead_letter_topic(input_topic)
+
+    now_ms = int(time.time() * 1000)
+    envelope = {
+        "agent": agent,
+        "original_topic": input_topic,
+        "attempt": attempt + 1,
+        "not_before": now_ms + delay * 1000 if delay is not None else None,
+        "failed_at": now_ms,
+        "retryable": retryable,
+        "error_type": type(error).__name__,
+        "error_message": str(error),
+        "stack_trace": "".join(traceback.format_exception(type(error), error, error.__traceback__))[-4000:],
+        "record": record,
+    }
+    key = str(record.get("message_id") or "") if isinstance(record, dict) else ""
+
+    producer = route(get_producer())
+    producer.produce(
+        topic=topic,
+        key=key.encode("utf-8") if key else None,
+        value=json.dumps(envelope, default=_json_default).encode("utf-8")
+    )
+    producer.flush()
+    print(f"Routed failed record {key or '<no message_id>'} to {topic} (attempt {attempt + 1}): {error}")
+    return topic
@@ -1,15 +1,16 @@
 import json
 import os
 import boto3
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 import uuid
+from concurrent.futures import Future
 
-from confluent_kafka.schema_registry import SchemaRegistryClient
-from confluent_kafka.schema_registry.avro import AvroSerializer
-from confluent_kafka import SerializingProducer
-from confluent_kafka.serialization import StringSerializer
+import aio
+import backends
+from resilience import ResilientCall
+from notifications import NOTIFY_FLUSH_PER_BATCH, NotificationCoalescer, render
+from partitioning import partition_key
+from confluent_kafka.serialization import StringSerializer, SerializationContext, MessageField
+from delivery import producer_conf, response_key, route
 
 from datetime import datetime, timedelta
 
@@ -27,6 +28,11 @@ def format_datetime(iso_str, hours=0):
 
 
 def get_calendar_service_from_aws_secret_manager():
+    # The Google client libraries take tens of MB once imported; only the calendar path needs them
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from googleapiclient.discovery import build
+
     secret_name = os.environ['AWS_SECRET_NAME']
     region = os.environ['AWS_REGION_NAME']
 
@@ -112,36 +118,43 @@ def schedule_meeting(service, meeting_info):
         return (None, str(e))
 
 
+# SNS publish is not idempotent, so it is never hedged; the breaker makes an
+# unhealthy SNS fail fast instead of stalling every record for the full timeout
+SNS_TIMEOUT_SECONDS = float(os.getenv("SNS_TIMEOUT_SECONDS", "5"))
+_sns = None
+_sns_publish_call = ResilientCall("sns-publish", hedge=False, timeout_s=SNS_TIMEOUT_SECONDS)
+
+
+def get_sns_client():
+    global _sns
+    if _sns is None:
+        _sns = backends.sns_client()
+    return _sns
+
+
+def notification_fields(meeting):
+    """Display fields of a meeting for the notification templates."""
+    return {
+        'title': meeting['title'],
+        'description': meeting['description'],
+        'location': meeting['location'],
+        'organizer': meeting['organizer'],
+        'start_time': format_datetime(meeting['start']),
+        'end_time': format_datetime(meeting['end'], hours=1),
+        'attendees': meeting['attendees'],
+    }
+
+
 def sns_publisher(meeting):
     try:
-        sns = boto3.client('sns')
+        sns = get_sns_client()
 
         sns_arn = os.environ['SNS_ARN']
 
-        # Format start and end times
-        start_time = format_datetime(meeting['start'])
-        end_time = format_datetime(meeting['end'], hours=1)
-
-        # Format attendee list
-        attendees = "\n".join(f"- {email}" for email in meeting['attendees'])
-
-        # Construct message
-        message = (
-            f"Subject: 🗓️ Meeting Invitation: {meeting['title']}\n\n"
-            f"You are invited to the following meeting:\n\n"
-            f"Title: {meeting['title']}\n"
-            f"Description: {meeting['description']}\n"
-            f"Location: {meeting['location']}\n"
-            f"Organizer: {meeting['organizer']}\n"
-            f"Start Time: {start_time}\n"
-            f"End Time: {end_time}\n\n"
-            f"Attendees:\n{attendees}\n\n"
-            "Please add this to your calendar. If you have any questions, feel free to reply to this email.\n\n"
-            "— This message was generated by an AI scheduling agent."
-        )
+        message = render([notification_fields(meeting)])
 
-
-        response = sns.publish(
+        response = _sns_publish_call.call(
+                sns.publish,
                 TopicArn=sns_arn,
                 Message=message
             )
@@ -156,14 +169,55 @@ def sns_publisher(meeting):
         print(f"Exception occurred in sns_publisher fn : {e}")
         return (None, str(e))
 
+
+# Invitations are coalesced and sent with publish_batch (see notifications.py);
+# NOTIFY_COALESCE=false publishes each one on its own, as before
+NOTIFY_COALESCE = os.getenv("NOTIFY_COALESCE", "true").lower() == "true"
+_coalescer = None
+
+
+def get_coalescer():
+    global _coalescer
+    if _coalescer is None:
+        _coalescer = NotificationCoalescer(get_sns_client, os.environ['SNS_ARN'], _sns_publish_call)
+    return _coalescer
+
+
+def notify(message_id, meeting):
+    """
+    Send a meeting's invitation.
+
+    Args:
+        message_id (str): The scheduling request's message_id
+        meeting (dict): The meeting info
+
+    Returns:
+        Future: Resolves to (SNS message id(s), error message)
+    """
+    if not NOTIFY_COALESCE:
+        future = Future()
+        future.set_result(sns_publisher(meeting))
+        return future
+    return get_coalescer().submit(message_id, notification_fields(meeting))
+
+
+def flush_notifications():
+    """Publish the invitations queued so far, unless batches share the coalescing window (NOTIFY_FLUSH_PER_BATCH)."""
+    if NOTIFY_COALESCE and NOTIFY_FLUSH_PER_BATCH and _coalescer is not None:
+        _coalescer.flush()
+
 def to_dict(order, ctx):
     return order
 
 
-def produce_event_to_kafka(event, status, error_message):
-    try:
-        topic_name = os.environ['scheduler_agent_result_topic']
+# Reused across invocations of a warm container (or a long-running worker)
+_producer = None
+_avro_serializer = None
+
 
+def get_producer():
+    global _producer, _avro_serializer
+    if _producer is None:
         bootstrap_server = os.environ['BOOTSTRAP_ENDPOINT']
         kafka_api_key = os.environ['KAFKA_API_KEY']
         kafka_api_secret = os.environ['KAFKA_API_SECRET']
@@ -178,38 +232,78 @@ def produce_event_to_kafka(event, status, error_message):
         }
 
         schema_str = open("scheduler_agent_response.avsc", "r").read()
-        schema_registry_client = SchemaRegistryClient(schema_registry_conf)
+        schema_registry_client = backends.schema_registry_client(schema_registry_conf)
 
         # string_serializer = StringSerializer('utf_8')
-        avro_serializer = AvroSerializer(
+        _avro_serializer = backends.avro_serializer(
             schema_registry_client=schema_registry_client,
             schema_str=schema_str,
             to_dict=to_dict
         )
 
         # Kafka producer configuration
-        producer_conf = {
+        kafka_conf = {
             'bootstrap.servers': bootstrap_server,
             'sasl.mechanisms': 'PLAIN',
             'security.protocol': 'SASL_SSL',
             'sasl.username': kafka_api_key,
             'sasl.password': kafka_api_secret,
-            # 'key.serializer': string_serializer,
-            'value.serializer': avro_serializer
         }
 
-        producer = SerializingProducer(producer_conf)
-        
-        event['status'] = 'success' if status else 'failed'
-        event['error_message'] = error_message
+        # Values are serialized per record, so a batch's transactional producer can write them too
+        _producer = backends.producer(producer_conf(kafka_conf))
+    return _producer, _avro_serializer
+
 
-        producer.produce(topic=topic_name, value=event)
+def event_message(event, status, error_message):
+    """Topic, key and Avro value of a scheduling result."""
+    topic_name = os.environ['scheduler_agent_result_topic']
+    _, avro_serializer = get_producer()
+
+    event['status'] = 'success' if status else 'failed'
+    event['error_message'] = error_message
+    return (
+        topic_name,
+        response_key(event, "scheduler", partition_key(event)),
+        avro_serializer(event, SerializationContext(topic_name, MessageField.VALUE))
+    )
+
+
+def produce_event_to_kafka(event, status, error_message):
+    try:
+        producer, _ = get_producer()
+        producer = route(producer)
+        topic_name, key, value = event_message(event, status, error_message)
+
+        producer.produce(
+            topic=topic_name,
+            key=key,
+            value=value
+        )
         producer.flush()
 
         print(f"Produced event to {topic_name} topic successfully!")
 
     except Exception as e:
         print(f"Exception occurred in produce_event_to_kafka fn : {e}")
+        # Let the handler route the record for retry instead of dropping it
+        raise
+
+
+async def produce_event_to_kafka_async(event, status, error_message):
+    """``produce_event_to_kafka`` for async_handler.py: waits for this record's delivery instead of a flush."""
+    try:
+        producer, _ = get_producer()
+        producer = aio.async_producer(route(producer))
+        topic_name, key, value = event_message(event, status, error_message)
+
+        await producer.produce(topic_name, value=value, key=key)
+
+        print(f"Produced event to {topic_name} topic successfully!")
+
+    except Exception as e:
+        print(f"Exception occurred in produce_event_to_kafka_async fn : {e}")
+        raise
 
 
 def ensure_list_of_strings(value):
@@ -0,0 +1,190 @@
+"""
+Asyncio runtime for the agents' async handlers (``async_handler.py``).
+
+The synchronous handlers block on every Mongo, Bedrock, SNS and Kafka round
+trip, so a connector batch takes the sum of its records' latencies. The async
+handlers run the records of a batch as concurrent tasks instead. A batch of
+I/O-bound records then takes about as long as its slowest record.
+
+- One event loop per container (``get_loop``) runs in a daemon thread and
+  outlives invocations, as the clients bound to it (``shared``) do.
+  ``run()`` hands a coroutine to it from the synchronous Lambda entry point
+  and carries the caller's context variables (the worker's partition and
+  transaction) along.
+- Each dependency has a bounded semaphore (``limit``), sized by
+  ``AIO_MONGO_CONCURRENCY``, ``AIO_BEDROCK_CONCURRENCY``,
+  ``AIO_SNS_CONCURRENCY`` and ``AIO_KAFKA_CONCURRENCY``, so a large batch can't
+  flood one backend.
+- ``AsyncProducer`` makes a confluent-kafka producer awaitable. ``produce()``
+  resolves when the broker acknowledges the record, instead of blocking in
+  ``flush()``.
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import inspect
+import os
+import threading
+
+AIO_LIMITS = {
+    "mongo": int(os.getenv("AIO_MONGO_CONCURRENCY", "16")),
+    "bedrock": int(os.getenv("AIO_BEDROCK_CONCURRENCY", "8")),
+    "sns": int(os.getenv("AIO_SNS_CONCURRENCY", "8")),
+    "kafka": int(os.getenv("AIO_KAFKA_CONCURRENCY", "64")),
+}
+# How often pending Kafka deliveries are polled for
+KAFKA_POLL_INTERVAL_S = float(os.getenv("AIO_KAFKA_POLL_MS", "5")) / 1000
+
+_loop = None
+_loop_lock = threading.Lock()
+_semaphores = {}
+_producers = {}
+_clients = {}
+_client_locks = {}
+
+
+def get_loop():
+    """The container's event loop, started in a daemon thread on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="agent-event-loop", daemon=True).start()
+            _loop = loop
+    return _loop
+
+
+def run(coroutine):
+    """
+    Run a coroutine on the container's event loop and wait for its result.
+
+    Args:
+        coroutine: The coroutine, typically a handler's batch
+
+    Returns:
+        The coroutine's result; its exception is raised here
+    """
+    loop = get_loop()
+    context = contextvars.copy_context()
+    result = concurrent.futures.Future()
+
+    def start():
+        task = loop.create_task(coroutine, context=context)
+
+        def finished(task):
+            if task.cancelled():
+                result.cancel()
+            elif task.exception() is not None:
+                result.set_exception(task.exception())
+            else:
+                result.set_result(task.result())
+        task.add_done_callback(finished)
+
+    loop.call_soon_threadsafe(start)
+    return result.result()
+
+
+def limit(dependency):
+    """Bounded semaphore of a dependency (mongo, bedrock, sns or kafka); use inside the loop."""
+    semaphore = _semaphores.get(dependency)
+    if semaphore is None:
+        semaphore = _semaphores[dependency] = asyncio.BoundedSemaphore(AIO_LIMITS[dependency])
+    return semaphore
+
+
+async def shared(name, create):
+    """
+    Container-wide async client, created once on first use.
+
+    Args:
+        name (str): Client name, e.g. "mongo" or "sns"
+        create (callable): Returns the client, or an awaitable of it
+            (e.g. ``backends.async_aws_client``)
+
+    Returns:
+        The client; later calls return the same one
+    """
+    if name not in _clients:
+        lock = _client_locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            if name not in _clients:
+                client = create()
+                if inspect.isawaitable(client):
+                    client = await client
+                _clients[name] = client
+    return _clients[name]
+
+
+async def gather_records(coroutines):
+    """Run one coroutine per record concurrently; returns each result or exception, in order."""
+    return await asyncio.gather(*coroutines, return_exceptions=True)
+
+
+class AsyncProducer:
+    """
+    Awaitable wrapper of a confluent-kafka Producer.
+
+    Args:
+        producer (Producer): The producer; its delivery callbacks are served by polling from the loop
+    """
+    def __init__(self, producer):
+        self.producer = producer
+        self.pending = 0
+        self.polling = False
+
+    async def produce(self, topic, value=None, key=None, **kwargs):
+        """
+        Produce a record and wait for its delivery.
+
+        Returns:
+            Message: The delivered message
+
+        Raises:
+            KafkaException: If the delivery failed
+        """
+        loop = asyncio.get_running_loop()
+        delivered = loop.create_future()
+
+        def on_delivery(err, msg):
+            if delivered.done():
+                return
+            if err is not None:
+                from confluent_kafka import KafkaException
+                delivered.set_exception(KafkaException(err))
+            else:
+                delivered.set_result(msg)
+
+        async with limit("kafka"):
+            while True:
+                try:
+                    self.producer.produce(topic=topic, value=value, key=key, on_delivery=on_delivery, **kwargs)
+                    break
+                except BufferError:
+                    # Local queue full: let deliveries drain
+                    self.producer.poll(0)
+                    await asyncio.sleep(KAFKA_POLL_INTERVAL_S)
+            self.pending += 1
+            if not self.polling:
+                self.polling = True
+                loop.create_task(self._poll())
+            try:
+                return await delivered
+            finally:
+                self.pending -= 1
+
+    async def _poll(self):
+        # Delivery callbacks run inside poll(), on the loop's thread
+        try:
+            while self.pending:
+                self.producer.poll(0)
+                await asyncio.sleep(KAFKA_POLL_INTERVAL_S)
+        finally:
+            self.polling = False
+
+
+def async_producer(producer):
+    """The AsyncProducer of ``producer``, one per producer (e.g. per transactional producer)."""
+    wrapper = _producers.get(id(producer))
+    if wrapper is None or wrapper.producer is not producer:
+        wrapper = _producers[id(producer)] = AsyncProducer(producer)
+    return wrapper
@@ -0,0 +1,258 @@
+"""
+Asyncio handler of the search agent.
+
+``lambda_handler`` takes the same batches as the one in lambda_function.py but
+runs their records concurrently on the container's event loop (see aio.py), so
+a batch takes about as long as its slowest record instead of the sum of them.
+
+- Vector search and the employee lookup go through an asyncio MongoClient,
+  query embedding through an asyncio bedrock-runtime client and the response
+  through an awaitable producer, each bounded by its dependency's semaphore.
+- Vector search keeps its hedging, timeout and circuit breaker
+  (``ResilientCall.call_async``) and the degraded fallbacks of the sync path.
+- Hybrid search needs the BM25 index built with the synchronous client, so with
+  SEARCH_MODE=hybrid the retrieval itself runs in a worker thread.
+
+Deploy it with ``async_handler.lambda_handler`` as the function's handler, or
+run it locally with ``workers/agent_worker.py --asyncio``.
+"""
+import asyncio
+import json
+import os
+import time
+
+import aio
+import backends
+import lambda_function
+import memory_profile
+from avro_kafka_producer import produce_context_result_async
+from embeddings import BedrockTitanEmbedder, decode_query_vector
+from lambda_function import (
+    DB_NAME, EMPLOYEE_COLLECTION_NAME, INPUT_TOPIC, MONGO_HEDGE, MONGO_TIMEOUT_SECONDS, MONGO_URI,
+    PARTITIONED_SEARCH, PARTITIONS_TTL_SECONDS, SEARCH_MODE, SESSION_REUSE, VECTOR_BACKEND, active_collection,
+    degraded_results, local_vector_search, remember_results, speculation_for, summarize, turn_from_session,
+    vector_search_pipeline
+)
+# Speculative dispatch only reads and stores, so the worker runs the sync handler for it
+from lambda_function import speculate_handler
+from metering import current_usage, metered, publish_rollup, set_query_type
+from partitioned_search import CorpusPartitions, partitioned_search_async
+from partitioning import get_affinity_cache
+from resilience import ResilientCall
+from retry_pipeline import NonRetryableError, route_failure
+from session_store import get_session_store, new_turn
+from speculation import SPECULATIVE_DISPATCH, get_speculative_store
+
+# Reused across invocations of a warm container; the clients themselves are held by aio.shared()
+_partitions = None
+_partitions_built_at = 0.0
+_partitions_lock = asyncio.Lock()
+# Shared with lambda_function.py's lookups
+_employee_locations = get_affinity_cache("employee_location")
+_vector_search_call = ResilientCall(
+    "mongo-vector-search",
+    hedge=MONGO_HEDGE,
+    timeout_s=MONGO_TIMEOUT_SECONDS
+)
+
+
+async def get_mongo_client():
+    return await aio.shared("mongo", lambda: backends.async_mongo_client(MONGO_URI))
+
+
+async def get_bedrock_client():
+    return await aio.shared("bedrock", lambda: backends.async_aws_client(
+        "bedrock-runtime", region_name=os.getenv("AWS_REGION", "us-east-1")
+    ))
+
+
+async def embed_query(text):
+    """Embed a query that arrived without an embedding; only Bedrock is awaited, the local embedders run inline."""
+    embedder = lambda_function.get_query_embedder()
+    if not isinstance(embedder, BedrockTitanEmbedder):
+        return embedder.embed(text)
+    client = await get_bedrock_client()
+    async with aio.limit("bedrock"):
+        return await embedder.embed_async(client, text)
+
+
+async def vector_search(client, input_vector, limit, regions=None, categories=None):
+    pipeline = vector_search_pipeline(input_vector, limit, regions, categories)
+    async with aio.limit("mongo"):
+        cursor = await client[DB_NAME][active_collection()[0]].aggregate(pipeline)
+        return await cursor.to_list()
+
+
+async def resilient_vector_search(client, query, input_vector, limit, regions=None, categories=None):
+    if VECTOR_BACKEND == "local":
+        return local_vector_search(input_vector, limit, regions, categories)
+    return await _vector_search_call.call_async(
+        vector_search, client, input_vector, limit, regions, categories,
+        fallback=lambda error: degraded_results(query, limit, regions, categories, input_vector)
+    )
+
+
+async def get_partitions(client):
+    """Region and category partitions of the active collection, refreshed after the TTL."""
+    global _partitions, _partitions_built_at
+
+    async with _partitions_lock:
+        if _partitions is None or time.time() - _partitions_built_at > PARTITIONS_TTL_SECONDS:
+            collection_name, _, _, _ = active_collection()
+            try:
+                async with aio.limit("mongo"):
+                    documents = await client[DB_NAME][collection_name].find(
+                        {}, {"_id": 0, "region": 1, "category": 1, "title": 1}
+                    ).to_list()
+            except Exception as e:
+                if _partitions is None:
+                    raise
+                print(f"Partition refresh failed, keeping the previous partitions: {e}")
+                return _partitions
+            _partitions = CorpusPartitions(documents)
+            _partitions_built_at = time.time()
+    return _partitions
+
+
+async def get_employee_location(client, employee_id):
+    """Region and country of an employee, cached per employee."""
+    if not employee_id:
+        return None, None
+    location = _employee_locations.get(employee_id)
+    if location is None:
+        try:
+            async with aio.limit("mongo"):
+                employee = await client[DB_NAME][EMPLOYEE_COLLECTION_NAME].find_one(
+                    {"employee_id": employee_id},
+                    {"_id": 0, "work_location.region": 1, "work_location.country": 1}
+                ) or {}
+        except Exception as e:
+            # Search without the region filter rather than fail; retried on the next query
+            print(f"Employee lookup failed for {employee_id}: {e}")
+            return None, None
+        work_location = employee.get("work_location", {})
+        location = (work_location.get("region"), work_location.get("country"))
+        _employee_locations.put(employee_id, location)
+    return location
+
+
+async def partition_filters(client, query, employee_id):
+    """Region and category pre-filters for a question, or None for each to search everything."""
+    if not PARTITIONED_SEARCH:
+        return None, None
+    # Independent lookups, so they run side by side
+    partitions, location = await asyncio.gather(
+        get_partitions(client), get_employee_location(client, employee_id), return_exceptions=True
+    )
+    if isinstance(partitions, Exception):
+        print(f"Partition lookup failed, searching the whole corpus: {partitions}")
+        return None, None
+    regions = partitions.question_regions(query, *location)
+    categories = partitions.categories_for(query)
+    return regions or None, categories or None
+
+
+async def search(client, query, input_vector, employee_id, limit):
+    if SEARCH_MODE == "hybrid":
+        return await asyncio.to_thread(
+            lambda_function.search, lambda_function.get_mongo_client(), query, input_vector, employee_id, limit
+        )
+    regions, categories = await partition_filters(client, query, employee_id)
+    return await partitioned_search_async(
+        lambda regions, categories: resilient_vector_search(client, query, input_vector, limit, regions, categories),
+        limit, regions, categories, id_field=active_collection()[2]
+    )
+
+
+async def process_record(client, search_event, limit):
+    query = search_event.get('query')
+    message = search_event.get('message')
+    employee_id = search_event.get('employee_id')
+    message_id = search_event.get('message_id', 'unknown')
+    user_email = search_event.get('user_email', 'unknown')
+    session_id = search_event.get('session_id')
+    # Retrieved from queries while the orchestrator was routing
+    speculative = get_speculative_store().take(message_id, "search") if SPECULATIVE_DISPATCH else None
+    speculative = speculation_for(speculative, query, message_id)
+    input_vector = decode_query_vector(search_event.get('query_embedding'))
+    if speculative is None and SPECULATIVE_DISPATCH and not input_vector and query:
+        # search_agent_input consumed directly, without the embedding step
+        input_vector = await embed_query(query)
+    if speculative is None and (not input_vector or not isinstance(input_vector, list)):
+        raise NonRetryableError("Invalid or missing 'query_embedding' in request.")
+
+    session_store = get_session_store() if session_id and SESSION_REUSE else None
+    turns = session_store.get(session_id) if session_store else []
+    earlier_turn = turn_from_session(query, turns) if speculative is None else None
+    set_query_type("speculative_hit" if speculative is not None else
+                   "retrieval" if earlier_turn is None else "session_reuse")
+    if speculative is not None:
+        print(f"Using documents retrieved speculatively for {message_id}")
+        search_result_summary = speculative["search_result_summary"]
+        document_ids = speculative["document_ids"]
+    elif earlier_turn is None:
+        results = await search(client, query, input_vector, employee_id, limit)
+        remember_results(query, results)
+        search_result_summary = "\n-----\n".join(summarize(results))
+        document_ids = [doc.get(active_collection()[2]) for doc in results]
+    else:
+        print(f"Reusing documents retrieved earlier in session {session_id}")
+        search_result_summary = earlier_turn["contexts"]["search_result_summary"]
+        document_ids = earlier_turn.get("entities", {}).get("document_ids", [])
+    if session_store:
+        session_store.append(session_id, new_turn(
+            query,
+            entities={"employee_id": employee_id, "document_ids": document_ids},
+            contexts={"search_result_summary": search_result_summary}
+        ))
+
+    await produce_context_result_async(
+        query=query,
+        message=message,
+        message_id=message_id,
+        employee_id=employee_id,
+        user_email=user_email,
+        session_id=session_id,
+        search_result_summary=search_result_summary,
+        usage=current_usage()
+    )
+    print(f"Results for {message_id}: {len(document_ids)} documents, {len(search_result_summary)} characters")
+
+
+async def handle_batch(event):
+    """
+    Process a batch's records concurrently.
+
+    Returns:
+        int: Records routed for retry
+    """
+    client = await get_mongo_client()
+    _, _, _, limit = active_collection()
+
+    async def handle(events):
+        search_event = events['payload']['value']
+        try:
+            with metered("search", search_event.get('message_id'), search_event.get('session_id')):
+                await process_record(client, search_event, limit)
+            return True
+        except Exception as e:
+            # Park the record on a retry tier (or the DLQ) and carry on with the batch
+            await asyncio.to_thread(
+                route_failure, search_event, e, INPUT_TOPIC, "search", events['payload'].get('attempt', 0)
+            )
+            return False
+
+    handled = await aio.gather_records([handle(events) for events in event])
+    return sum(1 for ok in handled if ok is not True)
+
+
+def lambda_handler(event, context):
+    # Records interleave, so memory is measured for the batch as a whole
+    with memory_profile.stage("batch"):
+        failed = aio.run(handle_batch(event))
+    publish_rollup()
+    memory_profile.report()
+    return {
+        'statusCode': 200,
+        'body': json.dumps(f'Messages sent to Kafka! ({failed} routed for retry)')
+    }
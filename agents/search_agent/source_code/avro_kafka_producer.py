@@ -1,10 +1,14 @@
 import os
-from uuid import uuid4
 from datetime import datetime
-from confluent_kafka import Producer
 from confluent_kafka.serialization import StringSerializer, SerializationContext, MessageField
-from confluent_kafka.schema_registry import SchemaRegistryClient
-from confluent_kafka.schema_registry.avro import AvroSerializer
+import aio
+import backends
+from delivery import producer_conf, response_key, route
+from partitioning import partition_key
+
+# Reused across invocations of a warm container (or a long-running worker)
+_producer = None
+_avro_serializer = None
 
 class ContextResult:
     """
@@ -19,9 +23,13 @@ class ContextResult:
         message (str): Original full message
         session_id (str): Session ID of the conversation
         search_result_summary (str): Search result summary extracted from vector DB
+        usage (dict): Model calls, tokens, latency and cost spent on the query
     """
+    __slots__ = ("message_id", "employee_id", "timestamp", "query", "user_email", "message", "session_id",
+                 "search_result_summary", "usage")
+
     def __init__(self, message_id, employee_id, timestamp, query, user_email,
-                 message, session_id, search_result_summary=None):
+                 message, session_id, search_result_summary=None, usage=None):
         self.message_id = message_id
         self.employee_id = employee_id
         self.timestamp = timestamp
@@ -30,6 +38,7 @@ class ContextResult:
         self.message = message
         self.session_id = session_id
         self.search_result_summary = search_result_summary
+        self.usage = usage
 
 def context_result_to_dict(result, ctx):
     return {
@@ -40,7 +49,8 @@ def context_result_to_dict(result, ctx):
         "user_email": result.user_email,
         "message": result.message,
         "session_id": result.session_id,
-        "search_result_summary": result.search_result_summary
+        "search_result_summary": result.search_result_summary,
+        "usage": result.usage
     }
 
 def delivery_report(err, msg):
@@ -59,55 +69,85 @@ def build_summary_from_doc(doc):
         f"{doc.get('content')}"
     )
 
-def produce_context_result(search_result_summary, query, message, message_id, employee_id, user_email, session_id):
-    topic = os.getenv("search_agent_result_topic")
-    schema_file = "search_agent_response.avsc"
+def get_producer():
+    global _producer, _avro_serializer
+    if _producer is None:
+        schema_file = "search_agent_response.avsc"
 
-    # Load Avro schema
-    schema_path = os.path.join(os.path.dirname(__file__), schema_file)
-    with open(schema_path) as f:
-        schema_str = f.read()
+        # Load Avro schema
+        schema_path = os.path.join(os.path.dirname(__file__), schema_file)
+        with open(schema_path) as f:
+            schema_str = f.read()
 
-    # Schema Registry setup
-    sr_conf = {
-        'url': os.getenv("SCHEMA_REGISTRY_ENDPOINT"),
-        'basic.auth.user.info': f"{os.getenv('SCHEMA_REGISTRY_API_KEY')}:{os.getenv('SCHEMA_REGISTRY_API_SECRET')}"
-    }
-    schema_registry_client = SchemaRegistryClient(sr_conf)
+        # Schema Registry setup
+        sr_conf = {
+            'url': os.getenv("SCHEMA_REGISTRY_ENDPOINT"),
+            'basic.auth.user.info': f"{os.getenv('SCHEMA_REGISTRY_API_KEY')}:{os.getenv('SCHEMA_REGISTRY_API_SECRET')}"
+        }
+        schema_registry_client = backends.schema_registry_client(sr_conf)
 
-    avro_serializer = AvroSerializer(
-        schema_registry_client,
-        schema_str,
-        context_result_to_dict
-    )
+        _avro_serializer = backends.avro_serializer(
+            schema_registry_client,
+            schema_str,
+            context_result_to_dict
+        )
+
+        kafka_conf = {
+            'bootstrap.servers': os.getenv("BOOTSTRAP_ENDPOINT"),
+            'sasl.mechanisms': 'PLAIN',
+            'security.protocol': 'SASL_SSL',
+            'sasl.username': os.getenv("KAFKA_API_KEY"),
+            'sasl.password': os.getenv("KAFKA_API_SECRET"),
+        }
+        _producer = backends.producer(producer_conf(kafka_conf))
+    return _producer, _avro_serializer
+
+def context_result_message(search_result_summary, query, message, message_id, employee_id, user_email, session_id,
+                           usage=None):
+    """
+    Topic, key and Avro value of a context result.
+
+    Returns:
+        tuple: (topic, key, value)
+    """
+    topic = os.getenv("search_agent_result_topic")
+    _, avro_serializer = get_producer()
     string_serializer = StringSerializer('utf_8')
 
-    producer_conf = {
-        'bootstrap.servers': os.getenv("BOOTSTRAP_ENDPOINT"),
-        'sasl.mechanisms': 'PLAIN',
-        'security.protocol': 'SASL_SSL',
-        'sasl.username': os.getenv("KAFKA_API_KEY"),
-        'sasl.password': os.getenv("KAFKA_API_SECRET"),
-    }
-    producer = Producer(producer_conf)
+    result_obj = ContextResult(
+        message_id=message_id,
+        employee_id=employee_id,
+        timestamp=int(datetime.utcnow().timestamp() * 1000),
+        query=query,
+        user_email=user_email,
+        message=message,
+        session_id=session_id,
+        search_result_summary=search_result_summary,
+        usage=usage
+    )
+
+    record = context_result_to_dict(result_obj, None)
+    return (
+        topic,
+        string_serializer(response_key(record, "search", partition_key(record))),
+        avro_serializer(result_obj, SerializationContext(topic, MessageField.VALUE))
+    )
+
+def produce_context_result(search_result_summary, query, message, message_id, employee_id, user_email, session_id,
+                           usage=None):
+    producer, _ = get_producer()
+    producer = route(producer)
 
     try:
-        result_obj = ContextResult(
-            message_id=message_id,
-            employee_id=employee_id,
-            timestamp=int(datetime.utcnow().timestamp() * 1000),
-            query=query,
-            user_email=user_email,
-            message=message,
-            session_id=session_id,
-            search_result_summary=search_result_summary
+        topic, key, value = context_result_message(
+            search_result_summary, query, message, message_id, employee_id, user_email, session_id, usage
         )
 
         # Produce
         producer.produce(
             topic=topic,
-            key=string_serializer(str(uuid4())),
-            value=avro_serializer(result_obj, SerializationContext(topic, MessageField.VALUE)),
+            key=key,
+            value=value,
             on_delivery=delivery_report
         )
 
@@ -117,3 +157,20 @@ def produce_context_result(search_result_summary, query, message, message_id, em
     except Exception as e:
         print(f"Error producing message: {e}")
         raise
+
+async def produce_context_result_async(search_result_summary, query, message, message_id, employee_id, user_email,
+                                       session_id, usage=None):
+    """``produce_context_result`` for async_handler.py: waits for this record's delivery instead of a flush."""
+    producer, _ = get_producer()
+    producer = aio.async_producer(route(producer))
+
+    try:
+        topic, key, value = context_result_message(
+            search_result_summary, query, message, message_id, employee_id, user_email, session_id, usage
+        )
+        delivery_report(None, await producer.produce(topic, value=value, key=key))
+        print(f"Sent context result for message_id: {message_id}")
+
+    except Exception as e:
+        print(f"Error producing message: {e}")
+        raise
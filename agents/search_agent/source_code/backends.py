@@ -0,0 +1,100 @@
+"""
+Factories for the external clients used by the search agent.
+
+Agent code obtains MongoDB, Bedrock, Schema Registry and Kafka clients, and the
+asyncio MongoDB and AWS clients of async_handler.py, through these functions
+instead of constructing them directly, so a local run can swap in in-process
+fakes with ``configure()`` (see benchmarks/fakes.py).
+"""
+
+
+def _default_mongo_client(uri):
+    from pymongo import MongoClient
+    return MongoClient(uri)
+
+
+def _default_bedrock_runtime(region_name=None, config=None):
+    import boto3
+    return boto3.client(service_name="bedrock-runtime", region_name=region_name, config=config)
+
+
+def _default_async_mongo_client(uri):
+    from pymongo import AsyncMongoClient
+    return AsyncMongoClient(uri)
+
+
+async def _default_async_aws_client(service_name, region_name=None, config=None):
+    from aiobotocore.session import get_session
+    # Entered once and kept for the container's lifetime, like the boto3 clients
+    return await get_session().create_client(service_name, region_name=region_name, config=config).__aenter__()
+
+
+def _default_schema_registry_client(conf):
+    from confluent_kafka.schema_registry import SchemaRegistryClient
+    return SchemaRegistryClient(conf)
+
+
+def _default_avro_serializer(schema_registry_client, schema_str, to_dict=None):
+    from confluent_kafka.schema_registry.avro import AvroSerializer
+    return AvroSerializer(schema_registry_client, schema_str, to_dict)
+
+
+def _default_producer(conf):
+    from confluent_kafka import Producer
+    return Producer(conf)
+
+
+DEFAULTS = {
+    "mongo_client": _default_mongo_client,
+    "bedrock_runtime": _default_bedrock_runtime,
+    "async_mongo_client": _default_async_mongo_client,
+    "async_aws_client": _default_async_aws_client,
+    "schema_registry_client": _default_schema_registry_client,
+    "avro_serializer": _default_avro_serializer,
+    "producer": _default_producer,
+}
+
+_factories = dict(DEFAULTS)
+
+
+def configure(**factories):
+    """Replace one or more client factories, e.g. ``configure(mongo_client=lambda uri: fake)``."""
+    unknown = set(factories) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown backend(s): {', '.join(sorted(unknown))}")
+    _factories.update(factories)
+
+
+def reset():
+    """Restore the real client factories."""
+    _factories.clear()
+    _factories.update(DEFAULTS)
+
+
+def mongo_client(uri):
+    return _factories["mongo_client"](uri)
+
+
+def bedrock_runtime(region_name=None, config=None):
+    return _factories["bedrock_runtime"](region_name=region_name, config=config)
+
+
+def async_mongo_client(uri):
+    return _factories["async_mongo_client"](uri)
+
+
+def async_aws_client(service_name, region_name=None, config=None):
+    """Awaitable of an asyncio AWS client (aiobotocore), for the async handlers."""
+    return _factories["async_aws_client"](service_name, region_name=region_name, config=config)
+
+
+def schema_registry_client(conf):
+    return _factories["schema_registry_client"](conf)
+
+
+def avro_serializer(schema_registry_client, schema_str, to_dict=None):
+    return _factories["avro_serializer"](schema_registry_client, schema_str, to_dict)
+
+
+def producer(conf):
+    return _factories["producer"](conf)
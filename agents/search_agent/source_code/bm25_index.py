@@ -0,0 +1,150 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+# Hyphenated identifiers such as POL-LEAVE-NA-001 are kept as one token in
+# addition to their parts, so an exact policy ID outranks partial matches.
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+
+DEFAULT_FIELD_WEIGHTS = {"title": 3, "category": 2, "region": 2, "content": 1}
+
+
+def tokenize(text):
+    tokens = []
+    for token in _TOKEN_PATTERN.findall((text or "").lower()):
+        tokens.append(token)
+        if "-" in token:
+            tokens.extend(token.split("-"))
+    return tokens
+
+
+def normalize_region(value):
+    """Canonical form used to compare region names ("Asia/Pacific" == "Asia Pacific")."""
+    return " ".join(tokenize(value))
+
+
+class BM25Index:
+    """
+    In-memory inverted index scored with Okapi BM25.
+
+    Documents are indexed over title, category, region and content; a field
+    weight repeats that field's terms, which boosts title and metadata matches
+    over body text.
+
+    Args:
+        documents (list[dict]): Documents to index (kept by reference)
+        id_field (str): Field holding the unique document identifier
+        field_weights (dict): Field name to term repetition factor
+        k1 (float): BM25 term frequency saturation
+        b (float): BM25 length normalisation
+    """
+    def __init__(self, documents, id_field="policyId", field_weights=None, k1=1.2, b=0.75):
+        self.documents = documents
+        self.id_field = id_field
+        self.field_weights = field_weights or DEFAULT_FIELD_WEIGHTS
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.doc_lengths = []
+        self.exact_ids = defaultdict(list)
+        self.by_region = defaultdict(set)
+        self.by_category = defaultdict(set)
+
+        for doc_index, document in enumerate(documents):
+            terms = Counter()
+            for field, weight in self.field_weights.items():
+                for token in tokenize(document.get(field)):
+                    terms[token] += weight
+            for term, frequency in terms.items():
+                self.postings[term].append((doc_index, frequency))
+            self.doc_lengths.append(sum(terms.values()))
+            self.exact_ids[str(document.get(id_field)).lower()].append(doc_index)
+            if id_field != "policyId" and document.get("policyId"):
+                self.exact_ids[str(document["policyId"]).lower()].append(doc_index)
+            self.by_region[normalize_region(document.get("region"))].add(doc_index)
+            self.by_category[normalize_region(document.get("category"))].add(doc_index)
+
+        self.avg_doc_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+        self.idf = {
+            term: math.log(1 + (len(documents) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def candidates(self, regions=None, categories=None):
+        """
+        Return the set of document positions matching the metadata filters, or
+        None when no filter is given.
+        """
+        allowed = None
+        if regions:
+            allowed = set()
+            for region in regions:
+                allowed |= self.by_region.get(normalize_region(region), set())
+        if categories:
+            in_category = set()
+            for category in categories:
+                in_category |= self.by_category.get(normalize_region(category), set())
+            allowed = in_category if allowed is None else allowed & in_category
+        return allowed
+
+    def exact_match(self, query):
+        """
+        Return the documents whose identifier (or policyId, for passages)
+        appears verbatim in the query, in index order. Empty if none does.
+        """
+        matches = []
+        seen = set()
+        for token in _TOKEN_PATTERN.findall((query or "").lower()):
+            for doc_index in self.exact_ids.get(token, []):
+                doc_id = self.documents[doc_index].get(self.id_field)
+                if doc_id not in seen:
+                    seen.add(doc_id)
+                    matches.append(self.documents[doc_index])
+        return matches
+
+    def search(self, query, k=10, allowed=None):
+        """
+        Rank documents for ``query``.
+
+        Args:
+            query (str): Free text query
+            k (int): Maximum number of hits
+            allowed (set[int]): Optional document positions to restrict scoring to
+
+        Returns:
+            list[tuple[dict, float]]: (document, score) pairs, best first
+        """
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_index, frequency in self.postings[term]:
+                if allowed is not None and doc_index not in allowed:
+                    continue
+                length_norm = 1 - self.b + self.b * self.doc_lengths[doc_index] / self.avg_doc_length
+                scores[doc_index] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.documents[doc_index], score) for doc_index, score in ranked]
+
+
+def reciprocal_rank_fusion(rankings, id_field="policyId", k=60):
+    """
+    Fuse several ranked lists of documents with reciprocal-rank fusion.
+
+    Args:
+        rankings (list[list[dict]]): Ranked document lists, best first
+        id_field (str): Field identifying the same document across lists
+        k (int): RRF damping constant
+
+    Returns:
+        list[tuple[dict, float]]: (document, fused score) pairs, best first
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking):
+            doc_id = document.get(id_field)
+            entry = fused.setdefault(doc_id, [document, 0.0])
+            entry[1] += 1.0 / (k + rank + 1)
+    return sorted((tuple(entry) for entry in fused.values()), key=lambda item: item[1], reverse=True)
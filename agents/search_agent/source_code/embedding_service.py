@@ -0,0 +1,235 @@
+import json
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+from cachetools import TTLCache
+from confluent_kafka.serialization import StringSerializer, SerializationContext, MessageField
+
+import backends
+from embeddings import get_embedder, pack_vector
+from partitioning import partition_key
+
+# Same prefix the `search_embeddings` Flink statement used with ML_PREDICT
+EMBEDDING_TEXT_PREFIX = "queryFromEmployee: "
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(text):
+    """Cache key for a question: case, surrounding punctuation and spacing do not change its meaning."""
+    return _WHITESPACE.sub(" ", (text or "").lower()).strip(" ?!.")
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent embedding requests into batched embedder calls.
+
+    A background thread drains the request queue, waiting at most
+    ``max_wait_ms`` after the first request for up to ``max_batch_size``
+    texts. Identical texts already waiting or in flight share one future.
+
+    Args:
+        embedder: Object exposing ``embed_batch(texts)``
+        max_batch_size (int): Upper bound on texts per embedder call
+        max_wait_ms (float): How long the first request waits for company
+    """
+    def __init__(self, embedder, max_batch_size=32, max_wait_ms=5.0):
+        self.embedder = embedder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text):
+        with self._lock:
+            future = self._pending.get(text)
+            if future is None:
+                future = Future()
+                self._pending[text] = future
+                self._queue.put(text)
+        return future
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            with self._lock:
+                futures = [self._pending.pop(text) for text in batch]
+            self.batches += 1
+            try:
+                vectors = list(self.embedder.embed_batch([EMBEDDING_TEXT_PREFIX + text for text in batch]))
+                if len(vectors) != len(batch):
+                    raise ValueError(f"Embedder returned {len(vectors)} vectors for {len(batch)} texts")
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, vector in zip(futures, vectors):
+                future.set_result(vector)
+
+
+class EmbeddingService:
+    """
+    Query embedding stage with a normalised-text cache in front of the batcher.
+
+    Args:
+        embedder: Object exposing ``embed_batch(texts)``
+        cache_size (int): Maximum number of cached question embeddings
+        cache_ttl_seconds (int): How long a cached embedding stays valid
+        max_batch_size (int): Upper bound on texts per embedder call
+        max_wait_ms (float): Batching window of the coalescer
+    """
+    def __init__(self, embedder, cache_size=10000, cache_ttl_seconds=86400,
+                 max_batch_size=32, max_wait_ms=5.0):
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl_seconds)
+        self.batcher = EmbeddingBatcher(embedder, max_batch_size, max_wait_ms)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def embed_many(self, texts):
+        keys = [normalize_query(text) for text in texts]
+        vectors = [None] * len(keys)
+        futures = {}
+        with self._lock:
+            for position, key in enumerate(keys):
+                cached = self.cache.get(key)
+                if cached is not None:
+                    vectors[position] = cached
+                    self.hits += 1
+                else:
+                    futures[position] = self.batcher.submit(key)
+                    self.misses += 1
+
+        for position, future in futures.items():
+            vectors[position] = future.result()
+        with self._lock:
+            for position in futures:
+                self.cache[keys[position]] = vectors[position]
+        return vectors
+
+    def embed(self, text):
+        return self.embed_many([text])[0]
+
+
+# Reused across invocations of a warm container
+_service = None
+_producer = None
+_avro_serializer = None
+
+
+def get_embedding_service():
+    global _service
+    if _service is None:
+        _service = EmbeddingService(
+            get_embedder(),
+            cache_size=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+            cache_ttl_seconds=int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "86400")),
+            max_batch_size=int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "32")),
+            max_wait_ms=float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5"))
+        )
+    return _service
+
+
+def embedding_record_to_dict(record, ctx):
+    return record
+
+
+def delivery_report(err, msg):
+    if err is not None:
+        print(f"Delivery failed for message {msg.key()}: {err}")
+
+
+def get_producer():
+    global _producer, _avro_serializer
+    if _producer is None:
+        schema_path = os.path.join(os.path.dirname(__file__), "search_embeddings_packed.avsc")
+        with open(schema_path) as f:
+            schema_str = f.read()
+
+        sr_conf = {
+            'url': os.getenv("SCHEMA_REGISTRY_ENDPOINT"),
+            'basic.auth.user.info': f"{os.getenv('SCHEMA_REGISTRY_API_KEY')}:{os.getenv('SCHEMA_REGISTRY_API_SECRET')}"
+        }
+        _avro_serializer = backends.avro_serializer(
+            backends.schema_registry_client(sr_conf),
+            schema_str,
+            embedding_record_to_dict
+        )
+        _producer = backends.producer({
+            'bootstrap.servers': os.getenv("BOOTSTRAP_ENDPOINT"),
+            'sasl.mechanisms': 'PLAIN',
+            'security.protocol': 'SASL_SSL',
+            'sasl.username': os.getenv("KAFKA_API_KEY"),
+            'sasl.password': os.getenv("KAFKA_API_SECRET"),
+            'linger.ms': 5,
+        })
+    return _producer, _avro_serializer
+
+
+def produce_query_embeddings(records):
+    """Produce embedded search records, keyed per PARTITION_KEY, with a single flush."""
+    # Not search_embeddings: its schema, registered by the Flink statement, holds
+    # the vector as an array, which VECTOR_SEARCH_AGG reads
+    topic = os.getenv("search_embeddings_topic", "search_embeddings_packed")
+    producer, avro_serializer = get_producer()
+    string_serializer = StringSerializer('utf_8')
+
+    for record in records:
+        producer.produce(
+            topic=topic,
+            key=string_serializer(partition_key(record)),
+            value=avro_serializer(record, SerializationContext(topic, MessageField.VALUE)),
+            on_delivery=delivery_report
+        )
+    producer.flush()
+
+
+def lambda_handler(event, context):
+    """
+    Embed a connector batch of `search_agent_input` records and produce them to
+    `search_embeddings_packed` with the vector packed as float32 bytes.
+    """
+    service = get_embedding_service()
+    search_events = [events['payload']['value'] for events in event]
+    vectors = service.embed_many([search_event.get('query') or search_event.get('message') for search_event in search_events])
+
+    records = []
+    for search_event, vector in zip(search_events, vectors):
+        records.append({
+            'query': search_event.get('query'),
+            'query_embedding': pack_vector(vector),
+            'message_id': search_event.get('message_id', 'unknown'),
+            'employee_id': search_event.get('employee_id'),
+            'user_email': search_event.get('user_email', 'unknown'),
+            'message': search_event.get('message'),
+            'session_id': search_event.get('session_id'),
+            'timestamp': search_event.get('timestamp'),
+        })
+    produce_query_embeddings(records)
+
+    print(f"Embedded {len(records)} queries (cache hits: {service.hits}, misses: {service.misses}, batches: {service.batcher.batches})")
+    return {
+        'statusCode': 200,
+        'body': json.dumps(f'{len(records)} embeddings sent to Kafka!')
+    }
@@ -0,0 +1,149 @@
+import base64
+import hashlib
+import json
+import math
+import os
+import re
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+EMBEDDING_DIMENSIONS = 1536
+TITAN_EMBED_MODEL_ID = "amazon.titan-embed-text-v1"
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def pack_vector(vector):
+    """Pack an embedding as little-endian float32 bytes (4 bytes per dimension)."""
+    return struct.pack(f"<{len(vector)}f", *vector)
+
+
+def unpack_vector(data):
+    """Inverse of pack_vector."""
+    return list(struct.unpack(f"<{len(data) // 4}f", data))
+
+
+def decode_query_vector(value):
+    """
+    Return a query embedding as a list of floats, whether it arrives as the
+    Avro array produced by ML_PREDICT, packed float32 bytes, or those bytes
+    base64-encoded by the Lambda sink connector's JSON conversion.
+    """
+    if isinstance(value, str):
+        value = base64.b64decode(value)
+    if isinstance(value, (bytes, bytearray)):
+        return unpack_vector(value)
+    return value
+
+
+class BedrockTitanEmbedder:
+    """
+    Embeds text with the Bedrock Titan model used by the `bedrock_embed` Flink model.
+
+    Titan takes a single ``inputText`` per request, so a batch is fanned out
+    over a small thread pool that shares one bedrock-runtime client.
+
+    Args:
+        model_id (str): Bedrock model identifier
+        region_name (str): AWS region of the Bedrock endpoint
+        max_workers (int): Concurrent requests used for one batch
+    """
+    def __init__(self, model_id=TITAN_EMBED_MODEL_ID, region_name=None, max_workers=8):
+        import backends
+
+        self.model_id = model_id
+        self.max_workers = max_workers
+        self.client = backends.bedrock_runtime(region_name=region_name or os.getenv("AWS_REGION", "us-east-1"))
+
+    def embed(self, text):
+        from metering import check_budget, record_call, token_counts
+
+        check_budget()
+        started = time.monotonic()
+        response = self.client.invoke_model(
+            modelId=self.model_id,
+            body=json.dumps({"inputText": text}),
+            contentType="application/json",
+            accept="application/json"
+        )
+        body = json.loads(response["body"].read())
+        record_call(self.model_id, *token_counts(response, body), (time.monotonic() - started) * 1000)
+        return body["embedding"]
+
+    async def embed_async(self, client, text):
+        """
+        ``embed()`` through an asyncio bedrock-runtime client.
+
+        Args:
+            client: Client from ``backends.async_aws_client("bedrock-runtime")``
+            text (str): Text to embed
+        """
+        from metering import check_budget, record_call, token_counts
+
+        check_budget()
+        started = time.monotonic()
+        response = await client.invoke_model(
+            modelId=self.model_id,
+            body=json.dumps({"inputText": text}),
+            contentType="application/json",
+            accept="application/json"
+        )
+        body = json.loads(await response["body"].read())
+        record_call(self.model_id, *token_counts(response, body), (time.monotonic() - started) * 1000)
+        return body["embedding"]
+
+    def embed_batch(self, texts):
+        if len(texts) <= 1:
+            return [self.embed(text) for text in texts]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(texts))) as pool:
+            return list(pool.map(self.embed, texts))
+
+
+class HashingEmbedder:
+    """
+    Deterministic local stand-in for the Bedrock embedder.
+
+    Each token and adjacent token pair is hashed to a signed bucket of a
+    fixed-size vector which is then L2-normalised, so texts sharing vocabulary
+    have a high cosine similarity. Needs no network access or credentials.
+
+    Args:
+        dimensions (int): Length of the produced vectors
+    """
+    def __init__(self, dimensions=EMBEDDING_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def _add_feature(self, vector, feature, weight):
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+        sign = 1.0 if digest[4] & 1 else -1.0
+        vector[bucket] += sign * weight
+
+    def embed(self, text):
+        vector = [0.0] * self.dimensions
+        tokens = _TOKEN_PATTERN.findall((text or "").lower())
+        for token in tokens:
+            self._add_feature(vector, token, 1.0)
+        for first, second in zip(tokens, tokens[1:]):
+            self._add_feature(vector, f"{first} {second}", 0.5)
+        norm = math.sqrt(sum(value * value for value in vector))
+        if norm:
+            vector = [value / norm for value in vector]
+        return vector
+
+    def embed_batch(self, texts):
+        return [self.embed(text) for text in texts]
+
+
+def get_embedder(name=None):
+    """
+    Return the embedder selected by ``name`` or the ``EMBEDDER`` environment
+    variable: ``bedrock`` (default) or ``hashing``.
+    """
+    name = (name or os.getenv("EMBEDDER", "bedrock")).lower()
+    if name == "bedrock":
+        return BedrockTitanEmbedder(model_id=os.getenv("EMBEDDING_MODEL_ID", TITAN_EMBED_MODEL_ID))
+    if name == "hashing":
+        return HashingEmbedder()
+    raise ValueError(f"Unknown embedder: {name}")
@@ -0,0 +1,86 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from bm25_index import normalize_region, reciprocal_rank_fusion
+
+GLOBAL_REGION = "Global"
+LEXICAL_K = 10
+
+# Shared across invocations of a warm container so the vector probe runs
+# alongside the local BM25 scoring without spawning a thread per query.
+_executor = ThreadPoolExecutor(max_workers=4)
+
+
+def region_filter_values(index, *employee_locations):
+    """
+    Map an employee's region/country onto the region values used in the corpus.
+
+    Corpus and HR data spell regions differently ("Asia Pacific" vs
+    "Asia/Pacific"), so values are compared in normalised form and the corpus
+    spelling is returned for use in a Mongo ``$in`` filter. Global policies
+    always apply.
+
+    Args:
+        index (BM25Index): Lexical index over the corpus
+        employee_locations (str): Employee region, country, ...
+
+    Returns:
+        list[str]: Corpus region values, or an empty list when nothing matched
+    """
+    return match_regions({document.get("region") for document in index.documents}, *employee_locations)
+
+
+def match_regions(corpus_regions, *employee_locations):
+    """
+    region_filter_values for a known set of corpus region values.
+
+    Args:
+        corpus_regions (iterable[str]): Region values present in the corpus
+        employee_locations (str): Employee region, country, ...
+
+    Returns:
+        list[str]: Matching corpus region values plus Global, or an empty list
+    """
+    wanted = {normalize_region(location) for location in employee_locations if location}
+    if not wanted:
+        return []
+    matched = {region for region in corpus_regions if region and normalize_region(region) in wanted}
+    if not matched:
+        return []
+    return sorted(matched) + [GLOBAL_REGION]
+
+
+def hybrid_search(query, input_vector, index, vector_search, k, regions=None, categories=None,
+                  lexical_k=LEXICAL_K):
+    """
+    Retrieve documents with BM25 and vector search and fuse them with RRF.
+
+    A query that names a document identifier verbatim is answered from the
+    lexical index alone, skipping the ANN probe.
+
+    Args:
+        query (str): Query text
+        input_vector (list[float]): Query embedding
+        index (BM25Index): Lexical index over the same documents
+        vector_search (callable): ``vector_search(input_vector, limit, regions, categories)``
+            returning ranked documents
+        k (int): Number of documents to return
+        regions (list[str]): Optional region pre-filter
+        categories (list[str]): Optional category pre-filter
+        lexical_k (int): Depth of the BM25 ranking fed into the fusion
+
+    Returns:
+        list[dict]: Fused documents, best first, each carrying a ``score``
+    """
+    exact = index.exact_match(query)
+    if exact:
+        return [dict(document, score=1.0) for document in exact[:k]]
+
+    vector_future = _executor.submit(vector_search, input_vector, max(k, lexical_k), regions, categories)
+    lexical = index.search(query, k=lexical_k, allowed=index.candidates(regions, categories))
+    vector = vector_future.result()
+
+    fused = reciprocal_rank_fusion(
+        [[document for document, _ in lexical], vector],
+        id_field=index.id_field
+    )
+    return [dict(document, score=score) for document, score in fused[:k]]
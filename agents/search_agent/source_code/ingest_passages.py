@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+
+from embeddings import EMBEDDING_DIMENSIONS, get_embedder
+from passages import (
+    PASSAGE_MAX_CHARS,
+    PASSAGE_OVERLAP_CHARS,
+    build_passages,
+    passage_embedding_text,
+)
+
+PASSAGE_COLLECTION_NAME = "knowledge_passages"
+PASSAGE_INDEX_NAME = "knowledge_passage_index"
+VECTOR_FIELD = "contentEmbedding"
+
+
+def load_policies(seed_path):
+    """
+    Load policies from a mongoimport-style JSON array, dropping the stored
+    whole-document embedding and any duplicate policyId.
+    """
+    with open(seed_path) as f:
+        documents = json.load(f)
+
+    policies = {}
+    for document in documents:
+        document.pop("_id", None)
+        document.pop(VECTOR_FIELD, None)
+        policies.setdefault(document["policyId"], document)
+    return list(policies.values())
+
+
+def build_passage_index(policies, embedder, batch_size=16,
+                        max_chars=PASSAGE_MAX_CHARS, overlap_chars=PASSAGE_OVERLAP_CHARS):
+    """
+    Split every policy into passages and embed them in batches.
+
+    Args:
+        policies (list[dict]): Knowledge base policies
+        embedder: Object exposing ``embed_batch(texts)``
+        batch_size (int): Number of passages sent to the embedder per call
+
+    Returns:
+        list[dict]: Passage documents with their ``contentEmbedding``
+    """
+    passages = []
+    for policy in policies:
+        passages.extend(build_passages(policy, max_chars, overlap_chars))
+
+    for start in range(0, len(passages), batch_size):
+        batch = passages[start:start + batch_size]
+        vectors = embedder.embed_batch([passage_embedding_text(passage) for passage in batch])
+        for passage, vector in zip(batch, vectors):
+            passage[VECTOR_FIELD] = vector
+        print(f"Embedded passages {start + 1}-{start + len(batch)} of {len(passages)}")
+    return passages
+
+
+def write_passages_to_mongo(passages, mongo_uri, db_name, collection_name, index_name=None):
+    """Upsert passages by passageId and optionally create the vector search index."""
+    from pymongo import MongoClient, ReplaceOne
+    from pymongo.operations import SearchIndexModel
+
+    client = MongoClient(mongo_uri)
+    collection = client[db_name][collection_name]
+    collection.bulk_write(
+        [ReplaceOne({"passageId": p["passageId"]}, p, upsert=True) for p in passages],
+        ordered=False
+    )
+    collection.delete_many({"passageId": {"$nin": [p["passageId"] for p in passages]}})
+    print(f"Wrote {len(passages)} passages to {db_name}.{collection_name}")
+
+    if index_name and index_name not in [index["name"] for index in collection.list_search_indexes()]:
+        collection.create_search_index(SearchIndexModel(
+            name=index_name,
+            type="vectorSearch",
+            definition={"fields": [
+                {"type": "vector", "path": VECTOR_FIELD,
+                 "numDimensions": EMBEDDING_DIMENSIONS, "similarity": "cosine"},
+                {"type": "filter", "path": "policyId"},
+                {"type": "filter", "path": "region"},
+                {"type": "filter", "path": "category"},
+            ]}
+        ))
+        print(f"Created vector search index {index_name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the passage-level knowledge index.")
+    parser.add_argument("--seed", default=os.path.join(
+        os.path.dirname(__file__), "..", "..", "..", "terraform", "seed", "data.json"))
+    parser.add_argument("--embedder", default=None, help="bedrock (default) or hashing")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--max-chars", type=int, default=PASSAGE_MAX_CHARS)
+    parser.add_argument("--overlap-chars", type=int, default=PASSAGE_OVERLAP_CHARS)
+    parser.add_argument("--output", help="Write passages to this JSON file instead of MongoDB")
+    parser.add_argument("--collection", default=PASSAGE_COLLECTION_NAME)
+    parser.add_argument("--index", default=PASSAGE_INDEX_NAME)
+    args = parser.parse_args()
+
+    policies = load_policies(args.seed)
+    passages = build_passage_index(
+        policies,
+        get_embedder(args.embedder),
+        batch_size=args.batch_size,
+        max_chars=args.max_chars,
+        overlap_chars=args.overlap_chars
+    )
+    print(f"Split {len(policies)} policies into {len(passages)} passages")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(passages, f)
+        print(f"Wrote passages to {args.output}")
+        return
+
+    mongo_uri = f"mongodb+srv://{os.getenv('MONGO_USER')}:{os.getenv('MONGO_PASSWORD')}@{os.getenv('MONGO_HOST')}/"
+    write_passages_to_mongo(passages, mongo_uri, os.getenv("DB_NAME"), args.collection, args.index)
+
+
+if __name__ == "__main__":
+    main()
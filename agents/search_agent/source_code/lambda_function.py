@@ -1,55 +1,400 @@
 import json
-from pymongo import MongoClient
+import time
 from avro_kafka_producer import produce_context_result,build_summary_from_doc
-import os 
+from passages import merge_passages_by_policy, build_summary_from_passages
+from bm25_index import BM25Index, tokenize
+from hybrid_search import hybrid_search
+from partitioned_search import CorpusPartitions, partitioned_search
+from embeddings import decode_query_vector, get_embedder
+from resilience import ResilientCall
+from retry_pipeline import NonRetryableError, route_failure
+from partitioning import get_affinity_cache
+from session_store import get_session_store, is_follow_up, new_turn
+from speculation import SPECULATIVE_DISPATCH, get_speculative_store
+from metering import current_usage, metered, publish_rollup, set_query_type
+import memory_profile
+import os
+import backends
 
 MONGO_HOST = os.getenv("MONGO_HOST")
 MONGO_USER = os.getenv("MONGO_USER")
 MONGO_PASSWORD = os.getenv("MONGO_PASSWORD")
 MONGO_URI = f"mongodb+srv://{MONGO_USER}:{MONGO_PASSWORD}@{MONGO_HOST}/"
 DB_NAME = os.getenv("DB_NAME")
+INPUT_TOPIC = os.getenv("INPUT_TOPIC", "search_embeddings")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME")
 VECTOR_FIELD = "contentEmbedding"
 K = 1
+NUM_CANDIDATES = int(os.getenv("NUM_CANDIDATES", "100"))
 
+# Passage-level retrieval, enabled once ingest_passages.py has built the collection
+PASSAGE_COLLECTION_NAME = os.getenv("PASSAGE_COLLECTION_NAME")
+PASSAGE_INDEX_NAME = os.getenv("PASSAGE_INDEX_NAME", "knowledge_passage_index")
+PASSAGE_K = int(os.getenv("PASSAGE_K", "6"))
 
-def lambda_handler(event, context):
+# "vector" (default) or "hybrid" (BM25 + vector search fused with RRF)
+SEARCH_MODE = os.getenv("SEARCH_MODE", "vector")
+EMPLOYEE_COLLECTION_NAME = os.getenv("EMPLOYEE_COLLECTION_NAME", "employee_collection")
+LEXICAL_INDEX_TTL_SECONDS = int(os.getenv("LEXICAL_INDEX_TTL_SECONDS", "300"))
+# Search the regions the question names (else the asking employee's) and the
+# question's category first, widening to the whole corpus only when they return
+# too little (see partitioned_search.py). Off by default: a level is only widened
+# when it comes back short, never because its best match is weak
+PARTITIONED_SEARCH = os.getenv("PARTITIONED_SEARCH", "false").lower() == "true"
+PARTITIONS_TTL_SECONDS = int(os.getenv("PARTITIONS_TTL_SECONDS", "300"))
 
-    for events in event:
-        search_event = events['payload']['value']
-        query = search_event.get('query')
-        message = search_event.get('message')
-        employee_id = search_event.get('employee_id')
-        message_id = search_event.get('message_id', 'unknown')
-        user_email = search_event.get('user_email', 'unknown')
-        session_id = search_event.get('session_id')
-        timestamp = search_event.get('timestamp')
-        input_vector = search_event['query_embedding']
-        if not input_vector or not isinstance(input_vector, list):
-            return {"statusCode": 400, "body": "Invalid or missing 'query_vector' in request."}
-
-        # Connect to MongoDB
-        client = MongoClient(MONGO_URI)
-        collection = client[DB_NAME][COLLECTION_NAME]
+# Vector search is hedged after its recent p95 and guarded by a circuit breaker;
+# while Mongo is degraded, recent results or the local BM25 index are served instead
+MONGO_TIMEOUT_SECONDS = float(os.getenv("MONGO_TIMEOUT_SECONDS", "5"))
+MONGO_HEDGE = os.getenv("MONGO_HEDGE", "true").lower() == "true"
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", "3600"))
+
+# Compact local copy of the active collection's embeddings (see vector_store.py).
+# With VECTOR_BACKEND=local it replaces $vectorSearch; otherwise it serves
+# vector results while Mongo is degraded
+VECTOR_STORE_PATH = os.getenv("VECTOR_STORE_PATH")
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "atlas")
+if VECTOR_BACKEND not in ("atlas", "local"):
+    raise ValueError(f"Unknown VECTOR_BACKEND {VECTOR_BACKEND!r}; use atlas or local")
+if VECTOR_BACKEND == "local" and not VECTOR_STORE_PATH:
+    raise ValueError("VECTOR_BACKEND=local needs VECTOR_STORE_PATH to point at a vector store (see vector_store.py)")
+# Follow-ups and repeated questions within a session reuse the documents an
+# earlier turn retrieved instead of searching again (see session_store.py)
+SESSION_REUSE = os.getenv("SESSION_REUSE", "true").lower() == "true"
+# Share of a follow-up's content words that must appear in the earlier turn's
+# question or in the documents it retrieved for them to be reused
+SESSION_REUSE_MIN_OVERLAP = float(os.getenv("SESSION_REUSE_MIN_OVERLAP", "1.0"))
+_FOLLOW_UP_FILLER = frozenset(
+    "a an the and also what about how of same for then ok okay so is are was were do does did can could "
+    "i me my mine we our you your he she his her hers him they them their it its that those this one "
+    "to in on at with by from any there please tell".split()
+)
+
+# Reused across invocations of a warm container
+_mongo_client = None
+_lexical_index = None
+_lexical_index_built_at = 0.0
+_vector_store = None
+_embedder = None
+_partitions = None
+_partitions_built_at = 0.0
+# Per-key caches; with inputs keyed by session_id or employee_id, the consumer
+# owning a partition holds the entries for its keys (see partitioning.py)
+_employee_locations = get_affinity_cache("employee_location")
+_recent_results = get_affinity_cache(
+    "recent_results", max_entries=RESULT_CACHE_SIZE, ttl_seconds=RESULT_CACHE_TTL_SECONDS
+)
+_vector_search_call = ResilientCall(
+    "mongo-vector-search",
+    hedge=MONGO_HEDGE,
+    timeout_s=MONGO_TIMEOUT_SECONDS
+)
+
+
+def get_mongo_client():
+    """MongoClient shared by all invocations; it pools connections and is thread-safe."""
+    global _mongo_client
+    if _mongo_client is None:
+        _mongo_client = backends.mongo_client(MONGO_URI)
+    return _mongo_client
+
+
+def active_collection():
+    """Collection, vector index, id field and result size for the configured retrieval unit."""
+    if PASSAGE_COLLECTION_NAME:
+        return PASSAGE_COLLECTION_NAME, PASSAGE_INDEX_NAME, "passageId", PASSAGE_K
+    return COLLECTION_NAME, "knowledge_index", "policyId", K
+
+
+def vector_search_pipeline(input_vector, limit, regions=None, categories=None):
+    """Aggregation pipeline of a vector search over the active collection."""
+    _, index_name, _, _ = active_collection()
+    vector_stage = {
+        "queryVector": input_vector,
+        "path": VECTOR_FIELD,
+        "numCandidates": NUM_CANDIDATES,
+        "limit": limit,
+        "index": index_name
+    }
+    filters = []
+    if regions:
+        filters.append({"region": {"$in": regions}})
+    if categories:
+        filters.append({"category": {"$in": categories}})
+    if filters:
+        vector_stage["filter"] = filters[0] if len(filters) == 1 else {"$and": filters}
+
+    return [
+        {"$vectorSearch": vector_stage},
+        {"$addFields": {"score": {"$meta": "vectorSearchScore"}}},
+        {"$project": {"_id": 0, VECTOR_FIELD: 0}}
+    ]
+
+
+def vector_search(client, input_vector, limit, regions=None, categories=None):
+    collection_name = active_collection()[0]
+    pipeline = vector_search_pipeline(input_vector, limit, regions, categories)
+    return list(client[DB_NAME][collection_name].aggregate(pipeline))
+
+
+def get_vector_store():
+    """The memory-mapped local vector store, or None if VECTOR_STORE_PATH is unset."""
+    global _vector_store
+    if _vector_store is None and VECTOR_STORE_PATH:
+        from vector_store import VectorStore
+        _vector_store = VectorStore(VECTOR_STORE_PATH)
+        print(f"Loaded {len(_vector_store)} {_vector_store.mode} vectors from {VECTOR_STORE_PATH}")
+    return _vector_store
+
+
+def get_query_embedder():
+    """Embedder for queries that arrive without an embedding, created on first use."""
+    global _embedder
+    if _embedder is None:
+        _embedder = get_embedder()
+    return _embedder
+
+
+def embed_query(text):
+    """Embed a query in-process, for records that did not go through the Flink embedding step."""
+    return get_query_embedder().embed(text)
+
+
+def local_vector_search(input_vector, limit, regions=None, categories=None):
+    store = get_vector_store()
+    allowed = store.candidates(regions, categories)
+    return [dict(doc, score=score) for doc, score in store.search(input_vector, k=limit, allowed=allowed)]
+
+
+def get_lexical_index(client):
+    """Build (or refresh after the TTL) the BM25 index over the active collection."""
+    global _lexical_index, _lexical_index_built_at
+
+    if _lexical_index is None or time.time() - _lexical_index_built_at > LEXICAL_INDEX_TTL_SECONDS:
+        collection_name, _, id_field, _ = active_collection()
+        try:
+            documents = list(client[DB_NAME][collection_name].find({}, {"_id": 0, VECTOR_FIELD: 0}))
+        except Exception as e:
+            if _lexical_index is None:
+                raise
+            # Keep serving the stale index while Mongo is unavailable
+            print(f"Lexical index refresh failed, keeping the previous index: {e}")
+            return _lexical_index
+        _lexical_index = BM25Index(documents, id_field=id_field)
+        _lexical_index_built_at = time.time()
+    return _lexical_index
+
+
+def get_partitions(client):
+    """Region and category partitions of the active collection, refreshed after the TTL."""
+    global _partitions, _partitions_built_at
+
+    if _partitions is None or time.time() - _partitions_built_at > PARTITIONS_TTL_SECONDS:
+        if _lexical_index is not None:
+            documents = _lexical_index.documents
+        else:
+            collection_name, _, _, _ = active_collection()
+            try:
+                documents = list(client[DB_NAME][collection_name].find(
+                    {}, {"_id": 0, "region": 1, "category": 1, "title": 1}
+                ))
+            except Exception as e:
+                if _partitions is None:
+                    raise
+                print(f"Partition refresh failed, keeping the previous partitions: {e}")
+                return _partitions
+        _partitions = CorpusPartitions(documents)
+        _partitions_built_at = time.time()
+    return _partitions
+
+
+def remember_results(query, results):
+    """Keep the latest results per query for degraded mode."""
+    _recent_results.put(" ".join((query or "").lower().split()), results)
+
+
+def degraded_results(query, limit, regions=None, categories=None, input_vector=None):
+    """
+    Results without Mongo: the last answer to the same query, else the local
+    vector store, else the local BM25 index.
+    """
+    cached = _recent_results.get(" ".join((query or "").lower().split()))
+    if cached is not None:
+        return cached
+    if input_vector is not None and get_vector_store() is not None:
+        return local_vector_search(input_vector, limit, regions, categories)
+    if _lexical_index is not None:
+        allowed = _lexical_index.candidates(regions, categories)
+        return [dict(doc, score=score) for doc, score in _lexical_index.search(query, k=limit, allowed=allowed)]
+    return []
+
+
+def resilient_vector_search(client, query, input_vector, limit, regions=None, categories=None, fallback=None):
+    if VECTOR_BACKEND == "local":
+        return local_vector_search(input_vector, limit, regions, categories)
+    return _vector_search_call.call(
+        vector_search, client, input_vector, limit, regions, categories,
+        fallback=fallback or (lambda error: degraded_results(query, limit, regions, categories, input_vector))
+    )
+
+
+def get_employee_location(client, employee_id):
+    """Region and country of an employee, cached per employee."""
+    if not employee_id:
+        return None, None
+    location = _employee_locations.get(employee_id)
+    if location is None:
+        try:
+            employee = client[DB_NAME][EMPLOYEE_COLLECTION_NAME].find_one(
+                {"employee_id": employee_id},
+                {"_id": 0, "work_location.region": 1, "work_location.country": 1}
+            ) or {}
+        except Exception as e:
+            # Search without the region filter rather than fail; retried on the next query
+            print(f"Employee lookup failed for {employee_id}: {e}")
+            return None, None
+        work_location = employee.get("work_location", {})
+        location = (work_location.get("region"), work_location.get("country"))
+        _employee_locations.put(employee_id, location)
+    return location
 
+
+def summarize(results):
+    if PASSAGE_COLLECTION_NAME:
+        return [build_summary_from_passages(group) for group in merge_passages_by_policy(results)]
+    return [build_summary_from_doc(doc) for doc in results]
+
+
+def turn_from_session(query, turns):
+    """
+    Earlier turn of the session whose retrieved documents can answer the query.
+
+    Args:
+        query (str): The new question
+        turns (list): The session's earlier turns, oldest first
+
+    Returns:
+        dict: The turn, or None to search
+    """
+    normalized = " ".join((query or "").lower().split())
+    searched = [turn for turn in turns if turn.get("contexts", {}).get("search_result_summary")]
+    for turn in reversed(searched):
+        if " ".join((turn.get("query") or "").lower().split()) == normalized:
+            return turn
+    # A follow-up refers to the latest turn, and only reuses it while on the same topic
+    if searched and is_follow_up(query):
+        latest = searched[-1]
+        if follow_up_covered(query, latest.get("query"), latest["contexts"]["search_result_summary"]):
+            return latest
+    return None
+
+
+def follow_up_covered(query, earlier_query, summary):
+    """
+    Whether a follow-up stays on the earlier turn's topic. After an annual
+    leave question, "and what about carry over?" does; "what about parental
+    leave?" asks about another policy and is searched.
+
+    Args:
+        query (str): The follow-up question
+        earlier_query (str): Question of the turn whose documents would be reused
+        summary (str): Those documents' search_result_summary
+
+    Returns:
+        bool
+    """
+    terms = {term for term in tokenize(query) if term not in _FOLLOW_UP_FILLER}
+    if not terms:
+        return True
+    known = set(tokenize(earlier_query)) | set(tokenize(summary))
+    return len(terms & known) / len(terms) >= SESSION_REUSE_MIN_OVERLAP
+
+
+def partition_filters(client, query, employee_id):
+    """Region and category pre-filters for a question, or None for each to search everything."""
+    if not PARTITIONED_SEARCH and SEARCH_MODE != "hybrid":
+        return None, None
+    try:
+        partitions = get_partitions(client)
+    except Exception as e:
+        print(f"Partition lookup failed, searching the whole corpus: {e}")
+        return None, None
+    regions = partitions.question_regions(query, *get_employee_location(client, employee_id))
+    categories = partitions.categories_for(query) if PARTITIONED_SEARCH else []
+    return regions or None, categories or None
+
+
+def search(client, query, input_vector, employee_id, limit):
+    regions, categories = partition_filters(client, query, employee_id)
+    if SEARCH_MODE == "hybrid":
+        index = get_lexical_index(client)
+
+        def run(regions, categories):
+            return hybrid_search(
+                query,
+                input_vector,
+                index,
+                # With Mongo degraded the fusion falls back to the lexical ranking alone
+                lambda vector, size, regions, categories: resilient_vector_search(
+                    client, query, vector, size, regions, categories, fallback=lambda error: []
+                ),
+                k=limit,
+                regions=regions,
+                categories=categories
+            )
+    else:
+        def run(regions, categories):
+            return resilient_vector_search(client, query, input_vector, limit, regions, categories)
+    return partitioned_search(run, limit, regions, categories, id_field=active_collection()[2])
+
+
+def process_record(client, search_event, limit):
+    query = search_event.get('query')
+    message = search_event.get('message')
+    employee_id = search_event.get('employee_id')
+    message_id = search_event.get('message_id', 'unknown')
+    user_email = search_event.get('user_email', 'unknown')
+    session_id = search_event.get('session_id')
+    # Retrieved from queries while the orchestrator was routing
+    speculative = get_speculative_store().take(message_id, "search") if SPECULATIVE_DISPATCH else None
+    speculative = speculation_for(speculative, query, message_id)
+    input_vector = decode_query_vector(search_event.get('query_embedding'))
+    if speculative is None and SPECULATIVE_DISPATCH and not input_vector and query:
+        # search_agent_input consumed directly, without the embedding step
+        input_vector = embed_query(query)
+    if speculative is None and (not input_vector or not isinstance(input_vector, list)):
+        raise NonRetryableError("Invalid or missing 'query_embedding' in request.")
+
+    session_store = get_session_store() if session_id and SESSION_REUSE else None
+    turns = session_store.get(session_id) if session_store else []
+    earlier_turn = turn_from_session(query, turns) if speculative is None else None
+    set_query_type("speculative_hit" if speculative is not None else
+                   "retrieval" if earlier_turn is None else "session_reuse")
+    if speculative is not None:
+        print(f"Using documents retrieved speculatively for {message_id}")
+        search_result_summary = speculative["search_result_summary"]
+        document_ids = speculative["document_ids"]
+    elif earlier_turn is None:
         # Perform vector search
-        pipeline = [
-            {
-                "$vectorSearch": {
-                    "queryVector": input_vector,
-                    "path": VECTOR_FIELD,
-                    "numCandidates": 100,
-                    "limit": K,
-                    "index": "knowledge_index"
-                }
-            },
-            {"$project": {"_id": 0, "score": {"$meta": "vectorSearchScore"}, "doc": "$$ROOT"}}
-        ]
-
-        results = list(collection.aggregate(pipeline))
-        summary_parts = [build_summary_from_doc(res["doc"]) for res in results]
-        search_result_summary = "\n-----\n".join(summary_parts)
+        with memory_profile.stage("search"):
+            results = search(client, query, input_vector, employee_id, limit)
+            remember_results(query, results)
+        with memory_profile.stage("summarize"):
+            search_result_summary = "\n-----\n".join(summarize(results))
+            document_ids = [doc.get(active_collection()[2]) for doc in results]
+    else:
+        print(f"Reusing documents retrieved earlier in session {session_id}")
+        search_result_summary = earlier_turn["contexts"]["search_result_summary"]
+        document_ids = earlier_turn.get("entities", {}).get("document_ids", [])
+    if session_store:
+        session_store.append(session_id, new_turn(
+            query,
+            entities={"employee_id": employee_id, "document_ids": document_ids},
+            contexts={"search_result_summary": search_result_summary}
+        ))
 
+    with memory_profile.stage("produce"):
         produce_context_result(
             query=query,
             message=message,
@@ -57,10 +402,95 @@ def lambda_handler(event, context):
             employee_id=employee_id,
             user_email=user_email,
             session_id=session_id,
-            search_result_summary=search_result_summary
+            search_result_summary=search_result_summary,
+            usage=current_usage()
         )
-        print("Results", results)
+    # The summary itself is in the response record; logging it again doubles its cost
+    print(f"Results for {message_id}: {len(document_ids)} documents, {len(search_result_summary)} characters")
+
+
+def speculation_for(speculative, query, message_id):
+    """
+    The speculative result, if it searched the routed query.
+
+    Speculation searches the whole message; the router may pass on a narrower
+    query (one intent of a multi-intent message), which must be searched itself.
+    """
+    if speculative is None or tokenize(speculative.get("searched_text") or "") == tokenize(query or ""):
+        return speculative
+    print(f"Discarding the speculative result for {message_id}: it searched the message, not the routed query")
+    return None
+
+
+def speculate(client, record, limit):
+    """
+    Retrieve documents for a record of the queries topic and store them for
+    the routed record. Retrieval has no side effects, so the work is only
+    wasted when the router sends the query elsewhere.
+
+    Args:
+        client (MongoClient): Connected client
+        record (dict): Record from the queries topic
+        limit (int): Documents to retrieve
+    """
+    message_id = record.get('message_id')
+    query = record.get('message')
+    if not message_id or not query:
+        return
+    results = search(client, query, embed_query(query), record.get('employee_id'), limit)
+    remember_results(query, results)
+    get_speculative_store().put(message_id, "search", {
+        # Only reused when the router passes the message on unchanged as the query
+        "searched_text": query,
+        "search_result_summary": "\n-----\n".join(summarize(results)),
+        "document_ids": [doc.get(active_collection()[2]) for doc in results],
+    })
+
+
+def speculate_handler(event, context):
+    """
+    Handler for speculative dispatch (``workers/agent_worker.py --speculative``).
+    Failures are only logged: the routed record does the work itself.
+    """
+    client = get_mongo_client()
+    _, _, _, limit = active_collection()
+
+    stored = 0
+    for events in event:
+        record = events['payload']['value']
+        try:
+            with metered("search", record.get('message_id'), record.get('session_id')):
+                set_query_type("speculative")
+                speculate(client, record, limit)
+            stored += 1
+        except Exception as e:
+            print(f"Speculative search for {record.get('message_id')} failed: {e}")
+    publish_rollup()
+    return {
+        'statusCode': 200,
+        'body': json.dumps(f'{stored} speculative results stored')
+    }
+
+
+def lambda_handler(event, context):
+
+    # Connect to MongoDB
+    client = get_mongo_client()
+    _, _, _, limit = active_collection()
+
+    failed = 0
+    for events in event:
+        search_event = events['payload']['value']
+        try:
+            with metered("search", search_event.get('message_id'), search_event.get('session_id')):
+                process_record(client, search_event, limit)
+        except Exception as e:
+            # Park the record on a retry tier (or the DLQ) and carry on with the batch
+            route_failure(search_event, e, INPUT_TOPIC, "search", events['payload'].get('attempt', 0))
+            failed += 1
+    publish_rollup()
+    memory_profile.report()
     return {
         'statusCode': 200,
-        'body': json.dumps('Messages sent to Kafka!')
+        'body': json.dumps(f'Messages sent to Kafka! ({failed} routed for retry)')
     }
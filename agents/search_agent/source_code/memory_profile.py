@@ -0,0 +1,134 @@
+"""
+Memory profiling of the agent's handler stages.
+
+With ``MEMORY_PROFILE=true`` each ``stage()`` block (for example ``search``,
+``summarize`` and ``produce`` in the search agent) is measured with
+tracemalloc. A stage records the memory it kept (net allocation) and its
+peak above the memory in use when it started. It also records the source
+lines that allocated the most, from snapshots taken as it starts and ends.
+``report()`` logs the totals per stage with the process's peak RSS and the
+Lambda memory size that peak suggests. The handlers call it after each
+batch.
+
+tracemalloc slows every allocation and its peak is process-wide, so profile
+with one batch in flight (the Lambda, or ``bench_agents.py --memory-profile``)
+and leave the mode off in production. Without it ``stage()`` costs nothing.
+"""
+import math
+import os
+import resource
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+MEMORY_PROFILE = os.getenv("MEMORY_PROFILE", "false").lower() == "true"
+# Allocation sites kept per stage
+MEMORY_PROFILE_TOP = int(os.getenv("MEMORY_PROFILE_TOP", "5"))
+# Frames kept per allocation, enough to tell the agent's call sites apart
+TRACEBACK_FRAMES = 1
+# Lambda memory recommendation: headroom over the peak, in 64 MB steps from 128 MB
+MEMORY_HEADROOM = 1.5
+LAMBDA_MIN_MEMORY_MB = 128
+
+_stats = {}
+_lock = threading.Lock()
+_open_stages = threading.local()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def recommended_memory_mb(rss_mb):
+    """Lambda memory size for a measured peak RSS."""
+    return max(LAMBDA_MIN_MEMORY_MB, int(math.ceil(rss_mb * MEMORY_HEADROOM / 64) * 64))
+
+
+def _snapshot():
+    """Allocations so far, without tracemalloc's and this module's own."""
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+
+
+def _fold_peak():
+    """Credit the traced peak so far to every open stage, before it is reset."""
+    _, peak = tracemalloc.get_traced_memory()
+    for frame in getattr(_open_stages, "stack", []):
+        frame["peak"] = max(frame["peak"], peak)
+
+
+@contextmanager
+def stage(name):
+    """Measure the block as handler stage ``name`` when MEMORY_PROFILE is set."""
+    if not MEMORY_PROFILE:
+        yield
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEBACK_FRAMES)
+    stack = _open_stages.__dict__.setdefault("stack", [])
+    _fold_peak()
+    tracemalloc.reset_peak()
+    before = _snapshot()
+    current, _ = tracemalloc.get_traced_memory()
+    frame = {"start": current, "peak": current}
+    stack.append(frame)
+    try:
+        yield
+    finally:
+        _fold_peak()
+        stack.pop()
+        after = _snapshot()
+        current, _ = tracemalloc.get_traced_memory()
+        top = after.compare_to(before, "lineno")[:MEMORY_PROFILE_TOP]
+        with _lock:
+            stats = _stats.setdefault(name, {"calls": 0, "net_bytes": 0, "peak_bytes": 0, "sites": {}})
+            stats["calls"] += 1
+            stats["net_bytes"] += current - frame["start"]
+            stats["peak_bytes"] = max(stats["peak_bytes"], frame["peak"] - frame["start"])
+            for difference in top:
+                site = str(difference.traceback[0])
+                stats["sites"][site] = max(stats["sites"].get(site, 0), difference.size_diff)
+
+
+def stats():
+    """
+    Measurements so far.
+
+    Returns:
+        dict: Per stage calls, mean_net_kib, peak_kib and top_sites (line and KiB),
+            plus peak_rss_mb and recommended_memory_mb
+    """
+    with _lock:
+        stages = {
+            name: {
+                "calls": stats["calls"],
+                "mean_net_kib": round(stats["net_bytes"] / stats["calls"] / 1024, 1),
+                "peak_kib": round(stats["peak_bytes"] / 1024, 1),
+                "top_sites": [
+                    (site, round(size / 1024, 1))
+                    for site, size in sorted(stats["sites"].items(), key=lambda item: -item[1])[:MEMORY_PROFILE_TOP]
+                ],
+            }
+            for name, stats in _stats.items()
+        }
+    rss_mb = peak_rss_mb()
+    return {"stages": stages, "peak_rss_mb": round(rss_mb, 1), "recommended_memory_mb": recommended_memory_mb(rss_mb)}
+
+
+def report():
+    """Log the stage measurements; a no-op unless MEMORY_PROFILE is set."""
+    if not MEMORY_PROFILE:
+        return None
+    measured = stats()
+    for name, stage_stats in measured["stages"].items():
+        sites = ", ".join(f"{site} {size} KiB" for site, size in stage_stats["top_sites"])
+        print(f"Memory stage {name}: {stage_stats['calls']} calls, {stage_stats['mean_net_kib']} KiB kept per call, "
+              f"peak {stage_stats['peak_kib']} KiB; top: {sites}")
+    print(f"Memory peak RSS {measured['peak_rss_mb']} MB, recommended Lambda memory "
+          f"{measured['recommended_memory_mb']} MB")
+    return measured
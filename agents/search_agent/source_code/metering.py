@@ -0,0 +1,262 @@
+"""
+Token, latency and cost metering of the agent's model calls.
+
+Every Bedrock call the agent makes is recorded with its model, input and
+output token counts, and latency. The calls are attributed to the message
+being handled: handlers wrap each record in ``metered()``, and code that
+calls a model can label the step it belongs to with ``step()`` (for example
+``summary``). The record's totals (``Meter.usage()``) go out with the agent's
+response in its ``usage`` field.
+
+Meters are also rolled up per agent and query type (the path the record
+took, e.g. ``department`` or ``session_reuse``). Every
+``USAGE_ROLLUP_SECONDS`` the roll-up is published as JSON to ``USAGE_TOPIC``
+(``agent_usage``) and logged. Costs use per-1K-token prices by model prefix.
+Override them with ``METERING_PRICES``, e.g. ``{"anthropic.claude-3-5-haiku": [0.0008, 0.004]}``.
+
+With ``TOKEN_BUDGET_PER_QUERY`` set, a record that has already used that
+many tokens fails its next model call with ``TokenBudgetExceeded``.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import backends
+from delivery import kafka_conf, producer_conf
+from retry_pipeline import NonRetryableError
+
+METERING = os.getenv("METERING", "true").lower() == "true"
+USAGE_TOPIC = os.getenv("USAGE_TOPIC", "agent_usage")
+USAGE_ROLLUP_SECONDS = float(os.getenv("USAGE_ROLLUP_SECONDS", "60"))
+TOKEN_BUDGET_PER_QUERY = int(os.getenv("TOKEN_BUDGET_PER_QUERY", "0"))
+
+# USD per 1K (input, output) tokens, matched by model id prefix
+MODEL_PRICES = {
+    "anthropic.claude-3-5-haiku": (0.0008, 0.004),
+    "anthropic.claude-3-5-sonnet": (0.003, 0.015),
+    "anthropic.claude-3-haiku": (0.00025, 0.00125),
+    "anthropic.claude-3-sonnet": (0.003, 0.015),
+    "amazon.titan-embed-text-v1": (0.0001, 0.0),
+    "amazon.titan-embed-text-v2": (0.00002, 0.0),
+}
+MODEL_PRICES.update({prefix: tuple(prices) for prefix, prices in json.loads(os.getenv("METERING_PRICES", "{}")).items()})
+
+_current_meter = contextvars.ContextVar("current_meter", default=None)
+_current_step = contextvars.ContextVar("current_step", default="model")
+
+
+class TokenBudgetExceeded(NonRetryableError):
+    """The record has used its TOKEN_BUDGET_PER_QUERY; retrying would exceed it again."""
+
+
+def price(model_id, input_tokens, output_tokens):
+    """Cost in USD of a call, 0 for models without a known price."""
+    matches = [prefix for prefix in MODEL_PRICES if str(model_id).startswith(prefix)]
+    if not matches:
+        return 0.0
+    input_price, output_price = MODEL_PRICES[max(matches, key=len)]
+    return input_tokens / 1000 * input_price + output_tokens / 1000 * output_price
+
+
+def token_counts(response, body=None):
+    """
+    Input and output tokens of an ``invoke_model`` call.
+
+    Args:
+        response (dict): The invoke_model response, for Bedrock's token count headers
+        body (dict | bytes): The response body, used when the headers are missing
+
+    Returns:
+        tuple: (input_tokens, output_tokens)
+    """
+    headers = (response or {}).get("ResponseMetadata", {}).get("HTTPHeaders", {})
+    if "x-amzn-bedrock-input-token-count" in headers:
+        return (int(headers["x-amzn-bedrock-input-token-count"]),
+                int(headers.get("x-amzn-bedrock-output-token-count", 0)))
+    if isinstance(body, (bytes, bytearray, str)):
+        try:
+            body = json.loads(body)
+        except ValueError:
+            body = None
+    if not isinstance(body, dict):
+        return 0, 0
+    usage = body.get("usage") or {}
+    if usage:
+        return int(usage.get("input_tokens", 0)), int(usage.get("output_tokens", 0))
+    return int(body.get("inputTextTokenCount", 0)), 0
+
+
+def _empty_totals():
+    return {"model_calls": 0, "input_tokens": 0, "output_tokens": 0, "latency_ms": 0.0, "cost_usd": 0.0}
+
+
+def _rounded(totals):
+    return dict(totals, latency_ms=round(totals["latency_ms"], 1), cost_usd=round(totals["cost_usd"], 6))
+
+
+def _add(totals, input_tokens, output_tokens, latency_ms, cost_usd, calls=1):
+    totals["model_calls"] += calls
+    totals["input_tokens"] += input_tokens
+    totals["output_tokens"] += output_tokens
+    totals["latency_ms"] += latency_ms
+    totals["cost_usd"] += cost_usd
+
+
+class Meter:
+    """
+    Model usage of one record.
+
+    Args:
+        agent (str): Agent name
+        message_id (str): The record's message_id
+        session_id (str): The record's session
+    """
+    def __init__(self, agent, message_id=None, session_id=None):
+        self.agent = agent
+        self.message_id = message_id
+        self.session_id = session_id
+        self.query_type = "unknown"
+        self.totals = _empty_totals()
+        self.by_step = {}
+        self.lock = threading.Lock()
+
+    @property
+    def tokens(self):
+        return self.totals["input_tokens"] + self.totals["output_tokens"]
+
+    def add(self, model_id, step, input_tokens, output_tokens, latency_ms):
+        cost = price(model_id, input_tokens, output_tokens)
+        with self.lock:
+            _add(self.totals, input_tokens, output_tokens, latency_ms, cost)
+            _add(self.by_step.setdefault(step, _empty_totals()), input_tokens, output_tokens, latency_ms, cost)
+
+    def usage(self):
+        """Totals for the response record's ``usage`` field."""
+        with self.lock:
+            return _rounded(self.totals)
+
+
+class Rollup:
+    """Usage per (agent, query type), published every ``interval_s``."""
+    def __init__(self, interval_s=USAGE_ROLLUP_SECONDS):
+        self.interval_s = interval_s
+        self.groups = {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.producer = None
+
+    def add(self, meter):
+        with self.lock:
+            group = self.groups.setdefault((meter.agent, meter.query_type), dict(_empty_totals(), queries=0, by_step={}))
+            group["queries"] += 1
+            _add(group, meter.totals["input_tokens"], meter.totals["output_tokens"], meter.totals["latency_ms"],
+                 meter.totals["cost_usd"], calls=meter.totals["model_calls"])
+            for step_name, totals in meter.by_step.items():
+                _add(group["by_step"].setdefault(step_name, _empty_totals()), totals["input_tokens"],
+                     totals["output_tokens"], totals["latency_ms"], totals["cost_usd"], calls=totals["model_calls"])
+
+    def publish(self, force=False):
+        """Publish and reset the roll-up once the interval has passed (or when forced)."""
+        now = time.time()
+        with self.lock:
+            if not self.groups or (not force and now - self.started < self.interval_s):
+                return []
+            groups, self.groups = self.groups, {}
+            started, self.started = self.started, now
+
+        records = []
+        for (agent, query_type), totals in sorted(groups.items()):
+            records.append(dict(
+                _rounded(totals),
+                by_step={name: _rounded(step_totals) for name, step_totals in totals["by_step"].items()},
+                agent=agent,
+                query_type=query_type,
+                window_start=int(started * 1000),
+                window_end=int(now * 1000),
+                tokens_per_query=round((totals["input_tokens"] + totals["output_tokens"]) / totals["queries"], 1),
+            ))
+            print(f"Usage {agent}/{query_type}: {totals['queries']} queries, {totals['model_calls']} model calls, "
+                  f"{totals['input_tokens']} in / {totals['output_tokens']} out tokens, ${totals['cost_usd']:.4f}")
+        try:
+            if self.producer is None:
+                self.producer = backends.producer(producer_conf(kafka_conf()))
+            for record in records:
+                self.producer.produce(
+                    topic=USAGE_TOPIC,
+                    key=f"{record['agent']}:{record['query_type']}".encode("utf-8"),
+                    value=json.dumps(record).encode("utf-8")
+                )
+            self.producer.flush()
+        except Exception as e:
+            # Usage is telemetry: losing a window must not fail the records
+            print(f"Failed to publish usage roll-up to {USAGE_TOPIC}: {e}")
+        return records
+
+
+_rollup = Rollup()
+
+
+@contextmanager
+def metered(agent, message_id=None, session_id=None):
+    """Attribute the model calls made inside the block to one record; yields its Meter."""
+    meter = Meter(agent, message_id, session_id)
+    token = _current_meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _current_meter.reset(token)
+        if METERING:
+            _rollup.add(meter)
+
+
+@contextmanager
+def step(name):
+    """Label the model calls made inside the block, e.g. ``with step("summary"):``."""
+    token = _current_step.set(name)
+    try:
+        yield
+    finally:
+        _current_step.reset(token)
+
+
+def current_meter():
+    return _current_meter.get()
+
+
+def current_usage():
+    """Usage of the record being handled, for its response; None outside ``metered()``."""
+    meter = _current_meter.get()
+    return meter.usage() if meter is not None else None
+
+
+def set_query_type(query_type):
+    """Set the query type of the record being handled, for the roll-up."""
+    meter = _current_meter.get()
+    if meter is not None and query_type:
+        meter.query_type = query_type
+
+
+def check_budget():
+    """Raise TokenBudgetExceeded if the record being handled has used its token budget."""
+    meter = _current_meter.get()
+    if TOKEN_BUDGET_PER_QUERY and meter is not None and meter.tokens >= TOKEN_BUDGET_PER_QUERY:
+        raise TokenBudgetExceeded(
+            f"Message {meter.message_id} used {meter.tokens} tokens, over its budget of {TOKEN_BUDGET_PER_QUERY}"
+        )
+
+
+def record_call(model_id, input_tokens, output_tokens, latency_ms):
+    """Record a model call against the record being handled, if any."""
+    meter = _current_meter.get()
+    if METERING and meter is not None:
+        meter.add(model_id, _current_step.get(), input_tokens, output_tokens, latency_ms)
+
+
+def publish_rollup(force=False):
+    """Publish the usage roll-up if its interval has passed; handlers call this after each batch."""
+    if METERING:
+        return _rollup.publish(force)
+    return []
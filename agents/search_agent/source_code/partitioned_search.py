@@ -0,0 +1,150 @@
+"""
+Region- and category-partitioned retrieval with a global fallback.
+
+Most policies apply to one region (or, for holiday calendars, one country),
+and each belongs to one category. A question is first searched only in the
+partitions that can answer it:
+
+- the regions the question names ("parental leave in Europe", "holidays in
+  India", "APAC healthcare"), plus Global; otherwise the regions matching the
+  asking employee's region and country, plus Global;
+- the category named by the question, when its terms point at a single
+  category ("healthcare benefits", "holiday calendar").
+
+The filters become a ``$vectorSearch`` pre-filter in Mongo, or position
+lists in the local vector store and BM25 index. Only the partition's
+documents are scanned. If the partitions return fewer than ``k`` results,
+the category filter is dropped first and then the region filter, and the
+extra results are appended after the partition's own.
+"""
+from collections import Counter, defaultdict
+
+from bm25_index import normalize_region, tokenize
+from hybrid_search import match_regions
+
+# Title words that say nothing about a policy's category
+_GENERIC_TERMS = {"policy", "policies", "guidelines", "program", "company", "global", "and", "the", "of", "for"}
+# Abbreviations and countries a question may use for a corpus region
+_PLACE_REGIONS = {
+    "apac": "Asia Pacific", "asia": "Asia Pacific", "australia": "Asia Pacific", "japan": "Asia Pacific",
+    "singapore": "Asia Pacific", "china": "Asia Pacific",
+    "latam": "Latin America", "brazil": "Latin America", "mexico": "Latin America", "argentina": "Latin America",
+    "chile": "Latin America", "colombia": "Latin America",
+    "emea": "Europe", "eu": "Europe", "european": "Europe", "uk": "Europe", "britain": "Europe",
+    "united kingdom": "Europe", "germany": "Europe", "france": "Europe", "spain": "Europe", "italy": "Europe",
+    "netherlands": "Europe", "ireland": "Europe", "poland": "Europe",
+    "usa": "United States", "canada": "North America", "indian": "India",
+}
+
+
+def _term(token):
+    return token[:-1] if token.endswith("s") and len(token) > 3 else token
+
+
+class CorpusPartitions:
+    """
+    Region and category partitions of a corpus, and the terms that name each category.
+
+    Args:
+        documents (list[dict]): Documents with region, category and title
+    """
+    def __init__(self, documents):
+        self.sizes = Counter((document.get("region"), document.get("category")) for document in documents)
+        region_terms = {_term(token) for region, _ in self.sizes if region for token in tokenize(region)}
+
+        self.categories_by_term = defaultdict(set)
+        for document in documents:
+            category = document.get("category")
+            if not category:
+                continue
+            for token in tokenize(f"{category} {document.get('title', '')}"):
+                term = _term(token)
+                if term not in _GENERIC_TERMS and term not in region_terms and not term.isdigit():
+                    self.categories_by_term[term].add(category)
+
+    def __len__(self):
+        return sum(self.sizes.values())
+
+    def regions_for(self, *locations):
+        """Corpus regions for an employee's region, country, ..., plus Global; empty if none matched."""
+        return match_regions({region for region, _ in self.sizes}, *locations)
+
+    def regions_named(self, query):
+        """Corpus regions the question itself names, plus Global; empty if it names none."""
+        text = f" {normalize_region(query)} "
+        named = {region for region, _ in self.sizes if region and f" {normalize_region(region)} " in text}
+        named |= {region for place, region in _PLACE_REGIONS.items() if f" {place} " in text}
+        return match_regions({region for region, _ in self.sizes}, *named)
+
+    def question_regions(self, query, *locations):
+        """Region filter for a question: the regions it names, else the asking employee's."""
+        return self.regions_named(query) or self.regions_for(*locations)
+
+    def categories_for(self, query):
+        """The one category the query's terms point at, as a filter list; empty if none or several."""
+        categories = set()
+        for token in tokenize(query):
+            matched = self.categories_by_term.get(_term(token))
+            if matched and len(matched) == 1:
+                categories |= matched
+        return sorted(categories) if len(categories) == 1 else []
+
+    def partition_size(self, regions=None, categories=None):
+        """Documents a search with these filters scans."""
+        return sum(
+            size for (region, category), size in self.sizes.items()
+            if (not regions or region in regions) and (not categories or category in categories)
+        )
+
+
+def partitioned_search(search, k, regions=None, categories=None, id_field="policyId"):
+    """
+    Search the narrowest partitions first and widen until ``k`` results are found.
+
+    Args:
+        search (callable): ``search(regions, categories)`` returning ranked documents
+        k (int): Number of results wanted
+        regions (list[str]): Region filter for the question (see CorpusPartitions.question_regions)
+        categories (list[str]): Category filter for the question
+        id_field (str): Field identifying a document, for merging
+
+    Returns:
+        list[dict]: Up to ``k`` documents, partition results first
+    """
+    results = []
+    seen = set()
+    for level_regions, level_categories in search_levels(regions, categories):
+        _merge(results, seen, search(level_regions, level_categories), id_field)
+        if len(results) >= k:
+            break
+    return results[:k]
+
+
+async def partitioned_search_async(search, k, regions=None, categories=None, id_field="policyId"):
+    """``partitioned_search`` with a coroutine function ``search(regions, categories)``."""
+    results = []
+    seen = set()
+    for level_regions, level_categories in search_levels(regions, categories):
+        _merge(results, seen, await search(level_regions, level_categories), id_field)
+        if len(results) >= k:
+            break
+    return results[:k]
+
+
+def search_levels(regions=None, categories=None):
+    """Filters to search with, narrowest first: both, then without the category, then neither."""
+    levels = [(regions or None, categories or None)]
+    if categories:
+        levels.append((regions or None, None))
+    if regions:
+        levels.append((None, None))
+    return levels
+
+
+def _merge(results, seen, documents, id_field):
+    for document in documents:
+        key = document.get(id_field)
+        if key not in seen:
+            seen.add(key)
+            results.append(document)
+
@@ -0,0 +1,164 @@
+import re
+
+PASSAGE_MAX_CHARS = 800
+PASSAGE_OVERLAP_CHARS = 200
+PASSAGE_METADATA_FIELDS = ("policyId", "title", "region", "category", "lastUpdated")
+
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+
+def _split_units(text, max_chars):
+    """
+    Break policy text into the smallest units passages are assembled from:
+    non-empty lines, with over-long lines further split on sentence boundaries.
+    """
+    units = []
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        if len(line) <= max_chars:
+            units.append(line)
+            continue
+        sentence_group = ""
+        for sentence in _SENTENCE_BOUNDARY.split(line):
+            if sentence_group and len(sentence_group) + len(sentence) + 1 > max_chars:
+                units.append(sentence_group)
+                sentence_group = sentence
+            else:
+                sentence_group = f"{sentence_group} {sentence}".strip()
+        if sentence_group:
+            units.append(sentence_group)
+    return units
+
+
+def split_into_passages(text, max_chars=PASSAGE_MAX_CHARS, overlap_chars=PASSAGE_OVERLAP_CHARS):
+    """
+    Split a policy body into overlapping passages.
+
+    Lines are packed greedily into windows of at most ``max_chars``; each new
+    window starts with the trailing lines of the previous one (up to
+    ``overlap_chars``) so that a fact spanning a boundary is kept whole in at
+    least one passage.
+
+    Args:
+        text (str): Full policy content
+        max_chars (int): Soft upper bound on the length of a passage
+        overlap_chars (int): Amount of trailing text repeated in the next passage
+
+    Returns:
+        list[str]: Passages in document order
+    """
+    units = _split_units(text or "", max_chars)
+    passages = []
+    window = []
+    window_len = 0
+    for unit in units:
+        if window and window_len + len(unit) + 1 > max_chars:
+            passages.append("\n".join(window))
+            overlap = []
+            overlap_len = 0
+            for previous in reversed(window):
+                if overlap_len + len(previous) + 1 > overlap_chars:
+                    break
+                overlap.insert(0, previous)
+                overlap_len += len(previous) + 1
+            window, window_len = overlap, overlap_len
+        window.append(unit)
+        window_len += len(unit) + 1
+    if window:
+        passages.append("\n".join(window))
+    return passages
+
+
+def build_passages(policy, max_chars=PASSAGE_MAX_CHARS, overlap_chars=PASSAGE_OVERLAP_CHARS):
+    """
+    Build the passage documents for one knowledge base policy.
+
+    Each passage carries the policy metadata and a back-reference
+    (``policyId`` + ``passageIndex``) to the document it was cut from.
+
+    Args:
+        policy (dict): Policy document as stored in the knowledge collection
+        max_chars (int): Soft upper bound on the length of a passage
+        overlap_chars (int): Amount of trailing text repeated in the next passage
+
+    Returns:
+        list[dict]: Passage documents, without embeddings
+    """
+    texts = split_into_passages(policy.get("content"), max_chars, overlap_chars)
+    passages = []
+    for index, text in enumerate(texts):
+        passage = {field: policy.get(field) for field in PASSAGE_METADATA_FIELDS}
+        passage["passageId"] = f"{policy.get('policyId')}#{index:03d}"
+        passage["passageIndex"] = index
+        passage["passageCount"] = len(texts)
+        passage["content"] = text
+        passages.append(passage)
+    return passages
+
+
+def passage_embedding_text(passage):
+    """Text that is embedded for a passage: the policy title gives the chunk its topic."""
+    return f"{passage.get('title')}\n{passage.get('content')}"
+
+
+def merge_passages_by_policy(results):
+    """
+    Group passage search hits by the policy they belong to.
+
+    Args:
+        results (list[dict]): Passage hits carrying ``score`` and passage fields
+
+    Returns:
+        list[dict]: One entry per policy ordered by its best passage score, with
+        the matched ``(passageIndex, content)`` pairs restored to document order
+    """
+    merged = {}
+    for hit in results:
+        policy_id = hit.get("policyId")
+        group = merged.get(policy_id)
+        if group is None:
+            group = {field: hit.get(field) for field in PASSAGE_METADATA_FIELDS}
+            group["score"] = hit.get("score", 0.0)
+            group["passages"] = {}
+            merged[policy_id] = group
+        group["score"] = max(group["score"], hit.get("score", 0.0))
+        group["passages"][hit.get("passageIndex")] = hit.get("content")
+
+    groups = sorted(merged.values(), key=lambda group: group["score"], reverse=True)
+    for group in groups:
+        group["passages"] = [(index, group["passages"][index]) for index in sorted(group["passages"])]
+    return groups
+
+
+def _stitch_passages(passages):
+    """
+    Join matched passages in document order. Adjacent passages share their
+    overlap, so the repeated leading lines of the later one are dropped.
+    """
+    sections = []
+    previous_index = None
+    previous_lines = []
+    for index, text in passages:
+        lines = text.split("\n")
+        if previous_index is not None and index == previous_index + 1:
+            while lines and lines[0] in previous_lines:
+                lines.pop(0)
+            if lines:
+                sections[-1] += "\n" + "\n".join(lines)
+        else:
+            sections.append("\n".join(lines))
+        previous_index, previous_lines = index, text.split("\n")
+    return "\n...\n".join(sections)
+
+
+def build_summary_from_passages(group):
+    return (
+        f"Policy ID: {group.get('policyId')}\n"
+        f"Title: {group.get('title')}\n"
+        f"Region: {group.get('region')}\n"
+        f"Category: {group.get('category')}\n"
+        f"Last Updated: {group.get('lastUpdated')}\n\n"
+        f"{_stitch_passages(group.get('passages', []))}"
+    )
@@ -0,0 +1,147 @@
+"""
+Per-session conversation memory.
+
+Each session keeps a bounded ring buffer of its most recent turns: the
+question, the entities resolved for it, the contexts retrieved and the
+answer. Turns expire ``SESSION_TTL_SECONDS`` after the session was last
+active. Agents use it to answer follow-ups ("and what about my manager?")
+from what earlier turns already resolved, instead of repeating entity
+extraction, SQL lookups or vector search.
+
+Backends, selected with ``SESSION_STORE``:
+
+- ``memory`` (default): held in an affinity cache, so with inputs keyed by
+  session_id a session lives on the consumer that owns its partition;
+- ``sqlite``: a SQLite file at ``SESSION_STORE_PATH``, a stand-in for a
+  shared persistent store that survives restarts and rebalances.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from partitioning import get_affinity_cache
+
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "/tmp/session_store.db")
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "8"))
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "1800"))
+
+_FOLLOW_UP_OPENERS = re.compile(r"^\s*(and|also|what about|how about|what of|same for|then|ok(ay)?,?|so)\b", re.IGNORECASE)
+_BACK_REFERENCES = re.compile(r"\b(he|she|his|her|hers|him|they|them|their|that|those|it|its|this one)\b", re.IGNORECASE)
+_EXPLICIT_ENTITY = re.compile(r"\bE\d{3,}\b|\bPOL-[A-Z]", re.IGNORECASE)
+
+
+def is_follow_up(query):
+    """
+    Heuristic: the question leans on an earlier turn, i.e. it opens like a
+    follow-up or refers back, and names no employee or policy ID.
+
+    Args:
+        query (str): The new question
+
+    Returns:
+        bool
+    """
+    if not query or _EXPLICIT_ENTITY.search(query):
+        return False
+    return bool(_FOLLOW_UP_OPENERS.search(query) or (len(query.split()) <= 8 and _BACK_REFERENCES.search(query)))
+
+
+def new_turn(query, entities=None, contexts=None, answer=None):
+    return {
+        "timestamp": time.time(),
+        "query": query,
+        "entities": entities or {},
+        "contexts": contexts or {},
+        "answer": answer,
+    }
+
+
+class InMemorySessionStore:
+    """Ring buffers in a partition-affine cache."""
+    def __init__(self, max_turns=SESSION_MAX_TURNS, ttl_seconds=SESSION_TTL_SECONDS):
+        self.max_turns = max_turns
+        self.cache = get_affinity_cache("session_history", ttl_seconds=ttl_seconds)
+        self.lock = threading.Lock()
+
+    def get(self, session_id):
+        turns = self.cache.get(session_id)
+        return list(turns) if turns else []
+
+    def append(self, session_id, turn):
+        with self.lock:
+            turns = self.cache.get(session_id) or deque(maxlen=self.max_turns)
+            turns.append(turn)
+            # Re-putting refreshes the TTL and tags the session with the current partition
+            self.cache.put(session_id, turns)
+
+
+class SQLiteSessionStore:
+    """Ring buffers in a SQLite table, trimmed to ``max_turns`` per session on write."""
+    def __init__(self, path=SESSION_STORE_PATH, max_turns=SESSION_MAX_TURNS, ttl_seconds=SESSION_TTL_SECONDS):
+        self.max_turns = max_turns
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS session_turns (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                turn TEXT NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_session_turns_created ON session_turns (created_at)")
+
+    def get(self, session_id):
+        cutoff = time.time() - self.ttl_seconds
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT turn FROM session_turns WHERE session_id = ? ORDER BY seq",
+                (session_id,)
+            ).fetchall()
+            latest = self.conn.execute(
+                "SELECT MAX(created_at) FROM session_turns WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+        if latest is None or latest < cutoff:
+            return []
+        return [json.loads(row[0]) for row in rows]
+
+    def append(self, session_id, turn):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN")
+            seq = self.conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) + 1 FROM session_turns WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            self.conn.execute(
+                "INSERT INTO session_turns (session_id, seq, created_at, turn) VALUES (?, ?, ?, ?)",
+                (session_id, seq, now, json.dumps(turn, default=str))
+            )
+            self.conn.execute(
+                "DELETE FROM session_turns WHERE session_id = ? AND seq <= ?", (session_id, seq - self.max_turns)
+            )
+            # Expire idle sessions as a side effect of writes
+            self.conn.execute("DELETE FROM session_turns WHERE created_at < ?", (now - self.ttl_seconds,))
+            self.conn.execute("COMMIT")
+
+
+_store = None
+
+
+def get_session_store():
+    global _store
+    if _store is None:
+        if SESSION_STORE == "sqlite":
+            _store = SQLiteSessionStore()
+        elif SESSION_STORE == "memory":
+            _store = InMemorySessionStore()
+        else:
+            raise ValueError(f"Unknown SESSION_STORE {SESSION_STORE!r}; use memory or sqlite")
+    return _store
@@ -0,0 +1,142 @@
+"""
+Short-lived store for speculative agent results.
+
+With speculative dispatch, cheap side-effect-free agent work starts on the
+``queries`` topic at the same time as the orchestrator's ``ML_PREDICT``
+routing, instead of after it (``workers/agent_worker.py --speculative``).
+That work is search retrieval and the requesting employee's context lookup.
+Results are stored here under the query's ``message_id``. When the router
+selects the agent, the routed record takes the result and skips the work.
+Results the router did not ask for expire after
+``SPECULATIVE_TTL_SECONDS``. Side-effecting agents (the scheduler) never
+speculate.
+
+Backends, selected with ``SPECULATIVE_STORE``:
+
+- ``memory`` (default): in-process, for a worker that consumes both
+  ``queries`` and the agent's input;
+- ``sqlite``: a SQLite file at ``SPECULATIVE_STORE_PATH``, shared by the
+  speculative and regular workers on a host.
+
+Routed records only consult the store with ``SPECULATIVE_DISPATCH=true``.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Whether routed records look for a speculative result before doing the work
+SPECULATIVE_DISPATCH = os.getenv("SPECULATIVE_DISPATCH", "false").lower() == "true"
+SPECULATIVE_STORE = os.getenv("SPECULATIVE_STORE", "memory")
+SPECULATIVE_STORE_PATH = os.getenv("SPECULATIVE_STORE_PATH", "/tmp/speculative_results.db")
+SPECULATIVE_TTL_SECONDS = float(os.getenv("SPECULATIVE_TTL_SECONDS", "120"))
+SPECULATIVE_MAX_ENTRIES = int(os.getenv("SPECULATIVE_MAX_ENTRIES", "10000"))
+
+
+class InMemorySpeculativeStore:
+    """Results by (message_id, kind), oldest dropped first once full or expired."""
+    def __init__(self, ttl_seconds=SPECULATIVE_TTL_SECONDS, max_entries=SPECULATIVE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stored = 0
+        self.taken = 0
+        self.expired = 0
+
+    def _expire(self, now):
+        while self.entries:
+            key, (_, created_at) = next(iter(self.entries.items()))
+            if now - created_at <= self.ttl_seconds and len(self.entries) <= self.max_entries:
+                return
+            del self.entries[key]
+            self.expired += 1
+
+    def put(self, message_id, kind, value):
+        now = time.monotonic()
+        with self.lock:
+            self.entries[(message_id, kind)] = (value, now)
+            self.entries.move_to_end((message_id, kind))
+            self.stored += 1
+            self._expire(now)
+
+    def take(self, message_id, kind):
+        """The result for a message, removed from the store, or None."""
+        now = time.monotonic()
+        with self.lock:
+            self._expire(now)
+            entry = self.entries.pop((message_id, kind), None)
+            if entry is None:
+                return None
+            self.taken += 1
+            return entry[0]
+
+    def stats(self):
+        return {"entries": len(self.entries), "stored": self.stored, "taken": self.taken, "expired": self.expired}
+
+
+class SQLiteSpeculativeStore:
+    """Results in a SQLite table shared between processes; expired rows are deleted on write."""
+    def __init__(self, path=SPECULATIVE_STORE_PATH, ttl_seconds=SPECULATIVE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS speculative_results (
+                message_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (message_id, kind)
+            )
+        """)
+        self.stored = 0
+        self.taken = 0
+        self.expired = 0
+
+    def put(self, message_id, kind, value):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO speculative_results (message_id, kind, created_at, value) VALUES (?, ?, ?, ?)",
+                (message_id, kind, now, json.dumps(value, default=str))
+            )
+            self.expired += self.conn.execute(
+                "DELETE FROM speculative_results WHERE created_at < ?", (now - self.ttl_seconds,)
+            ).rowcount
+            self.stored += 1
+
+    def take(self, message_id, kind):
+        """The result for a message, removed from the store, or None."""
+        with self.lock:
+            row = self.conn.execute(
+                "DELETE FROM speculative_results WHERE message_id = ? AND kind = ? AND created_at >= ? "
+                "RETURNING value",
+                (message_id, kind, time.time() - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                return None
+            self.taken += 1
+            return json.loads(row[0])
+
+    def stats(self):
+        entries = self.conn.execute("SELECT COUNT(*) FROM speculative_results").fetchone()[0]
+        return {"entries": entries, "stored": self.stored, "taken": self.taken, "expired": self.expired}
+
+
+_store = None
+
+
+def get_speculative_store():
+    global _store
+    if _store is None:
+        if SPECULATIVE_STORE == "sqlite":
+            _store = SQLiteSpeculativeStore()
+        elif SPECULATIVE_STORE == "memory":
+            _store = InMemorySpeculativeStore()
+        else:
+            raise ValueError(f"Unknown SPECULATIVE_STORE {SPECULATIVE_STORE!r}; use memory or sqlite")
+    return _store
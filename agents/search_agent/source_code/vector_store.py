@@ -0,0 +1,291 @@
+"""
+Compact on-disk vector store for a local copy of the knowledge base.
+
+Embeddings are L2-normalised and stored in one of three code formats:
+
+- ``float16``: half precision, 2 bytes per dimension;
+- ``int8``: symmetric scalar quantisation with one float32 scale per vector,
+  about 1 byte per dimension;
+- ``pq``: product quantisation. Each vector is split into ``subspaces``
+  slices, and each slice is replaced by the index of its nearest of 256
+  k-means centroids. That is 1 byte per subspace, e.g. 96 bytes for a
+  1536-dimension Titan embedding.
+
+Searches score the codes of the whole store, or of the region/category
+pre-filtered positions, keep the top ``k * oversample`` candidates, and
+rerank those exactly against the float32 originals when the store has them.
+All arrays are ``.npy`` files loaded with ``mmap_mode="r"``. Opening a store
+costs milliseconds whatever its size, and only the pages a search touches
+are read.
+
+Build a store from documents that carry ``contentEmbedding``, e.g. the seed
+corpus or the output of ``ingest_passages.py --output``::
+
+    python vector_store.py --input ../../../terraform/seed/data.json --output /tmp/vector_store --mode int8
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from bm25_index import normalize_region
+
+VECTOR_FIELD = "contentEmbedding"
+MODES = ("float16", "int8", "pq")
+PQ_CENTROIDS = 256
+PQ_TRAINING_SAMPLE = 20000
+# Rows converted to float32 at a time when scoring float16/int8 codes
+SCORE_CHUNK_ROWS = 16384
+# Candidates kept per result for the exact rerank; PQ scores are coarser
+DEFAULT_OVERSAMPLE = {"float16": 2, "int8": 4, "pq": 16}
+
+
+def _as_float(value):
+    """Plain number from JSON or mongoexport's extended JSON ({"$numberDouble": "0.12"})."""
+    if isinstance(value, dict):
+        value = next(iter(value.values()))
+    return float(value)
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def train_product_quantizer(vectors, subspaces, iterations=20, seed=7):
+    """
+    K-means codebooks for each subspace.
+
+    Args:
+        vectors (np.ndarray): (n, d) float32 vectors, d divisible by subspaces
+        subspaces (int): Number of slices each vector is split into
+        iterations (int): Lloyd iterations per subspace
+        seed (int): Seed for the centroid initialisation
+
+    Returns:
+        np.ndarray: (subspaces, centroids, d / subspaces) float32 codebooks
+    """
+    dimensions = vectors.shape[1]
+    if dimensions % subspaces:
+        raise ValueError(f"{dimensions} dimensions do not split into {subspaces} subspaces")
+    rng = np.random.default_rng(seed)
+    if len(vectors) > PQ_TRAINING_SAMPLE:
+        vectors = vectors[rng.choice(len(vectors), PQ_TRAINING_SAMPLE, replace=False)]
+    n = len(vectors)
+    width = dimensions // subspaces
+    centroids = min(PQ_CENTROIDS, n)
+    codebooks = np.zeros((subspaces, centroids, width), dtype=np.float32)
+    for m in range(subspaces):
+        data = vectors[:, m * width:(m + 1) * width]
+        codebook = data[rng.choice(n, centroids, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = _nearest(data, codebook)
+            sums = np.zeros_like(codebook)
+            np.add.at(sums, assignment, data)
+            counts = np.bincount(assignment, minlength=centroids)
+            # Empty clusters keep their previous centroid
+            filled = counts > 0
+            codebook[filled] = sums[filled] / counts[filled, None]
+        codebooks[m] = codebook
+    return codebooks
+
+
+def _nearest(data, codebook):
+    # argmin ||x - c||^2 == argmin (||c||^2 - 2 x.c)
+    distances = (codebook * codebook).sum(axis=1) - 2.0 * data @ codebook.T
+    return distances.argmin(axis=1)
+
+
+def encode(vectors, mode, subspaces=96, iterations=20):
+    """
+    Quantise normalised float32 vectors.
+
+    Returns:
+        dict: Array name to array, written to ``<name>.npy``
+    """
+    if mode == "float16":
+        return {"codes": vectors.astype(np.float16)}
+    if mode == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.round(vectors / scales[:, None]).astype(np.int8)
+        return {"codes": codes, "scales": scales.astype(np.float32)}
+    if mode == "pq":
+        codebooks = train_product_quantizer(vectors, subspaces, iterations)
+        width = vectors.shape[1] // subspaces
+        codes = np.empty((len(vectors), subspaces), dtype=np.uint8)
+        for m in range(subspaces):
+            codes[:, m] = _nearest(vectors[:, m * width:(m + 1) * width], codebooks[m])
+        return {"codes": codes, "codebooks": codebooks}
+    raise ValueError(f"Unknown mode {mode!r}; use one of {', '.join(MODES)}")
+
+
+def build_vector_store(documents, path, mode="int8", subspaces=96, keep_full=True, id_field="policyId"):
+    """
+    Write a store for documents carrying ``contentEmbedding``.
+
+    Args:
+        documents (list[dict]): Documents with their embedding
+        path (str): Directory to write
+        mode (str): float16, int8 or pq
+        subspaces (int): PQ subspaces (bytes per vector)
+        keep_full (bool): Also write the float32 originals for exact reranking
+        id_field (str): Field identifying a document
+
+    Returns:
+        dict: The store's metadata
+    """
+    vectors = _normalize(np.asarray(
+        [[_as_float(value) for value in doc[VECTOR_FIELD]] for doc in documents], dtype=np.float32
+    ))
+    arrays = encode(vectors, mode, subspaces)
+    if keep_full:
+        arrays["full"] = vectors
+
+    os.makedirs(path, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), array)
+    with open(os.path.join(path, "documents.json"), "w") as f:
+        json.dump([{key: value for key, value in doc.items() if key not in (VECTOR_FIELD, "_id")} for doc in documents], f)
+
+    meta = {
+        "mode": mode,
+        "count": len(documents),
+        "dimensions": int(vectors.shape[1]),
+        "id_field": id_field,
+        "code_bytes": int(arrays["codes"].nbytes),
+        "rerank": keep_full,
+    }
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return meta
+
+
+class VectorStore:
+    """
+    A store written by build_vector_store, memory-mapped from ``path``.
+
+    Args:
+        path (str): Store directory
+        mmap (bool): Map the arrays instead of reading them into memory
+    """
+    def __init__(self, path, mmap=True):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        with open(os.path.join(path, "documents.json")) as f:
+            self.documents = json.load(f)
+        mmap_mode = "r" if mmap else None
+
+        def load(name):
+            file = os.path.join(path, f"{name}.npy")
+            return np.load(file, mmap_mode=mmap_mode) if os.path.exists(file) else None
+
+        self.mode = self.meta["mode"]
+        self.id_field = self.meta.get("id_field", "policyId")
+        self.codes = load("codes")
+        self.scales = load("scales")
+        self.codebooks = np.asarray(load("codebooks")) if self.mode == "pq" else None
+        self.full = load("full")
+        self.by_region = {}
+        self.by_category = {}
+        for position, doc in enumerate(self.documents):
+            self.by_region.setdefault(normalize_region(doc.get("region")), []).append(position)
+            self.by_category.setdefault(normalize_region(doc.get("category")), []).append(position)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def candidates(self, regions=None, categories=None):
+        """Positions matching the metadata filters (sorted array), or None for all."""
+        allowed = None
+        for values, groups in ((regions, self.by_region), (categories, self.by_category)):
+            if values:
+                matched = set()
+                for value in values:
+                    matched.update(groups.get(normalize_region(value), ()))
+                allowed = matched if allowed is None else allowed & matched
+        return None if allowed is None else np.fromiter(sorted(allowed), dtype=np.int64)
+
+    def approximate_scores(self, query, positions=None):
+        """Inner products of the (normalised) query with the codes at ``positions``."""
+        codes = self.codes if positions is None else self.codes[positions]
+        if self.mode in ("float16", "int8"):
+            scores = np.empty(len(codes), dtype=np.float32)
+            for start in range(0, len(codes), SCORE_CHUNK_ROWS):
+                chunk = codes[start:start + SCORE_CHUNK_ROWS]
+                scores[start:start + len(chunk)] = chunk.astype(np.float32) @ query
+            if self.mode == "int8":
+                scores *= self.scales if positions is None else self.scales[positions]
+            return scores
+        # Asymmetric distance: one table of centroid scores per subspace, then lookups
+        subspaces, _, width = self.codebooks.shape
+        tables = np.einsum("mcw,mw->mc", self.codebooks, query.reshape(subspaces, width))
+        return tables[np.arange(subspaces), np.asarray(codes)].sum(axis=1)
+
+    def search(self, query_vector, k=10, allowed=None, oversample=None, rerank=True):
+        """
+        Top documents by cosine similarity.
+
+        Args:
+            query_vector (list[float]): Query embedding
+            k (int): Results to return
+            allowed (np.ndarray): Positions to search (from candidates()), None for all
+            oversample (int): Candidates kept per result for the exact rerank
+                (default per mode, see DEFAULT_OVERSAMPLE)
+            rerank (bool): Rescore the candidates against the float32 originals
+
+        Returns:
+            list[tuple[dict, float]]: (document, score), best first
+        """
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        if allowed is not None and len(allowed) == 0:
+            return []
+
+        scores = self.approximate_scores(query, allowed)
+        positions = np.arange(len(self.documents)) if allowed is None else allowed
+        exact = rerank and self.full is not None
+        oversample = oversample or DEFAULT_OVERSAMPLE[self.mode]
+        keep = min(len(scores), k * oversample if exact else k)
+        top = np.argpartition(-scores, keep - 1)[:keep]
+        candidates, scores = positions[top], scores[top]
+        if exact:
+            # Only the candidates' rows of the mapped originals are read
+            order = np.argsort(candidates)
+            candidates = candidates[order]
+            scores = np.asarray(self.full[candidates], dtype=np.float32) @ query
+        best = np.argsort(-scores)[:k]
+        return [(self.documents[int(candidates[i])], float(scores[i])) for i in best]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a compact vector store from embedded documents.")
+    parser.add_argument("--input", required=True, help="JSON array of documents with contentEmbedding")
+    parser.add_argument("--output", required=True, help="Store directory")
+    parser.add_argument("--mode", choices=MODES, default="int8")
+    parser.add_argument("--subspaces", type=int, default=96, help="PQ subspaces (bytes per vector)")
+    parser.add_argument("--id-field", default="policyId")
+    parser.add_argument("--no-rerank", action="store_true", help="Don't keep float32 originals for reranking")
+    args = parser.parse_args()
+
+    with open(args.input) as f:
+        documents = {}
+        for doc in json.load(f):
+            if doc.get(VECTOR_FIELD):
+                documents.setdefault(doc.get(args.id_field), doc)
+        documents = list(documents.values())
+    started = time.perf_counter()
+    meta = build_vector_store(documents, args.output, args.mode, args.subspaces, not args.no_rerank, args.id_field)
+    full_bytes = meta["count"] * meta["dimensions"] * 4
+    print(f"Wrote {meta['count']} vectors to {args.output} in {time.perf_counter() - started:.1f}s: "
+          f"{meta['code_bytes']} bytes of {args.mode} codes vs {full_bytes} bytes of float32 "
+          f"({full_bytes / max(meta['code_bytes'], 1):.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,27 @@
 from langchain.agents import create_sql_agent
 from langchain.agents.agent_toolkits import SQLDatabaseToolkit
+from langchain_community.agent_toolkits.sql.prompt import SQL_PREFIX
 from langchain_community.utilities import SQLDatabase
-from langchain_community.chat_models import BedrockChat
 import os
 from dotenv import load_dotenv
 from typing import Dict, Any, List, Optional, Union
 import json
 import re
-import boto3
+import backends
+from bedrock_governor import govern
+from metering import set_query_type, step
+from partitioning import get_affinity_cache
+from session_store import get_session_store, is_follow_up, new_turn
+from plan_cache import PLAN_CACHE, PlanCache
+from hr_store import (
+    DEPARTMENTS_DDL, EMPLOYEES_DDL, HR_DB_PERFORMANCE_MODE, apply_performance_mode, tune_connection
+)
+from sqlalchemy import create_engine, event
 from botocore.exceptions import ClientError, CredentialRetrievalError
 from botocore.config import Config
 
+SQL_AGENT_VERBOSE = os.getenv("SQL_AGENT_VERBOSE", "false").lower() == "true"
+
 class HRSQLAgent:
     """A SQL agent specialized for HR data retrieval only."""
     
@@ -32,30 +43,25 @@ class HRSQLAgent:
         db_uri = f"sqlite:///{db_path}"
         
         # Connect to the database
-        self.db = SQLDatabase.from_uri(db_uri)
+        engine = create_engine(db_uri)
+        if HR_DB_PERFORMANCE_MODE:
+            event.listen(engine, "connect", lambda dbapi_connection, _: tune_connection(dbapi_connection))
+        self.db = SQLDatabase(engine)
         
         try:
-            # Create AWS session with credentials
-            session_kwargs = {
-                'region_name': self.aws_region
-            }
-            
-            
-            session = boto3.Session(**session_kwargs)
-            
-            # Initialize AWS Bedrock client using the session
-            self.bedrock_client = session.client(
-                service_name='bedrock-runtime',
+            # Initialize AWS Bedrock client. Throttling is retried by the governor,
+            # which adapts concurrency instead of piling retries onto an overloaded endpoint
+            self.bedrock_client = govern(backends.bedrock_runtime(
                 region_name=self.aws_region,
                 config=Config(
                     retries=dict(
-                        max_attempts=3
+                        max_attempts=1
                     )
                 )
-            )
+            ))
             
             # Initialize the language model with Claude Sonnet
-            self.llm = BedrockChat(
+            self.llm = backends.chat_model(
                 client=self.bedrock_client,
                 model_id="anthropic.claude-3-5-haiku-20241022-v1:0",
                 model_kwargs={
@@ -69,14 +75,26 @@ class HRSQLAgent:
             # Create SQL toolkit and agent
             self.toolkit = SQLDatabaseToolkit(db=self.db, llm=self.llm)
             
+            # The schema is static: introspect it once and pin it into the prompt,
+            # so the agent doesn't spend round trips listing tables and fetching schemas
+            table_info = self.db.get_table_info()
+            pinned_prefix = SQL_PREFIX + "\n\nThe database has these tables; you do not need to look them up:\n\n" + (
+                table_info.replace("{", "{{").replace("}", "}}")
+            )
+            
             # Initialize the SQL agent
             self.agent = create_sql_agent(
                 llm=self.llm,
                 toolkit=self.toolkit,
-                verbose=True,
+                prefix=pinned_prefix,
+                # Verbose runs echo every intermediate step and observation to the log
+                verbose=SQL_AGENT_VERBOSE,
                 handle_parsing_errors=True
             )
             
+            # Questions of an already-seen shape run as one parameterised query
+            self.plan_cache = PlanCache(db_path, llm=self.llm, table_info=table_info) if PLAN_CACHE else None
+            
         except CredentialRetrievalError as e:
             raise ValueError(
                 "Failed to retrieve AWS credentials. Please verify your AWS credentials are correct "
@@ -100,6 +118,23 @@ class HRSQLAgent:
                     "to access AWS Bedrock."
                 ) from e
     
+    def _invoke(self, query: str) -> Dict[str, Any]:
+        """
+        Answer a query from the plan cache, falling back to the agent loop.
+        
+        Args:
+            query: SQL or natural language query
+            
+        Returns:
+            Dictionary with the answer under "output", as returned by the agent
+        """
+        with step("sql"):
+            if self.plan_cache is not None:
+                output = self.plan_cache.run(query)
+                if output is not None:
+                    return {"output": output}
+            return self.agent.invoke({"input": query})
+    
     def get_employee_context(self, employee_id: str) -> Dict[str, Any]:
         """
         Retrieve employee context data for policy lookup.
@@ -110,6 +145,13 @@ class HRSQLAgent:
         Returns:
             Dictionary containing the employee context
         """
+        # Each employee's context is an agent round trip; with inputs keyed by
+        # employee_id or session_id the consumer owning the key keeps it warm
+        employee_context_cache = get_affinity_cache("employee_context")
+        cached = employee_context_cache.get(employee_id)
+        if cached is not None:
+            return cached
+
         query = f"""
         SELECT 
             e.employee_id,
@@ -131,7 +173,7 @@ class HRSQLAgent:
         WHERE e.employee_id = '{employee_id}'
         """
         try:
-            result = self.agent.invoke({"input": query})
+            result = self._invoke(query)
             output = result.get("output", "")
             
             # Initialize employee context with basic info
@@ -161,6 +203,7 @@ class HRSQLAgent:
                     # If there's an error getting department data, just continue without it
                     pass
             
+            employee_context_cache.put(employee_id, employee_context)
             return employee_context
             
         except Exception as e:
@@ -195,7 +238,7 @@ class HRSQLAgent:
         GROUP BY d.department_id, d.department_name, d.location, d.head_id, e.first_name, e.last_name
         """
         try:
-            result = self.agent.invoke({"input": query})
+            result = self._invoke(query)
             output = result.get("output", "")
             
             # Initialize department context
@@ -248,6 +291,14 @@ class HRSQLAgent:
             if re.search(pattern, query, re.IGNORECASE):
                 return {"entity_type": "self_reference", "needs_employee_id": True}
         
+        # Departments and employees named as in the database need no LLM round trip
+        if self.plan_cache is not None:
+            entity = self.plan_cache.match_entity(query)
+            if entity and entity[0] == "department":
+                return {"entity_type": "department", "department_name": entity[1]}
+            if entity and entity[0] == "employee":
+                return {"entity_type": "employee", "employee_id": entity[1]}
+        
         # Check for department mentions
         department_check_query = f"""
         The following is a user query: "{query}"
@@ -256,7 +307,8 @@ class HRSQLAgent:
         If neither, respond with ONLY "GENERAL".
         """
         
-        entity_response = self.agent.run(department_check_query).strip()
+        with step("entities"):
+            entity_response = self.agent.run(department_check_query).strip()
         
         if entity_response.upper() == "GENERAL":
             return {"entity_type": "general"}
@@ -268,7 +320,7 @@ class HRSQLAgent:
             Find the employee_id for an employee named {employee_name}.
             Respond with ONLY the employee_id in the format E###.
             """
-            employee_id = self.agent.run(employee_id_query).strip()
+            employee_id = self._invoke(employee_id_query).get("output", "").strip()
             if re.match(r'E\d{3}', employee_id):
                 return {"entity_type": "employee", "employee_id": employee_id, "employee_name": employee_name}
             else:
@@ -297,7 +349,7 @@ class HRSQLAgent:
             Query: {query}
             
             Retrieved Information:
-            {json.dumps(context, indent=2)}
+            {json.dumps(context, separators=(',', ':'), default=str)}
             
             Please provide a natural language summary that:
             1. Directly answers the query
@@ -310,39 +362,100 @@ class HRSQLAgent:
             """
             
             # Get summary from the model
-            result = self.llm.invoke(prompt)
+            with step("summary"):
+                result = self.llm.invoke(prompt)
             return result.content.strip()
             
         except Exception as e:
             return f"Error generating summary: {str(e)}"
 
-    def run_hr_query(self, query: str, requesting_employee_id: Optional[str] = None) -> Dict[str, Any]:
+    def _entities_from_session(self, query: str, turns: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Entities of a follow-up: those resolved by the latest earlier turn when the
+        query names no subject of its own ("and his manager?"), otherwise the ones
+        it names ("What about Finance?").
+        
+        Args:
+            query: Natural language query, as asked
+            turns: The session's earlier turns, oldest first
+            
+        Returns:
+            The follow-up's entities, or None to extract them from the query
+        """
+        if not turns or not is_follow_up(query):
+            return None
+        # "and my manager?" names its subject: the requesting employee
+        if re.search(r'\b(my|I|me|mine)\b', query, re.IGNORECASE):
+            return None
+        earlier = None
+        for turn in reversed(turns):
+            entities = turn.get("entities") or {}
+            if entities.get("entity_type") in ("employee", "department", "self_reference"):
+                earlier = entities
+                break
+        if earlier is None:
+            return None
+        # Extracted from the question as asked, without the requesting employee's ID
+        named = self.extract_query_entities(query)
+        return earlier if named.get("entity_type") == "general" else named
+    
+    def _context_from_session(self, entity_info: Dict[str, Any], turns: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Context an earlier turn of the session already retrieved for the same entity.
+        
+        Args:
+            entity_info: Entities resolved for this query
+            turns: The session's earlier turns, oldest first
+            
+        Returns:
+            The earlier turn's context, or None if no turn retrieved one
+        """
+        if entity_info.get("entity_type") not in ("employee", "department", "self_reference"):
+            return None
+        for turn in reversed(turns):
+            if turn.get("entities") == entity_info and turn.get("contexts"):
+                return turn["contexts"]
+        return None
+    
+    def run_hr_query(self, query: str, requesting_employee_id: Optional[str] = None,
+                     session_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Process an HR query and return both the query result and relevant context.
         
         Args:
             query: Natural language query about HR data
             requesting_employee_id: ID of the employee making the request (for self-referential queries)
+            session_id: Conversation the query belongs to; follow-ups reuse the
+                entities and context earlier turns resolved
             
         Returns:
             Dictionary containing query results and context for policy lookup
         """
         try:
+            session_store = get_session_store() if session_id else None
+            turns = session_store.get(session_id) if session_store else []
+            asked = query
             # Add requesting employee ID to query for context
             if requesting_employee_id:
                 query = f"{query} (Requested by employee: {requesting_employee_id})"
             print(query)
-            # Extract entities from the query
-            entity_info = self.extract_query_entities(query)
+            # Extract entities from the query, unless an earlier turn already resolved them
+            entity_info = self._entities_from_session(asked, turns) or self.extract_query_entities(query)
             
             # Initialize response structure
             response_data = {
                 "raw_output": "",
                 "context": {}
             }
+            session_context = self._context_from_session(entity_info, turns)
+            set_query_type("session_reuse" if session_context is not None else entity_info.get("entity_type"))
             
             # Handle different entity types
-            if entity_info.get("entity_type") == "employee":
+            if session_context is not None:
+                response_data["context"] = dict(session_context)
+                response_data["raw_output"] = "Reused information retrieved earlier in the session"
+                
+            elif entity_info.get("entity_type") == "employee":
                 employee_id = entity_info.get("employee_id")
                 employee_context = self.get_employee_context(employee_id)
                 response_data["context"]["employeeContext"] = employee_context
@@ -373,7 +486,7 @@ class HRSQLAgent:
                 ORDER BY e.employee_id
                 """
                 try:
-                    result = self.agent.invoke({"input": employee_query})
+                    result = self._invoke(employee_query)
                     if result and result.get("output"):
                         response_data["context"]["departmentEmployees"] = {
                             "raw_output": result.get("output", ""),
@@ -406,7 +519,7 @@ class HRSQLAgent:
                         WHERE department = '{dept_name}'
                         """
                         try:
-                            result = self.agent.invoke({"input": count_query})
+                            result = self._invoke(count_query)
                             if result and result.get("output"):
                                 response_data["context"]["employeeCount"] = {
                                     "department": dept_name,
@@ -425,6 +538,14 @@ class HRSQLAgent:
                 summary = self._generate_summary(query, response_data["context"])
                 response_data["summary"] = summary
             
+            if session_store:
+                session_store.append(session_id, new_turn(
+                    asked,
+                    entities=entity_info,
+                    contexts=response_data["context"],
+                    answer=response_data.get("summary")
+                ))
+            
             return self._standardize_response(response_data)
             
         except Exception as e:
@@ -484,47 +605,35 @@ class HRSQLAgent:
 
 
 # Example setup code (sqlite database creation) - unchanged from original
-def setup_hr_database(db_path="/tmp/hr_database.db"):
-    """Create a sample HR database for testing."""
+def setup_hr_database(db_path="/tmp/hr_database.db", seed=True):
+    """
+    Create the HR database.
+    
+    Args:
+        db_path: Path to the SQLite database file
+        seed: Recreate the database with sample rows. With False the schema is
+            created if missing, existing rows are kept for hr_sync.py to update,
+            and only the departments and the managers they reference are added.
+    """
     import sqlite3
     import os
     
     # Delete the database file if it exists to ensure we create a fresh one with the new schema
-    if os.path.exists(db_path):
+    if seed and os.path.exists(db_path):
         os.remove(db_path)
     
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
     # Create employees table with the new columns
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS employees (
-        employee_id TEXT PRIMARY KEY,
-        first_name TEXT,
-        last_name TEXT,
-        email TEXT,
-        phone TEXT,
-        hire_date TEXT,
-        job_title TEXT,
-        department TEXT,
-        manager_id TEXT,
-        salary REAL,
-        tenure TEXT,
-        country TEXT,
-        region TEXT,
-        employee_type TEXT
-    )
-    ''')
+    cursor.execute(EMPLOYEES_DDL)
     
     # Create departments table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS departments (
-        department_id TEXT PRIMARY KEY,
-        department_name TEXT,
-        location TEXT,
-        head_id TEXT
-    )
-    ''')
+    cursor.execute(DEPARTMENTS_DDL)
+    
+    # Indexes, WAL and planner statistics (see hr_store.py)
+    if HR_DB_PERFORMANCE_MODE:
+        apply_performance_mode(conn)
     
     # Insert sample employees with country, region, and employee type
     sample_employees = [
@@ -537,34 +646,47 @@ def setup_hr_database(db_path="/tmp/hr_database.db"):
         ("E102", "Jennifer", "Wilson", "jennifer.wilson@company.com", "555-7890", "2017-09-12", "HR Director", "Human Resources", "E201", 155000.00, "5 years", "United States", "North America", "Full Time"),
         ("E103", "James", "Taylor", "james.taylor@company.com", "555-8901", "2018-04-30", "Finance Director", "Finance", "E201", 165000.00, "4.5 years", "Europe", "Europe", "Full Time"),
         ("E104", "Vaishnavi", "Deshpande", "vaishnavi.deshpande@company.com", "555-9012", "2019-03-22", "Product Director", "Product", "E201", 170000.00, "4 years", "Asia/Pacific", "India", "Full Time"),
+        ("E105", "Robert", "Brown", "robert.brown@company.com", "555-2233", "2016-05-09", "Chief Marketing Officer", "Marketing", "E201", 180000.00, "7 years", "United Kingdom", "Europe", "Full Time"),
         ("E201", "Richard", "Thomas", "richard.thomas@company.com", "555-0123", "2015-10-18", "COO", "Executive", "E301", 250000.00, "8 years", "United States", "Latin America", "Full Time"),
         ("E301", "Elizabeth", "Jackson", "elizabeth.jackson@company.com", "555-1122", "2010-01-05", "CEO", "Executive", None, 350000.00, "13 years", "United States", "Latin America", "Full Time")
     ]
     
-    cursor.executemany('''
-    INSERT OR REPLACE INTO employees 
-    (employee_id, first_name, last_name, email, phone, hire_date, job_title, department, manager_id, salary, tenure, country, region, employee_type) 
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', sample_employees)
-    
     # Insert sample departments
     sample_departments = [
         ("D001", "Engineering", "Building A, Floor 2", "E101"),
         ("D002", "Human Resources", "Building B, Floor 1", "E102"),
         ("D003", "Finance", "Building A, Floor 3", "E103"),
         ("D004", "Product", "Building B, Floor 2", "E104"),
-        ("D005", "Executive", "Building A, Floor 4", "E301")
+        ("D005", "Executive", "Building A, Floor 4", "E301"),
+        ("D006", "Marketing", "London Office", "E105")
     ]
     
-    cursor.executemany('''
-    INSERT OR REPLACE INTO departments 
+    if not seed:
+        # The employee collection holds neither the departments nor the managers and
+        # department heads, and its documents carry no department (hr_sync.py takes
+        # it from the manager's row). Keep them as reference rows that synced
+        # documents may update but that are never replaced by the seed again.
+        referenced = {row[8] for row in sample_employees} | {row[3] for row in sample_departments}
+        sample_employees = [row for row in sample_employees if row[0] in referenced]
+    
+    cursor.executemany(f'''
+    INSERT OR {"REPLACE" if seed else "IGNORE"} INTO employees 
+    (employee_id, first_name, last_name, email, phone, hire_date, job_title, department, manager_id, salary, tenure, country, region, employee_type) 
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', sample_employees)
+    
+    cursor.executemany(f'''
+    INSERT OR {"REPLACE" if seed else "IGNORE"} INTO departments 
     (department_id, department_name, location, head_id) 
     VALUES (?, ?, ?, ?)
     ''', sample_departments)
-    
+
+    if HR_DB_PERFORMANCE_MODE:
+        cursor.execute("ANALYZE")
+
     conn.commit()
     conn.close()
     
-    print(f"HR database created at {db_path}")
+    print(f"HR database {'created' if seed else 'ready for sync'} at {db_path}")
     return os.path.abspath(db_path)
 
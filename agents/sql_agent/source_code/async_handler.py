@@ -0,0 +1,104 @@
+"""
+Asyncio handler of the HR SQL agent.
+
+``lambda_handler`` takes the same batches as the one in main.py but runs their
+records concurrently on the container's event loop (see aio.py), so a batch
+takes about as long as its slowest record instead of the sum of them.
+
+LangChain's Bedrock chat model and the SQLite database have no asyncio
+clients, so each record's agent run goes to a worker thread, bounded by the
+Bedrock semaphore (and by the governor in bedrock_governor.py, as before).
+Its result is then produced as an awaitable delivery instead of a flush.
+
+Deploy it with ``async_handler.lambda_handler`` as the function's handler, or
+run it locally with ``workers/agent_worker.py --asyncio``.
+"""
+import asyncio
+import json
+import logging
+
+import aio
+import memory_profile
+from avro_kafka_producer import produce_async
+# The worker initializes the agent before the first batch, and runs speculative
+# dispatch (read-only lookups) with the sync handler
+from main import INPUT_TOPIC, answer_message, initialize_resources, speculate_handler
+from metering import publish_rollup
+from retry_pipeline import route_failure
+
+logger = logging.getLogger('hr_agent_async')
+
+
+async def process_message(message):
+    """
+    Answer one HR query and produce the result to Kafka.
+
+    Args:
+        message (dict): Record from the agent's input topic
+
+    Returns:
+        dict: The agent's standardized result
+    """
+    async with aio.limit("bedrock"):
+        result, sql_result = await asyncio.to_thread(answer_message, message)
+    await produce_async(sql_result)
+    logger.info(f"Result sent for message ID: {sql_result['message_id']}")
+    return result
+
+
+async def handle_batch(event):
+    """
+    Process a batch's records concurrently.
+
+    Returns:
+        tuple: (each handled record's message_id and status, records routed for retry)
+    """
+    async def handle(record):
+        message = record['payload']['value']
+        try:
+            result = await process_message(message)
+            return {'message_id': message.get('message_id'), 'status': result.get('status')}
+        except Exception as e:
+            logger.error(f"Error processing query: {str(e)}")
+            # Park the record on a retry tier (or the DLQ) and carry on with the batch
+            await asyncio.to_thread(
+                route_failure, message, e, INPUT_TOPIC, "sql", record['payload'].get('attempt', 0)
+            )
+            return None
+
+    handled = await aio.gather_records([handle(record) for record in event])
+    results = [result for result in handled if isinstance(result, dict)]
+    return results, len(handled) - len(results)
+
+
+def lambda_handler(event, context):
+    """
+    AWS Lambda handler function.
+
+    Args:
+        event (dict): The event data from AWS Lambda
+        context (LambdaContext): The runtime information from AWS Lambda
+
+    Returns:
+        dict: Response containing the processing result
+    """
+    try:
+        # Initialize resources if not already done
+        initialize_resources()
+    except Exception as e:
+        logger.error(f"Error initializing resources: {str(e)}")
+
+        return {
+            'statusCode': 500,
+            'body': json.dumps(str(e))
+        }
+
+    # The agent stage of each record is measured in its own thread
+    results, failed = aio.run(handle_batch(event))
+    publish_rollup()
+    memory_profile.report()
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'results': results, 'routed_for_retry': failed})
+    }
@@ -1,11 +1,15 @@
 import argparse
 import os
-from uuid import uuid4
 from datetime import datetime
-from confluent_kafka import Producer
 from confluent_kafka.serialization import StringSerializer, SerializationContext, MessageField
-from confluent_kafka.schema_registry import SchemaRegistryClient
-from confluent_kafka.schema_registry.avro import AvroSerializer
+import aio
+import backends
+from delivery import producer_conf, response_key, route
+from partitioning import partition_key
+
+# Reused across invocations of a warm container (or a long-running worker)
+_producer = None
+_avro_serializer = None
 
 class HRResultProducer:
     """
@@ -20,9 +24,13 @@ class HRResultProducer:
         sql_result (str): Extracted context information
         source (str): Source of the original query
         sessionId (str, optional): Session identifier
+        usage (dict, optional): Model calls, tokens, latency and cost spent on the query
     """
+    __slots__ = ("message_id", "employee_id", "timestamp", "query", "status", "sql_result", "source", "sessionId",
+                 "usage")
+
     def __init__(self, message_id=None, employee_id=None, timestamp=None, 
-                 query=None, status=None, sql_result=None, source=None, sessionId=None):
+                 query=None, status=None, sql_result=None, source=None, sessionId=None, usage=None):
         self.message_id = message_id
         self.employee_id = employee_id
         self.timestamp = timestamp
@@ -31,6 +39,7 @@ class HRResultProducer:
         self.sql_result = sql_result
         self.source = source
         self.sessionId = sessionId
+        self.usage = usage
 
 def result_to_dict(result, ctx):
     """
@@ -49,9 +58,11 @@ def result_to_dict(result, ctx):
         'timestamp': result.timestamp,
         'query': result.query,
         'status': result.status,
-        'sql_result': result.sql_result,
+        # The response schema (and the Flink statements downstream) call it mongo_result
+        'mongo_result': result.sql_result or '',
         'source': result.source,
-        'sessionId': result.sessionId
+        'sessionId': result.sessionId,
+        'usage': result.usage
     }
 
 def delivery_report(err, msg):
@@ -67,64 +78,97 @@ def delivery_report(err, msg):
         return
     print(f'Message {msg.key()} successfully produced to {msg.topic()} [{msg.partition()}] at offset {msg.offset()}')
 
-def produce(result):
+def get_producer():
     """
-    Produce a message to Kafka using the SQL result schema.
-    
+    Create the Kafka producer and Avro serializer once and reuse them.
+
+    Returns:
+        tuple: (Producer, AvroSerializer)
+    """
+    global _producer, _avro_serializer
+    if _producer is None:
+        schema = "sql_agent_response.avsc"
+
+        # Read schema file
+        path = os.path.realpath(os.path.dirname(__file__))
+        with open(f"{path}/{schema}") as f:
+            schema_str = f.read()
+
+        # Configure Schema Registry client
+        sr_conf = {
+            'url': os.getenv("SCHEMA_REGISTRY_ENDPOINT"),
+            'basic.auth.user.info': f'{os.getenv("SCHEMA_REGISTRY_API_KEY")}:{os.getenv("SCHEMA_REGISTRY_API_SECRET")}'
+        }
+        schema_registry_client = backends.schema_registry_client(sr_conf)
+
+        # Create serializer
+        _avro_serializer = backends.avro_serializer(
+            schema_registry_client,
+            schema_str,
+            result_to_dict
+        )
+
+        # Configure Kafka producer
+        kafka_conf = {
+            'bootstrap.servers': os.getenv("BOOTSTRAP_ENDPOINT"),
+            'sasl.mechanisms': 'PLAIN',
+            'security.protocol': 'SASL_SSL',
+            'sasl.username': os.getenv("KAFKA_API_KEY"),
+            'sasl.password': os.getenv("KAFKA_API_SECRET"),
+        }
+        _producer = backends.producer(producer_conf(kafka_conf))
+    return _producer, _avro_serializer
+
+def result_message(result):
+    """
+    Topic, key and Avro value of a SQL result.
+
     Args:
         result (dict): Dictionary containing the result data matching the schema
+
+    Returns:
+        tuple: (topic, key, value)
     """
     topic = os.getenv("sql_agent_result_topic")
-    schema = "sql_agent_response.avsc"
-
-    # Read schema file
-    path = os.path.realpath(os.path.dirname(__file__))
-    with open(f"{path}/{schema}") as f:
-        schema_str = f.read()
-
-    # Configure Schema Registry client
-    sr_conf = {
-        'url': os.getenv("SCHEMA_REGISTRY_ENDPOINT"),
-        'basic.auth.user.info': f'{os.getenv("SCHEMA_REGISTRY_API_KEY")}:{os.getenv("SCHEMA_REGISTRY_API_SECRET")}'
-    }
-    schema_registry_client = SchemaRegistryClient(sr_conf)
+    _, avro_serializer = get_producer()
+    string_serializer = StringSerializer('utf_8')
 
-    # Create serializers
-    avro_serializer = AvroSerializer(
-        schema_registry_client,
-        schema_str,
-        result_to_dict
+    # Create result object
+    result_obj = HRResultProducer(
+        message_id=result.get('message_id'),
+        employee_id=result.get('employee_id'),
+        timestamp=result.get('timestamp'),
+        query=result.get('query'),
+        status=result.get('status'),
+        sql_result=result.get('sql_result'),
+        source=result.get('source'),
+        sessionId=result.get('sessionId', result.get('session_id')),
+        usage=result.get('usage')
+    )
+    return (
+        topic,
+        string_serializer(response_key(result, "sql", partition_key(result))),
+        avro_serializer(result_obj, SerializationContext(topic, MessageField.VALUE))
     )
-    string_serializer = StringSerializer('utf_8')
 
-    # Configure Kafka producer
-    producer_conf = {
-        'bootstrap.servers': os.getenv("BOOTSTRAP_ENDPOINT"),
-        'sasl.mechanisms': 'PLAIN',
-        'security.protocol': 'SASL_SSL',
-        'sasl.username': os.getenv("KAFKA_API_KEY"),
-        'sasl.password': os.getenv("KAFKA_API_SECRET"),
-    }
-    producer = Producer(producer_conf)
+def produce(result):
+    """
+    Produce a message to Kafka using the SQL result schema.
+    
+    Args:
+        result (dict): Dictionary containing the result data matching the schema
+    """
+    producer, _ = get_producer()
+    producer = route(producer)
 
     try:
-        # Create result object
-        result_obj = HRResultProducer(
-            message_id=result.get('message_id'),
-            employee_id=result.get('employee_id'),
-            timestamp=result.get('timestamp'),
-            query=result.get('query'),
-            status=result.get('status'),
-            sql_result=result.get('sql_result'),
-            source=result.get('source'),
-            sessionId=result.get('sessionId')
-        )
+        topic, key, value = result_message(result)
 
         # Produce message
         producer.produce(
             topic=topic,
-            key=string_serializer(str(uuid4())),
-            value=avro_serializer(result_obj, SerializationContext(topic, MessageField.VALUE)),
+            key=key,
+            value=value,
             on_delivery=delivery_report
         )
 
@@ -136,3 +180,21 @@ def produce(result):
         print(f"Error producing message: {str(e)}")
         raise
 
+async def produce_async(result):
+    """
+    ``produce`` for async_handler.py: waits for this record's delivery instead of a flush.
+
+    Args:
+        result (dict): Dictionary containing the result data matching the schema
+    """
+    producer, _ = get_producer()
+    producer = aio.async_producer(route(producer))
+
+    try:
+        topic, key, value = result_message(result)
+        delivery_report(None, await producer.produce(topic, value=value, key=key))
+        print(f"Successfully produced result for message_id: {result.get('message_id')}")
+
+    except Exception as e:
+        print(f"Error producing message: {str(e)}")
+        raise
@@ -0,0 +1,99 @@
+"""
+Factories for the external clients used by the SQL agent.
+
+Agent code obtains the Bedrock client, the chat model, Mongo, Schema Registry
+and Kafka clients through these functions instead of constructing them directly,
+so a local run can swap in in-process fakes with ``configure()``
+(see benchmarks/fakes.py).
+"""
+
+
+def _default_bedrock_runtime(region_name=None, config=None):
+    import boto3
+    session = boto3.Session(region_name=region_name)
+    return session.client(service_name="bedrock-runtime", region_name=region_name, config=config)
+
+
+def _default_chat_model(client, model_id, model_kwargs):
+    from langchain_community.chat_models import BedrockChat
+    return BedrockChat(client=client, model_id=model_id, model_kwargs=model_kwargs)
+
+
+def _default_mongo_client(uri):
+    from pymongo import MongoClient
+    return MongoClient(uri)
+
+
+def _default_schema_registry_client(conf):
+    from confluent_kafka.schema_registry import SchemaRegistryClient
+    return SchemaRegistryClient(conf)
+
+
+def _default_avro_serializer(schema_registry_client, schema_str, to_dict=None):
+    from confluent_kafka.schema_registry.avro import AvroSerializer
+    return AvroSerializer(schema_registry_client, schema_str, to_dict)
+
+
+def _default_producer(conf):
+    from confluent_kafka import Producer
+    return Producer(conf)
+
+
+def _default_consumer(conf):
+    from confluent_kafka import Consumer
+    return Consumer(conf)
+
+
+DEFAULTS = {
+    "bedrock_runtime": _default_bedrock_runtime,
+    "chat_model": _default_chat_model,
+    "mongo_client": _default_mongo_client,
+    "schema_registry_client": _default_schema_registry_client,
+    "avro_serializer": _default_avro_serializer,
+    "producer": _default_producer,
+    "consumer": _default_consumer,
+}
+
+_factories = dict(DEFAULTS)
+
+
+def configure(**factories):
+    """Replace one or more client factories, e.g. ``configure(bedrock_runtime=lambda **kw: fake)``."""
+    unknown = set(factories) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown backend(s): {', '.join(sorted(unknown))}")
+    _factories.update(factories)
+
+
+def reset():
+    """Restore the real client factories."""
+    _factories.clear()
+    _factories.update(DEFAULTS)
+
+
+def bedrock_runtime(region_name=None, config=None):
+    return _factories["bedrock_runtime"](region_name=region_name, config=config)
+
+
+def chat_model(client, model_id, model_kwargs):
+    return _factories["chat_model"](client, model_id, model_kwargs)
+
+
+def mongo_client(uri):
+    return _factories["mongo_client"](uri)
+
+
+def schema_registry_client(conf):
+    return _factories["schema_registry_client"](conf)
+
+
+def avro_serializer(schema_registry_client, schema_str, to_dict=None):
+    return _factories["avro_serializer"](schema_registry_client, schema_str, to_dict)
+
+
+def producer(conf):
+    return _factories["producer"](conf)
+
+
+def consumer(conf):
+    return _factories["consumer"](conf)
@@ -0,0 +1,276 @@
+"""
+Client-side governor for Bedrock calls.
+
+Every Bedrock request of the SQL agent (the ReAct agent's steps, SQL tool
+reasoning and summaries) goes through the ``bedrock-runtime`` client handed
+to ``BedrockChat``. ``GovernedBedrockClient`` wraps that client with:
+
+- an AIMD concurrency limit: halved on throttling, reduced when latency
+  exceeds the target, and grown by one slot per window of healthy calls;
+- a token bucket paced by the account's tokens-per-minute quota, charged with
+  an estimate up front and reconciled with the token counts Bedrock reports;
+- single-flight coalescing: identical requests already in flight share one
+  call instead of issuing duplicates.
+
+Each call's token counts and latency are also recorded against the message
+being handled (see metering.py). Only the caller that actually issued the
+request is charged.
+
+Throttled calls are retried here with jittered backoff, so botocore's own
+retries should be disabled to avoid retry storms.
+"""
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from metering import check_budget, record_call, token_counts
+
+logger = logging.getLogger('hr_agent_bedrock')
+
+THROTTLE_ERROR_CODES = {
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'ServiceUnavailableException',
+    'ModelNotReadyException',
+}
+
+# Rough chars-per-token ratio used to estimate a request before it is sent
+CHARS_PER_TOKEN = 4
+
+
+def is_throttle_error(error: Exception) -> bool:
+    """True for Bedrock errors that signal overload rather than a bad request."""
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in THROTTLE_ERROR_CODES
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD limit on concurrent requests.
+
+    Args:
+        initial_limit: Starting number of concurrent requests
+        min_limit: Lower bound of the limit
+        max_limit: Upper bound of the limit
+        latency_target_ms: Latency above which the limit is reduced gently
+        decrease_factor: Multiplier applied on throttling
+        cooldown_s: Minimum time between two decreases, so one burst of
+            throttles only halves the limit once
+    """
+
+    def __init__(self, initial_limit: int = 4, min_limit: int = 1, max_limit: int = 32,
+                 latency_target_ms: float = 8000, decrease_factor: float = 0.5, cooldown_s: float = 2.0):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target_ms = latency_target_ms
+        self.decrease_factor = decrease_factor
+        self.cooldown_s = cooldown_s
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency_ms: float, throttled: bool = False) -> None:
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self.last_decrease >= self.cooldown_s:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self.last_decrease = now
+            elif latency_ms > self.latency_target_ms:
+                if now - self.last_decrease >= self.cooldown_s:
+                    self.limit = max(self.min_limit, self.limit * 0.9)
+                    self.last_decrease = now
+            else:
+                # Additive increase: about one extra slot per `limit` successful calls
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+
+
+class TokenBucket:
+    """
+    Tokens-per-minute pacing. The balance may go negative when a call used
+    more tokens than estimated; later calls then wait for the debt to refill.
+
+    Args:
+        tokens_per_minute: Refill rate, 0 to disable pacing
+        burst: Bucket capacity, defaults to one minute of tokens
+    """
+
+    def __init__(self, tokens_per_minute: int, burst: Optional[int] = None):
+        self.rate = tokens_per_minute / 60.0
+        self.capacity = burst or tokens_per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens: int) -> None:
+        if self.rate <= 0:
+            return
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_s = (tokens - self.tokens) / self.rate
+            time.sleep(min(wait_s, 1.0))
+
+    def adjust(self, tokens: int) -> None:
+        """Charge (or refund, if negative) the difference between estimated and actual usage."""
+        if self.rate <= 0:
+            return
+        with self.lock:
+            self._refill()
+            self.tokens -= tokens
+
+
+class _Body:
+    """Re-readable stand-in for the botocore StreamingBody shared by coalesced callers."""
+
+    def __init__(self, payload: bytes):
+        self._payload = payload
+
+    def read(self, *args) -> bytes:
+        return self._payload
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response: Optional[Dict[str, Any]] = None
+        self.payload: bytes = b''
+        self.error: Optional[Exception] = None
+
+
+class GovernedBedrockClient:
+    """
+    Proxy for a bedrock-runtime client that governs ``invoke_model``; all other
+    attributes are passed through.
+
+    Args:
+        client: The bedrock-runtime client
+        limiter: Shared AdaptiveConcurrencyLimiter
+        bucket: Shared TokenBucket
+        expected_output_tokens: Output tokens assumed when charging the bucket up front
+        max_throttle_retries: Retries of a throttled call before the error is raised
+    """
+
+    def __init__(self, client: Any, limiter: AdaptiveConcurrencyLimiter, bucket: TokenBucket,
+                 expected_output_tokens: int = 300, max_throttle_retries: int = 4):
+        self.client = client
+        self.limiter = limiter
+        self.bucket = bucket
+        self.expected_output_tokens = expected_output_tokens
+        self.max_throttle_retries = max_throttle_retries
+        self.in_flight: Dict[str, _Call] = {}
+        self.lock = threading.Lock()
+        self.coalesced = 0
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
+
+    def invoke_model(self, **kwargs) -> Dict[str, Any]:
+        check_budget()
+        body = kwargs.get('body') or ''
+        body_bytes = body.encode() if isinstance(body, str) else bytes(body)
+        key = hashlib.sha256(str(kwargs.get('modelId')).encode() + b'\0' + body_bytes).hexdigest()
+
+        with self.lock:
+            call = self.in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self.in_flight[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                call.response, call.payload = self._invoke(kwargs, len(body_bytes))
+            except Exception as e:
+                call.error = e
+            finally:
+                with self.lock:
+                    del self.in_flight[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return dict(call.response, body=_Body(call.payload))
+
+    def _invoke(self, kwargs: Dict[str, Any], body_size: int):
+        estimate = body_size // CHARS_PER_TOKEN + self.expected_output_tokens
+        self.bucket.acquire(estimate)
+
+        for attempt in range(self.max_throttle_retries + 1):
+            self.limiter.acquire()
+            started = time.monotonic()
+            try:
+                response = self.client.invoke_model(**kwargs)
+                payload = response['body'].read()
+            except Exception as e:
+                throttled = is_throttle_error(e)
+                self.limiter.release((time.monotonic() - started) * 1000, throttled=throttled)
+                if not throttled or attempt == self.max_throttle_retries:
+                    self.bucket.adjust(-estimate)
+                    raise
+                backoff_s = min(0.5 * 2 ** attempt, 8.0) * random.uniform(0.5, 1.0)
+                logger.warning(f"Bedrock throttled (attempt {attempt + 1}), limit now "
+                               f"{int(self.limiter.limit)}, retrying in {backoff_s:.2f}s")
+                time.sleep(backoff_s)
+                continue
+
+            latency_ms = (time.monotonic() - started) * 1000
+            self.limiter.release(latency_ms)
+            input_tokens, output_tokens = token_counts(response, payload)
+            record_call(kwargs.get('modelId'), input_tokens, output_tokens, latency_ms)
+            used = input_tokens + output_tokens
+            if used:
+                self.bucket.adjust(used - estimate)
+            return response, payload
+
+
+_limiter: Optional[AdaptiveConcurrencyLimiter] = None
+_bucket: Optional[TokenBucket] = None
+
+
+def govern(client: Any) -> GovernedBedrockClient:
+    """
+    Wrap a bedrock-runtime client with the process-wide limiter and token bucket,
+    configured from BEDROCK_MAX_CONCURRENCY, BEDROCK_INITIAL_CONCURRENCY,
+    BEDROCK_LATENCY_TARGET_MS and BEDROCK_TOKENS_PER_MINUTE (0 disables pacing).
+
+    Args:
+        client: The bedrock-runtime client
+
+    Returns:
+        GovernedBedrockClient sharing limits with every other governed client
+    """
+    global _limiter, _bucket
+    if _limiter is None:
+        _limiter = AdaptiveConcurrencyLimiter(
+            initial_limit=int(os.getenv("BEDROCK_INITIAL_CONCURRENCY", "4")),
+            max_limit=int(os.getenv("BEDROCK_MAX_CONCURRENCY", "16")),
+            latency_target_ms=float(os.getenv("BEDROCK_LATENCY_TARGET_MS", "8000")),
+        )
+        _bucket = TokenBucket(int(os.getenv("BEDROCK_TOKENS_PER_MINUTE", "0")))
+    return GovernedBedrockClient(client, _limiter, _bucket)
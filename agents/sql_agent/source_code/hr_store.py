@@ -0,0 +1,169 @@
+"""
+Storage settings for the SQL agent's SQLite HR database.
+
+The schema lives here so that setup_hr_database, hr_sync.py and the
+benchmark all create the same tables. In performance mode
+(``HR_DB_PERFORMANCE_MODE``, on by default), the database also gets:
+
+- indexes for the agent's access paths. The department listing and the
+  per-department counts are answered from one covering index on
+  ``(department, employee_id, ...)``. Department context comes from a
+  covering index on ``department_name``. Direct reports and department heads
+  are looked up through ``manager_id`` and ``head_id``;
+- WAL journaling, so readers never wait for hr_sync.py's writes;
+- memory-mapped I/O (``HR_DB_MMAP_BYTES``) and a larger page cache on every
+  connection;
+- a pool of read-only connections (``ReadConnectionPool``) shared by the
+  threads of a worker, instead of one connection per query or per thread.
+"""
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+HR_DB_PERFORMANCE_MODE = os.getenv("HR_DB_PERFORMANCE_MODE", "true").lower() == "true"
+HR_DB_MMAP_BYTES = int(os.getenv("HR_DB_MMAP_BYTES", str(256 * 1024 * 1024)))
+HR_DB_CACHE_KIB = int(os.getenv("HR_DB_CACHE_KIB", str(64 * 1024)))
+HR_DB_READ_POOL_SIZE = int(os.getenv("HR_DB_READ_POOL_SIZE", "8"))
+
+EMPLOYEES_DDL = '''
+    CREATE TABLE IF NOT EXISTS employees (
+        employee_id TEXT PRIMARY KEY,
+        first_name TEXT,
+        last_name TEXT,
+        email TEXT,
+        phone TEXT,
+        hire_date TEXT,
+        job_title TEXT,
+        department TEXT,
+        manager_id TEXT,
+        salary REAL,
+        tenure TEXT,
+        country TEXT,
+        region TEXT,
+        employee_type TEXT
+    )
+    '''
+
+DEPARTMENTS_DDL = '''
+    CREATE TABLE IF NOT EXISTS departments (
+        department_id TEXT PRIMARY KEY,
+        department_name TEXT,
+        location TEXT,
+        head_id TEXT
+    )
+    '''
+
+INDEXES = [
+    # Department listing (WHERE department = ? ORDER BY employee_id) and the
+    # per-department employee counts, without touching the table
+    """CREATE INDEX IF NOT EXISTS idx_employees_department ON employees (
+        department, employee_id, first_name, last_name, job_title, email, phone,
+        hire_date, tenure, salary, manager_id
+    )""",
+    # Direct reports (hr_sync.py invalidation, "who reports to ...")
+    "CREATE INDEX IF NOT EXISTS idx_employees_manager ON employees (manager_id)",
+    # Department context by name
+    """CREATE INDEX IF NOT EXISTS idx_departments_name ON departments (
+        department_name, department_id, location, head_id
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_departments_head ON departments (head_id)",
+]
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def create_schema(conn):
+    conn.execute(EMPLOYEES_DDL)
+    conn.execute(DEPARTMENTS_DDL)
+
+
+def tune_connection(conn, read_only=False):
+    """
+    Per-connection settings: memory-mapped reads, a larger page cache, and in-memory temp tables.
+
+    Args:
+        conn: sqlite3 connection (or a DB-API connection wrapping one)
+        read_only (bool): Also refuse writes on this connection
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"PRAGMA mmap_size = {HR_DB_MMAP_BYTES}")
+    cursor.execute(f"PRAGMA cache_size = -{HR_DB_CACHE_KIB}")
+    cursor.execute("PRAGMA temp_store = MEMORY")
+    if read_only:
+        cursor.execute("PRAGMA query_only = 1")
+    else:
+        # Durable at checkpoints rather than at every commit; the data can be re-synced
+        cursor.execute("PRAGMA synchronous = NORMAL")
+    cursor.close()
+
+
+def apply_performance_mode(conn):
+    """Switch the database to WAL, create the access-path indexes and refresh planner statistics."""
+    conn.execute("PRAGMA journal_mode = WAL")
+    for statement in INDEXES:
+        conn.execute(statement)
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+class ReadConnectionPool:
+    """
+    Read-only connections shared across threads; at most ``size`` exist, and
+    a caller waits for one to be returned when all are in use.
+
+    Args:
+        db_path (str): SQLite database file
+        size (int): Maximum number of connections
+    """
+    def __init__(self, db_path, size=HR_DB_READ_POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        tune_connection(conn, read_only=True)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                create = self.created < self.size
+                if create:
+                    self.created += 1
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self.lock:
+                        self.created -= 1
+                    raise
+            else:
+                conn = self.idle.get()
+        try:
+            yield conn
+        finally:
+            self.idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def get_read_pool(db_path):
+    """Process-wide read pool for a database file."""
+    with _pools_lock:
+        if db_path not in _pools:
+            _pools[db_path] = ReadConnectionPool(db_path)
+        return _pools[db_path]
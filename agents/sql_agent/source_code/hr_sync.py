@@ -0,0 +1,399 @@
+"""
+Incremental sync of employee records into the SQL agent's SQLite copy.
+
+Instead of rebuilding the database from seed rows, the agent applies change
+events for the employee collection as they happen. Each batch of events is
+collapsed per employee (the last change wins) and written in one
+transaction together with the source's high-water mark. A restart therefore
+resumes exactly where the last committed batch ended. After a commit, only
+the cached contexts of the affected employees and their direct reports are
+invalidated.
+
+``HR_SYNC_SOURCE`` selects where change events come from:
+
+- ``file:<path>``: a JSON-lines file of change events, a local stand-in;
+- ``mongo``: a change stream on ``DB_NAME.EMPLOYEE_COLLECTION_NAME``. With no
+  checkpoint yet, the collection is first copied in batches;
+- ``kafka:<topic>``: a CDC topic of JSON change events, e.g. from the
+  MongoDB source connector. All partitions are read, because every copy of
+  the database needs every employee.
+
+Change events use the change stream shape::
+
+    {"operationType": "insert" | "update" | "replace" | "delete",
+     "documentKey": {"employee_id": "E001"},
+     "fullDocument": {...employee document...}}
+
+Usage (local)::
+
+    python hr_sync.py --events-from-seed ../../../terraform/seed/employee.json > /tmp/hr_changes.jsonl
+    python hr_sync.py --db /tmp/hr_database.db --source file:/tmp/hr_changes.jsonl --once
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+import backends
+from hr_store import HR_DB_PERFORMANCE_MODE, apply_performance_mode, create_schema, tune_connection
+from partitioning import get_affinity_cache
+
+logger = logging.getLogger(__name__)
+
+HR_SYNC_SOURCE = os.getenv("HR_SYNC_SOURCE", "")
+HR_SYNC_BATCH_SIZE = int(os.getenv("HR_SYNC_BATCH_SIZE", "500"))
+HR_SYNC_INTERVAL_SECONDS = float(os.getenv("HR_SYNC_INTERVAL_SECONDS", "30"))
+
+EMPLOYEE_COLUMNS = (
+    "employee_id", "first_name", "last_name", "email", "phone", "hire_date", "job_title",
+    "department", "manager_id", "salary", "tenure", "country", "region", "employee_type",
+)
+
+# Employee documents carry no department; an employee without one is placed in
+# their manager's department, and an existing row keeps the one it has
+_DEPARTMENT_VALUE = "COALESCE(?, (SELECT manager.department FROM employees manager WHERE manager.employee_id = ?))"
+_UPSERT_SQL = (
+    f"INSERT INTO employees ({', '.join(EMPLOYEE_COLUMNS)}) "
+    f"VALUES ({', '.join(_DEPARTMENT_VALUE if column == 'department' else '?' for column in EMPLOYEE_COLUMNS)}) "
+    f"ON CONFLICT(employee_id) DO UPDATE SET "
+    + ", ".join(
+        "department = COALESCE(excluded.department, employees.department)" if column == "department"
+        else f"{column} = excluded.{column}"
+        for column in EMPLOYEE_COLUMNS[1:]
+    )
+)
+_DEPARTMENT = EMPLOYEE_COLUMNS.index("department")
+_MANAGER_ID = EMPLOYEE_COLUMNS.index("manager_id")
+
+
+def upsert_params(row):
+    """Parameters of _UPSERT_SQL for an employee_row(): the manager_id again after the department."""
+    return row[:_DEPARTMENT + 1] + (row[_MANAGER_ID],) + row[_DEPARTMENT + 1:]
+
+
+def employee_row(document):
+    """
+    Map an employee document (terraform/seed/employee.json shape) to an employees row.
+
+    Args:
+        document (dict): Employee document
+
+    Returns:
+        tuple: Values in EMPLOYEE_COLUMNS order
+    """
+    work_location = document.get("work_location") or {}
+    compensation = document.get("compensation") or {}
+    tenure = document.get("tenure")
+    if tenure is None and document.get("tenure_years") is not None:
+        tenure = f"{document['tenure_years']} years"
+    return (
+        document["employee_id"],
+        document.get("first_name"),
+        document.get("last_name"),
+        document.get("email"),
+        document.get("phone"),
+        document.get("hire_date"),
+        document.get("job_title"),
+        document.get("department"),
+        document.get("manager_id"),
+        compensation.get("base_salary", document.get("salary")),
+        tenure,
+        work_location.get("country", document.get("country")),
+        work_location.get("region", document.get("region")),
+        document.get("employment_type", document.get("employee_type")),
+    )
+
+
+def event_employee_id(event):
+    for source in (event.get("documentKey"), event.get("fullDocument"), event.get("fullDocumentBeforeChange")):
+        if source and source.get("employee_id"):
+            return source["employee_id"]
+    return None
+
+
+class FileChangeSource:
+    """JSON-lines change events; the checkpoint is the byte offset after the last applied line."""
+    def __init__(self, path):
+        self.path = path
+
+    def poll(self, checkpoint, max_events):
+        offset = (checkpoint or {}).get("offset", 0)
+        events = []
+        if not os.path.exists(self.path):
+            return events, checkpoint
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            while len(events) < max_events:
+                line = f.readline()
+                # A partial last line is still being written; pick it up next time
+                if not line or not line.endswith(b"\n"):
+                    break
+                offset = f.tell()
+                if line.strip():
+                    events.append(json.loads(line))
+        return events, {"offset": offset}
+
+    def close(self):
+        pass
+
+
+class MongoChangeSource:
+    """
+    Change stream on the employee collection. The first sync copies the
+    collection in employee_id order, after noting the stream's resume token,
+    so no change made during the copy is lost.
+    """
+    def __init__(self, client, db_name, collection_name):
+        self.collection = client[db_name][collection_name]
+        self.stream = None
+
+    def _open_stream(self, resume_token):
+        if self.stream is None:
+            self.stream = self.collection.watch(
+                full_document="updateLookup",
+                full_document_before_change="whenAvailable",
+                resume_after=resume_token,
+            )
+        return self.stream
+
+    def poll(self, checkpoint, max_events):
+        checkpoint = dict(checkpoint or {})
+        if "resume_token" not in checkpoint:
+            checkpoint["resume_token"] = self._open_stream(None).resume_token
+            checkpoint["snapshot_after"] = ""
+        if "snapshot_after" in checkpoint:
+            documents = list(
+                self.collection.find({"employee_id": {"$gt": checkpoint["snapshot_after"]}}, {"_id": 0})
+                .sort("employee_id", 1)
+                .limit(max_events)
+            )
+            if documents:
+                checkpoint["snapshot_after"] = documents[-1]["employee_id"]
+            else:
+                del checkpoint["snapshot_after"]
+            return [{"operationType": "replace", "fullDocument": doc} for doc in documents], checkpoint
+
+        stream = self._open_stream(checkpoint["resume_token"])
+        events = []
+        while len(events) < max_events:
+            change = stream.try_next()
+            if change is None:
+                break
+            events.append(change)
+        checkpoint["resume_token"] = stream.resume_token
+        return events, checkpoint
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+
+
+class KafkaChangeSource:
+    """CDC topic of JSON change events; the checkpoint holds the next offset per partition."""
+    def __init__(self, topic):
+        self.topic = topic
+        self.consumer = None
+
+    def _assign(self, checkpoint):
+        from confluent_kafka import OFFSET_BEGINNING, TopicPartition
+        self.consumer = backends.consumer({
+            'bootstrap.servers': os.getenv("BOOTSTRAP_ENDPOINT"),
+            'sasl.mechanisms': 'PLAIN',
+            'security.protocol': 'SASL_SSL',
+            'sasl.username': os.getenv("KAFKA_API_KEY"),
+            'sasl.password': os.getenv("KAFKA_API_SECRET"),
+            'group.id': f"hr-sync-{os.getpid()}",
+            'enable.auto.commit': False,
+        })
+        offsets = (checkpoint or {}).get("offsets", {})
+        partitions = self.consumer.list_topics(self.topic, timeout=10).topics[self.topic].partitions
+        self.consumer.assign([
+            TopicPartition(self.topic, p, offsets.get(str(p), OFFSET_BEGINNING)) for p in partitions
+        ])
+
+    def poll(self, checkpoint, max_events):
+        if self.consumer is None:
+            self._assign(checkpoint)
+        offsets = dict((checkpoint or {}).get("offsets", {}))
+        events = []
+        for msg in self.consumer.consume(max_events, timeout=1.0):
+            if msg.error():
+                logger.warning(f"HR sync consume error: {msg.error()}")
+                continue
+            if msg.value():
+                events.append(json.loads(msg.value()))
+            offsets[str(msg.partition())] = msg.offset() + 1
+        return events, {"offsets": offsets}
+
+    def close(self):
+        if self.consumer is not None:
+            self.consumer.close()
+
+
+def build_source(spec):
+    """Source for an HR_SYNC_SOURCE value."""
+    kind, _, target = spec.partition(":")
+    if kind == "file":
+        return FileChangeSource(target)
+    if kind == "mongo":
+        uri = f"mongodb+srv://{os.getenv('MONGO_USER')}:{os.getenv('MONGO_PASSWORD')}@{os.getenv('MONGO_HOST')}/"
+        return MongoChangeSource(
+            backends.mongo_client(uri),
+            os.getenv("DB_NAME"),
+            os.getenv("EMPLOYEE_COLLECTION_NAME", "employee_collection"),
+        )
+    if kind == "kafka":
+        return KafkaChangeSource(target or "hr_employee_changes")
+    raise ValueError(f"Unknown HR_SYNC_SOURCE {spec!r}; use file:<path>, mongo or kafka:<topic>")
+
+
+class HRSync:
+    """
+    Applies change events from ``source`` to the employees table at ``db_path``.
+
+    Args:
+        db_path (str): SQLite database created by setup_hr_database
+        source: FileChangeSource, MongoChangeSource or KafkaChangeSource
+        batch_size (int): Events applied per transaction
+    """
+    def __init__(self, db_path, source, batch_size=HR_SYNC_BATCH_SIZE):
+        self.source = source
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        # Readers (the agent's connection) keep working while a batch commits
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        if HR_DB_PERFORMANCE_MODE:
+            tune_connection(self.conn)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sync_state (name TEXT PRIMARY KEY, checkpoint TEXT)")
+        self.applied = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def checkpoint(self):
+        row = self.conn.execute("SELECT checkpoint FROM sync_state WHERE name = 'employees'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def apply(self, events, checkpoint):
+        """
+        Write one batch and its checkpoint in a single transaction.
+
+        Args:
+            events (list): Change events, oldest first
+            checkpoint (dict): Source position after the batch
+
+        Returns:
+            set: Employee IDs whose rows changed
+        """
+        changes = {}
+        for event in events:
+            employee_id = event_employee_id(event)
+            if employee_id is None:
+                logger.warning(f"Skipping HR change event without an employee_id: {event.get('operationType')}")
+                continue
+            if event.get("operationType") == "delete":
+                changes[employee_id] = None
+            elif event.get("fullDocument"):
+                changes[employee_id] = employee_row(dict(event["fullDocument"], employee_id=employee_id))
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany(_UPSERT_SQL, [upsert_params(row) for row in changes.values() if row is not None])
+            self.conn.executemany(
+                "DELETE FROM employees WHERE employee_id = ?",
+                [(employee_id,) for employee_id, row in changes.items() if row is None]
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sync_state (name, checkpoint) VALUES ('employees', ?)",
+                (json.dumps(checkpoint),)
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.applied += len(changes)
+        return set(changes)
+
+    def invalidate(self, employee_ids):
+        """Drop cached contexts of changed employees and their direct reports (whose manager_name changed)."""
+        if not employee_ids:
+            return
+        placeholders = ", ".join("?" for _ in employee_ids)
+        reports = self.conn.execute(
+            f"SELECT employee_id FROM employees WHERE manager_id IN ({placeholders})", list(employee_ids)
+        ).fetchall()
+        cache = get_affinity_cache("employee_context")
+        for employee_id in set(employee_ids) | {row[0] for row in reports}:
+            cache.invalidate(employee_id)
+
+    def sync_once(self):
+        """Apply everything the source has now, batch by batch; returns the number of employees changed."""
+        changed = 0
+        while True:
+            current = self.checkpoint()
+            events, checkpoint = self.source.poll(current, self.batch_size)
+            if events or checkpoint != current:
+                employee_ids = self.apply(events, checkpoint)
+                self.invalidate(employee_ids)
+                changed += len(employee_ids)
+            if not events:
+                if changed and HR_DB_PERFORMANCE_MODE:
+                    # Refresh planner statistics for tables that changed noticeably
+                    self.conn.execute("PRAGMA optimize")
+                return changed
+
+    def run(self, interval_seconds=HR_SYNC_INTERVAL_SECONDS):
+        while not self.stop_event.is_set():
+            try:
+                changed = self.sync_once()
+                if changed:
+                    logger.info(f"HR sync applied changes for {changed} employees")
+            except Exception as e:
+                # Keep serving the last synced data; the checkpoint makes the next attempt resume
+                logger.error(f"HR sync failed: {e}")
+            self.stop_event.wait(interval_seconds)
+
+    def start(self, interval_seconds=HR_SYNC_INTERVAL_SECONDS):
+        """Sync in a daemon thread, so a large backlog doesn't hold up cold start."""
+        self.thread = threading.Thread(target=self.run, args=(interval_seconds,), name="hr-sync", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.source.close()
+
+
+def start_sync(db_path, spec=HR_SYNC_SOURCE):
+    """Start background sync of ``db_path`` from an HR_SYNC_SOURCE value."""
+    return HRSync(db_path, build_source(spec)).start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync employee changes into the SQL agent's SQLite database")
+    parser.add_argument("--db", default="/tmp/hr_database.db")
+    parser.add_argument("--source", default=HR_SYNC_SOURCE)
+    parser.add_argument("--once", action="store_true", help="Apply pending changes and exit")
+    parser.add_argument("--events-from-seed", metavar="EMPLOYEE_JSON",
+                        help="Print insert events for a seed file (e.g. terraform/seed/employee.json) and exit")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.events_from_seed:
+        with open(args.events_from_seed) as f:
+            for document in json.load(f):
+                print(json.dumps({"operationType": "insert", "fullDocument": document}))
+    else:
+        conn = sqlite3.connect(args.db)
+        create_schema(conn)
+        if HR_DB_PERFORMANCE_MODE:
+            apply_performance_mode(conn)
+        conn.close()
+        sync = HRSync(args.db, build_source(args.source))
+        if args.once:
+            print(f"Applied changes for {sync.sync_once()} employees")
+        else:
+            sync.run()
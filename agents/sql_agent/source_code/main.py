@@ -1,5 +1,11 @@
 from agent import HRSQLAgent, setup_hr_database
 from avro_kafka_producer import HRResultProducer , produce
+from retry_pipeline import NonRetryableError, route_failure
+from hr_sync import start_sync
+from partitioning import get_affinity_cache
+from speculation import SPECULATIVE_DISPATCH, get_speculative_store
+from metering import metered, publish_rollup, set_query_type
+import memory_profile
 import os
 import logging
 from dotenv import load_dotenv
@@ -12,6 +18,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger('hr_agent_main')
 
+INPUT_TOPIC = os.getenv("INPUT_TOPIC", "mongo_agent_input")
+
 # Global variables for Lambda container reuse
 _agent = None
 _producer = None
@@ -31,11 +39,16 @@ def initialize_resources():
         # Set up the HR database and agent
         logger.info("Setting up HR database and agent...")
         try:
-            db_path = setup_hr_database()
+            # With HR_SYNC_SOURCE set, rows arrive as change events in the background
+            # rather than from the hardcoded seed rows
+            sync_source = os.getenv("HR_SYNC_SOURCE")
+            db_path = setup_hr_database(seed=not sync_source)
             _agent = HRSQLAgent(
                 db_path=db_path,
                 aws_region=aws_region
             )
+            if sync_source:
+                start_sync(db_path, sync_source)
             logger.info("HR SQL Agent initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize HR SQL Agent: {str(e)}")
@@ -46,6 +59,129 @@ def initialize_resources():
         
         logger.info("Resources initialized successfully")
 
+def answer_message(message):
+    """
+    Answer one HR query.
+
+    Args:
+        message (dict): Record from the agent's input topic
+
+    Returns:
+        tuple: (the agent's standardized result, the record to produce)
+    """
+    if not message:
+        raise NonRetryableError('No message provided in event')
+
+    # Extract query and employee ID
+    query = message.get('query')
+    employee_id = message.get('employee_id')
+    message_id = message.get('message_id', 'unknown')
+    source = message.get('source', 'unknown')
+    session_id = message.get('session_id')
+
+    logger.info(f"Processing query: '{query}' (ID: {message_id})")
+
+    if SPECULATIVE_DISPATCH and employee_id:
+        # Looked up from queries while the orchestrator was routing
+        employee_context = get_speculative_store().take(message_id, "employee_context")
+        if employee_context is not None:
+            get_affinity_cache("employee_context").put(employee_id, employee_context)
+
+    # Process query with the agent, metering its model calls
+    with metered("sql", message_id, session_id) as meter, memory_profile.stage("agent"):
+        result = _agent.run_hr_query(query, requesting_employee_id=employee_id, session_id=session_id)
+
+    # The context can be a whole department; only its size is worth a log line
+    logger.info(f"Query {message_id} finished with status {result.get('status')}, "
+                f"{len(json.dumps(result.get('data', {}).get('context', {}), default=str))} characters of context")
+    sql_result={}
+    print("\nANSWER:")
+    if 'error' in result.get('data', {}).get('raw_output', ''):
+        print(f"Error: {result['data']['raw_output']}")
+        sql_result['status'] = 'error'
+    else:
+        # Format the raw output for better readability
+
+        raw_output = result['data']
+        if raw_output and "Agent stopped" not in raw_output:
+            print(raw_output)
+        else:
+            print("Retrieved employee information directly from database.")
+        sql_result['status'] = 'success'
+        sql_result['sql_result'] = str(raw_output)
+
+    # Add message metadata to result
+
+    sql_result['message_id'] = message_id
+    sql_result['employee_id'] = employee_id
+    sql_result['timestamp'] = str(message.get('timestamp'))
+    sql_result['query'] = query
+    sql_result['source'] = source
+    if session_id:
+        sql_result['session_id'] = session_id
+    sql_result['usage'] = meter.usage()
+    return result, sql_result
+
+def process_message(message):
+    """
+    Answer one HR query and produce the result to Kafka.
+
+    Args:
+        message (dict): Record from the agent's input topic
+
+    Returns:
+        dict: The agent's standardized result
+    """
+    result, sql_result = answer_message(message)
+
+    #Send result to Kafka
+
+    with memory_profile.stage("produce"):
+        produce(sql_result)
+    logger.info(f"Result sent for message ID: {sql_result['message_id']}")
+    return result
+
+def speculate(record):
+    """
+    Look up the requesting employee's context for a record of the queries topic
+    and store it for the routed record. Read-only, so safe for queries the
+    router sends elsewhere.
+
+    Args:
+        record (dict): Record from the queries topic
+    """
+    employee_id = record.get('employee_id')
+    message_id = record.get('message_id')
+    if not employee_id or not message_id:
+        return
+    employee_context = _agent.get_employee_context(employee_id)
+    if "error" not in employee_context:
+        get_speculative_store().put(message_id, "employee_context", employee_context)
+
+
+def speculate_handler(event, context):
+    """
+    Handler for speculative dispatch (``workers/agent_worker.py --speculative``).
+    Failures are only logged: the routed record does the work itself.
+    """
+    initialize_resources()
+    stored = 0
+    for record in event:
+        message = record['payload']['value']
+        try:
+            with metered("sql", message.get('message_id'), message.get('session_id')):
+                set_query_type("speculative")
+                speculate(message)
+            stored += 1
+        except Exception as e:
+            logger.warning(f"Speculative lookup for {message.get('message_id')} failed: {str(e)}")
+    publish_rollup()
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'speculated': stored})
+    }
+
 def lambda_handler(event, context):
     """
     AWS Lambda handler function.
@@ -60,75 +196,34 @@ def lambda_handler(event, context):
     try:
         # Initialize resources if not already done
         initialize_resources()
-        # Extract message from the event
-        # Assuming the event contains the Kafka message in the body
-        # message = json.loads(event.get('body', '{}'))
-        message = event[0]['payload']['value']
-        print(message)
-        if not message:
-            return {
-                'statusCode': 400,
-                'body': json.dumps({'error': 'No message provided in event'})
-            }
-        
-        # Extract query and employee ID
-        query = message.get('query')
-        employee_id = message.get('employee_id')
-        message_id = message.get('message_id', 'unknown')
-        source = message.get('source', 'unknown')
-        session_id = message.get('session_id')
-        
-        logger.info(f"Processing query: '{query}' (ID: {message_id})")
-        
-        # Process query with the agent
-        result = _agent.run_hr_query(query, requesting_employee_id=employee_id)
-
-        print(result)
-        sql_result={}
-        print("\nANSWER:")
-        if 'error' in result.get('data', {}).get('raw_output', ''):
-            print(f"Error: {result['data']['raw_output']}")
-            sql_result['status'] = 'error'
-        else:
-            # Format the raw output for better readability
-            
-            raw_output = result['data']
-            if raw_output and "Agent stopped" not in raw_output:
-                print(raw_output)
-            else:
-                print("Retrieved employee information directly from database.")
-            sql_result['status'] = 'success'
-            sql_result['sql_result'] = str(raw_output)
-
-        # Show the extracted context that would be used for policy lookup
-        
-        # Add message metadata to result
-        
-        sql_result['message_id'] = message_id
-        sql_result['employee_id'] = employee_id
-        sql_result['timestamp'] = str(message.get('timestamp'))
-        sql_result['query'] = query
-        sql_result['source'] = source
-        if session_id:
-            sql_result['session_id'] = session_id
-        
-        #Send result to Kafka
-        
-        produce(sql_result)
-        logger.info(f"Result sent for message ID: {raw_output}")
-        
-        return {
-            'statusCode': 200,
-            'body': json.dumps(result)
-        }
-        
     except Exception as e:
-        logger.error(f"Error processing query: {str(e)}")
-        
+        logger.error(f"Error initializing resources: {str(e)}")
+
         return {
             'statusCode': 500,
             'body': json.dumps(str(e))
         }
 
+    # Only each record's status is returned; full results (contexts, summaries) are freed with the record
+    results = []
+    failed = 0
+    for record in event:
+        message = record['payload']['value']
+        try:
+            result = process_message(message)
+            results.append({'message_id': message.get('message_id'), 'status': result.get('status')})
+        except Exception as e:
+            logger.error(f"Error processing query: {str(e)}")
+            # Park the record on a retry tier (or the DLQ) and carry on with the batch
+            route_failure(message, e, INPUT_TOPIC, "sql", record['payload'].get('attempt', 0))
+            failed += 1
+    publish_rollup()
+    memory_profile.report()
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'results': results, 'routed_for_retry': failed})
+    }
+
 if __name__ == "__main__":
     lambda_handler([{'payload': {'value': {'query': 'What is my department located?', 'employee_id': 'E001', 'message_id': 'test-123', 'source': 'test', 'session_id': 'test-session'}}}], {})
\ No newline at end of file
@@ -0,0 +1,144 @@
+"""
+Record keys for the agents' producers, and per-key affinity caches.
+
+``PARTITION_KEY`` selects the field responses are keyed by:
+
+- ``message_id`` (default): spreads records evenly and co-partitions with
+  anything else keyed by the message;
+- ``session_id``: keeps a conversation on one partition, so the consumer
+  that owns it also holds its history;
+- ``employee_id``: keeps an employee's traffic on one partition, so their
+  context is cached by exactly one consumer.
+
+When the input topic is keyed the same way, each consumer sees a stable
+subset of sessions or employees. ``AffinityCache`` exploits that: entries
+remember the partition they were filled from (``current_partition``, set by
+``workers/agent_worker.py`` around each batch) and are dropped when that
+partition is revoked, so a consumer's memory follows the partitions it owns.
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict
+from uuid import uuid4
+
+PARTITION_KEY = os.getenv("PARTITION_KEY", "message_id")
+PARTITION_KEY_FIELDS = {
+    "message_id": ("message_id",),
+    "session_id": ("session_id", "sessionId"),
+    "employee_id": ("employee_id",),
+}
+
+# (topic, partition) of the batch being processed in this thread, if known
+current_partition = contextvars.ContextVar("current_partition", default=None)
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def partition_key(record, strategy=None):
+    """
+    Key for a record under the configured strategy, falling back to the
+    message_id (and a random key) when the field is missing.
+
+    Args:
+        record (dict): Record being produced
+        strategy (str): Overrides PARTITION_KEY
+
+    Returns:
+        str: Record key
+    """
+    strategy = strategy or PARTITION_KEY
+    if strategy not in PARTITION_KEY_FIELDS:
+        raise ValueError(f"Unknown PARTITION_KEY {strategy!r}; use one of {', '.join(PARTITION_KEY_FIELDS)}")
+    for field in PARTITION_KEY_FIELDS[strategy] + ("message_id",):
+        value = record.get(field)
+        if value:
+            return str(value)
+    return str(uuid4())
+
+
+class AffinityCache:
+    """
+    Bounded LRU with TTL whose entries are tied to the partition they came from.
+
+    Args:
+        name (str): Cache name, for stats
+        max_entries (int): Entries kept before the least recently used is dropped
+        ttl_seconds (float): Lifetime of an entry
+    """
+    def __init__(self, name, max_entries=10000, ttl_seconds=900):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl_seconds:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic(), current_partition.get())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def evict_partitions(self, partitions):
+        """Drop entries filled from any of ``partitions`` ((topic, partition) pairs)."""
+        with self.lock:
+            stale = [key for key, (_, _, partition) in self.entries.items() if partition in partitions]
+            for key in stale:
+                del self.entries[key]
+        return len(stale)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def get_affinity_cache(name, max_entries=None, ttl_seconds=None):
+    """Process-wide cache by name; size and TTL default to AFFINITY_CACHE_SIZE / AFFINITY_CACHE_TTL_SECONDS."""
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = AffinityCache(
+                name,
+                max_entries=max_entries or int(os.getenv("AFFINITY_CACHE_SIZE", "10000")),
+                ttl_seconds=ttl_seconds or float(os.getenv("AFFINITY_CACHE_TTL_SECONDS", "900")),
+            )
+        return _caches[name]
+
+
+def evict_partitions(partitions):
+    """Drop every cache's entries for revoked partitions; returns the number dropped."""
+    partitions = set(partitions)
+    with _caches_lock:
+        caches = list(_caches.values())
+    return sum(cache.evict_partitions(partitions) for cache in caches)
+
+
+def cache_stats():
+    with _caches_lock:
+        return [cache.stats() for cache in _caches.values()]
@@ -0,0 +1,273 @@
+"""
+Plan cache for the HR SQL agent.
+
+The LangChain SQL agent answers every question with a loop of LLM round trips
+(list tables, fetch schema, check the query, run it). Most questions the
+agent gets have the same shape and differ only in their literals ("... for
+employee E001" vs "... for employee E004"). This cache normalises a question
+into a template plus its literals, and keeps one parameterised SQL query per
+template:
+
+- questions that already are SQL (the context lookups) are parameterised
+  directly, with no LLM call at all;
+- natural-language questions are compiled once, with a single LLM call over
+  the pinned table info, and validated with ``EXPLAIN``.
+
+Later questions of the same shape bind their literals and run as one SQLite
+query. Templates that fail to compile are remembered, so they go straight to
+the agent loop.
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from hr_store import get_read_pool
+
+logger = logging.getLogger(__name__)
+
+PLAN_CACHE = os.getenv("PLAN_CACHE", "true").lower() == "true"
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "512"))
+PLAN_VOCABULARY_TTL_SECONDS = float(os.getenv("PLAN_VOCABULARY_TTL_SECONDS", "300"))
+
+_SQL_START = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_SQL_STRING = re.compile(r"'((?:[^']|'')*)'")
+_EMPLOYEE_ID = r"\b[Ee]\d{3,}\b"
+_NUMBER = r"\b\d+(?:\.\d+)?\b"
+_QUOTED = r"\"[^\"]+\"|(?<!\w)'[^']+'(?!\w)"
+_FAILED = object()
+
+COMPILE_PROMPT = """You translate questions about an HR database into one SQLite query.
+
+{table_info}
+
+Question: {template}
+
+The placeholders {placeholders} stand for literal values. Refer to them in the query as {named}, and never write their values inline.
+Respond with ONLY the SQL query, without explanation or formatting."""
+
+
+def is_sql(text):
+    return bool(_SQL_START.match(text or ""))
+
+
+def _literal(value):
+    if re.fullmatch(_NUMBER, value):
+        return float(value) if "." in value else int(value)
+    return value
+
+
+class PlanCache:
+    """
+    Parameterised SQL per question template, executed on the database's read pool.
+
+    Args:
+        db_path (str): SQLite database the plans run against
+        llm: Chat model used to compile natural-language templates
+        table_info (str): Schema description given to the model
+        max_plans (int): Templates kept before the least recently used is dropped
+    """
+    def __init__(self, db_path, llm=None, table_info="", max_plans=PLAN_CACHE_SIZE):
+        self.db_path = db_path
+        self.llm = llm
+        self.table_info = table_info
+        self.max_plans = max_plans
+        self.plans = OrderedDict()
+        self.lock = threading.Lock()
+        self.pool = get_read_pool(db_path)
+        self.vocabulary = None
+        self.vocabulary_loaded_at = 0.0
+        self.vocabulary_pattern = None
+        self.hits = 0
+        self.compiled = 0
+        self.fallbacks = 0
+
+    def get_vocabulary(self):
+        """
+        Department and employee names in the database, lower-cased, refreshed
+        every PLAN_VOCABULARY_TTL_SECONDS so synced changes are picked up.
+
+        Returns:
+            dict: Lower-cased name to (kind, value, name), with kind "department"
+            (value: the department name) or "employee" (value: the employee_id)
+        """
+        if self.vocabulary is None or time.monotonic() - self.vocabulary_loaded_at > PLAN_VOCABULARY_TTL_SECONDS:
+            vocabulary = {}
+            with self.pool.connection() as conn:
+                for (name,) in conn.execute(
+                    "SELECT department_name FROM departments UNION SELECT DISTINCT department FROM employees"
+                ):
+                    if name:
+                        vocabulary[name.lower()] = ("department", name, name)
+                for employee_id, full_name in conn.execute(
+                    "SELECT employee_id, first_name || ' ' || last_name FROM employees"
+                ):
+                    if full_name:
+                        vocabulary[full_name.lower()] = ("employee", employee_id, full_name)
+            names = sorted(vocabulary, key=len, reverse=True)
+            self.vocabulary_pattern = (
+                re.compile(r"\b(" + "|".join(re.escape(name) for name in names) + r")\b", re.IGNORECASE)
+                if names else None
+            )
+            self.vocabulary = vocabulary
+            self.vocabulary_loaded_at = time.monotonic()
+        return self.vocabulary
+
+    def match_entity(self, question):
+        """
+        First department or employee named in a question.
+
+        Returns:
+            tuple: ("department", name) or ("employee", employee_id), or None
+        """
+        vocabulary = self.get_vocabulary()
+        match = self.vocabulary_pattern.search(question) if self.vocabulary_pattern else None
+        return vocabulary[match.group(0).lower()][:2] if match else None
+
+    def normalize(self, question):
+        """
+        Split a question into its template and literal parameters.
+
+        SQL keeps its structure and has its string literals replaced. Natural
+        language is lower-cased, and quoted values, department and employee names,
+        employee IDs and numbers are replaced.
+
+        Args:
+            question (str): SQL or natural-language question
+
+        Returns:
+            tuple: (template, params) where params maps "p0", "p1", ... to values
+        """
+        params = {}
+
+        def bind(value):
+            name = f"p{len(params)}"
+            params[name] = value
+            return f":{name}" if sql else "{" + name + "}"
+
+        sql = is_sql(question)
+        if sql:
+            template = _SQL_STRING.sub(lambda m: bind(m.group(1).replace("''", "'")), question)
+            return " ".join(template.split()), params
+
+        self.get_vocabulary()
+        alternatives = [_QUOTED, _EMPLOYEE_ID, _NUMBER]
+        if self.vocabulary_pattern is not None:
+            alternatives.insert(1, self.vocabulary_pattern.pattern)
+        pattern = re.compile("|".join(f"(?:{alt})" for alt in alternatives), re.IGNORECASE)
+
+        def replace(match):
+            value = match.group(0)
+            if value[0] in "\"'":
+                return bind(value[1:-1])
+            entry = self.vocabulary.get(value.lower())
+            if entry is not None:
+                return bind(entry[2])
+            if re.fullmatch(_EMPLOYEE_ID, value):
+                return bind(value.upper())
+            return bind(_literal(value))
+
+        template = pattern.sub(replace, question)
+        return " ".join(template.lower().rstrip(" ?.!").split()), params
+
+    def compile(self, template, params):
+        """
+        Parameterised SQL for a natural-language template, or None.
+
+        Args:
+            template (str): Normalised question
+            params (dict): Literals of the question being compiled, used to validate the plan
+
+        Returns:
+            str: SQL using :p0, :p1, ... placeholders
+        """
+        if self.llm is None:
+            return None
+        prompt = COMPILE_PROMPT.format(
+            table_info=self.table_info,
+            template=template,
+            placeholders=", ".join("{" + name + "}" for name in params) or "(none)",
+            named=", ".join(f":{name}" for name in params) or "(none)",
+        )
+        response = self.llm.invoke(prompt)
+        sql = getattr(response, "content", response).strip()
+        sql = re.sub(r"^```(?:sql)?\s*|\s*```$", "", sql, flags=re.IGNORECASE).strip().rstrip(";")
+        if not is_sql(sql) or ";" in sql:
+            return None
+        # A plan with a value inlined instead of its placeholder would answer
+        # every later question of this shape with the first one's literal
+        if any(f":{name}" not in sql for name in params):
+            return None
+        with self.pool.connection() as conn:
+            conn.execute(f"EXPLAIN {sql}", params)
+        return sql
+
+    def plan(self, template, params, question):
+        with self.lock:
+            plan = self.plans.get(template)
+            if plan is not None:
+                self.plans.move_to_end(template)
+                return plan
+        if is_sql(question):
+            plan = template
+        else:
+            try:
+                plan = self.compile(template, params) or _FAILED
+            except Exception as e:
+                logger.warning(f"Plan compilation failed for '{template}': {e}")
+                plan = _FAILED
+            self.compiled += 1
+        with self.lock:
+            self.plans[template] = plan
+            while len(self.plans) > self.max_plans:
+                self.plans.popitem(last=False)
+        return plan
+
+    def run(self, question):
+        """
+        Answer a question from its cached plan.
+
+        Args:
+            question (str): SQL or natural-language question
+
+        Returns:
+            str: The rows as text, or None when the question needs the agent loop
+        """
+        template, params = self.normalize(question)
+        plan = self.plan(template, params, question)
+        if plan is _FAILED:
+            self.fallbacks += 1
+            return None
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.execute(plan, params)
+                rows = cursor.fetchall()
+                columns = [column[0] for column in cursor.description]
+        except sqlite3.Error as e:
+            logger.warning(f"Cached plan failed for '{template}': {e}")
+            with self.lock:
+                self.plans[template] = _FAILED
+            self.fallbacks += 1
+            return None
+        self.hits += 1
+        return format_rows(columns, rows)
+
+    def stats(self):
+        return {"plans": len(self.plans), "hits": self.hits, "compiled": self.compiled, "fallbacks": self.fallbacks}
+
+
+def format_rows(columns, rows):
+    """
+    Rows as text in the shape the agent's parsing expects: a bare value for a
+    single cell, "column: value" lines for a single row, one line per row otherwise.
+    """
+    if not rows:
+        return "No matching records found."
+    if len(rows) == 1 and len(columns) == 1:
+        return str(rows[0][0])
+    if len(rows) == 1:
+        return "\n".join(f"{column}: {value}" for column, value in zip(columns, rows[0]))
+    return "\n".join(", ".join(f"{column}: {value}" for column, value in zip(columns, row)) for row in rows)
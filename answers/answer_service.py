@@ -0,0 +1,216 @@
+"""
+Answers frequent HR questions from the precomputed answer store.
+
+The service sits in front of the pipeline. User queries are published to the
+intake topic (``QUERY_INTAKE_TOPIC``, default ``queries_intake``). A query
+with a current precomputed answer for the asker's region and employment type
+is answered straight away on ``ANSWER_TOPIC`` (``precomputed_answers``). Its
+fields match ``user_friendly_agent_response``, plus the cluster it matched.
+Every other query is forwarded unchanged to ``queries`` and takes the usual
+path through the router, the agents and the final model::
+
+    python answers/answer_service.py
+    python answers/answer_service.py --query "How many PTO days do I get?" --employee-id E001
+
+Policy versions and the HR segments are re-read every
+``ANSWER_REFRESH_SECONDS``, together with the store itself. An answer stops
+being served as soon as a policy it used or its HR segment changes (see
+answer_store.py). Run ``precompute_answers.py --refresh-stale`` to recompute it.
+"""
+import argparse
+import json
+import os
+import signal
+import threading
+import time
+from datetime import datetime, timezone
+
+from answer_store import (
+    ANSWER_STORE_PATH,
+    AnswerStore,
+    hr_segment_versions,
+    load_employees,
+    load_policies,
+    policy_versions,
+)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED_DIR = os.path.join(ROOT_DIR, "terraform", "seed")
+QUERY_INTAKE_TOPIC = os.getenv("QUERY_INTAKE_TOPIC", "queries_intake")
+QUERIES_TOPIC = os.getenv("QUERIES_TOPIC", "queries")
+ANSWER_TOPIC = os.getenv("ANSWER_TOPIC", "precomputed_answers")
+ANSWER_POLICIES_SOURCE = os.getenv("ANSWER_POLICIES_SOURCE", os.path.join(SEED_DIR, "data.json"))
+ANSWER_EMPLOYEES_SOURCE = os.getenv("ANSWER_EMPLOYEES_SOURCE", os.path.join(SEED_DIR, "employee.json"))
+ANSWER_REFRESH_SECONDS = float(os.getenv("ANSWER_REFRESH_SECONDS", "60"))
+
+
+class AnswerService:
+    """
+    Looks up precomputed answers for incoming queries.
+
+    Args:
+        store (AnswerStore): The precomputed answers
+        policies_source (str): Where to read policy versions (see load_policies)
+        employees_source (str): Where to read the employees (see load_employees)
+        refresh_seconds (float): Interval between re-reads of the policies, employees and store
+    """
+    def __init__(self, store, policies_source=ANSWER_POLICIES_SOURCE, employees_source=ANSWER_EMPLOYEES_SOURCE,
+                 refresh_seconds=ANSWER_REFRESH_SECONDS):
+        self.store = store
+        self.policies_source = policies_source
+        self.employees_source = employees_source
+        self.refresh_seconds = refresh_seconds
+        self.lock = threading.Lock()
+        self.refreshed_at = 0.0
+        self.policies = {}
+        self.hr_versions = {}
+        self.employees = {}
+
+    def refresh(self, force=False):
+        """Re-read the current policy versions, HR segments and store once the interval has passed."""
+        with self.lock:
+            if not force and time.monotonic() - self.refreshed_at < self.refresh_seconds:
+                return
+            employees = load_employees(self.employees_source)
+            self.policies = policy_versions(load_policies(self.policies_source))
+            self.hr_versions = hr_segment_versions(employees)
+            self.employees = {employee["employee_id"]: employee for employee in employees}
+            self.store.reload()
+            self.refreshed_at = time.monotonic()
+
+    def answer(self, record):
+        """
+        The precomputed answer to a queries record.
+
+        Args:
+            record (dict): message_id, employee_id, user_email, session_id and message
+
+        Returns:
+            dict: A precomputed_answer record, or None to run the pipeline
+        """
+        self.refresh()
+        employee = self.employees.get(record.get("employee_id"))
+        if employee is None:
+            return None
+        found = self.store.lookup(record.get("message"), employee.get("region"), employee.get("employee_type"),
+                                  self.policies, self.hr_versions)
+        if found is None:
+            return None
+        return {
+            "message_id": record.get("message_id"),
+            "user_email": record.get("user_email"),
+            "session_id": record.get("session_id"),
+            "employee_id": record.get("employee_id"),
+            "message": record.get("message"),
+            "final_response_text": found["answer"],
+            "cluster_id": found["cluster_id"],
+            "computed_at": datetime.fromtimestamp(found["computed_at"], tz=timezone.utc),
+        }
+
+
+def _serializer(schema_registry_client, schema_file):
+    from confluent_kafka.schema_registry.avro import AvroSerializer
+
+    with open(schema_file) as f:
+        return AvroSerializer(schema_registry_client, f.read())
+
+
+def run_front_door(service, intake_topic=QUERY_INTAKE_TOPIC, queries_topic=QUERIES_TOPIC,
+                   answer_topic=ANSWER_TOPIC, group_id="answer-service"):
+    """
+    Answer intake queries from the store and forward the rest to the queries topic.
+    Offsets are committed after the produced records have been flushed.
+    """
+    from confluent_kafka import DeserializingConsumer, Producer
+    from confluent_kafka.schema_registry import SchemaRegistryClient
+    from confluent_kafka.schema_registry.avro import AvroDeserializer
+    from confluent_kafka.serialization import MessageField, SerializationContext, StringSerializer
+
+    kafka_conf = {
+        'bootstrap.servers': os.getenv("BOOTSTRAP_ENDPOINT"),
+        'sasl.mechanisms': 'PLAIN',
+        'security.protocol': 'SASL_SSL',
+        'sasl.username': os.getenv("KAFKA_API_KEY"),
+        'sasl.password': os.getenv("KAFKA_API_SECRET"),
+    }
+    schema_registry_client = SchemaRegistryClient({
+        'url': os.getenv("SCHEMA_REGISTRY_ENDPOINT"),
+        'basic.auth.user.info': f"{os.getenv('SCHEMA_REGISTRY_API_KEY')}:{os.getenv('SCHEMA_REGISTRY_API_SECRET')}"
+    })
+    consumer = DeserializingConsumer(dict(
+        kafka_conf,
+        **{'group.id': group_id, 'auto.offset.reset': 'earliest', 'enable.auto.commit': False,
+           'value.deserializer': AvroDeserializer(schema_registry_client)}
+    ))
+    producer = Producer(kafka_conf)
+    string_serializer = StringSerializer('utf_8')
+    serializers = {
+        queries_topic: _serializer(schema_registry_client, os.path.join(ROOT_DIR, "schemas", "queries.avsc")),
+        answer_topic: _serializer(schema_registry_client, os.path.join(os.path.dirname(__file__),
+                                                                       "precomputed_answer.avsc")),
+    }
+
+    running = True
+
+    def stop(*_):
+        nonlocal running
+        running = False
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    consumer.subscribe([intake_topic])
+    pending = 0
+    answered = forwarded = 0
+    try:
+        while running:
+            message = consumer.poll(1.0)
+            if message is not None and not message.error():
+                record = message.value()
+                answer = service.answer(record)
+                topic, value = (answer_topic, answer) if answer else (queries_topic, record)
+                producer.produce(
+                    topic=topic,
+                    key=string_serializer(record.get("message_id")),
+                    value=serializers[topic](value, SerializationContext(topic, MessageField.VALUE))
+                )
+                answered += bool(answer)
+                forwarded += not answer
+                pending += 1
+            elif message is not None:
+                print(f"Consumer error: {message.error()}")
+            if pending and (message is None or pending >= 100):
+                producer.flush()
+                consumer.commit(asynchronous=False)
+                pending = 0
+                print(f"Answered {answered}, forwarded {forwarded}; store {service.store.stats()}")
+    finally:
+        producer.flush()
+        if pending:
+            consumer.commit(asynchronous=False)
+        consumer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer frequent HR questions from the precomputed answer store.")
+    parser.add_argument("--store", default=ANSWER_STORE_PATH)
+    parser.add_argument("--policies", default=ANSWER_POLICIES_SOURCE)
+    parser.add_argument("--employees", default=ANSWER_EMPLOYEES_SOURCE)
+    parser.add_argument("--query", help="Look up one question and exit")
+    parser.add_argument("--employee-id", default="E001", help="Asker of --query")
+    parser.add_argument("--group-id", default=os.getenv("ANSWER_SERVICE_GROUP_ID", "answer-service"))
+    args = parser.parse_args()
+
+    service = AnswerService(AnswerStore(args.store), args.policies, args.employees)
+    service.refresh(force=True)
+    if args.query:
+        started = time.perf_counter()
+        answer = service.answer({"message_id": "local", "employee_id": args.employee_id, "message": args.query})
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        print(json.dumps(answer, default=str, indent=2) if answer else "No precomputed answer; the pipeline would run")
+        print(f"Lookup took {elapsed_ms:.2f} ms")
+        return
+    run_front_door(service, group_id=args.group_id)
+
+
+if __name__ == "__main__":
+    main()
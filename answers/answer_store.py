@@ -0,0 +1,386 @@
+"""
+Precomputed answers for the most frequent HR questions.
+
+A handful of generic questions (leave policy, benefits eligibility, PTO
+accrual) make up most of the ``queries`` traffic. Their answer only depends on
+the policies that apply to the asker, i.e. on the employee's region and
+employment type. precompute_answers.py mines those questions from the topic
+history and groups their normalised forms into clusters. It then stores one
+answer per (cluster, region, employee_type) here. answer_service.py answers
+matching queries from this store instead of running the router, the agents
+and the final model.
+
+Every answer records what it was computed from:
+
+- the ``lastUpdated`` of each policy it used;
+- a fingerprint of the HR data of its segment (the countries its employees
+  work in, which decide the country-specific policies such as holiday
+  calendars).
+
+A lookup only serves an answer while both still match the current policies
+and HR data. Otherwise the query falls through to the pipeline and the
+answer is listed by ``stale_answers`` for the next precompute run.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+
+ANSWER_STORE_PATH = os.getenv("ANSWER_STORE_PATH", "/tmp/precomputed_answers.db")
+# Minimum Jaccard similarity between a question and a cluster's terms, once
+# their content terms agree (see same_question)
+ANSWER_MATCH_THRESHOLD = float(os.getenv("ANSWER_MATCH_THRESHOLD", "0.6"))
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "the", "i", "me", "my", "we", "our", "you", "your", "is", "are", "am", "was", "be", "do",
+    "does", "did", "can", "could", "will", "would", "should", "shall", "may", "to", "of", "for", "in", "on",
+    "at", "by", "with", "about", "and", "or", "what", "whats", "how", "when", "where", "which", "who",
+    "there", "this", "that", "it", "get", "have", "has", "any", "much", "many", "please", "tell", "know",
+}
+# Spellings of the same HR concept, after stemming
+SYNONYMS = {
+    "pto": "leave", "vacation": "leave", "annual": "leave", "off": "leave",
+    "healthcare": "health", "medical": "health", "insurance": "health",
+    "accrue": "accrual", "accru": "accrual", "eligible": "eligibility",
+    "parental": "parent", "maternity": "parent", "paternity": "parent",
+    "wfh": "remote", "home": "remote",
+}
+# Terms that don't change which policy a question is about
+GENERIC_TERMS = {"policy", "rule", "guideline", "detail", "info", "information"}
+# Questions about a particular person, record or meeting are never precomputed
+_SPECIFIC = re.compile(
+    r"\b(?:e\d{3,}|pol-[\w-]+)\b|\b(?:schedule|meeting|book|invite|calendar invite|manager|report|reports|"
+    r"colleague|team|salary|review)\b",
+    re.IGNORECASE
+)
+
+
+def _stem(token):
+    if token.endswith(("ss", "us")):
+        return token
+    for suffix, replacement in (("ies", "y"), ("ing", ""), ("ed", ""), ("s", "")):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)] + replacement
+    return token
+
+
+def question_terms(text):
+    """Normalised content terms of a question, as a sorted tuple."""
+    terms = set()
+    for token in _TOKEN_PATTERN.findall((text or "").lower()):
+        if token in STOPWORDS or len(token) < 2:
+            continue
+        stemmed = _stem(token)
+        terms.add(SYNONYMS.get(token, SYNONYMS.get(stemmed, stemmed)))
+    return tuple(sorted(terms))
+
+
+def is_precomputable(text):
+    """Whether a question is generic enough to share an answer across a segment."""
+    return not _SPECIFIC.search(text or "") and len(question_terms(text)) >= 2
+
+
+def similarity(terms, other):
+    terms, other = set(terms), set(other)
+    return len(terms & other) / len(terms | other) if terms or other else 0.0
+
+
+def same_question(terms, other, threshold=ANSWER_MATCH_THRESHOLD):
+    """
+    Whether two questions' terms ask the same thing.
+
+    Every content term of each must be in the other, so "sick leave" never
+    matches a "leave" (annual leave) cluster however similar the rest is;
+    only GENERIC_TERMS may differ, within ``threshold``.
+    """
+    return set(terms) - GENERIC_TERMS == set(other) - GENERIC_TERMS and similarity(terms, other) >= threshold
+
+
+def canonical(value):
+    """Comparable form of a region or employment type ("Asia/Pacific" == "Asia Pacific")."""
+    return " ".join(_TOKEN_PATTERN.findall((value or "").lower()))
+
+
+def mine_clusters(messages, min_count=3, max_clusters=50, threshold=ANSWER_MATCH_THRESHOLD):
+    """
+    Group frequent questions whose normalised terms are similar.
+
+    Args:
+        messages (iterable[str]): Questions from the queries topic
+        min_count (int): Occurrences a cluster needs to be kept
+        max_clusters (int): Clusters kept, most frequent first
+        threshold (float): Similarity for joining an existing cluster (see same_question)
+
+    Returns:
+        list[dict]: Clusters with cluster_id, representative, terms and frequency
+    """
+    counts = Counter()
+    wordings = defaultdict(Counter)
+    for message in messages:
+        if not is_precomputable(message):
+            continue
+        terms = question_terms(message)
+        counts[terms] += 1
+        wordings[terms][" ".join(message.split())] += 1
+
+    clusters = []
+    for terms, count in counts.most_common():
+        matching = [cluster for cluster in clusters if same_question(terms, cluster["terms"], threshold)]
+        best = max(matching, key=lambda cluster: similarity(terms, cluster["terms"]), default=None)
+        if best is not None:
+            best["frequency"] += count
+            best["variants"].append(terms)
+            continue
+        clusters.append({
+            "cluster_id": hashlib.sha1(" ".join(terms).encode("utf-8")).hexdigest()[:12],
+            "representative": wordings[terms].most_common(1)[0][0],
+            "terms": terms,
+            "variants": [terms],
+            "frequency": count,
+        })
+    clusters = [cluster for cluster in clusters if cluster["frequency"] >= min_count]
+    return sorted(clusters, key=lambda cluster: cluster["frequency"], reverse=True)[:max_clusters]
+
+
+def policy_versions(policies, id_field="policyId"):
+    """{policy id: lastUpdated} for policy documents."""
+    return {doc.get(id_field): str(doc.get("lastUpdated")) for doc in policies if doc.get(id_field)}
+
+
+def hr_segment_versions(employees):
+    """
+    Fingerprint of each (region, employee_type) segment's HR data.
+
+    Args:
+        employees (iterable[dict]): Rows with region, country and employee_type
+
+    Returns:
+        dict: {(region, employee_type): fingerprint}
+    """
+    countries = defaultdict(set)
+    for employee in employees:
+        countries[(canonical(employee.get("region")), canonical(employee.get("employee_type")))].add(
+            canonical(employee.get("country"))
+        )
+    return {
+        segment: hashlib.sha1(json.dumps(sorted(values)).encode("utf-8")).hexdigest()[:16]
+        for segment, values in countries.items()
+    }
+
+
+def load_policies(source, id_field="policyId"):
+    """
+    Policy documents without their embeddings, one per policy id.
+
+    Args:
+        source (str): A mongoexport-style JSON array (terraform/seed/data.json)
+            or ``mongo`` for the collection in ``COLLECTION_NAME``
+    """
+    if source == "mongo":
+        from pymongo import MongoClient
+        client = MongoClient(
+            f"mongodb+srv://{os.getenv('MONGO_USER')}:{os.getenv('MONGO_PASSWORD')}@{os.getenv('MONGO_HOST')}/"
+        )
+        documents = client[os.getenv("DB_NAME")][os.getenv("COLLECTION_NAME")].find(
+            {}, {"_id": 0, "contentEmbedding": 0}
+        )
+    else:
+        with open(source) as f:
+            documents = json.load(f)
+    policies = {}
+    for document in documents:
+        document.pop("_id", None)
+        document.pop("contentEmbedding", None)
+        policies.setdefault(document.get(id_field), document)
+    return list(policies.values())
+
+
+def load_employees(source):
+    """
+    Employees with region, country and employee_type.
+
+    Args:
+        source (str): The employee collection export (``.json``, as in
+            terraform/seed/employee.json) or the SQL agent's SQLite database
+
+    Returns:
+        list[dict]: One row per employee
+    """
+    if source.endswith(".json"):
+        with open(source) as f:
+            documents = json.load(f)
+        return [{
+            "employee_id": doc.get("employee_id"),
+            "region": doc.get("work_location", {}).get("region"),
+            "country": doc.get("work_location", {}).get("country"),
+            "employee_type": doc.get("employment_type"),
+        } for doc in documents]
+    conn = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("SELECT employee_id, region, country, employee_type FROM employees").fetchall()
+    finally:
+        conn.close()
+    return [dict(zip(("employee_id", "region", "country", "employee_type"), row)) for row in rows]
+
+
+class AnswerStore:
+    """
+    Clusters and their answers in a SQLite file, matched in memory.
+
+    Args:
+        path (str): SQLite database file
+        threshold (float): Minimum similarity for a question to match a cluster
+    """
+    def __init__(self, path=ANSWER_STORE_PATH, threshold=ANSWER_MATCH_THRESHOLD):
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS clusters (
+                cluster_id TEXT PRIMARY KEY,
+                representative TEXT NOT NULL,
+                variants TEXT NOT NULL,
+                frequency INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS answers (
+                cluster_id TEXT NOT NULL,
+                region TEXT NOT NULL,
+                employee_type TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                policy_versions TEXT NOT NULL,
+                hr_version TEXT NOT NULL,
+                computed_at REAL NOT NULL,
+                PRIMARY KEY (cluster_id, region, employee_type)
+            );
+        """)
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.reload()
+
+    def reload(self):
+        """Read the clusters and answers written by the last precompute run."""
+        with self.lock:
+            clusters = {}
+            by_term = defaultdict(set)
+            for cluster_id, representative, variants, frequency in self.conn.execute(
+                "SELECT cluster_id, representative, variants, frequency FROM clusters"
+            ):
+                variants = [tuple(terms) for terms in json.loads(variants)]
+                clusters[cluster_id] = {"representative": representative, "variants": variants,
+                                        "frequency": frequency}
+                for terms in variants:
+                    for term in terms:
+                        by_term[term].add(cluster_id)
+            answers = {}
+            for cluster_id, region, employee_type, answer, versions, hr_version, computed_at in self.conn.execute(
+                "SELECT cluster_id, region, employee_type, answer, policy_versions, hr_version, computed_at FROM answers"
+            ):
+                answers[(cluster_id, region, employee_type)] = {
+                    "answer": answer,
+                    "policy_versions": json.loads(versions),
+                    "hr_version": hr_version,
+                    "computed_at": computed_at,
+                }
+            self.clusters, self.by_term, self.answers = clusters, by_term, answers
+
+    def replace_clusters(self, clusters):
+        """Store freshly mined clusters, dropping the answers of clusters that are gone."""
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.execute("DELETE FROM clusters")
+            self.conn.executemany(
+                "INSERT INTO clusters (cluster_id, representative, variants, frequency) VALUES (?, ?, ?, ?)",
+                [(cluster["cluster_id"], cluster["representative"], json.dumps(cluster["variants"]),
+                  cluster["frequency"]) for cluster in clusters]
+            )
+            self.conn.execute("DELETE FROM answers WHERE cluster_id NOT IN (SELECT cluster_id FROM clusters)")
+            self.conn.commit()
+        self.reload()
+
+    def put_answers(self, answers):
+        """
+        Store answers.
+
+        Args:
+            answers (list[dict]): cluster_id, region, employee_type, answer,
+                policy_versions and hr_version of each answer
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO answers (cluster_id, region, employee_type, answer, policy_versions, "
+                "hr_version, computed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(answer["cluster_id"], canonical(answer["region"]), canonical(answer["employee_type"]),
+                  answer["answer"], json.dumps(answer["policy_versions"]), answer["hr_version"], now)
+                 for answer in answers]
+            )
+            self.conn.commit()
+        self.reload()
+
+    def match(self, question):
+        """
+        The cluster a question belongs to.
+
+        Returns:
+            tuple: (cluster_id, similarity), or None if no cluster asks the same (see same_question)
+        """
+        if not is_precomputable(question):
+            return None
+        terms = question_terms(question)
+        candidates = set()
+        for term in terms:
+            candidates |= self.by_term.get(term, set())
+        best = None
+        for cluster_id in candidates:
+            scores = [similarity(terms, variant) for variant in self.clusters[cluster_id]["variants"]
+                      if same_question(terms, variant, self.threshold)]
+            if scores and (best is None or max(scores) > best[1]):
+                best = (cluster_id, max(scores))
+        return best
+
+    def is_current(self, entry, segment, policies, hr_versions):
+        if hr_versions.get(segment) != entry["hr_version"]:
+            return False
+        return all(policies.get(policy_id) == version for policy_id, version in entry["policy_versions"].items())
+
+    def lookup(self, question, region, employee_type, policies, hr_versions):
+        """
+        The precomputed answer to a question for an employee's segment.
+
+        Args:
+            question (str): The user's message
+            region (str): The employee's region
+            employee_type (str): The employee's employment type
+            policies (dict): Current {policy id: lastUpdated}
+            hr_versions (dict): Current hr_segment_versions()
+
+        Returns:
+            dict: answer, cluster_id, similarity and computed_at, or None
+        """
+        matched = self.match(question)
+        segment = (canonical(region), canonical(employee_type))
+        entry = self.answers.get((matched[0], *segment)) if matched else None
+        if entry is None:
+            self.misses += 1
+            return None
+        if not self.is_current(entry, segment, policies, hr_versions):
+            self.stale += 1
+            return None
+        self.hits += 1
+        return {"answer": entry["answer"], "cluster_id": matched[0], "similarity": matched[1],
+                "computed_at": entry["computed_at"]}
+
+    def stale_answers(self, policies, hr_versions):
+        """(cluster_id, region, employee_type) of answers the current data no longer supports."""
+        return [key for key, entry in self.answers.items()
+                if not self.is_current(entry, key[1:], policies, hr_versions)]
+
+    def stats(self):
+        return {"clusters": len(self.clusters), "answers": len(self.answers),
+                "hits": self.hits, "misses": self.misses, "stale": self.stale}
@@ -0,0 +1,287 @@
+"""
+Prompt assembly, templated answers and streamed generation for the final
+response (see final_response_service.py).
+
+The Flink ``user_friendly_agent_response`` statement pastes every agent result
+verbatim into one prompt. A large department context or several overlapping
+policy summaries can then crowd out the question or go over the model's
+context. Here the prompt is assembled within ``FINAL_RESPONSE_PROMPT_TOKENS``:
+
+- the instructions, the question and the meeting fields are always kept;
+- the search agent's summaries are split back into passages. Repeats,
+  near-repeats and passages the employee context already covers are
+  dropped, and the rest are ranked against the question with BM25;
+- the passages are packed best first. They may use the budget the employee
+  context leaves free, but no more than half of it when that context is
+  large. The last passage that partly fits is cut at a line break, and the
+  employee context gets what is left.
+
+A record whose only agent already gave a complete answer (a short HR lookup,
+a scheduled meeting) is answered from a template without a model call.
+"""
+import json
+import os
+import re
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEARCH_AGENT_DIR = os.path.join(ROOT_DIR, "agents", "search_agent", "source_code")
+sys.path.insert(0, SEARCH_AGENT_DIR)
+
+from bm25_index import BM25Index, tokenize  # noqa: E402
+
+FINAL_RESPONSE_MODEL_ID = os.getenv("FINAL_RESPONSE_MODEL_ID", "anthropic.claude-3-5-haiku-20241022-v1:0")
+FINAL_RESPONSE_PROMPT_TOKENS = int(os.getenv("FINAL_RESPONSE_PROMPT_TOKENS", "4000"))
+FINAL_RESPONSE_MAX_TOKENS = int(os.getenv("FINAL_RESPONSE_MAX_TOKENS", "1024"))
+FINAL_RESPONSE_TEMPLATES = os.getenv("FINAL_RESPONSE_TEMPLATES", "true").lower() == "true"
+# Longest HR lookup result that is served as it is
+FINAL_RESPONSE_TEMPLATE_MAX_CHARS = int(os.getenv("FINAL_RESPONSE_TEMPLATE_MAX_CHARS", "300"))
+
+# Rough size of a token in English text, as in the benchmark fakes
+CHARS_PER_TOKEN = 4
+# The search agent joins its document summaries with this line
+PASSAGE_SEPARATOR = "\n-----\n"
+# Share of a passage's word 5-grams found in a kept passage (or in the
+# employee context) above which it is dropped as a repeat
+DUPLICATE_OVERLAP = 0.8
+SHINGLE_SIZE = 5
+# A passage is only cut when at least this many tokens of it fit
+MIN_PARTIAL_TOKENS = 64
+TRUNCATION_MARK = " [...]"
+
+INSTRUCTIONS = (
+    "You are a helpful workplace assistant. Summarize the structured agent responses below into a natural and "
+    "helpful reply to the user. Use only the information given, and say so if it does not answer the question."
+)
+AGENTS = ("mongo_agent", "search_agent", "scheduler_agent")
+_HEADER_LINE = re.compile(r"^([A-Za-z ]+):\s*(.*)$")
+_FAILED_LOOKUP = re.compile(r"\berror\b|agent stopped|no further information", re.IGNORECASE)
+
+
+def estimate_tokens(text):
+    return (len(text or "") + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text, tokens):
+    """``text`` cut to about ``tokens`` tokens, at the last line break or sentence end in its final fifth."""
+    limit = max(0, tokens * CHARS_PER_TOKEN - len(TRUNCATION_MARK))
+    if len(text) <= tokens * CHARS_PER_TOKEN:
+        return text
+    cut = text[:limit]
+    boundary = max(cut.rfind("\n"), cut.rfind(". "))
+    if boundary >= limit * 0.8:
+        cut = cut[:boundary + 1]
+    return cut.rstrip() + TRUNCATION_MARK
+
+
+def triggered(record, agent):
+    """Whether the router sent the query to ``agent``; Flink writes the flags as 'true'/'false'."""
+    return str(record.get(agent)).lower() == "true"
+
+
+def split_passages(summary):
+    """
+    The documents of a search agent summary.
+
+    Returns:
+        list[dict]: policyId, title, region and category from each summary's
+            header, its body as ``content`` and the whole summary as ``text``
+    """
+    passages = []
+    for text in (summary or "").split(PASSAGE_SEPARATOR):
+        text = text.strip()
+        if not text:
+            continue
+        header, _, body = text.partition("\n\n")
+        fields = {}
+        for line in header.splitlines():
+            match = _HEADER_LINE.match(line)
+            if match:
+                fields[match.group(1).strip().lower().replace(" ", "_")] = match.group(2)
+        passages.append({
+            "policyId": fields.get("policy_id"),
+            "title": fields.get("title"),
+            "region": fields.get("region"),
+            "category": fields.get("category"),
+            "content": body if fields else text,
+            "text": text,
+        })
+    return passages
+
+
+def _shingles(text):
+    tokens = tokenize(text)
+    if len(tokens) < SHINGLE_SIZE:
+        return {tuple(tokens)} if tokens else set()
+    return {tuple(tokens[start:start + SHINGLE_SIZE]) for start in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+
+def _overlap(shingles, other):
+    return len(shingles & other) / len(shingles) if shingles else 1.0
+
+
+def dedupe_passages(passages, covered=None):
+    """
+    Drop passages that repeat a kept passage or ``covered`` text.
+
+    Args:
+        passages (list[dict]): Passages from ``split_passages``, in their original order
+        covered (str): Context already in the prompt, e.g. the employee information
+
+    Returns:
+        tuple: (kept passages, number dropped)
+    """
+    covered_shingles = _shingles(covered) if covered else set()
+    kept, kept_shingles = [], []
+    for passage in passages:
+        shingles = _shingles(passage["content"])
+        if covered_shingles and _overlap(shingles, covered_shingles) >= DUPLICATE_OVERLAP:
+            continue
+        if any(_overlap(shingles, other) >= DUPLICATE_OVERLAP or _overlap(other, shingles) >= DUPLICATE_OVERLAP
+               for other in kept_shingles):
+            continue
+        kept.append(passage)
+        kept_shingles.append(shingles)
+    return kept, len(passages) - len(kept)
+
+
+def rank_passages(question, passages):
+    """Passages best first for ``question`` (BM25); unmatched ones keep their search order after the rest."""
+    if len(passages) <= 1:
+        return list(passages)
+    documents = [dict(passage, position=position) for position, passage in enumerate(passages)]
+    ranked = [document for document, _ in BM25Index(documents, id_field="position").search(question, k=len(documents))]
+    matched = {document["position"] for document in ranked}
+    ranked += [document for document in documents if document["position"] not in matched]
+    return [passages[document["position"]] for document in ranked]
+
+
+def render_prompt(record, employee_info=None, passages=()):
+    """The final response prompt with the given (already budgeted) agent results."""
+    sections = [INSTRUCTIONS, "---", f"Original message: {record.get('message') or ''}"]
+    if triggered(record, "mongo_agent"):
+        sections.append(
+            f"Employee/Department Level Info Result obtained from Mongo agent: {employee_info or 'none'}"
+        )
+    if triggered(record, "search_agent"):
+        sections.append("Search Result:\n" + (PASSAGE_SEPARATOR.join(passages) if passages else "none"))
+    if triggered(record, "scheduler_agent"):
+        sections.append(
+            f"Scheduler Agent Triggered: true\n"
+            f"Meeting Title: {record.get('scheduler_title') or 'none'}\n"
+            f"Description: {record.get('scheduler_description') or 'none'}\n"
+            f"Scheduling Status: {record.get('scheduler_status') or 'no response from the scheduler'}"
+        )
+    sections.append("Generate a complete, professional answer below:\n")
+    return "\n\n".join(sections)
+
+
+def assemble_prompt(record, budget=FINAL_RESPONSE_PROMPT_TOKENS):
+    """
+    The final response prompt of a joined record, within ``budget`` tokens.
+
+    Args:
+        record (dict): Row of final_response_builder
+        budget (int): Prompt tokens allowed
+
+    Returns:
+        tuple: (prompt, stats) with the prompt's estimated tokens and the
+            passages received, dropped as repeats, used and cut
+    """
+    record = dict(record)
+    # A pasted document as the question still leaves room for the agents' results
+    if estimate_tokens(record.get("message")) > budget // 2:
+        record["message"] = truncate_to_tokens(record["message"], budget // 2)
+    employee_info = (record.get("employee_info") or "").strip() if triggered(record, "mongo_agent") else ""
+    passages = split_passages(record.get("additional_context")) if triggered(record, "search_agent") else []
+    unique, duplicates = dedupe_passages(passages, covered=employee_info)
+    ranked = rank_passages(record.get("message") or "", unique)
+
+    remaining = max(0, budget - estimate_tokens(render_prompt(record)))
+    passage_budget = remaining - min(estimate_tokens(employee_info), remaining // 2)
+    separator_tokens = estimate_tokens(PASSAGE_SEPARATOR)
+    used, texts, truncated = 0, [], 0
+    for passage in ranked:
+        available = passage_budget - used - (separator_tokens if texts else 0)
+        tokens = estimate_tokens(passage["text"])
+        if tokens <= available:
+            texts.append(passage["text"])
+        elif available >= MIN_PARTIAL_TOKENS:
+            texts.append(truncate_to_tokens(passage["text"], available))
+            truncated += 1
+        else:
+            break
+        used += estimate_tokens(texts[-1]) + (separator_tokens if len(texts) > 1 else 0)
+
+    employee_budget = remaining - used
+    employee_truncated = estimate_tokens(employee_info) > employee_budget
+    if employee_truncated:
+        employee_info = truncate_to_tokens(employee_info, employee_budget)
+
+    prompt = render_prompt(record, employee_info, texts)
+    return prompt, {
+        "prompt_tokens": estimate_tokens(prompt),
+        "passages": len(passages),
+        "duplicate_passages": duplicates,
+        "used_passages": len(texts),
+        "truncated_passages": truncated,
+        "employee_info_truncated": employee_truncated,
+    }
+
+
+def templated_answer(record):
+    """
+    The answer to a record one agent already answered completely, or None to ask the model.
+
+    Only records routed to a single agent qualify: a meeting the scheduler
+    reports as scheduled (``scheduler_status``, ``meeting_title`` and
+    ``meeting_description`` joined from its response), or a short HR lookup
+    result. Policy summaries always go to the model.
+    """
+    if not FINAL_RESPONSE_TEMPLATES:
+        return None
+    agents = [agent for agent in AGENTS if triggered(record, agent)]
+    if agents == ["scheduler_agent"] and record.get("scheduler_status") == "success" and record.get("meeting_title"):
+        description = (record.get("meeting_description") or "").strip().rstrip(".")
+        return f'Your meeting "{record["meeting_title"]}" has been scheduled' + (
+            f": {description}." if description else "."
+        )
+    if agents == ["mongo_agent"]:
+        info = (record.get("employee_info") or "").strip()
+        if info and "\n" not in info and len(info) <= FINAL_RESPONSE_TEMPLATE_MAX_CHARS \
+                and not _FAILED_LOOKUP.search(info):
+            return info if info.endswith((".", "!", "?")) else f"Here's what I found in the HR records: {info}."
+    return None
+
+
+def stream_text(client, prompt, model_id=FINAL_RESPONSE_MODEL_ID, max_tokens=FINAL_RESPONSE_MAX_TOKENS):
+    """
+    Generate the response with Bedrock's streaming API.
+
+    Args:
+        client: bedrock-runtime client
+        prompt (str): The assembled prompt
+
+    Yields:
+        str: Text deltas as the model writes them
+    """
+    response = client.invoke_model_with_response_stream(
+        modelId=model_id,
+        body=json.dumps({
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": max_tokens,
+            "temperature": 0.1,
+            "messages": [{"role": "user", "content": prompt}],
+        }),
+        contentType="application/json",
+        accept="application/json"
+    )
+    for event in response["body"]:
+        chunk = event.get("chunk")
+        if not chunk:
+            continue
+        payload = json.loads(chunk["bytes"])
+        if payload.get("type") == "content_block_delta":
+            text = payload.get("delta", {}).get("text")
+            if text:
+                yield text
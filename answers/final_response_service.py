@@ -0,0 +1,268 @@
+"""
+Writes the final response to each joined agent result and streams it out.
+
+The service replaces the ``user_friendly_agent_response`` statement of Task 08.
+It reads ``final_response_builder`` (``FINAL_RESPONSE_INPUT_TOPIC``) and:
+
+- answers a record from a template when its only agent already answered the
+  question, without calling the model (see ``templated_answer``);
+- otherwise assembles the prompt within ``FINAL_RESPONSE_PROMPT_TOKENS`` (see
+  final_response.py) and streams the model's reply with
+  ``invoke_model_with_response_stream``.
+
+The reply is produced to ``FINAL_RESPONSE_TOPIC`` (``final_response_chunks``)
+as it is written, keyed by ``session_id`` so a conversation's chunks stay in
+order. Each chunk carries its ``message_id`` and ``sequence``. Deltas are
+grouped until ``FINAL_RESPONSE_CHUNK_CHARS`` characters or
+``FINAL_RESPONSE_CHUNK_MS`` have passed. The last chunk of a message has
+``is_final`` set and the whole ``final_response_text``, so a consumer that
+does not render partial text can read only that one::
+
+    python answers/final_response_service.py
+    python answers/final_response_service.py --record joined.json --show-prompt
+
+Up to ``FINAL_RESPONSE_CONCURRENCY`` records of a poll are answered side by
+side. Offsets are committed once their chunks have been flushed.
+"""
+import argparse
+import json
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from final_response import (
+    FINAL_RESPONSE_MAX_TOKENS,
+    FINAL_RESPONSE_MODEL_ID,
+    FINAL_RESPONSE_PROMPT_TOKENS,
+    assemble_prompt,
+    stream_text,
+    templated_answer,
+)
+
+# From the search agent, which final_response puts on sys.path
+import backends
+from delivery import Deduplicator
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FINAL_RESPONSE_INPUT_TOPIC = os.getenv("FINAL_RESPONSE_INPUT_TOPIC", "final_response_builder")
+FINAL_RESPONSE_TOPIC = os.getenv("FINAL_RESPONSE_TOPIC", "final_response_chunks")
+FINAL_RESPONSE_CHUNK_CHARS = int(os.getenv("FINAL_RESPONSE_CHUNK_CHARS", "200"))
+FINAL_RESPONSE_CHUNK_MS = float(os.getenv("FINAL_RESPONSE_CHUNK_MS", "100"))
+FINAL_RESPONSE_CONCURRENCY = int(os.getenv("FINAL_RESPONSE_CONCURRENCY", "8"))
+FALLBACK_TEXT = "Sorry, I couldn't put together an answer to your question just now. Please try again shortly."
+
+
+def chunked(deltas, min_chars=FINAL_RESPONSE_CHUNK_CHARS, max_wait_s=FINAL_RESPONSE_CHUNK_MS / 1000):
+    """
+    Group text deltas into chunks.
+
+    A chunk is yielded once it holds ``min_chars`` characters, or as soon as a
+    delta arrives ``max_wait_s`` after the chunk was started.
+    """
+    buffer, started = [], None
+    for delta in deltas:
+        if not buffer:
+            started = time.monotonic()
+        buffer.append(delta)
+        if sum(map(len, buffer)) >= min_chars or time.monotonic() - started >= max_wait_s:
+            yield "".join(buffer)
+            buffer = []
+    if buffer:
+        yield "".join(buffer)
+
+
+class FinalResponder:
+    """
+    Writes final responses to joined records.
+
+    Args:
+        client: bedrock-runtime client
+        model_id (str): Bedrock model identifier
+        budget (int): Prompt tokens allowed
+        max_tokens (int): Response tokens allowed
+        deduplicator (Deduplicator): Drops redelivered message_ids
+    """
+    def __init__(self, client, model_id=FINAL_RESPONSE_MODEL_ID, budget=FINAL_RESPONSE_PROMPT_TOKENS,
+                 max_tokens=FINAL_RESPONSE_MAX_TOKENS, deduplicator=None):
+        self.client = client
+        self.model_id = model_id
+        self.budget = budget
+        self.max_tokens = max_tokens
+        self.deduplicator = deduplicator or Deduplicator()
+        self.counts = {"template": 0, "llm": 0, "error": 0}
+
+    def respond(self, record, emit):
+        """
+        Write the response to a record, passing each chunk to ``emit`` as it is ready.
+
+        Args:
+            record (dict): Row of final_response_builder
+            emit (callable): Called with each final_response_chunk record, in sequence
+
+        Returns:
+            str: The whole response, or None for a redelivered record
+        """
+        message_id = record.get("message_id")
+        if message_id and self.deduplicator.is_duplicate(message_id):
+            return None
+
+        sequence = 0
+
+        def chunk(text, source, is_final=False, final_text=None, prompt_tokens=None):
+            nonlocal sequence
+            emit({
+                "message_id": message_id,
+                "session_id": record.get("session_id"),
+                "user_email": record.get("user_email"),
+                "employee_id": record.get("employee_id"),
+                "sequence": sequence,
+                "text": text,
+                "is_final": is_final,
+                "source": source,
+                "final_response_text": final_text,
+                "prompt_tokens": prompt_tokens,
+            })
+            sequence += 1
+
+        answer = templated_answer(record)
+        if answer is not None:
+            self.counts["template"] += 1
+            chunk(answer, "template", is_final=True, final_text=answer)
+            return answer
+
+        prompt, stats = assemble_prompt(record, self.budget)
+        parts = []
+        try:
+            for text in chunked(stream_text(self.client, prompt, self.model_id, self.max_tokens)):
+                chunk(text, "llm")
+                parts.append(text)
+        except Exception as e:
+            print(f"Response generation failed for {message_id}: {e}")
+            self.counts["error"] += 1
+            # Whatever was streamed stays on screen; the final chunk says it stopped short
+            text = ("\n\n" if parts else "") + FALLBACK_TEXT
+            chunk(text, "error", is_final=True, final_text="".join(parts) + text,
+                  prompt_tokens=stats["prompt_tokens"])
+            return "".join(parts) + text
+        self.counts["llm"] += 1
+        answer = "".join(parts)
+        chunk("", "llm", is_final=True, final_text=answer, prompt_tokens=stats["prompt_tokens"])
+        return answer
+
+    def stats(self):
+        return dict(self.counts, **self.deduplicator.stats())
+
+
+def _serializer(schema_registry_client, schema_file):
+    from confluent_kafka.schema_registry.avro import AvroSerializer
+
+    with open(schema_file) as f:
+        return AvroSerializer(schema_registry_client, f.read())
+
+
+def run_service(responder, input_topic=FINAL_RESPONSE_INPUT_TOPIC, output_topic=FINAL_RESPONSE_TOPIC,
+                group_id="final-response-service", concurrency=FINAL_RESPONSE_CONCURRENCY):
+    """
+    Answer the joined records and produce their response chunks.
+    Offsets are committed after each poll's chunks have been flushed.
+    """
+    from confluent_kafka import DeserializingConsumer, Producer
+    from confluent_kafka.schema_registry import SchemaRegistryClient
+    from confluent_kafka.schema_registry.avro import AvroDeserializer
+    from confluent_kafka.serialization import MessageField, SerializationContext, StringSerializer
+
+    kafka_conf = {
+        'bootstrap.servers': os.getenv("BOOTSTRAP_ENDPOINT"),
+        'sasl.mechanisms': 'PLAIN',
+        'security.protocol': 'SASL_SSL',
+        'sasl.username': os.getenv("KAFKA_API_KEY"),
+        'sasl.password': os.getenv("KAFKA_API_SECRET"),
+    }
+    schema_registry_client = SchemaRegistryClient({
+        'url': os.getenv("SCHEMA_REGISTRY_ENDPOINT"),
+        'basic.auth.user.info': f"{os.getenv('SCHEMA_REGISTRY_API_KEY')}:{os.getenv('SCHEMA_REGISTRY_API_SECRET')}"
+    })
+    consumer = DeserializingConsumer(dict(
+        kafka_conf,
+        **{'group.id': group_id, 'auto.offset.reset': 'earliest', 'enable.auto.commit': False,
+           'value.deserializer': AvroDeserializer(schema_registry_client)}
+    ))
+    producer = Producer(kafka_conf)
+    string_serializer = StringSerializer('utf_8')
+    serializer = _serializer(schema_registry_client,
+                             os.path.join(os.path.dirname(__file__), "final_response_chunk.avsc"))
+
+    def emit(chunk):
+        producer.produce(
+            topic=output_topic,
+            key=string_serializer(chunk["session_id"] or chunk["message_id"]),
+            value=serializer(chunk, SerializationContext(output_topic, MessageField.VALUE))
+        )
+        # Serves delivery callbacks and hands the chunk to the network straight away
+        producer.poll(0)
+
+    def answer(record):
+        try:
+            responder.respond(record, emit)
+        except Exception as e:
+            print(f"Error answering {record.get('message_id')}: {e}")
+
+    running = True
+
+    def stop(*_):
+        nonlocal running
+        running = False
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    consumer.subscribe([input_topic])
+    answered = 0
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            while running:
+                messages = consumer.consume(num_messages=concurrency, timeout=1.0)
+                records = []
+                for message in messages:
+                    if message.error():
+                        print(f"Consumer error: {message.error()}")
+                    elif message.value() is not None:
+                        records.append(message.value())
+                if not messages:
+                    continue
+                list(pool.map(answer, records))
+                producer.flush()
+                consumer.commit(asynchronous=False)
+                answered += len(records)
+                print(f"Answered {answered}; {responder.stats()}")
+    finally:
+        producer.flush()
+        consumer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write and stream the final response to joined agent results.")
+    parser.add_argument("--record", help="Answer one final_response_builder record (a JSON file) and exit")
+    parser.add_argument("--show-prompt", action="store_true", help="With --record, print the assembled prompt")
+    parser.add_argument("--group-id", default=os.getenv("FINAL_RESPONSE_GROUP_ID", "final-response-service"))
+    args = parser.parse_args()
+
+    responder = FinalResponder(backends.bedrock_runtime(region_name=os.getenv("AWS_REGION", "us-east-1")))
+    if args.record:
+        with open(args.record) as f:
+            record = json.load(f)
+        if args.show_prompt:
+            prompt, stats = assemble_prompt(record, responder.budget)
+            print(prompt)
+            print(json.dumps(stats))
+        started = time.perf_counter()
+        responder.respond(record, lambda chunk: print(
+            f"[{(time.perf_counter() - started) * 1000:7.1f} ms] #{chunk['sequence']} {chunk['source']}: "
+            f"{chunk['text']!r}"
+        ))
+        return
+    run_service(responder, group_id=args.group_id)
+
+
+if __name__ == "__main__":
+    main()
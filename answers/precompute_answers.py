@@ -0,0 +1,290 @@
+"""
+Batch job that fills the precomputed answer store (see answer_store.py).
+
+It reads the history of the ``queries`` topic (from Kafka, or from a JSON
+export) and mines the most frequent generic questions. For every question
+cluster and every (region, employee_type) segment of the HR data, it picks
+the policies that apply to the segment and answers the cluster's
+representative question from them::
+
+    python answers/precompute_answers.py --history /tmp/queries.jsonl --answerer extractive
+    python answers/precompute_answers.py --topic queries --answerer bedrock
+    python answers/precompute_answers.py --refresh-stale
+
+``--refresh-stale`` keeps the mined clusters and only recomputes answers
+whose policies or HR segment changed since they were computed, plus those of
+new segments. Run it after policy or HR updates, or on a schedule.
+
+Policies are selected with the search agent's BM25 index and region
+pre-filter. The ``extractive`` answerer needs no model access. It answers
+with the best-matching FAQ entry of those policies and the eligibility rule
+for the segment's employment type. The ``bedrock`` answerer writes the
+answer with the same model family as the final response step.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEARCH_AGENT_DIR = os.path.join(ROOT_DIR, "agents", "search_agent", "source_code")
+sys.path.insert(0, SEARCH_AGENT_DIR)
+
+from bm25_index import BM25Index  # noqa: E402
+from hybrid_search import GLOBAL_REGION, region_filter_values  # noqa: E402
+
+from answer_store import (  # noqa: E402
+    ANSWER_STORE_PATH,
+    AnswerStore,
+    canonical,
+    hr_segment_versions,
+    load_employees,
+    load_policies,
+    mine_clusters,
+    policy_versions,
+    question_terms,
+    similarity,
+)
+
+SEED_DIR = os.path.join(ROOT_DIR, "terraform", "seed")
+ANSWER_MODEL_ID = os.getenv("ANSWER_MODEL_ID", "anthropic.claude-3-5-haiku-20241022-v1:0")
+POLICIES_PER_ANSWER = 3
+# Below this similarity between the question and the best FAQ entry, the
+# segment's policies don't cover the question and it is left to the pipeline
+MIN_FAQ_SIMILARITY = 0.3
+
+_FAQ_PATTERN = re.compile(r"Q:\s*(.+?)\s*\n\s*A:\s*(.+?)(?=\n\s*Q:|\n\s*\n|\Z)", re.DOTALL)
+# How each employment type is spelled in the policies' eligibility sections
+_ELIGIBILITY_TERMS = {"full time": "full-time", "part time": "part-time", "contract": "contract", "intern": "intern"}
+# An eligibility rule excluding the employment type: the FAQ answer does not apply to it
+_NOT_ELIGIBLE = re.compile(r"\b(not eligible|ineligible)\b", re.IGNORECASE)
+
+
+def read_history_file(path):
+    """Messages of an exported queries topic: a JSON array or JSON lines of records."""
+    with open(path) as f:
+        text = f.read().strip()
+    records = json.loads(text) if text.startswith("[") else [json.loads(line) for line in text.splitlines() if line]
+    return [record.get("message", "") if isinstance(record, dict) else str(record) for record in records]
+
+
+def read_topic_history(topic):
+    """Messages of every record currently in a topic, read from the beginning."""
+    from confluent_kafka import OFFSET_BEGINNING, DeserializingConsumer, TopicPartition
+    from confluent_kafka.schema_registry import SchemaRegistryClient
+    from confluent_kafka.schema_registry.avro import AvroDeserializer
+
+    schema_registry_client = SchemaRegistryClient({
+        'url': os.getenv("SCHEMA_REGISTRY_ENDPOINT"),
+        'basic.auth.user.info': f"{os.getenv('SCHEMA_REGISTRY_API_KEY')}:{os.getenv('SCHEMA_REGISTRY_API_SECRET')}"
+    })
+    consumer = DeserializingConsumer({
+        'bootstrap.servers': os.getenv("BOOTSTRAP_ENDPOINT"),
+        'sasl.mechanisms': 'PLAIN',
+        'security.protocol': 'SASL_SSL',
+        'sasl.username': os.getenv("KAFKA_API_KEY"),
+        'sasl.password': os.getenv("KAFKA_API_SECRET"),
+        # Offsets are never committed; every run reads the whole history
+        'group.id': f"precompute-answers-{uuid.uuid4()}",
+        'enable.auto.commit': False,
+        'value.deserializer': AvroDeserializer(schema_registry_client),
+    })
+    partitions = consumer.list_topics(topic, timeout=10).topics[topic].partitions
+    ends = {}
+    for partition in partitions:
+        low, high = consumer.get_watermark_offsets(TopicPartition(topic, partition), timeout=10)
+        if high > low:
+            ends[partition] = high
+    consumer.assign([TopicPartition(topic, partition, OFFSET_BEGINNING) for partition in ends])
+
+    messages = []
+    while ends:
+        message = consumer.poll(1.0)
+        if message is None or message.error():
+            continue
+        messages.append((message.value() or {}).get("message", ""))
+        if message.offset() + 1 >= ends.get(message.partition(), 0):
+            ends.pop(message.partition(), None)
+    consumer.close()
+    return messages
+
+
+def segments_of(employees):
+    """{(region, employee_type): {"region", "employee_type", "countries"}} with the HR spellings."""
+    segments = defaultdict(lambda: {"countries": set()})
+    for employee in employees:
+        segment = segments[(canonical(employee.get("region")), canonical(employee.get("employee_type")))]
+        segment["region"] = employee.get("region")
+        segment["employee_type"] = employee.get("employee_type")
+        segment["countries"].add(employee.get("country"))
+    return dict(segments)
+
+
+def eligibility_rule(document, employee_type):
+    """The line of a policy's eligibility section that covers an employment type."""
+    term = _ELIGIBILITY_TERMS.get(canonical(employee_type))
+    if not term:
+        return None
+    for line in document.get("content", "").splitlines():
+        line = line.strip().lstrip("- ")
+        if line.lower().startswith(term):
+            return line
+    return None
+
+
+def extractive_answer(question, segment, documents):
+    """
+    Answer from the policies' own FAQ entries.
+
+    Args:
+        question (str): The cluster's representative question
+        segment (dict): region, employee_type and countries of the segment
+        documents (list[dict]): Policies that apply to the segment, best first
+
+    Returns:
+        str: The answer, citing its policy, or None if no FAQ entry covers the question.
+            When the policy's eligibility rule excludes the segment's employment
+            type, the answer is that rule alone.
+    """
+    terms = question_terms(question)
+    best = None
+    for document in documents:
+        for faq_question, faq_answer in _FAQ_PATTERN.findall(document.get("content", "")):
+            score = similarity(terms, question_terms(faq_question))
+            if best is None or score > best[0]:
+                best = (score, document, " ".join(faq_answer.split()))
+    if best is None or best[0] < MIN_FAQ_SIMILARITY:
+        return None
+    _, document, text = best
+    rule = eligibility_rule(document, segment["employee_type"])
+    if rule and _NOT_ELIGIBLE.search(rule):
+        text = f"For your employment type: {rule}."
+    elif rule:
+        text = f"{text} For your employment type: {rule}."
+    return f"{text} (Source: {document.get('title')}, last updated {document.get('lastUpdated')}.)"
+
+
+class BedrockAnswerer:
+    """
+    Writes answers with a Bedrock text model.
+
+    Args:
+        model_id (str): Bedrock model identifier
+        region_name (str): AWS region of the Bedrock endpoint
+    """
+    def __init__(self, model_id=ANSWER_MODEL_ID, region_name=None):
+        import backends
+
+        self.model_id = model_id
+        self.client = backends.bedrock_runtime(region_name=region_name or os.getenv("AWS_REGION", "us-east-1"))
+
+    def __call__(self, question, segment, documents):
+        policies = "\n\n".join(
+            f"{document.get('title')} (last updated {document.get('lastUpdated')}):\n{document.get('content')}"
+            for document in documents
+        )
+        prompt = (
+            "You are a helpful workplace assistant. Answer the question below for an employee in "
+            f"{segment['region']} ({', '.join(sorted(filter(None, segment['countries'])))}) with employment "
+            f"type {segment['employee_type']}, using only these policies. Cite the policy you used.\n\n"
+            f"{policies}\n\nQuestion: {question}\n\nAnswer:"
+        )
+        response = self.client.invoke_model(
+            modelId=self.model_id,
+            body=json.dumps({
+                "anthropic_version": "bedrock-2023-05-31",
+                "max_tokens": 1024,
+                "temperature": 0.1,
+                "messages": [{"role": "user", "content": prompt}],
+            }),
+            contentType="application/json",
+            accept="application/json"
+        )
+        return json.loads(response["body"].read())["content"][0]["text"].strip()
+
+
+def precompute(store, policies, employees, answerer, refresh_stale=False):
+    """
+    Answer every cluster in the store for every HR segment.
+
+    Args:
+        store (AnswerStore): Store holding the clusters
+        policies (list[dict]): Policy documents
+        employees (list[dict]): Employees with region, country and employee_type
+        answerer (callable): ``answerer(question, segment, documents)`` returning the answer text,
+            or None when the documents don't answer the question
+        refresh_stale (bool): Keep answers that are still current
+
+    Returns:
+        int: Answers written
+    """
+    index = BM25Index(policies)
+    versions = policy_versions(policies)
+    hr_versions = hr_segment_versions(employees)
+    answers = []
+    for segment_key, segment in segments_of(employees).items():
+        regions = region_filter_values(index, segment["region"], *segment["countries"]) or [GLOBAL_REGION]
+        allowed = index.candidates(regions=regions)
+        for cluster_id, cluster in store.clusters.items():
+            existing = store.answers.get((cluster_id, *segment_key))
+            if refresh_stale and existing and store.is_current(existing, segment_key, versions, hr_versions):
+                continue
+            documents = [document for document, _ in
+                         index.search(cluster["representative"], k=POLICIES_PER_ANSWER, allowed=allowed)]
+            answer = answerer(cluster["representative"], segment, documents) if documents else None
+            if answer is None:
+                continue
+            answers.append({
+                "cluster_id": cluster_id,
+                "region": segment["region"],
+                "employee_type": segment["employee_type"],
+                "answer": answer,
+                "policy_versions": {document["policyId"]: versions[document["policyId"]] for document in documents},
+                "hr_version": hr_versions[segment_key],
+            })
+    store.put_answers(answers)
+    return len(answers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute answers to the most frequent HR questions.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--history", help="Exported queries records (JSON array or JSON lines)")
+    source.add_argument("--topic", help="Read the history from this Kafka topic, e.g. queries")
+    parser.add_argument("--refresh-stale", action="store_true",
+                        help="Keep the mined clusters and recompute only stale or missing answers")
+    parser.add_argument("--policies", default=os.path.join(SEED_DIR, "data.json"),
+                        help="Policy JSON export, or mongo for COLLECTION_NAME")
+    parser.add_argument("--employees", default=os.path.join(SEED_DIR, "employee.json"),
+                        help="Employee JSON export, or the SQL agent's SQLite database")
+    parser.add_argument("--store", default=ANSWER_STORE_PATH)
+    parser.add_argument("--min-count", type=int, default=3, help="Occurrences a question cluster needs")
+    parser.add_argument("--max-clusters", type=int, default=50)
+    parser.add_argument("--answerer", choices=["extractive", "bedrock"], default="extractive")
+    args = parser.parse_args()
+    if not args.refresh_stale and not (args.history or args.topic):
+        parser.error("--history or --topic is required unless --refresh-stale is given")
+
+    store = AnswerStore(args.store)
+    started = time.perf_counter()
+    if not args.refresh_stale:
+        messages = read_history_file(args.history) if args.history else read_topic_history(args.topic)
+        clusters = mine_clusters(messages, args.min_count, args.max_clusters)
+        store.replace_clusters(clusters)
+        print(f"Mined {len(clusters)} question clusters from {len(messages)} queries")
+        for cluster in clusters:
+            print(f"  {cluster['frequency']:>6}  {cluster['representative']}")
+
+    answerer = extractive_answer if args.answerer == "extractive" else BedrockAnswerer()
+    written = precompute(store, load_policies(args.policies), load_employees(args.employees), answerer,
+                         refresh_stale=args.refresh_stale)
+    print(f"Wrote {written} answers to {args.store} in {time.perf_counter() - started:.1f}s "
+          f"({store.stats()['answers']} in the store)")
+
+
+if __name__ == "__main__":
+    main()
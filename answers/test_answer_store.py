@@ -0,0 +1,93 @@
+"""
+Regression tests for matching questions to precomputed answers.
+
+    python -m unittest discover answers
+"""
+import os
+import tempfile
+import unittest
+
+from answer_store import AnswerStore, hr_segment_versions, mine_clusters
+from precompute_answers import extractive_answer
+
+EMPLOYEES = [{"employee_id": "E001", "region": "North America", "country": "USA", "employee_type": "Full-time"}]
+SEGMENT = ("north america", "full time")
+
+
+class PrecomputedAnswerMatchTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.store = AnswerStore(os.path.join(directory, "answers.db"))
+        self.hr_versions = hr_segment_versions(EMPLOYEES)
+
+    def store_answer(self, question, answer):
+        cluster = mine_clusters([question], min_count=1)[0]
+        self.store.replace_clusters([cluster])
+        self.store.put_answers([{
+            "cluster_id": cluster["cluster_id"], "region": SEGMENT[0], "employee_type": SEGMENT[1],
+            "answer": answer, "policy_versions": {}, "hr_version": self.hr_versions[SEGMENT],
+        }])
+
+    def lookup(self, question):
+        found = self.store.lookup(question, *SEGMENT, {}, self.hr_versions)
+        return found and found["answer"]
+
+    def assert_not_answered_by(self, stored, asked):
+        self.store_answer(stored, "stored answer")
+        self.assertIsNone(self.lookup(asked), f"{asked!r} was answered with the answer to {stored!r}")
+
+    def test_other_leave_types_are_not_annual_leave(self):
+        self.assert_not_answered_by("What is the annual leave policy?", "What is the sick leave policy?")
+        self.assert_not_answered_by("What is the annual leave policy?", "What is the maternity leave policy?")
+
+    def test_sick_leave_accrual_is_not_pto_accrual(self):
+        self.assert_not_answered_by("How does PTO accrual work?", "How does sick leave accrual work?")
+
+    def test_dental_benefits_are_not_health_benefits(self):
+        self.assert_not_answered_by("What are my health benefits?", "What are my dental benefits?")
+
+    def test_generic_question_is_not_a_specific_one(self):
+        self.assert_not_answered_by("What is the sick leave policy?", "What is the leave policy?")
+
+    def test_rewording_still_matches(self):
+        self.store_answer("What is the annual leave policy?", "25 days")
+        self.assertEqual(self.lookup("what's the vacation policy"), "25 days")
+        self.assertEqual(self.lookup("What is the PTO policy?"), "25 days")
+
+    def test_mining_keeps_leave_types_apart(self):
+        clusters = mine_clusters(
+            ["What is the annual leave policy?"] * 3 + ["What is the sick leave policy?"] * 3, min_count=1
+        )
+        self.assertEqual(len(clusters), 2)
+
+
+class ExtractiveAnswerTest(unittest.TestCase):
+    POLICY = {
+        "title": "Annual Leave Policy - North America",
+        "lastUpdated": "2025-01-15",
+        "content": (
+            "EMPLOYMENT TYPE ELIGIBILITY:\n"
+            "- Full-time employees: Eligible for full benefits as described\n"
+            "- Contract workers: Not eligible for company PTO policy\n\n"
+            "Q: How many PTO days do I get?\n"
+            "A: New employees start with 15 PTO days per year.\n"
+        ),
+    }
+
+    def answer(self, employee_type):
+        segment = {"region": "North America", "employee_type": employee_type, "countries": {"USA"}}
+        return extractive_answer("How many PTO days do I get?", segment, [self.POLICY])
+
+    def test_eligible_segment_gets_the_faq_answer_and_its_rule(self):
+        answer = self.answer("Full-time")
+        self.assertIn("15 PTO days", answer)
+        self.assertIn("Full-time employees: Eligible for full benefits", answer)
+
+    def test_ineligible_segment_gets_only_the_rule(self):
+        answer = self.answer("Contract")
+        self.assertNotIn("15 PTO days", answer)
+        self.assertIn("Contract workers: Not eligible for company PTO policy", answer)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,293 @@
+"""
+Drive each agent's lambda_handler with synthetic connector batches against
+fake Bedrock, Mongo, SNS and Kafka backends (installed through each agent's
+`backends` module), and report throughput, latency percentiles and memory per
+agent.
+
+    python benchmarks/bench_agents.py --agent all --records 500 --batch-size 10 \\
+        --bedrock-latency-ms 400 --mongo-latency-ms 30 --sns-latency-ms 40 --kafka-latency-ms 15
+
+With ``--memory-profile`` each agent's handler stages are also measured with
+tracemalloc (see memory_profile.py in each agent), to show where the memory
+goes.
+
+With ``--asyncio`` the agents' ``async_handler.lambda_handler`` is driven
+instead (see aio.py in each agent): records of a batch run concurrently, so
+with injected latency a batch should take about as long as its slowest record.
+
+Each agent runs in its own subprocess: the agents share module names
+(`lambda_function`, `avro_kafka_producer`) and the peak RSS of a clean
+process is what a Lambda container of that agent would need.
+Requires the agents' own requirements.txt to be installed.
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from workload import (  # noqa: E402
+    DEFAULT_MIX, QUERY_TYPE_AGENT, WorkloadGenerator, connector_batches, parse_mix, to_agent_input,
+)
+
+AGENTS = {
+    "search": {
+        "dir": os.path.join(ROOT_DIR, "agents", "search_agent", "source_code"),
+        "module": "lambda_function",
+        "result_topic": "search_agent_response",
+    },
+    "sql": {
+        "dir": os.path.join(ROOT_DIR, "agents", "sql_agent", "source_code"),
+        "module": "main",
+        "result_topic": "sql_agent_response",
+    },
+    "scheduler": {
+        "dir": os.path.join(ROOT_DIR, "agents", "scheduler_agent", "source-code"),
+        "module": "lambda_function",
+        "result_topic": "scheduler_agent_response",
+    },
+}
+
+AGENT_ENV = {
+    "search_agent_result_topic": "search_agent_response",
+    "sql_agent_result_topic": "sql_agent_response",
+    "scheduler_agent_result_topic": "scheduler_agent_response",
+    "BOOTSTRAP_ENDPOINT": "localhost:9092",
+    "KAFKA_API_KEY": "bench",
+    "KAFKA_API_SECRET": "bench",
+    "SCHEMA_REGISTRY_ENDPOINT": "http://localhost:8081",
+    "SCHEMA_REGISTRY_API_KEY": "bench",
+    "SCHEMA_REGISTRY_API_SECRET": "bench",
+    "SNS_ARN": "arn:aws:sns:us-east-1:000000000000:bench",
+    "MONGO_HOST": "localhost",
+    "MONGO_USER": "bench",
+    "MONGO_PASSWORD": "bench",
+    "DB_NAME": "workplace_knowledgebase",
+    "COLLECTION_NAME": "knowledge_collection",
+    "AWS_REGION": "us-east-1",
+    "AWS_DEFAULT_REGION": "us-east-1",
+}
+
+# Lambda bills memory in 1 MB steps from 128 MB; keep headroom over the measured peak
+MEMORY_HEADROOM = 1.5
+LAMBDA_MIN_MEMORY_MB = 128
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def build_collections(embedder):
+    """Mongo collections for the fakes: the seed policies (re-embedded locally) and employees."""
+    from fakes import FakeCollection
+    from ingest_passages import load_policies
+
+    seed_dir = os.path.join(ROOT_DIR, "terraform", "seed")
+    policies = load_policies(os.path.join(seed_dir, "data.json"))
+    for policy, vector in zip(policies, embedder.embed_batch([p["content"] for p in policies])):
+        policy["contentEmbedding"] = vector
+    with open(os.path.join(seed_dir, "employee.json")) as f:
+        employees = json.load(f)
+    return {
+        "knowledge_collection": FakeCollection(policies),
+        "employee_collection": FakeCollection(employees),
+    }
+
+
+def run_agent(agent, args):
+    """Benchmark one agent in this process and return its result dict."""
+    from fakes import FakeBackends, ReplayResponder, install_fakes
+
+    config = AGENTS[agent]
+    for name, value in AGENT_ENV.items():
+        os.environ.setdefault(name, value)
+    if args.memory_profile:
+        # Read by the agent's memory_profile module when it is imported
+        os.environ["MEMORY_PROFILE"] = "true"
+    # The search agent's embedder doubles as the fake Titan model
+    sys.path.insert(0, AGENTS["search"]["dir"])
+    from embeddings import HashingEmbedder
+    embedder = HashingEmbedder()
+
+    responder = ReplayResponder(args.replay, strict=args.strict_replay)
+    backends = FakeBackends(
+        collections=build_collections(embedder),
+        embedder=embedder,
+        bedrock_ms=args.bedrock_latency_ms,
+        mongo_ms=args.mongo_latency_ms,
+        sns_ms=args.sns_latency_ms,
+        kafka_ms=args.kafka_latency_ms,
+        responder=responder,
+    )
+
+    generator = WorkloadGenerator(mix=parse_mix(args.mix) if args.mix else None, zipf_s=args.zipf_s, seed=args.seed)
+    vectors = {}
+
+    def embed(text):
+        if text not in vectors:
+            vectors[text] = embedder.embed(text)
+        return vectors[text]
+
+    records = []
+    while len(records) < args.records:
+        query_type, query = generator.next_query()
+        if QUERY_TYPE_AGENT[query_type] == agent:
+            records.append(to_agent_input(query_type, query, embed)[1])
+
+    sys.path.insert(0, config["dir"])
+    os.chdir(config["dir"])
+    import backends as agent_backends
+    install_fakes(backends, agent_backends)
+    module = __import__("async_handler" if args.asyncio else config["module"])
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    batch_latencies = []
+    started = time.perf_counter()
+    for batch in connector_batches(records, args.batch_size):
+        batch_started = time.perf_counter()
+        module.lambda_handler(batch, None)
+        batch_latencies.append((time.perf_counter() - batch_started) * 1000)
+    elapsed = time.perf_counter() - started
+
+    produced = backends.kafka.count(config["result_topic"])
+    traced_peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024 if args.tracemalloc else None
+    rss_mb = peak_rss_mb()
+    memory_stages = None
+    if args.memory_profile:
+        import memory_profile
+        memory_stages = memory_profile.stats()["stages"]
+    return {
+        "agent": agent,
+        "handler": "asyncio" if args.asyncio else "sync",
+        "records": len(records),
+        "produced": produced,
+        "batches": len(batch_latencies),
+        "throughput_rps": produced / elapsed if elapsed else 0.0,
+        "batch_p50_ms": percentile(batch_latencies, 0.50),
+        "batch_p95_ms": percentile(batch_latencies, 0.95),
+        "batch_p99_ms": percentile(batch_latencies, 0.99),
+        "record_mean_ms": sum(batch_latencies) / len(records),
+        "bedrock_calls": backends.bedrock.calls,
+        "replay_hits": responder.hits,
+        "sns_calls": backends.sns.calls,
+        "peak_rss_mb": rss_mb,
+        "traced_peak_mb": traced_peak_mb,
+        "recommended_memory_mb": max(LAMBDA_MIN_MEMORY_MB, int(math.ceil(rss_mb * MEMORY_HEADROOM / 64) * 64)),
+        "memory_stages": memory_stages,
+    }
+
+
+COLUMNS = [
+    ("agent", "{:<10}", "{:<10}"),
+    ("records", "{:>8}", "{:>8}"),
+    ("produced", "{:>9}", "{:>9}"),
+    ("throughput_rps", "{:>15}", "{:>15.1f}"),
+    ("batch_p50_ms", "{:>13}", "{:>13.1f}"),
+    ("batch_p95_ms", "{:>13}", "{:>13.1f}"),
+    ("batch_p99_ms", "{:>13}", "{:>13.1f}"),
+    ("record_mean_ms", "{:>15}", "{:>15.1f}"),
+    ("bedrock_calls", "{:>14}", "{:>14}"),
+    ("sns_calls", "{:>10}", "{:>10}"),
+    ("peak_rss_mb", "{:>12}", "{:>12.1f}"),
+    ("recommended_memory_mb", "{:>22}", "{:>22}"),
+]
+
+
+def print_table(results):
+    print("".join(header.format(name) for name, header, _ in COLUMNS))
+    for result in results:
+        print("".join(cell.format(result[name]) for name, _, cell in COLUMNS))
+    for result in results:
+        for name, stage in (result.get("memory_stages") or {}).items():
+            top = stage["top_sites"][0] if stage["top_sites"] else ("-", 0)
+            print(f"{result['agent']:<10}{name:<12} kept {stage['mean_net_kib']:>9.1f} KiB/call  "
+                  f"peak {stage['peak_kib']:>9.1f} KiB  top {top[0]} ({top[1]} KiB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic workload benchmark for the agent Lambdas.")
+    parser.add_argument("--agent", choices=sorted(AGENTS) + ["all"], default="all")
+    parser.add_argument("--records", type=int, default=200, help="Records per agent")
+    parser.add_argument("--batch-size", type=int, default=10, help="Records per connector invocation")
+    parser.add_argument("--mix", help="Query mix, e.g. policy=0.5,employee=0.2,department=0.15,scheduling=0.15")
+    parser.add_argument("--zipf-s", type=float, default=1.1, help="Zipf exponent of question repeats")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--bedrock-latency-ms", type=float, default=0.0)
+    parser.add_argument("--mongo-latency-ms", type=float, default=0.0)
+    parser.add_argument("--sns-latency-ms", type=float, default=0.0)
+    parser.add_argument("--kafka-latency-ms", type=float, default=0.0)
+    parser.add_argument("--replay", help="JSONL of recorded LLM responses to replay (see fakes.ReplayResponder)")
+    parser.add_argument("--strict-replay", action="store_true", help="Fail on prompts without a recorded response")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also report the Python heap peak (slower)")
+    parser.add_argument("--memory-profile", action="store_true",
+                        help="Also measure each handler stage with tracemalloc (see memory_profile.py in each agent)")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="Drive the agents' async_handler (a batch's records concurrently on an event loop)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON lines")
+    args = parser.parse_args()
+
+    # An agent the mix gives no traffic would never fill its --records
+    try:
+        mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+    except ValueError as e:
+        parser.error(str(e))
+    idle = {agent for agent in AGENTS
+            if not any(weight > 0 and QUERY_TYPE_AGENT[name] == agent for name, weight in mix.items())}
+    if args.agent in idle:
+        parser.error(f"--mix sends no queries to the {args.agent} agent")
+
+    if args.agent != "all":
+        result = run_agent(args.agent, args)
+        print(json.dumps(result) if args.json else result)
+        return
+
+    results = []
+    for agent in sorted(set(AGENTS) - idle):
+        command = [
+            sys.executable, os.path.abspath(__file__), "--json", "--agent", agent,
+            "--records", str(args.records),
+            "--batch-size", str(args.batch_size),
+            "--zipf-s", str(args.zipf_s),
+            "--seed", str(args.seed),
+            "--bedrock-latency-ms", str(args.bedrock_latency_ms),
+            "--mongo-latency-ms", str(args.mongo_latency_ms),
+            "--sns-latency-ms", str(args.sns_latency_ms),
+            "--kafka-latency-ms", str(args.kafka_latency_ms),
+        ]
+        if args.mix:
+            command += ["--mix", args.mix]
+        if args.replay:
+            command += ["--replay", os.path.abspath(args.replay)]
+        if args.strict_replay:
+            command.append("--strict-replay")
+        if args.tracemalloc:
+            command.append("--tracemalloc")
+        if args.memory_profile:
+            command.append("--memory-profile")
+        if args.asyncio:
+            command.append("--asyncio")
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    print_table(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Latency and concurrent throughput of the SQL agent's HR queries on synthetic
+employee tables, with and without the performance mode of hr_store.py.
+
+For each table size, one database is built with the plain schema and a copy
+is given the indexes, WAL and planner statistics. The agent's three access
+paths (employee context, department context, department listing) then run as
+the plan cache would run them: parameterised, on default connections for
+the baseline and on the tuned read pool otherwise. The throughput run mixes
+all three from several threads; the baseline shares one connection between
+them.
+
+    python benchmarks/bench_hr_store.py [--employees 100000,1000000] [--departments 200] [--threads 8]
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+SQL_AGENT_DIR = os.path.join(os.path.dirname(__file__), "..", "agents", "sql_agent", "source_code")
+sys.path.insert(0, SQL_AGENT_DIR)
+
+from hr_store import ReadConnectionPool, apply_performance_mode, create_schema  # noqa: E402
+
+# The agent's lookups, parameterised as the plan cache runs them
+QUERIES = {
+    "employee_context": """
+        SELECT e.employee_id, e.first_name || ' ' || e.last_name as full_name, e.job_title, e.department,
+               e.email, e.phone, e.hire_date, e.tenure, e.salary, e.manager_id,
+               m.first_name || ' ' || m.last_name as manager_name, e.country, e.region, e.employee_type
+        FROM employees e
+        LEFT JOIN employees m ON e.manager_id = m.employee_id
+        WHERE e.employee_id = :p0
+    """,
+    "department_context": """
+        SELECT d.department_id, d.department_name, d.location, d.head_id,
+               e.first_name || ' ' || e.last_name as head_name, COUNT(e2.employee_id) as employee_count
+        FROM departments d
+        LEFT JOIN employees e ON d.head_id = e.employee_id
+        LEFT JOIN employees e2 ON e2.department = d.department_name
+        WHERE d.department_name = :p0
+        GROUP BY d.department_id, d.department_name, d.location, d.head_id, e.first_name, e.last_name
+    """,
+    "department_listing": """
+        SELECT e.employee_id, e.first_name || ' ' || e.last_name as full_name, e.job_title, e.email, e.phone,
+               e.hire_date, e.tenure, e.salary, e.manager_id, m.first_name || ' ' || m.last_name as manager_name
+        FROM employees e
+        LEFT JOIN employees m ON e.manager_id = m.employee_id
+        WHERE e.department = :p0
+        ORDER BY e.employee_id
+    """,
+}
+
+REGIONS = [("United States", "North America"), ("Germany", "Europe"), ("India", "Asia/Pacific"), ("Brazil", "Latin America")]
+
+
+def employee_id(n):
+    return f"E{n:07d}"
+
+
+def build_database(path, employees, departments, seed):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    create_schema(conn)
+    heads = [employee_id(i) for i in range(departments)]
+    conn.executemany(
+        "INSERT INTO departments VALUES (?, ?, ?, ?)",
+        [(f"D{i:04d}", f"Department {i}", f"Building {i % 10}", heads[i]) for i in range(departments)]
+    )
+    batch = []
+    for n in range(employees):
+        department = n % departments
+        country, region = rng.choice(REGIONS)
+        manager = heads[department] if n >= departments else None
+        batch.append((
+            employee_id(n), f"First{n}", f"Last{n}", f"employee{n}@company.com", f"555-{n % 10000:04d}",
+            "2020-01-01", "Engineer", f"Department {department}", manager, 50000 + rng.random() * 150000,
+            f"{rng.randint(0, 20)} years", country, region, rng.choice(["Full Time", "Contract"]),
+        ))
+        if len(batch) == 10000:
+            conn.executemany("INSERT INTO employees VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO employees VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+    conn.commit()
+    conn.close()
+
+
+def params_for(path, rng, employees, departments):
+    if path == "employee_context":
+        return {"p0": employee_id(rng.randrange(employees))}
+    return {"p0": f"Department {rng.randrange(departments)}"}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_latency(connect, employees, departments, queries, seed):
+    results = {}
+    for path, sql in QUERIES.items():
+        rng = random.Random(seed)
+        latencies = []
+        with connect() as conn:
+            for _ in range(queries):
+                params = params_for(path, rng, employees, departments)
+                started = time.perf_counter()
+                conn.execute(sql, params).fetchall()
+                latencies.append((time.perf_counter() - started) * 1000)
+        results[path] = (sum(latencies) / len(latencies), percentile(latencies, 0.95))
+    return results
+
+
+def run_throughput(connect, employees, departments, threads, queries_per_thread, seed):
+    paths = list(QUERIES)
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        for i in range(queries_per_thread):
+            path = paths[i % len(paths)]
+            with connect() as conn:
+                conn.execute(QUERIES[path], params_for(path, rng, employees, departments)).fetchall()
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return threads * queries_per_thread / (time.perf_counter() - started)
+
+
+class SharedConnection:
+    """The baseline: one default connection, serialised between threads."""
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+
+    def connection(self):
+        shared = self
+
+        class _Held:
+            def __enter__(self):
+                shared.lock.acquire()
+                return shared.conn
+
+            def __exit__(self, *exc):
+                shared.lock.release()
+        return _Held()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--employees", default="100000,1000000", help="Comma-separated table sizes")
+    parser.add_argument("--departments", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200, help="Queries per access path in the latency run")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--queries-per-thread", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_hr_store_")
+    try:
+        for employees in [int(n) for n in args.employees.split(",")]:
+            baseline_path = os.path.join(workdir, f"baseline_{employees}.db")
+            tuned_path = os.path.join(workdir, f"tuned_{employees}.db")
+
+            started = time.perf_counter()
+            build_database(baseline_path, employees, args.departments, args.seed)
+            build_s = time.perf_counter() - started
+            shutil.copy(baseline_path, tuned_path)
+            started = time.perf_counter()
+            conn = sqlite3.connect(tuned_path)
+            apply_performance_mode(conn)
+            conn.close()
+            index_s = time.perf_counter() - started
+            print(f"\n{employees} employees, {args.departments} departments "
+                  f"(built in {build_s:.1f}s, performance mode applied in {index_s:.1f}s)")
+
+            baseline = SharedConnection(baseline_path)
+            pool = ReadConnectionPool(tuned_path, size=args.threads)
+            print(f"{'access path':<22}{'baseline mean ms':>18}{'p95':>10}{'tuned mean ms':>16}{'p95':>10}")
+            before = run_latency(baseline.connection, employees, args.departments, args.queries, args.seed)
+            after = run_latency(pool.connection, employees, args.departments, args.queries, args.seed)
+            for path in QUERIES:
+                print(f"{path:<22}{before[path][0]:>18.3f}{before[path][1]:>10.3f}{after[path][0]:>16.3f}{after[path][1]:>10.3f}")
+
+            before_qps = run_throughput(baseline.connection, employees, args.departments,
+                                        args.threads, args.queries_per_thread, args.seed)
+            after_qps = run_throughput(pool.connection, employees, args.departments,
+                                       args.threads, args.queries_per_thread, args.seed)
+            print(f"{args.threads} threads, mixed paths: baseline {before_qps:.0f} queries/s, "
+                  f"tuned read pool {after_qps:.0f} queries/s")
+            baseline.conn.close()
+            pool.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Recall@K and latency of vector, BM25 and hybrid retrieval on the seed corpus.
+
+Both the documents and the questions are embedded with the deterministic
+HashingEmbedder so the benchmark runs offline; absolute vector recall is
+therefore lower than with Titan embeddings, but the relative effect of the
+lexical side, the fusion and the region pre-filter is representative. The
+``vector+partitions`` mode searches the regions the question names (else the
+employee's) and the question's category first, with the global fallback of partitioned_search.py; the
+scanned column counts the documents the vector searches scored per question.
+
+    python benchmarks/bench_hybrid_retrieval.py [--k 3] [--repeat 50]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+SEARCH_AGENT_DIR = os.path.join(os.path.dirname(__file__), "..", "agents", "search_agent", "source_code")
+SEED_PATH = os.path.join(os.path.dirname(__file__), "..", "terraform", "seed", "data.json")
+sys.path.insert(0, SEARCH_AGENT_DIR)
+
+from bm25_index import BM25Index  # noqa: E402
+from embeddings import HashingEmbedder  # noqa: E402
+from hybrid_search import hybrid_search  # noqa: E402
+from ingest_passages import load_policies  # noqa: E402
+from partitioned_search import CorpusPartitions, partitioned_search  # noqa: E402
+
+# (question, employee region, employee country, relevant policyId)
+LABELED_QUESTIONS = [
+    ("How many PTO days do I get per year?", "North America", "United States", "POL-LEAVE-NA-001"),
+    ("How many unused vacation days can I carry over?", "North America", "United States", "POL-LEAVE-NA-001"),
+    ("What does POL-LEAVE-NA-001 say about probation?", "North America", "United States", "POL-LEAVE-NA-001"),
+    ("How long is maternity leave?", "Europe", "Germany", "POL-PARENT-EU-002"),
+    ("Can fathers take paternity leave after the birth of a child?", "Europe", "Germany", "POL-PARENT-EU-002"),
+    ("What healthcare coverage do I have?", "Asia/Pacific", "India", "POL-HEALTH-APAC-003"),
+    ("Can I add my family members to my health insurance?", "Europe", "United Kingdom", "POL-HEALTH-EU-006"),
+    ("Which dental and vision benefits are included?", "Europe", "Germany", "POL-HEALTH-EU-006"),
+    ("What are the public holidays in Brazil?", "Latin America", "Brazil", "POL-HOLIDAY-LATAM-004"),
+    ("When is the next public holiday?", "North America", "United States", "HOLIDAY-CAL-US-2025"),
+    ("Is Thanksgiving a company holiday?", "North America", "United States", "HOLIDAY-CAL-US-2025"),
+    ("When is Diwali off this year?", "Asia/Pacific", "India", "HOLIDAY-CAL-INDIA-2025"),
+    ("Which holidays are observed in India in 2025?", "Asia/Pacific", "India", "HOLIDAY-CAL-INDIA-2025"),
+    ("Can I work remotely two days a week?", "North America", "United States", "POL-FLEX-GLOBAL-005"),
+    ("What is the flexible work arrangement policy?", "Europe", "Germany", "POL-FLEX-GLOBAL-005"),
+    ("How do skill premiums work with the overall compensation structure?", "North America", "United States", "POL-COMP-GLOBAL-008"),
+    ("How is the annual performance bonus calculated?", "Europe", "Germany", "POL-COMP-GLOBAL-008"),
+    ("What are the compliance and governance requirements for subsidiaries?", "Europe", "United Kingdom", "POL-COMPL-GLOBAL-009"),
+    ("What happens to my benefits during an international assignment?", "North America", "United States", "POL-MOBILITY-GLOBAL-007"),
+    ("Is relocation allowance provided for international assignments?", "Asia/Pacific", "India", "POL-MOBILITY-GLOBAL-007"),
+    # Questions about another region than the asker's
+    ("How long is parental leave in Europe?", "North America", "United States", "POL-PARENT-EU-002"),
+    ("Which holidays are observed in India?", "North America", "United States", "HOLIDAY-CAL-INDIA-2025"),
+    ("What healthcare benefits do employees in APAC get?", "Europe", "Germany", "POL-HEALTH-APAC-003"),
+    ("What are the public holidays in Brazil?", "North America", "United States", "POL-HOLIDAY-LATAM-004"),
+    ("How much annual leave do employees in North America get?", "Asia/Pacific", "India", "POL-LEAVE-NA-001"),
+    ("Does the health insurance in Europe cover dental care?", "Asia/Pacific", "India", "POL-HEALTH-EU-006"),
+]
+
+
+def cosine(first, second):
+    return sum(a * b for a, b in zip(first, second))
+
+
+def build_vector_search(policies, vectors, scanned):
+    def vector_search(input_vector, limit, regions=None, categories=None):
+        scored = []
+        for policy, vector in zip(policies, vectors):
+            if regions and policy.get("region") not in regions:
+                continue
+            if categories and policy.get("category") not in categories:
+                continue
+            scanned[0] += 1
+            scored.append((cosine(input_vector, vector), policy))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [dict(policy, score=score) for score, policy in scored[:limit]]
+    return vector_search
+
+
+def run_mode(mode, index, partitions, vector_search, scanned, embedder, k, repeat):
+    hits = 0
+    latencies = []
+    scanned[0] = 0
+    for question, region, country, relevant in LABELED_QUESTIONS:
+        input_vector = embedder.embed(question)
+        # The agent's region filter: the regions the question names, else the employee's
+        regions = partitions.question_regions(question, region, country)
+        for _ in range(repeat):
+            started = time.perf_counter()
+            if mode == "vector":
+                results = vector_search(input_vector, k)
+            elif mode == "vector+partitions":
+                results = partitioned_search(
+                    lambda regions, categories: vector_search(input_vector, k, regions, categories),
+                    k,
+                    regions,
+                    partitions.categories_for(question)
+                )
+            elif mode == "bm25":
+                results = [document for document, _ in index.search(question, k=k)]
+            else:
+                results = hybrid_search(question, input_vector, index, vector_search, k=k,
+                                        regions=regions if mode.endswith("+prefilter") else None)
+            latencies.append((time.perf_counter() - started) * 1000)
+        hits += relevant in [result.get("policyId") for result in results]
+
+    latencies.sort()
+    return {
+        "recall": hits / len(LABELED_QUESTIONS),
+        "scanned": scanned[0] / (len(LABELED_QUESTIONS) * repeat),
+        "mean_ms": statistics.mean(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    policies = load_policies(SEED_PATH)
+    embedder = HashingEmbedder()
+    vectors = embedder.embed_batch([f"{p['title']}\n{p['content']}" for p in policies])
+    index = BM25Index(policies)
+    partitions = CorpusPartitions(policies)
+    scanned = [0]
+    vector_search = build_vector_search(policies, vectors, scanned)
+
+    print(f"{len(policies)} policies, {len(LABELED_QUESTIONS)} labelled questions, k={args.k}")
+    print(f"{'mode':<20}{'recall@' + str(args.k):>10}{'scanned':>10}{'mean ms':>10}{'p95 ms':>10}")
+    for mode in ("vector", "vector+partitions", "bm25", "hybrid", "hybrid+prefilter"):
+        result = run_mode(mode, index, partitions, vector_search, scanned, embedder, args.k, args.repeat)
+        print(f"{mode:<20}{result['recall']:>10.2f}{result['scanned']:>10.1f}{result['mean_ms']:>10.3f}"
+              f"{result['p95_ms']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
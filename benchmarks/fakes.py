@@ -0,0 +1,715 @@
+"""
+In-process fakes for Bedrock, MongoDB, SNS, Schema Registry and Kafka with
+configurable injected latency.
+
+``install_fakes`` registers these fakes with an agent's ``backends`` module,
+the factory every agent obtains its external clients from, so the agents run
+unchanged without AWS, Atlas or Confluent endpoints. The asyncio clients of
+the agents' async handlers get async views of the same fakes, which wait with
+``asyncio.sleep`` instead of blocking the event loop.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import os
+import math
+import random
+import re
+import threading
+import time
+import uuid
+
+
+class Latency:
+    """Sleeps for ``mean_ms`` +/- ``jitter`` (fraction) on every call."""
+    def __init__(self, mean_ms=0.0, jitter=0.2, seed=11):
+        self.mean_ms = mean_ms
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def sample_s(self):
+        if self.mean_ms <= 0:
+            return 0.0
+        with self.lock:
+            factor = 1 + self.random.uniform(-self.jitter, self.jitter)
+        return self.mean_ms * factor / 1000.0
+
+    def wait(self):
+        delay_s = self.sample_s()
+        if delay_s:
+            time.sleep(delay_s)
+
+    async def wait_async(self):
+        delay_s = self.sample_s()
+        if delay_s:
+            await asyncio.sleep(delay_s)
+
+
+class _Body:
+    def __init__(self, payload):
+        self._payload = payload
+
+    def read(self):
+        return self._payload
+
+
+# Bedrock --------------------------------------------------------------------
+
+def _message_text(payload):
+    """Prompt text of an Anthropic messages or text-completion request body."""
+    if "messages" in payload:
+        content = payload["messages"][-1]["content"]
+        if isinstance(content, list):
+            return "".join(block.get("text", "") for block in content)
+        return content
+    return payload.get("prompt", "")
+
+
+def react_sql_responder(prompt):
+    """
+    Deterministic stand-in for the SQL agent's LLM.
+
+    Follows the ReAct format `create_sql_agent` parses: a SQL question is run
+    once through `sql_db_query`, its observation becomes the final answer;
+    entity-extraction and summary prompts get short fixed answers.
+    """
+    question_at = prompt.rfind("Question:")
+    if question_at == -1:
+        return "Summary: The requested HR information was retrieved from the database."
+
+    question, _, scratchpad = prompt[question_at + len("Question:"):].partition("\nThought:")
+    observations = re.findall(r"Observation:\s*(.*?)(?:\nThought:|$)", scratchpad, re.DOTALL)
+    if observations:
+        return f" I now know the final answer\nFinal Answer: {observations[-1].strip()}"
+    if re.search(r"\bSELECT\b", question, re.IGNORECASE):
+        sql = " ".join(question.split())
+        return f" I will run the query.\nAction: sql_db_query\nAction Input: {sql}"
+    if 'respond with ONLY "GENERAL"' in question:
+        for department in ("Engineering", "Finance", "Human Resources", "Product", "Executive"):
+            if department.lower() in question.lower():
+                return f" The query names a department.\nFinal Answer: {department}"
+        return " The query is general.\nFinal Answer: GENERAL"
+    if "employee_id" in question:
+        return " Found it.\nFinal Answer: E001"
+    return " Nothing to look up.\nFinal Answer: No further information."
+
+
+def prompt_key(prompt):
+    """Recording key of a prompt: sha256 of its whitespace-normalised text."""
+    return hashlib.sha256(" ".join(prompt.split()).encode()).hexdigest()
+
+
+class ReplayResponder:
+    """
+    Deterministic LLM that replays recorded responses.
+
+    Recordings are JSON lines of ``{"prompt_sha256": ..., "response": ...}``.
+    Prompts without a recording go to ``fallback``; with ``strict`` they raise
+    instead, so a regression run notices when a prompt template changed.
+    ``record()`` adds responses, e.g. captured from a live run, and ``save()``
+    writes them back out.
+
+    Args:
+        path (str): Recording file, loaded if it exists
+        fallback (callable): Prompt to response for unrecorded prompts
+        strict (bool): Raise KeyError on unrecorded prompts
+    """
+    def __init__(self, path=None, fallback=react_sql_responder, strict=False):
+        self.path = path
+        self.fallback = fallback
+        self.strict = strict
+        self.responses = {}
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.responses[entry["prompt_sha256"]] = entry["response"]
+
+    def record(self, prompt, response):
+        self.responses[prompt_key(prompt)] = response
+
+    def save(self, path=None):
+        with open(path or self.path, "w") as f:
+            for key, response in self.responses.items():
+                f.write(json.dumps({"prompt_sha256": key, "response": response}) + "\n")
+
+    def __call__(self, prompt):
+        key = prompt_key(prompt)
+        if key in self.responses:
+            self.hits += 1
+            return self.responses[key]
+        self.misses += 1
+        if self.strict:
+            raise KeyError(f"No recorded response for prompt {key[:12]}")
+        return self.fallback(prompt)
+
+
+class FakeBedrockRuntime:
+    """
+    bedrock-runtime client answering ``invoke_model`` locally.
+
+    Embedding requests (``inputText``) are served by ``embedder``; text
+    requests get ``responder(prompt)`` wrapped in an Anthropic messages response
+    with approximate token usage. Streamed responses deliver a word every
+    ``stream_delta_ms``.
+    """
+    def __init__(self, latency=None, embedder=None, responder=react_sql_responder, stream_delta_ms=5.0):
+        self.latency = latency or Latency()
+        self.embedder = embedder
+        self.responder = responder
+        self.stream_delta_ms = stream_delta_ms
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def invoke_model(self, modelId=None, body=None, **kwargs):
+        self.latency.wait()
+        return self.respond(modelId, body)
+
+    def invoke_model_with_response_stream(self, modelId=None, body=None, **kwargs):
+        """The text response as a stream of Anthropic events, one delta per word after the usual latency."""
+        self.latency.wait()
+        text = json.loads(self.respond(modelId, body)["body"].read())["content"][0]["text"]
+
+        def events():
+            yield {"chunk": {"bytes": json.dumps({"type": "message_start"}).encode()}}
+            for word in re.findall(r"\S+\s*", text):
+                time.sleep(self.stream_delta_ms / 1000.0)
+                delta = {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": word}}
+                yield {"chunk": {"bytes": json.dumps(delta).encode()}}
+            yield {"chunk": {"bytes": json.dumps({"type": "message_stop"}).encode()}}
+
+        return {"body": events(), "contentType": "application/json"}
+
+    def respond(self, modelId, body):
+        with self.lock:
+            self.calls += 1
+        payload = json.loads(body)
+        if "inputText" in payload:
+            response = {
+                "embedding": self.embedder.embed(payload["inputText"]),
+                "inputTextTokenCount": len(payload["inputText"].split()),
+            }
+            return {"body": _Body(json.dumps(response).encode()), "contentType": "application/json"}
+
+        prompt = _message_text(payload)
+        text = self.responder(prompt)
+        input_tokens = max(1, len(prompt) // 4)
+        output_tokens = max(1, len(text) // 4)
+        response = {
+            "id": f"msg_{uuid.uuid4().hex[:12]}",
+            "type": "message",
+            "role": "assistant",
+            "model": modelId,
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+        }
+        headers = {
+            "x-amzn-bedrock-input-token-count": str(input_tokens),
+            "x-amzn-bedrock-output-token-count": str(output_tokens),
+        }
+        return {
+            "body": _Body(json.dumps(response).encode()),
+            "contentType": "application/json",
+            "ResponseMetadata": {"HTTPHeaders": headers},
+        }
+
+
+class _AsyncBody:
+    def __init__(self, body):
+        self._body = body
+
+    async def read(self):
+        return self._body.read()
+
+
+class FakeAsyncBedrockRuntime:
+    """Asyncio view of a FakeBedrockRuntime, as an aiobotocore client."""
+    def __init__(self, bedrock):
+        self.bedrock = bedrock
+
+    async def invoke_model(self, modelId=None, body=None, **kwargs):
+        await self.bedrock.latency.wait_async()
+        response = self.bedrock.respond(modelId, body)
+        return dict(response, body=_AsyncBody(response["body"]))
+
+
+# MongoDB --------------------------------------------------------------------
+
+def _cosine(first, second):
+    dot = sum(a * b for a, b in zip(first, second))
+    norm = math.sqrt(sum(a * a for a in first)) * math.sqrt(sum(b * b for b in second))
+    return dot / norm if norm else 0.0
+
+
+def _get_path(document, path):
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _matches(document, query):
+    for field, condition in (query or {}).items():
+        if field == "$and":
+            if not all(_matches(document, clause) for clause in condition):
+                return False
+            continue
+        value = _get_path(document, field)
+        if isinstance(condition, dict):
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+            if "$nin" in condition and value in condition["$nin"]:
+                return False
+            if "$eq" in condition and value != condition["$eq"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _project(document, projection):
+    if not projection:
+        return dict(document)
+    included = {field for field, flag in projection.items() if flag and not isinstance(flag, dict)}
+    computed = {field: spec for field, spec in projection.items() if isinstance(spec, dict)}
+    if included - {"_id"} or computed:
+        result = {}
+        for field in included:
+            top = field.split(".")[0]
+            value = _get_path(document, field)
+            if value is None:
+                continue
+            if "." in field:
+                result.setdefault(top, {})[field.split(".", 1)[1]] = value
+            else:
+                result[field] = value
+        if projection.get("_id", 1) and "_id" in document:
+            result["_id"] = document["_id"]
+        for field, spec in computed.items():
+            result[field] = document.get("__score") if "$meta" in spec else None
+        return result
+    return {field: value for field, value in document.items() if projection.get(field, 1)}
+
+
+class FakeCollection:
+    """List-backed collection supporting the find/aggregate shapes the agents use."""
+    def __init__(self, documents=None, latency=None):
+        self.documents = list(documents or [])
+        self.latency = latency or Latency()
+
+    def insert_many(self, documents):
+        self.documents.extend(dict(document) for document in documents)
+
+    def find(self, query=None, projection=None):
+        self.latency.wait()
+        return self.matching(query, projection)
+
+    def matching(self, query=None, projection=None):
+        return [_project(document, projection) for document in self.documents if _matches(document, query)]
+
+    def find_one(self, query=None, projection=None):
+        results = self.find(query, projection)
+        return results[0] if results else None
+
+    def aggregate(self, pipeline):
+        self.latency.wait()
+        return iter(self.run_pipeline(pipeline))
+
+    def run_pipeline(self, pipeline):
+        documents = self.documents
+        for stage in pipeline:
+            if "$vectorSearch" in stage:
+                spec = stage["$vectorSearch"]
+                candidates = [d for d in documents if _matches(d, spec.get("filter"))]
+                scored = sorted(
+                    (dict(d, __score=_cosine(spec["queryVector"], d.get(spec["path"]) or [])) for d in candidates),
+                    key=lambda d: d["__score"],
+                    reverse=True
+                )
+                documents = scored[:spec["limit"]]
+            elif "$addFields" in stage or "$set" in stage:
+                fields = stage.get("$addFields") or stage.get("$set")
+                documents = [
+                    dict(d, **{name: d.get("__score") for name, spec in fields.items() if "$meta" in spec})
+                    for d in documents
+                ]
+            elif "$project" in stage:
+                projection = stage["$project"]
+                if any(spec == "$$ROOT" for spec in projection.values()):
+                    documents = [
+                        {name: (d if spec == "$$ROOT" else d.get("__score")) for name, spec in projection.items()
+                         if name != "_id"}
+                        for d in documents
+                    ]
+                else:
+                    documents = [_project(d, projection) for d in documents]
+            elif "$match" in stage:
+                documents = [d for d in documents if _matches(d, stage["$match"])]
+            elif "$limit" in stage:
+                documents = documents[:stage["$limit"]]
+        return [{key: value for key, value in d.items() if key != "__score"} for d in documents]
+
+
+class FakeDatabase:
+    def __init__(self, collections):
+        self.collections = collections
+
+    def __getitem__(self, collection_name):
+        return self.collections.setdefault(collection_name, FakeCollection())
+
+
+class FakeMongoClient:
+    """``client[db][collection]`` over shared in-memory collections (one namespace for all dbs)."""
+    def __init__(self, collections):
+        self.database = FakeDatabase(collections)
+
+    def __getitem__(self, db_name):
+        return self.database
+
+    def get_database(self, db_name):
+        return self.database
+
+    def close(self):
+        pass
+
+
+class FakeAsyncCursor:
+    """Cursor of the asyncio client; the collection's latency is paid when it is read."""
+    def __init__(self, fetch, latency):
+        self.fetch = fetch
+        self.latency = latency
+
+    async def to_list(self, length=None):
+        await self.latency.wait_async()
+        documents = self.fetch()
+        return documents[:length] if length else documents
+
+
+class FakeAsyncCollection:
+    """Asyncio view of a FakeCollection, as a pymongo AsyncCollection."""
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, query=None, projection=None):
+        return FakeAsyncCursor(lambda: self.collection.matching(query, projection), self.collection.latency)
+
+    async def find_one(self, query=None, projection=None):
+        results = await self.find(query, projection).to_list()
+        return results[0] if results else None
+
+    async def aggregate(self, pipeline):
+        return FakeAsyncCursor(lambda: self.collection.run_pipeline(pipeline), self.collection.latency)
+
+
+class FakeAsyncDatabase:
+    def __init__(self, database):
+        self.database = database
+
+    def __getitem__(self, collection_name):
+        return FakeAsyncCollection(self.database[collection_name])
+
+
+class FakeAsyncMongoClient:
+    """Asyncio view of a FakeMongoClient, as a pymongo AsyncMongoClient."""
+    def __init__(self, client):
+        self.database = FakeAsyncDatabase(client.database)
+
+    def __getitem__(self, db_name):
+        return self.database
+
+    def get_database(self, db_name):
+        return self.database
+
+    async def close(self):
+        pass
+
+
+# SNS ------------------------------------------------------------------------
+
+class FakeSNS:
+    """Records published notifications."""
+    def __init__(self, latency=None):
+        self.latency = latency or Latency()
+        self.published = []
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def publish(self, TopicArn=None, Message=None, **kwargs):
+        self.latency.wait()
+        return self.record(TopicArn, Message, **kwargs)
+
+    def record(self, TopicArn=None, Message=None, **kwargs):
+        message_id = str(uuid.uuid4())
+        with self.lock:
+            self.calls += 1
+            self.published.append({"TopicArn": TopicArn, "Message": Message, "MessageId": message_id, **kwargs})
+        return {"MessageId": message_id}
+
+    def publish_batch(self, TopicArn=None, PublishBatchRequestEntries=None, **kwargs):
+        self.latency.wait()
+        return self.record_batch(TopicArn, PublishBatchRequestEntries)
+
+    def record_batch(self, TopicArn=None, PublishBatchRequestEntries=None):
+        successful = []
+        with self.lock:
+            self.calls += 1
+            for entry in PublishBatchRequestEntries:
+                message_id = str(uuid.uuid4())
+                self.published.append({"TopicArn": TopicArn, "MessageId": message_id, **entry})
+                successful.append({"Id": entry["Id"], "MessageId": message_id})
+        return {"Successful": successful, "Failed": []}
+
+
+class FakeAsyncSNS:
+    """Asyncio view of a FakeSNS, as an aiobotocore client."""
+    def __init__(self, sns):
+        self.sns = sns
+
+    async def publish(self, TopicArn=None, Message=None, **kwargs):
+        await self.sns.latency.wait_async()
+        return self.sns.record(TopicArn, Message, **kwargs)
+
+    async def publish_batch(self, TopicArn=None, PublishBatchRequestEntries=None, **kwargs):
+        await self.sns.latency.wait_async()
+        return self.sns.record_batch(TopicArn, PublishBatchRequestEntries)
+
+
+# Schema Registry + Kafka ----------------------------------------------------
+
+class FakeSchemaRegistryClient:
+    """Schema Registry holding schemas in memory; one id per distinct schema, shared by all clients."""
+    schemas = {}
+    subjects = {}
+    lock = threading.Lock()
+
+    def __init__(self, conf=None):
+        self.conf = conf
+
+    def register_schema(self, subject_name, schema_str):
+        canonical = json.dumps(json.loads(schema_str), sort_keys=True)
+        with self.lock:
+            schema_id = next(
+                (schema_id for schema_id, known in self.schemas.items() if known == canonical),
+                len(self.schemas) + 1
+            )
+            self.schemas[schema_id] = canonical
+            versions = self.subjects.setdefault(subject_name, [])
+            if schema_id not in versions:
+                versions.append(schema_id)
+        return schema_id
+
+    def get_schema(self, schema_id):
+        return self.schemas[schema_id]
+
+
+class FakeAvroSerializer:
+    """
+    Registers the schema under ``<topic>-value`` on first use and encodes
+    records in the Confluent wire format: magic byte, schema id, then Avro
+    binary via fastavro (a requirement of every agent). Without fastavro it
+    checks required fields and falls back to a JSON body.
+    """
+    def __init__(self, schema_registry_client=None, schema_str=None, to_dict=None, conf=None):
+        self.registry = schema_registry_client or FakeSchemaRegistryClient()
+        self.schema_str = schema_str
+        self.schema = json.loads(schema_str)
+        self.to_dict = to_dict
+        self.schema_id = None
+        self.required = [
+            field["name"] for field in self.schema["fields"]
+            if "default" not in field and not (isinstance(field["type"], list) and "null" in field["type"])
+        ]
+        try:
+            import fastavro
+            self.parsed_schema = fastavro.parse_schema(self.schema)
+            self.writer = fastavro.schemaless_writer
+        except ImportError:
+            self.parsed_schema = None
+
+    def __call__(self, obj, ctx=None):
+        if self.schema_id is None:
+            subject = f"{getattr(ctx, 'topic', None) or self.schema['name']}-value"
+            self.schema_id = self.registry.register_schema(subject, self.schema_str)
+        record = self.to_dict(obj, ctx) if self.to_dict else obj
+        header = b"\x00" + self.schema_id.to_bytes(4, "big")
+
+        if self.parsed_schema is not None:
+            buffer = io.BytesIO()
+            self.writer(buffer, self.parsed_schema, record)
+            return header + buffer.getvalue()
+
+        missing = [name for name in self.required if record.get(name) is None]
+        if missing:
+            raise ValueError(f"Record is missing required fields {missing} for schema {self.schema['name']}")
+        encoded = {
+            key: (value.hex() if isinstance(value, (bytes, bytearray)) else value) for key, value in record.items()
+        }
+        return header + json.dumps(encoded, default=str).encode()
+
+
+class FakeMessage:
+    def __init__(self, topic, key, value, partition, offset):
+        self._topic, self._key, self._value = topic, key, value
+        self._partition, self._offset = partition, offset
+
+    def topic(self):
+        return self._topic
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def error(self):
+        return None
+
+
+class FakeKafka:
+    """In-memory log of everything produced, shared by all fake producers."""
+    def __init__(self, latency=None, partitions=6):
+        self.latency = latency or Latency()
+        self.partitions = partitions
+        self.topics = {}
+        self.lock = threading.Lock()
+
+    def append(self, topic, key, value, partition=None):
+        with self.lock:
+            log = self.topics.setdefault(topic, [])
+            if partition is None:
+                partition = (hash(key) % self.partitions) if key is not None else len(log) % self.partitions
+            message = FakeMessage(topic, key, value, partition, len(log))
+            log.append(message)
+        return message
+
+    def count(self, topic=None):
+        with self.lock:
+            if topic:
+                return len(self.topics.get(topic, []))
+            return sum(len(log) for log in self.topics.values())
+
+
+class FakeSerializationContext:
+    def __init__(self, topic, field="value"):
+        self.topic = topic
+        self.field = field
+
+
+class FakeProducer:
+    """
+    Producer / SerializingProducer writing to a FakeKafka. A record is
+    acknowledged (its callback run by ``poll``) one round trip after it was
+    produced; ``flush`` waits one round trip for all of them.
+    """
+    kafka = None
+
+    def __init__(self, conf=None):
+        self.conf = conf or {}
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def produce(self, topic, value=None, key=None, partition=None, on_delivery=None, callback=None, **kwargs):
+        serializer = self.conf.get("value.serializer")
+        if serializer is not None:
+            value = serializer(value, FakeSerializationContext(topic, "value"))
+        key_serializer = self.conf.get("key.serializer")
+        if key_serializer is not None and key is not None:
+            key = key_serializer(key, FakeSerializationContext(topic, "key"))
+        message = self.kafka.append(topic, key, value, partition)
+        acknowledged_at = time.monotonic() + self.kafka.latency.sample_s()
+        with self.lock:
+            self.pending.append((on_delivery or callback, message, acknowledged_at))
+
+    def _deliver(self, delivered):
+        for callback, message, _ in delivered:
+            if callback:
+                callback(None, message)
+        return len(delivered)
+
+    def poll(self, timeout=None):
+        now = time.monotonic()
+        with self.lock:
+            delivered = [item for item in self.pending if item[2] <= now]
+            self.pending = [item for item in self.pending if item[2] > now]
+        return self._deliver(delivered)
+
+    def flush(self, timeout=None):
+        if self.pending:
+            self.kafka.latency.wait()
+        with self.lock:
+            delivered, self.pending = self.pending, []
+        self._deliver(delivered)
+        return 0
+
+    def __len__(self):
+        return len(self.pending)
+
+
+# Installation ---------------------------------------------------------------
+
+class FakeBackends:
+    """
+    The set of fakes one benchmark run uses, each with its own latency.
+
+    Args:
+        collections (dict): Mongo collection name to FakeCollection
+        embedder: Embedder used for Titan requests
+        bedrock_ms, mongo_ms, sns_ms, kafka_ms (float): Mean injected latency per call
+    """
+    def __init__(self, collections=None, embedder=None, bedrock_ms=0.0, mongo_ms=0.0, sns_ms=0.0, kafka_ms=0.0,
+                 responder=react_sql_responder):
+        mongo_latency = Latency(mongo_ms)
+        self.collections = collections or {}
+        for collection in self.collections.values():
+            collection.latency = mongo_latency
+        self.mongo_latency = mongo_latency
+        self.mongo = FakeMongoClient(self.collections)
+        self.bedrock = FakeBedrockRuntime(Latency(bedrock_ms), embedder=embedder, responder=responder)
+        self.sns = FakeSNS(Latency(sns_ms))
+        self.kafka = FakeKafka(Latency(kafka_ms))
+
+
+def install_fakes(backends, agent_backends):
+    """
+    Point an agent's client factories at ``backends``.
+
+    Args:
+        backends (FakeBackends): Fakes to install
+        agent_backends (module): The agent's ``backends`` module; only the
+            factories it defines are replaced
+    """
+    FakeProducer.kafka = backends.kafka
+
+    async def async_aws_client(service_name, region_name=None, config=None):
+        if service_name == "bedrock-runtime":
+            return FakeAsyncBedrockRuntime(backends.bedrock)
+        if service_name == "sns":
+            return FakeAsyncSNS(backends.sns)
+        raise ValueError(f"No fake for AWS service {service_name}")
+
+    factories = {
+        "mongo_client": lambda uri: backends.mongo,
+        "bedrock_runtime": lambda region_name=None, config=None: backends.bedrock,
+        "sns_client": lambda: backends.sns,
+        "async_mongo_client": lambda uri: FakeAsyncMongoClient(backends.mongo),
+        "async_aws_client": async_aws_client,
+        "schema_registry_client": FakeSchemaRegistryClient,
+        "avro_serializer": FakeAvroSerializer,
+        "producer": FakeProducer,
+        "serializing_producer": FakeProducer,
+    }
+    agent_backends.configure(**{name: factory for name, factory in factories.items() if name in agent_backends.DEFAULTS})
@@ -0,0 +1,403 @@
+"""
+Replay a capture of an agent's traffic (see workers/recording.py) through its
+handlers, with every Bedrock, Mongo and SNS call served from the recording,
+and report throughput, latency and how the responses compare with the
+recorded ones.
+
+    python benchmarks/replay.py captures/search.jsonl.gz
+    python benchmarks/replay.py captures/sql.jsonl.gz --speed 10
+    python benchmarks/replay.py captures/search.*.jsonl.gz --speed 0 --strict --show-diffs 5
+
+``--speed 1`` replays at the recorded pace: each batch is handed to the
+handler at its recorded time (batches of one partition still run in order)
+and each call answers after its recorded latency. ``--speed 10`` divides
+every wait by ten, and ``--speed 0`` drops them for a throughput run.
+
+Calls are matched on the same request hashes the capture used. A request the
+recording doesn't hold, for example after a prompt template changed, is
+served by the fakes of fakes.py; with ``--strict`` it fails instead. The agent
+runs with the current environment, so a replay can compare settings (e.g.
+``SEARCH_MODE``) on the same traffic. Like bench_agents.py, this needs the
+agent's requirements.txt installed but no AWS, Atlas or Confluent access.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "workers"))
+
+from bench_agents import AGENTS, AGENT_ENV, build_collections, peak_rss_mb, percentile  # noqa: E402
+from recording import MONGO_READS, bedrock_key, decode_bytes, mongo_key, read_recording, sns_key  # noqa: E402
+
+# Fields of a response that legitimately change between runs
+VOLATILE_FIELDS = {"timestamp"}
+VOLATILE_USAGE_FIELDS = {"latency_ms"}
+
+
+class Recording:
+    """
+    The entries of one or more capture files of the same agent.
+
+    Args:
+        paths (list[str]): Capture files, e.g. one per worker process
+    """
+    def __init__(self, paths):
+        self.agent = None
+        self.inputs = []
+        self.outputs = []
+        self.calls = {}
+        for path in paths:
+            for entry in read_recording(path):
+                kind = entry["kind"]
+                if kind == "header":
+                    if self.agent not in (None, entry["agent"]):
+                        raise ValueError(f"{path} is a capture of the {entry['agent']} agent, not {self.agent}")
+                    self.agent = entry["agent"]
+                elif kind == "input":
+                    self.inputs.append(entry)
+                elif kind == "output":
+                    self.outputs.append(entry)
+                else:
+                    self.calls.setdefault((kind, entry["key"]), []).append(entry)
+        self.inputs.sort(key=lambda entry: entry["t"])
+        for entries in self.calls.values():
+            entries.sort(key=lambda entry: entry["t"])
+
+
+class ReplayCalls:
+    """
+    Serves recorded calls by request key. Repeats of a request get its
+    recorded responses in order, then the last one again.
+
+    Args:
+        recording (Recording): The capture
+        speed (float): Recorded latencies are divided by this; 0 serves without waiting
+        strict (bool): Raise KeyError for requests the capture doesn't hold
+    """
+    def __init__(self, recording, speed=1.0, strict=False):
+        self.queues = {key: deque(entries) for key, entries in recording.calls.items()}
+        self.speed = speed
+        self.strict = strict
+        self.hits = {}
+        self.misses = {}
+        self.lock = threading.Lock()
+
+    def take(self, service, key):
+        """The recorded call for the request after its latency, or None to use the fallback."""
+        with self.lock:
+            queue = self.queues.get((service, key))
+            if not queue:
+                self.misses[service] = self.misses.get(service, 0) + 1
+                if self.strict:
+                    raise KeyError(f"No recorded {service} call for request {key[:12]}")
+                return None
+            entry = queue.popleft() if len(queue) > 1 else queue[0]
+            self.hits[service] = self.hits.get(service, 0) + 1
+        if self.speed > 0:
+            time.sleep(entry["ms"] / self.speed / 1000)
+        return entry
+
+
+class _Body:
+    def __init__(self, payload):
+        self._payload = payload
+
+    def read(self, *args):
+        return self._payload
+
+
+class ReplayBedrockRuntime:
+    def __init__(self, calls, fallback):
+        self.calls = calls
+        self.fallback = fallback
+
+    def invoke_model(self, **kwargs):
+        entry = self.calls.take("bedrock", bedrock_key(kwargs.get("modelId"), kwargs.get("body")))
+        if entry is None:
+            return self.fallback.invoke_model(**kwargs)
+        return {
+            "body": _Body(decode_bytes(entry["body"])),
+            "contentType": entry.get("content_type"),
+            "ResponseMetadata": {"HTTPHeaders": entry.get("headers") or {}},
+        }
+
+
+class ReplayCollection:
+    def __init__(self, calls, db_name, collection_name, fallback):
+        self.calls = calls
+        self.db_name = db_name
+        self.collection_name = collection_name
+        self.fallback = fallback
+
+    def __getattr__(self, name):
+        if name not in MONGO_READS:
+            return getattr(self.fallback, name)
+
+        def replayed(*args, **kwargs):
+            entry = self.calls.take("mongo", mongo_key(self.db_name, self.collection_name, name, args, kwargs))
+            if entry is None:
+                return getattr(self.fallback, name)(*args, **kwargs)
+            return iter(entry["result"]) if name == "aggregate" else entry["result"]
+        return replayed
+
+
+class ReplayDatabase:
+    def __init__(self, calls, db_name, fallback):
+        self.calls = calls
+        self.db_name = db_name
+        self.fallback = fallback
+
+    def __getitem__(self, collection_name):
+        return ReplayCollection(self.calls, self.db_name, collection_name, self.fallback[collection_name])
+
+    def get_collection(self, collection_name, **kwargs):
+        return self[collection_name]
+
+
+class ReplayMongoClient:
+    def __init__(self, calls, fallback):
+        self.calls = calls
+        self.fallback = fallback
+
+    def __getitem__(self, db_name):
+        return ReplayDatabase(self.calls, db_name, self.fallback[db_name])
+
+    def get_database(self, db_name, **kwargs):
+        return self[db_name]
+
+    def close(self):
+        pass
+
+
+class ReplaySNS:
+    def __init__(self, calls, fallback):
+        self.calls = calls
+        self.fallback = fallback
+
+    def publish(self, **kwargs):
+        entry = self.calls.take("sns", sns_key("publish", kwargs))
+        if entry is None:
+            return self.fallback.publish(**kwargs)
+        return entry["response"]
+
+    def publish_batch(self, **kwargs):
+        entry = self.calls.take("sns", sns_key("publish_batch", kwargs))
+        if entry is None:
+            return self.fallback.publish_batch(**kwargs)
+        # Same entries in the same order; map the recorded entry ids onto this request's
+        ids = dict(zip(entry["ids"], [request["Id"] for request in kwargs["PublishBatchRequestEntries"]]))
+        return {
+            status: [dict(result, Id=ids.get(result["Id"], result["Id"])) for result in entry["response"].get(status, [])]
+            for status in ("Successful", "Failed")
+        }
+
+
+class OutputCollector:
+    """Stands in for the RecordingWriter behind a RecordingSerializer, keeping the replayed responses."""
+    def __init__(self):
+        self.outputs = []
+        self.lock = threading.Lock()
+
+    def write(self, kind, t=None, **fields):
+        with self.lock:
+            self.outputs.append(fields)
+
+
+def comparable(value):
+    """A response without the fields that change from run to run."""
+    value = {name: field for name, field in value.items() if name not in VOLATILE_FIELDS}
+    if isinstance(value.get("usage"), dict):
+        value["usage"] = {name: field for name, field in value["usage"].items() if name not in VOLATILE_USAGE_FIELDS}
+    return value
+
+
+def compare_outputs(recorded, replayed):
+    """
+    Match responses by topic and message_id and compare them.
+
+    Returns:
+        dict: matched, differed, missing and extra counts, and the differing pairs
+    """
+    def index(outputs):
+        indexed = {}
+        for position, output in enumerate(outputs):
+            value = output.get("value") or {}
+            indexed.setdefault((output.get("topic"), value.get("message_id") or position), []).append(value)
+        return indexed
+
+    recorded_index, replayed_index = index(recorded), index(replayed)
+    result = {"matched": 0, "differed": 0, "missing": 0, "extra": 0, "diffs": []}
+    for key, values in recorded_index.items():
+        others = replayed_index.get(key, [])
+        for position, value in enumerate(values):
+            if position >= len(others):
+                result["missing"] += 1
+            elif comparable(value) == comparable(others[position]):
+                result["matched"] += 1
+            else:
+                result["differed"] += 1
+                result["diffs"].append((key, value, others[position]))
+        result["extra"] += max(0, len(others) - len(values))
+    result["extra"] += sum(len(values) for key, values in replayed_index.items() if key not in recorded_index)
+    return result
+
+
+def print_diff(key, recorded, replayed):
+    print(f"--- {key[0]} {key[1]}")
+    recorded, replayed = comparable(recorded), comparable(replayed)
+    for name in sorted(set(recorded) | set(replayed)):
+        if recorded.get(name) != replayed.get(name):
+            print(f"  {name}:\n    recorded: {recorded.get(name)!r}\n    replayed: {replayed.get(name)!r}")
+
+
+def install_replay(calls, agent_backends):
+    """
+    Point an agent's client factories at the recording, with the fakes of
+    fakes.py behind it for unrecorded requests, Schema Registry and Kafka.
+
+    Returns:
+        tuple: (FakeBackends, OutputCollector)
+    """
+    from fakes import FakeBackends, install_fakes
+    from recording import RecordingSerializer
+
+    # The search agent's embedder doubles as the fake Titan model. Its directory
+    # goes after the agent's own, which must keep resolving the modules every
+    # agent ships a copy of (backends, delivery, metering, ...)
+    sys.path.append(AGENTS["search"]["dir"])
+    from embeddings import HashingEmbedder
+    embedder = HashingEmbedder()
+    fallback = FakeBackends(collections=build_collections(embedder), embedder=embedder)
+    install_fakes(fallback, agent_backends)
+
+    collector = OutputCollector()
+    serializer_factory = agent_backends._factories["avro_serializer"]
+    replayed = {
+        "bedrock_runtime": lambda region_name=None, config=None: ReplayBedrockRuntime(calls, fallback.bedrock),
+        "mongo_client": lambda uri: ReplayMongoClient(calls, fallback.mongo),
+        "sns_client": lambda: ReplaySNS(calls, fallback.sns),
+        "avro_serializer": lambda schema_registry_client, schema_str, to_dict=None: RecordingSerializer(
+            serializer_factory(schema_registry_client, schema_str, to_dict), to_dict, collector
+        ),
+    }
+    agent_backends.configure(**{name: factory for name, factory in replayed.items() if name in agent_backends.DEFAULTS})
+    return fallback, collector
+
+
+def replay(recording, args):
+    """Replay the capture in this process and return the result dict."""
+    config = AGENTS[recording.agent]
+    for name, value in AGENT_ENV.items():
+        os.environ.setdefault(name, value)
+    calls = ReplayCalls(recording, speed=args.speed, strict=args.strict)
+
+    sys.path.insert(0, config["dir"])
+    os.chdir(config["dir"])
+    import backends as agent_backends
+    fallback, collector = install_replay(calls, agent_backends)
+    module = __import__(config["module"])
+
+    # One lane per input partition, so a partition's batches keep their order
+    lanes = {}
+    for entry in recording.inputs:
+        lanes.setdefault((entry["topic"], entry["partition"]), []).append(entry)
+    first_t = recording.inputs[0]["t"] if recording.inputs else 0.0
+    latencies = []
+    lags = []
+    errors = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def run_lane(entries):
+        for entry in entries:
+            if args.speed > 0:
+                due = started + (entry["t"] - first_t) / args.speed / 1000
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                lag_ms = max(0.0, -delay * 1000)
+            else:
+                lag_ms = 0.0
+            batch_started = time.perf_counter()
+            try:
+                getattr(module, entry["entry"])(entry["event"], None)
+            except Exception as e:
+                with lock:
+                    errors.append(f"batch {entry['batch']}: {e}")
+            with lock:
+                latencies.append((time.perf_counter() - batch_started) * 1000)
+                lags.append(lag_ms)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency or max(1, len(lanes))) as executor:
+        for future in [executor.submit(run_lane, entries) for entries in lanes.values()]:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    comparison = compare_outputs(recording.outputs, collector.outputs)
+    if args.show_diffs:
+        for key, recorded, replayed in comparison["diffs"][:args.show_diffs]:
+            print_diff(key, recorded, replayed)
+    for error in errors[:10]:
+        print(f"Handler failed on {error}")
+
+    recorded_latencies = [entry["ms"] for entry in recording.inputs]
+    records = sum(len(entry["event"]) for entry in recording.inputs)
+    return {
+        "agent": recording.agent,
+        "batches": len(recording.inputs),
+        "records": records,
+        "speed": args.speed,
+        "elapsed_s": elapsed,
+        "throughput_rps": records / elapsed if elapsed else 0.0,
+        "batch_p50_ms": percentile(latencies, 0.50),
+        "batch_p95_ms": percentile(latencies, 0.95),
+        "batch_p99_ms": percentile(latencies, 0.99),
+        "recorded_batch_p50_ms": percentile(recorded_latencies, 0.50),
+        "recorded_batch_p95_ms": percentile(recorded_latencies, 0.95),
+        "max_lag_ms": max(lags, default=0.0),
+        "call_hits": calls.hits,
+        "call_misses": calls.misses,
+        "handler_errors": len(errors),
+        "responses": len(collector.outputs),
+        "matched": comparison["matched"],
+        "differed": comparison["differed"],
+        "missing": comparison["missing"],
+        "extra": comparison["extra"],
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured agent traffic without live services.")
+    parser.add_argument("recordings", nargs="+", help="Capture file(s) of one agent, from agent_worker.py --record")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Pace relative to the recording: 1 as recorded, 10 ten times faster, 0 no waits")
+    parser.add_argument("--concurrency", type=int, help="Partitions replayed in parallel (default: all)")
+    parser.add_argument("--strict", action="store_true", help="Fail calls the recording doesn't hold")
+    parser.add_argument("--show-diffs", type=int, default=0, metavar="N", help="Print the first N differing responses")
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON")
+    args = parser.parse_args()
+    if args.speed < 0:
+        parser.error("--speed must be 0 or more")
+
+    recording = Recording([os.path.abspath(path) for path in args.recordings])
+    if recording.agent is None:
+        parser.error("No capture header found; record with workers/agent_worker.py --record")
+    result = replay(recording, args)
+    if args.json:
+        print(json.dumps(result))
+        return
+    for name, value in result.items():
+        print(f"{name:<24}{value:.1f}" if isinstance(value, float) else f"{name:<24}{value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Synthetic `queries` traffic for the agent fleet.
+
+Questions are drawn from per-type template pools with a Zipfian distribution,
+so a handful of questions dominate the traffic the way leave-policy and
+benefits questions do in production. Each generated query is also turned into
+the record its agent receives (`search_embeddings`, `mongo_agent_input`,
+`scheduler_agent_input`) and grouped into Lambda-sink-connector-shaped batches.
+"""
+import json
+import os
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+
+SEED_DIR = os.path.join(os.path.dirname(__file__), "..", "terraform", "seed")
+
+POLICY_QUESTIONS = [
+    "What is the company's maternity leave policy?",
+    "How many PTO days do I get per year?",
+    "How many unused vacation days can I carry over?",
+    "Can I extend coverage of my healthcare benefits to family members?",
+    "When is the next public holiday?",
+    "Which holidays are observed in India in 2025?",
+    "Can I work remotely two days a week?",
+    "How do skill premiums work with the overall compensation structure?",
+    "What happens to my benefits during an international assignment?",
+    "Is relocation allowance provided for international assignments?",
+    "How is the annual performance bonus calculated?",
+    "What are the compliance requirements for subsidiaries?",
+    "How long is paternity leave in Europe?",
+    "What dental coverage is included in my health plan?",
+    "What does POL-LEAVE-NA-001 say about the probationary period?",
+    "Are public holidays in Brazil paid?",
+]
+
+EMPLOYEE_QUESTIONS = [
+    "Who is my manager?",
+    "What is my job title?",
+    "When did I join the company?",
+    "Tell me about employee {other_id}",
+    "What is the email address of employee {other_id}?",
+    "What is my current salary?",
+    "Which region am I based in?",
+    "Who is {other_id}'s manager?",
+]
+
+DEPARTMENT_QUESTIONS = [
+    "How many employees are in the Engineering department?",
+    "Where is the Finance department located?",
+    "Who heads the Human Resources department?",
+    "How many employees are in the Product department?",
+    "List everyone in the Engineering department",
+    "Where is my department located?",
+]
+
+SCHEDULING_QUESTIONS = [
+    "Schedule a 1:1 with my manager {attendee} next Tuesday at 10am",
+    "Set up a skip-level meeting with {attendee} next week",
+    "Book a 30 minute sync with {attendee} tomorrow afternoon",
+    "Schedule a team all-hands with {attendee} on Friday",
+    "Can you schedule a meeting with {attendee} to discuss my benefits during my international assignment?",
+]
+
+QUESTION_POOLS = {
+    "policy": POLICY_QUESTIONS,
+    "employee": EMPLOYEE_QUESTIONS,
+    "department": DEPARTMENT_QUESTIONS,
+    "scheduling": SCHEDULING_QUESTIONS,
+}
+
+DEFAULT_MIX = {"policy": 0.45, "employee": 0.25, "department": 0.15, "scheduling": 0.15}
+
+# Query type -> agent that the orchestrator routes it to
+QUERY_TYPE_AGENT = {
+    "policy": "search",
+    "employee": "sql",
+    "department": "sql",
+    "scheduling": "scheduler",
+}
+
+EMPLOYEE_IDS = ["E001", "E002", "E003", "E004", "E005", "E101", "E102", "E103", "E104", "E201", "E301"]
+
+
+def parse_mix(value):
+    """Parse ``policy=0.5,employee=0.2,...`` into a normalised mix."""
+    mix = {}
+    for part in value.split(","):
+        name, weight = part.split("=")
+        if name not in QUESTION_POOLS:
+            raise ValueError(f"Unknown query type: {name}")
+        mix[name] = float(weight)
+    total = sum(mix.values())
+    if total <= 0:
+        raise ValueError("The query mix needs at least one positive weight")
+    return {name: weight / total for name, weight in mix.items()}
+
+
+def zipf_weights(n, s):
+    return [1.0 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def load_employees():
+    with open(os.path.join(SEED_DIR, "employee.json")) as f:
+        return {employee["employee_id"]: employee for employee in json.load(f)}
+
+
+class WorkloadGenerator:
+    """
+    Generates `queries`-schema records.
+
+    Args:
+        mix (dict): Query type to share of traffic
+        zipf_s (float): Zipf exponent of the question repeat distribution;
+            higher values concentrate traffic on fewer questions
+        sessions (int): Number of concurrent conversation sessions
+        seed (int): Random seed, for reproducible runs
+    """
+    def __init__(self, mix=None, zipf_s=1.1, sessions=50, seed=7):
+        self.mix = mix or DEFAULT_MIX
+        self.random = random.Random(seed)
+        self.pool_weights = {name: zipf_weights(len(pool), zipf_s) for name, pool in QUESTION_POOLS.items()}
+        self.sessions = [
+            (f"sess-{index:04d}", self.random.choice(EMPLOYEE_IDS)) for index in range(sessions)
+        ]
+        self.clock = datetime(2025, 5, 8, 15, 0, tzinfo=timezone.utc)
+
+    def next_query(self):
+        query_type = self.random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        pool = QUESTION_POOLS[query_type]
+        template = self.random.choices(pool, weights=self.pool_weights[query_type])[0]
+        session_id, employee_id = self.random.choice(self.sessions)
+        other_id = self.random.choice(EMPLOYEE_IDS)
+        message = template.format(other_id=other_id, attendee=f"{other_id.lower()}@company.com")
+        self.clock += timedelta(milliseconds=self.random.randint(5, 200))
+
+        return query_type, {
+            "message_id": str(uuid.UUID(int=self.random.getrandbits(128))),
+            "employee_id": employee_id,
+            "user_email": f"{employee_id.lower()}@company.com",
+            "session_id": session_id,
+            "message": message,
+            "timestamp": int(self.clock.timestamp() * 1000),
+        }
+
+    def generate(self, count):
+        return [self.next_query() for _ in range(count)]
+
+
+def to_agent_input(query_type, query, embed=None):
+    """
+    Shape a `queries` record into the input record of the agent it routes to,
+    as the orchestrator's Flink statements would.
+
+    Args:
+        query_type (str): Query type the record was generated as
+        query (dict): `queries` record
+        embed (callable): Text to embedding, required for search records
+    """
+    agent = QUERY_TYPE_AGENT[query_type]
+    record = dict(query, query=query["message"])
+    if agent == "search":
+        record["query_embedding"] = embed(query["message"])
+    elif agent == "sql":
+        record["source"] = "web"
+    elif agent == "scheduler":
+        start = datetime.fromtimestamp(query["timestamp"] / 1000, tz=timezone.utc) + timedelta(days=1)
+        attendees = [word.strip("?,.") for word in query["message"].split() if "@" in word]
+        record.update({
+            "title": "Meeting requested via assistant",
+            "description": query["message"],
+            "location": "Virtual",
+            "start": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "end": (start + timedelta(minutes=30)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "attendees": attendees or [query["user_email"]],
+        })
+    return agent, record
+
+
+def connector_batches(records, batch_size):
+    """Group records into the event shape the AWS Lambda Sink Connector invokes handlers with."""
+    for start in range(0, len(records), batch_size):
+        yield [{"payload": {"value": record}} for record in records[start:start + batch_size]]
@@ -142,6 +142,31 @@ resource "aws_sns_topic" "gameday_sns_topic" {
   name = "gameday-sns-topic-new_${random_string.random.id}"
 }
 
+# The agents mostly wait on Bedrock, Atlas, SNS and Kafka, so memory beyond their
+# peak RSS (and the CPU that comes with it) doesn't make them much faster. The
+# `python benchmarks/bench_agents.py --agent <agent> --memory-profile` peaks, with
+# the clients the fakes replace added back, are only estimates:
+#   search      38.7 MB + boto3 31.6 MB + pymongo 15.4 MB  =  86 MB
+#   scheduler   46.8 MB + Google calendar client 27.3 MB   =  74 MB
+#   sql        100.5 MB + boto3 31.6 MB                    = 132 MB
+# They leave out the real Kafka producer's buffers, full-size Bedrock responses,
+# and, for the search agent, numpy with the mmap vector store and BM25 index of
+# VECTOR_BACKEND=local. Lambda also sizes CPU with memory, and 128 MB gets the
+# smallest share. The defaults stay at a conservative 512 MB until `Max Memory Used`
+# has been checked on the deployed functions; lower them from that figure.
+# The SQL agent has no Lambda resource here; size it the same way wherever it is deployed.
+variable "scheduler_agent_memory_mb" {
+  description = "Memory of the scheduler agent Lambda, in MB"
+  type        = number
+  default     = 512
+}
+
+variable "search_agent_memory_mb" {
+  description = "Memory of the search agent Lambda, in MB"
+  type        = number
+  default     = 512
+}
+
 resource "aws_lambda_function" "scheduler_agent" {
   function_name = "scheduler_agent_${random_string.random.id}"
   role          = aws_iam_role.lambda_exec_role.arn
@@ -149,7 +174,7 @@ resource "aws_lambda_function" "scheduler_agent" {
   runtime       = "python3.13"
   filename      = data.archive_file.scheduler_agent_lambda.output_path
   timeout       = 900
-  memory_size   = 10240
+  memory_size   = var.scheduler_agent_memory_mb
   ephemeral_storage {
     size = 10240
   }
@@ -181,7 +206,7 @@ resource "aws_lambda_function" "search_agent" {
   runtime       = "python3.12"
   filename      = data.archive_file.search_agent_lambda.output_path
   timeout       = 900
-  memory_size   = 10240
+  memory_size   = var.search_agent_memory_mb
   ephemeral_storage {
     size = 10240
   }
@@ -210,3 +235,32 @@ resource "aws_cloudwatch_log_group" "lambda_log_group_search_agent" {
   name              = "/aws/lambda/${aws_lambda_function.search_agent.function_name}"
   retention_in_days = 14
 }
+
+resource "aws_lambda_function" "embedding_service" {
+  function_name    = "embedding_service_${random_string.random.id}"
+  role             = aws_iam_role.lambda_exec_role.arn
+  handler          = "embedding_service.lambda_handler"
+  runtime          = "python3.12"
+  filename         = data.archive_file.search_agent_lambda.output_path
+  timeout          = 300
+  memory_size      = 1024
+  source_code_hash = filebase64sha256(data.archive_file.search_agent_lambda.output_path)
+  layers           = [aws_lambda_layer_version.search_agent_layer.arn]
+  environment {
+    variables = {
+      BOOTSTRAP_ENDPOINT         = confluent_kafka_cluster.default.bootstrap_endpoint
+      KAFKA_API_KEY              = confluent_api_key.cluster-api-key.id
+      KAFKA_API_SECRET           = confluent_api_key.cluster-api-key.secret
+      SCHEMA_REGISTRY_API_KEY    = confluent_api_key.schema-registry-api-key.id
+      SCHEMA_REGISTRY_API_SECRET = confluent_api_key.schema-registry-api-key.secret
+      SCHEMA_REGISTRY_ENDPOINT   = data.confluent_schema_registry_cluster.default.rest_endpoint
+      search_embeddings_topic    = "search_embeddings_packed"
+      EMBEDDING_MODEL_ID         = "amazon.titan-embed-text-v1"
+    }
+  }
+}
+
+resource "aws_cloudwatch_log_group" "lambda_log_group_embedding_service" {
+  name              = "/aws/lambda/${aws_lambda_function.embedding_service.function_name}"
+  retention_in_days = 14
+}
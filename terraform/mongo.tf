@@ -132,6 +132,14 @@ resource "mongodbatlas_search_index" "default" {
         "path": "contentEmbedding",
         "numDimensions": 1536,
         "similarity": "cosine"
+    },
+    {
+        "type": "filter",
+        "path": "region"
+    },
+    {
+        "type": "filter",
+        "path": "category"
     }]
     EOF
   depends_on      = [null_resource.seed_mongodb_knowledge]
@@ -51,3 +51,119 @@ resource "confluent_kafka_topic" "scheduler_agent_response" {
   }
 }
 
+
+# Output of the embedding service Lambda. Its query_embedding is packed float32
+# bytes, so it can't share a schema subject with the Flink search_embeddings
+# table (an array of doubles, as VECTOR_SEARCH_AGG expects)
+resource "confluent_kafka_topic" "search_embeddings_packed" {
+  kafka_cluster {
+    id = confluent_kafka_cluster.default.id
+  }
+  topic_name       = "search_embeddings_packed"
+  rest_endpoint    = confluent_kafka_cluster.default.rest_endpoint
+  partitions_count = 1
+  credentials {
+    key    = confluent_api_key.cluster-api-key.id
+    secret = confluent_api_key.cluster-api-key.secret
+  }
+
+  lifecycle {
+    prevent_destroy = false
+  }
+}
+
+# Retry tiers and dead-letter topics for failed agent records (see retry_pipeline.py
+# in each agent). The tier delays must match RETRY_TIERS_SECONDS. Only
+# `workers/agent_worker.py --agent <agent> --retries` replays the tiers; no
+# connector is created for them, so run that worker next to the Lambdas.
+locals {
+  agent_input_topics  = ["search_embeddings", "search_embeddings_packed", "mongo_agent_input", "scheduler_agent_input"]
+  retry_tiers_seconds = [30, 300, 1800]
+  agent_failure_topics = concat(
+    flatten([for topic in local.agent_input_topics : [for delay in local.retry_tiers_seconds : "${topic}-retry-${delay}s"]]),
+    [for topic in local.agent_input_topics : "${topic}-dlq"]
+  )
+}
+
+resource "confluent_kafka_topic" "agent_failures" {
+  for_each = toset(local.agent_failure_topics)
+
+  kafka_cluster {
+    id = confluent_kafka_cluster.default.id
+  }
+  topic_name       = each.value
+  rest_endpoint    = confluent_kafka_cluster.default.rest_endpoint
+  partitions_count = 1
+  config = {
+    # Dead letters are kept for inspection and replay; retry tiers only need to outlive their delay
+    "retention.ms" = endswith(each.value, "-dlq") ? "2592000000" : "604800000"
+  }
+  credentials {
+    key    = confluent_api_key.cluster-api-key.id
+    secret = confluent_api_key.cluster-api-key.secret
+  }
+
+  lifecycle {
+    prevent_destroy = false
+  }
+}
+
+# Front door of the precomputed answer service (answers/answer_service.py):
+# queries arrive on queries_intake, frequent ones are answered on
+# precomputed_answers and the rest are forwarded to queries
+resource "confluent_kafka_topic" "precomputed_answers" {
+  for_each = toset(["queries_intake", "precomputed_answers"])
+
+  kafka_cluster {
+    id = confluent_kafka_cluster.default.id
+  }
+  topic_name       = each.value
+  rest_endpoint    = confluent_kafka_cluster.default.rest_endpoint
+  partitions_count = 1
+  credentials {
+    key    = confluent_api_key.cluster-api-key.id
+    secret = confluent_api_key.cluster-api-key.secret
+  }
+
+  lifecycle {
+    prevent_destroy = false
+  }
+}
+
+# Streamed final responses of answers/final_response_service.py, keyed by
+# session_id (one record per chunk, the last one with is_final set)
+resource "confluent_kafka_topic" "final_response_chunks" {
+  kafka_cluster {
+    id = confluent_kafka_cluster.default.id
+  }
+  topic_name       = "final_response_chunks"
+  rest_endpoint    = confluent_kafka_cluster.default.rest_endpoint
+  partitions_count = 1
+  credentials {
+    key    = confluent_api_key.cluster-api-key.id
+    secret = confluent_api_key.cluster-api-key.secret
+  }
+
+  lifecycle {
+    prevent_destroy = false
+  }
+}
+
+# Per-agent, per-query-type token and cost roll-ups (see metering.py in the
+# search and SQL agents)
+resource "confluent_kafka_topic" "agent_usage" {
+  kafka_cluster {
+    id = confluent_kafka_cluster.default.id
+  }
+  topic_name       = "agent_usage"
+  rest_endpoint    = confluent_kafka_cluster.default.rest_endpoint
+  partitions_count = 1
+  credentials {
+    key    = confluent_api_key.cluster-api-key.id
+    secret = confluent_api_key.cluster-api-key.secret
+  }
+
+  lifecycle {
+    prevent_destroy = false
+  }
+}
@@ -0,0 +1,570 @@
+"""
+Long-running Kafka consumer for an agent, as an alternative to the AWS Lambda
+Sink Connector.
+
+    python workers/agent_worker.py --agent search --concurrency 8
+    python workers/agent_worker.py --agent sql --processes 4
+    python workers/agent_worker.py --agent search --retries
+    python workers/agent_worker.py --agent search --speculative
+    python workers/agent_worker.py --agent sql --exactly-once
+    python workers/agent_worker.py --agent search --record captures/search.jsonl.gz
+    python workers/agent_worker.py --agent search --asyncio
+
+The worker joins a consumer group on the agent's input topic, deserializes
+records with Schema Registry, and hands them to the agent's existing
+``lambda_handler`` in the same ``[{'payload': {'value': record}}]`` shape the
+connector uses. Partitions are processed concurrently on a thread pool, with
+records of one partition handled in order. Offsets are committed only after
+the handler has returned (the handlers flush their producer before
+returning), so a crash replays uncommitted records instead of losing them.
+A batch whose handler still fails after ``--max-retries`` attempts has its
+records routed to their next retry tier or the dead-letter topic before its
+offsets are committed. If even that fails, the partition is paused at the
+batch and nothing after it is committed until the partition is reassigned.
+
+With ``--retries`` the worker consumes the agent's retry tiers instead
+(see retry_pipeline.py in each agent): each record waits until its backoff
+delay has passed and is then handed to the handler with its attempt count,
+so a further failure moves it to the next tier or the dead-letter topic.
+
+With ``--speculative`` the worker also consumes the ``queries`` topic
+(``QUERIES_TOPIC``) and runs the agent's ``speculate_handler`` on it, in
+parallel with the orchestrator's routing. The side-effect-free part of the
+agent's work (search retrieval, the requesting employee's context) is stored
+under the query's ``message_id`` (see speculation.py in each agent) and taken
+by the routed record. Only the search and SQL agents speculate; the
+scheduler's work has side effects and always waits for routing. Set
+``SPECULATIVE_DISPATCH=true`` for the handlers to use the results, and
+``SPECULATIVE_STORE=sqlite`` when several processes share the work.
+
+With ``--exactly-once`` (which also sets ``EXACTLY_ONCE=true``) each batch
+runs in a Kafka transaction on a producer owned by its input partition. The
+agent's responses and retry-tier records commit atomically with the batch's
+input offsets (see delivery.py in each agent). A retried or replayed batch
+therefore aborts its earlier writes instead of producing duplicates.
+
+With ``--record`` the worker also captures what it consumes, the Bedrock,
+Mongo and SNS calls the agent makes and the responses it produces (see
+recording.py), for benchmarks/replay.py to replay without live services.
+
+With ``--asyncio`` the worker hands batches to the agent's
+``async_handler.lambda_handler`` instead (see aio.py in each agent), which
+runs a batch's records concurrently on one event loop per process with
+asyncio Mongo, AWS and Kafka clients. The recorders only wrap the
+synchronous clients, so ``--record`` needs the default handler.
+
+Module-level state (the SQL agent, Mongo client, lexical index and producers)
+stays warm for the lifetime of the process. Per-key caches (see partitioning.py
+in each agent) are tagged with the partition being processed and dropped
+when that partition is revoked. ``--processes`` starts several
+such processes in the same consumer group for CPU-bound agents.
+
+Uses the same environment variables as the agent Lambdas, plus
+``WORKER_GROUP_ID`` (defaults to ``<agent>-agent-worker``,
+``<agent>-agent-retry-worker`` with ``--retries``, or
+``<agent>-agent-speculative-worker`` with ``--speculative``).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+AGENTS = {
+    "search": {
+        "dir": os.path.join(ROOT_DIR, "agents", "search_agent", "source_code"),
+        "module": "lambda_function",
+        "input_topic": "search_embeddings",
+        "max_batch": 10,
+        "speculate": "speculate_handler",
+    },
+    "sql": {
+        "dir": os.path.join(ROOT_DIR, "agents", "sql_agent", "source_code"),
+        "module": "main",
+        "input_topic": "mongo_agent_input",
+        "max_batch": 10,
+        "init": "initialize_resources",
+        "speculate": "speculate_handler",
+    },
+    "scheduler": {
+        "dir": os.path.join(ROOT_DIR, "agents", "scheduler_agent", "source-code"),
+        "module": "lambda_function",
+        "input_topic": "scheduler_agent_input",
+        "max_batch": 10,
+    },
+}
+
+# Pause fetching once this many records are waiting per worker thread
+BACKLOG_PER_THREAD = 100
+
+
+def to_connector_value(value):
+    """Convert Avro-deserialized values to the JSON-friendly form the connector delivers."""
+    if isinstance(value, dict):
+        return {key: to_connector_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [to_connector_value(item) for item in value]
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def load_handler(agent, entry="lambda_handler", module=None):
+    """Import the agent module (or ``module``) from its source directory and run its one-off initialisation."""
+    config = AGENTS[agent]
+    sys.path.insert(0, config["dir"])
+    # The scheduler agent opens its schema file by relative path
+    os.chdir(config["dir"])
+    module = __import__(module or config["module"])
+    if config.get("init"):
+        getattr(module, config["init"])()
+    return getattr(module, entry)
+
+
+def build_consumer(topics, group_id, on_assign, on_revoke, retries=False, read_committed=False):
+    """Consumer for the agent's Avro input topic, or for its JSON retry tiers."""
+    from confluent_kafka import DeserializingConsumer
+    from confluent_kafka.schema_registry import SchemaRegistryClient
+    from confluent_kafka.schema_registry.avro import AvroDeserializer
+
+    conf = {
+        'bootstrap.servers': os.getenv("BOOTSTRAP_ENDPOINT"),
+        'sasl.mechanisms': 'PLAIN',
+        'security.protocol': 'SASL_SSL',
+        'sasl.username': os.getenv("KAFKA_API_KEY"),
+        'sasl.password': os.getenv("KAFKA_API_SECRET"),
+        'group.id': group_id,
+        'auto.offset.reset': 'earliest',
+        'enable.auto.commit': False,
+    }
+    if read_committed:
+        conf['isolation.level'] = 'read_committed'
+    if retries:
+        conf['value.deserializer'] = lambda value, ctx: json.loads(value)
+    else:
+        schema_registry_client = SchemaRegistryClient({
+            'url': os.getenv("SCHEMA_REGISTRY_ENDPOINT"),
+            'basic.auth.user.info': f"{os.getenv('SCHEMA_REGISTRY_API_KEY')}:{os.getenv('SCHEMA_REGISTRY_API_SECRET')}"
+        })
+        conf['value.deserializer'] = AvroDeserializer(schema_registry_client)
+    consumer = DeserializingConsumer(conf)
+    consumer.subscribe(topics, on_assign=on_assign, on_revoke=on_revoke)
+    return consumer
+
+
+class AgentWorker:
+    """
+    Consumes one agent's input topic and runs its handler, one in-flight batch per partition.
+
+    Args:
+        agent (str): Agent name, a key of AGENTS
+        handler (callable): The agent's lambda_handler
+        concurrency (int): Partitions processed in parallel
+        max_batch (int): Records per handler call
+        max_retries (int): Handler retries per batch before its records are routed to the retry tiers
+        commit_interval (float): Seconds between offset commits
+        retries (bool): Consume retry-tier envelopes instead of input records
+        speculative_handlers (dict): Handler by topic for speculative work, e.g. {"queries": speculate_handler}
+        exactly_once (bool): Run each batch in a transaction together with its input offsets
+    """
+    def __init__(self, agent, handler, concurrency=8, max_batch=10, max_retries=3, commit_interval=1.0,
+                 retries=False, speculative_handlers=None, exactly_once=False):
+        self.agent = agent
+        self.handler = handler
+        self.retries = retries
+        self.speculative_handlers = speculative_handlers or {}
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        self.commit_interval = commit_interval
+        self.max_backlog = concurrency * BACKLOG_PER_THREAD
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"{agent}-worker")
+        self.backlog = {}
+        self.in_flight = {}
+        self.done_offsets = {}
+        self.paused = False
+        self.running = True
+        self.consumer = None
+        self.group_id = None
+        # The agent's partitioning module, for partition-affine caches
+        self.partitioning = None
+        # The agent's delivery module and a transactional producer per input partition
+        self.exactly_once = exactly_once
+        self.delivery = None
+        self.transactions = {}
+        # The agent's retry_pipeline module, and partitions held at a batch it could not route
+        self.retry_pipeline = None
+        self.stalled = set()
+        # RecordingWriter capturing the traffic, with --record
+        self.recorder = None
+
+    def stop(self, *_):
+        self.running = False
+
+    def to_event(self, messages):
+        """
+        Connector-shaped event for a batch; retry envelopes are held until
+        their delay has passed. Returns None if the worker stops meanwhile.
+        """
+        if not self.retries:
+            return [{'payload': {'value': to_connector_value(message.value())}} for message in messages]
+
+        envelopes = [message.value() for message in messages]
+        # A tier has a single delay, so its records become due in offset order
+        due = max(envelope.get('not_before') or 0 for envelope in envelopes) / 1000
+        while time.time() < due:
+            if not self.running:
+                return None
+            time.sleep(min(1.0, due - time.time()))
+        return [{'payload': {'value': envelope['record'], 'attempt': envelope['attempt']}} for envelope in envelopes]
+
+    def process(self, messages):
+        """
+        Run the handler on one partition's batch, retrying with backoff.
+        Returns the next offset to commit, or None if nothing was processed.
+        """
+        event = self.to_event(messages)
+        if event is None:
+            return None
+        if self.partitioning is not None and not self.retries:
+            self.partitioning.current_partition.set((messages[0].topic(), messages[0].partition()))
+        # Speculative handlers log their own failures; the routed record redoes the work
+        handler = self.speculative_handlers.get(messages[0].topic())
+        speculative = handler is not None
+        attempts = 1 if speculative else self.max_retries + 1
+        handler = handler or self.handler
+        recorded_at = self.recorder.elapsed_ms() if self.recorder is not None else None
+        if self.exactly_once:
+            offset = self.process_transaction(messages, event, handler, attempts, speculative)
+        else:
+            offset = self.process_batch(messages, event, handler, attempts, speculative)
+        if self.recorder is not None:
+            self.recorder.input(messages, event, handler.__name__, recorded_at,
+                                self.recorder.elapsed_ms() - recorded_at)
+        return offset
+
+    def process_batch(self, messages, event, handler, attempts, speculative=False):
+        for attempt in range(attempts):
+            try:
+                self.run_handler(handler, event)
+                break
+            except Exception as e:
+                if attempt == attempts - 1:
+                    if not speculative and not self.route_failed(messages, event, attempt, e):
+                        return None
+                    break
+                time.sleep(min(0.5 * 2 ** attempt, 10))
+        return messages[-1].offset() + 1
+
+    def run_handler(self, handler, event):
+        response = handler(event, None)
+        if isinstance(response, dict) and response.get('statusCode', 200) >= 500:
+            raise RuntimeError(f"Handler returned {response.get('statusCode')}: {response.get('body')}")
+
+    def route_failed(self, messages, event, attempt, error):
+        """
+        Send the records of a batch that kept failing to their next retry tier
+        (or the dead-letter topic), so its offsets can be committed.
+
+        Returns:
+            bool: False if they could not be routed; the partition is then
+                stalled at this batch, uncommitted, until it is reassigned
+        """
+        topic, partition = messages[0].topic(), messages[0].partition()
+        print(f"Routing {len(event)} record(s) from {topic} [{partition}] at offset "
+              f"{messages[0].offset()} for retry after {attempt + 1} attempts: {error}")
+        try:
+            for record in event:
+                self.retry_pipeline.route_failure(
+                    record['payload']['value'], error, AGENTS[self.agent]["input_topic"], self.agent,
+                    record['payload'].get('attempt', 0)
+                )
+            return True
+        except Exception as e:
+            print(f"Could not route the batch, holding {topic} [{partition}] at offset {messages[0].offset()}: {e}")
+            self.stalled.add((topic, partition))
+            return False
+
+    def process_transaction(self, messages, event, handler, attempts, speculative=False):
+        """
+        Run the handler inside a transaction that also commits the batch's input offsets.
+        A failed attempt is aborted, so its writes never reach read_committed consumers.
+        Returns None: the offsets are committed by the transaction, not by commit().
+        """
+        from confluent_kafka import TopicPartition
+
+        topic, partition = messages[0].topic(), messages[0].partition()
+        producer = self.transactions.get((topic, partition))
+        if producer is None:
+            producer = self.delivery.transactional_producer(f"{self.group_id}-{topic}-{partition}")
+            self.transactions[(topic, partition)] = producer
+        offsets = [TopicPartition(topic, partition, messages[-1].offset() + 1)]
+
+        for attempt in range(attempts):
+            producer.begin_transaction()
+            token = self.delivery.current_transaction.set(producer)
+            try:
+                self.run_handler(handler, event)
+                producer.send_offsets_to_transaction(offsets, self.consumer.consumer_group_metadata())
+                producer.commit_transaction()
+                return None
+            except Exception as e:
+                producer.abort_transaction()
+                if attempt == attempts - 1:
+                    error = e
+                    break
+                time.sleep(min(0.5 * 2 ** attempt, 10))
+            finally:
+                self.delivery.current_transaction.reset(token)
+
+        # The records' retry envelopes commit together with the offsets that move past them
+        producer.begin_transaction()
+        token = self.delivery.current_transaction.set(producer)
+        try:
+            if not speculative and not self.route_failed(messages, event, attempt, error):
+                producer.abort_transaction()
+                return None
+            producer.send_offsets_to_transaction(offsets, self.consumer.consumer_group_metadata())
+            producer.commit_transaction()
+        finally:
+            self.delivery.current_transaction.reset(token)
+        return None
+
+    def finish(self, partition, future):
+        offset = future.result()
+        if offset is not None:
+            self.done_offsets[partition] = offset
+
+    def dispatch(self):
+        """Collect finished batches and start the next batch of every idle partition."""
+        from confluent_kafka import TopicPartition
+
+        for partition, future in list(self.in_flight.items()):
+            if future.done():
+                self.finish(partition, future)
+                del self.in_flight[partition]
+                if partition in self.stalled:
+                    # Nothing after the unrouted batch is processed or committed
+                    self.consumer.pause([TopicPartition(*partition)])
+                    self.backlog.pop(partition, None)
+        for partition, queued in self.backlog.items():
+            if queued and partition not in self.in_flight and partition not in self.stalled:
+                batch = [queued.popleft() for _ in range(min(self.max_batch, len(queued)))]
+                self.in_flight[partition] = self.executor.submit(self.process, batch)
+
+    def commit(self, partitions=None):
+        from confluent_kafka import TopicPartition
+
+        offsets = [
+            TopicPartition(topic, partition, offset)
+            for (topic, partition), offset in self.done_offsets.items()
+            if partitions is None or (topic, partition) in partitions
+        ]
+        if offsets:
+            self.consumer.commit(offsets=offsets, asynchronous=False)
+            for offset in offsets:
+                self.done_offsets.pop((offset.topic, offset.partition), None)
+
+    def on_assign(self, consumer, partitions):
+        print(f"Assigned {[(p.topic, p.partition) for p in partitions]}")
+
+    def on_revoke(self, consumer, partitions):
+        """Finish in-flight work of revoked partitions and commit it; queued records go to the new owner."""
+        revoked = {(p.topic, p.partition) for p in partitions}
+        for partition in revoked:
+            future = self.in_flight.pop(partition, None)
+            if future is not None:
+                self.finish(partition, future)
+            self.backlog.pop(partition, None)
+        self.commit(revoked)
+        # The new owner starts again from the unrouted batch
+        self.stalled -= revoked
+        for partition in revoked:
+            producer = self.transactions.pop(partition, None)
+            if producer is not None:
+                producer.flush()
+        dropped = self.partitioning.evict_partitions(revoked) if self.partitioning is not None else 0
+        print(f"Revoked {sorted(revoked)}, dropped {dropped} affinity cache entries")
+
+    def backlog_size(self):
+        return sum(len(queued) for queued in self.backlog.values())
+
+    def run(self, topics, group_id):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.group_id = group_id
+        self.consumer = build_consumer(topics, group_id, self.on_assign, self.on_revoke, retries=self.retries,
+                                       read_committed=self.exactly_once)
+        last_commit = time.time()
+        try:
+            while self.running:
+                message = self.consumer.poll(0.1 if self.in_flight else 1.0)
+                while message is not None:
+                    if message.error():
+                        print(f"Consumer error: {message.error()}")
+                    else:
+                        partition = (message.topic(), message.partition())
+                        self.backlog.setdefault(partition, deque()).append(message)
+                    if self.backlog_size() >= self.max_backlog:
+                        break
+                    message = self.consumer.poll(0)
+
+                self.dispatch()
+
+                # Backpressure: stop fetching while the thread pool is behind
+                backlog = self.backlog_size()
+                if not self.paused and backlog >= self.max_backlog:
+                    self.consumer.pause(self.consumer.assignment())
+                    self.paused = True
+                elif self.paused and backlog < self.max_backlog // 2:
+                    self.consumer.resume([
+                        partition for partition in self.consumer.assignment()
+                        if (partition.topic, partition.partition) not in self.stalled
+                    ])
+                    self.paused = False
+
+                if time.time() - last_commit >= self.commit_interval:
+                    self.commit()
+                    last_commit = time.time()
+        finally:
+            print("Shutting down: finishing in-flight batches")
+            for partition, future in self.in_flight.items():
+                self.finish(partition, future)
+            self.executor.shutdown(wait=True)
+            self.commit()
+            self.consumer.close()
+            if self.partitioning is not None:
+                for stats in self.partitioning.cache_stats():
+                    print(f"Affinity cache {stats['name']}: {stats['entries']} entries, "
+                          f"hit rate {stats['hit_rate']:.1%}")
+
+
+def start_recording(agent, path):
+    """
+    Record the agent's batches, external calls and responses to ``path``
+    (see recording.py). Must run before the agent module is imported, so
+    every client it creates is wrapped.
+    """
+    from recording import RecordingWriter, install_recorder
+
+    sys.path.insert(0, AGENTS[agent]["dir"])
+    import backends
+    writer = RecordingWriter(path, agent)
+    install_recorder(writer, backends)
+    return writer
+
+
+def process_path(path):
+    """``path`` with the process id before its extension, one recording per process of the group."""
+    name, extension = os.path.splitext(path)
+    if extension == ".gz":
+        name, inner = os.path.splitext(name)
+        extension = inner + extension
+    return f"{name}.{os.getpid()}{extension}"
+
+
+def run_worker(agent, args):
+    config = AGENTS[agent]
+    recorder = None
+    if args.record:
+        recorder = start_recording(agent, process_path(args.record) if args.processes > 1 else args.record)
+    handler = load_handler(agent, module="async_handler" if args.asyncio else None)
+    worker = AgentWorker(
+        agent,
+        handler,
+        concurrency=args.concurrency,
+        max_batch=args.max_batch or config["max_batch"],
+        max_retries=args.max_retries,
+        commit_interval=args.commit_interval,
+        retries=args.retries,
+        exactly_once=args.exactly_once,
+    )
+    worker.recorder = recorder
+    if args.speculative:
+        queries_topic = os.getenv("QUERIES_TOPIC", "queries")
+        worker.speculative_handlers = {queries_topic: load_handler(agent, config["speculate"])}
+    import delivery
+    import partitioning
+    import retry_pipeline
+    worker.delivery = delivery
+    worker.partitioning = partitioning
+    worker.retry_pipeline = retry_pipeline
+    if args.retries:
+        # Imported from the agent's directory, which load_handler put on sys.path
+        topics = retry_pipeline.retry_topics(config["input_topic"])
+        group_id = os.getenv("WORKER_GROUP_ID", f"{agent}-agent-retry-worker")
+    elif args.speculative:
+        topics = [config["input_topic"], *worker.speculative_handlers]
+        group_id = os.getenv("WORKER_GROUP_ID", f"{agent}-agent-speculative-worker")
+    else:
+        topics = [config["input_topic"]]
+        group_id = os.getenv("WORKER_GROUP_ID", f"{agent}-agent-worker")
+    try:
+        worker.run(topics, group_id)
+    finally:
+        if recorder is not None:
+            recorder.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an agent as a long-lived Kafka consumer.")
+    parser.add_argument("--agent", choices=sorted(AGENTS), required=True)
+    parser.add_argument("--concurrency", type=int, default=8, help="Partitions processed in parallel per process")
+    parser.add_argument("--processes", type=int, default=1, help="Consumer processes in the group")
+    parser.add_argument("--max-batch", type=int, help="Records per handler call (default depends on the agent)")
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--commit-interval", type=float, default=1.0, help="Seconds between offset commits")
+    parser.add_argument("--retries", action="store_true", help="Consume the agent's retry tiers instead of its input")
+    parser.add_argument("--speculative", action="store_true",
+                        help="Also run the agent's side-effect-free work on queries, in parallel with routing")
+    parser.add_argument("--exactly-once", action="store_true",
+                        help="Produce each batch's responses in a transaction with its input offsets")
+    parser.add_argument("--record", metavar="PATH",
+                        help="Capture batches, external calls and responses for benchmarks/replay.py "
+                             "(.jsonl or .jsonl.gz; one file per process with --processes)")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="Run the agent's async_handler: a batch's records concurrently on an event loop")
+    args = parser.parse_args()
+    if args.asyncio and args.record:
+        parser.error("--record captures the synchronous clients; record without --asyncio")
+    if args.speculative and args.retries:
+        parser.error("--speculative and --retries are separate workers")
+    if args.speculative and "speculate" not in AGENTS[args.agent]:
+        parser.error(f"The {args.agent} agent has side effects and does not speculate")
+    if args.exactly_once:
+        # Read by the agent modules at import time, here and in spawned processes
+        os.environ["EXACTLY_ONCE"] = "true"
+    if args.agent == "scheduler" and args.concurrency > 1:
+        # Concurrent batches share the scheduler's notification window (see notifications.py)
+        os.environ.setdefault("NOTIFY_FLUSH_PER_BATCH", "false")
+
+    if args.processes == 1:
+        run_worker(args.agent, args)
+        return
+
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=run_worker, args=(args.agent, args)) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+
+    def forward(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""
+Capture of an agent's production traffic for replay.
+
+    python workers/agent_worker.py --agent search --record captures/search.jsonl.gz
+
+With ``--record`` the worker writes one line-delimited JSON file (gzipped
+when the path ends in ``.gz``) holding, in the order they happened:
+
+- ``input``: every connector-shaped batch handed to a handler, with its
+  topic, partition, offsets, the handler that ran it and how long it took;
+- ``bedrock``, ``mongo``, ``sns``: every external call the agent made, keyed
+  by a hash of the request, with the response and the call's latency;
+- ``output``: every record the agent serialized for a response topic, as the
+  dict given to the Avro serializer.
+
+Each line carries ``t``, milliseconds since the capture started, so
+benchmarks/replay.py can feed the batches back at the recorded pace and
+serve each call after its recorded latency. The recorders wrap the clients
+the agent gets from its ``backends`` module; nothing else in the agent
+changes. Recordings hold production questions, answers and employee records:
+store them like the topics they were captured from.
+"""
+import base64
+import gzip
+import hashlib
+import json
+import threading
+import time
+
+RECORDING_VERSION = 1
+
+# Collection methods whose results are recorded; other methods are passed through
+MONGO_READS = ("find", "find_one", "aggregate", "count_documents", "distinct")
+
+
+def _canonical(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def bedrock_key(model_id, body):
+    """Recording key of an ``invoke_model`` request, the same hash the SQL agent's governor coalesces on."""
+    body = body or ""
+    body_bytes = body.encode() if isinstance(body, str) else bytes(body)
+    return hashlib.sha256(str(model_id).encode() + b"\0" + body_bytes).hexdigest()
+
+
+def mongo_key(db_name, collection_name, operation, args, kwargs):
+    """Recording key of a collection read."""
+    return hashlib.sha256(_canonical([db_name, collection_name, operation, list(args), kwargs]).encode()).hexdigest()
+
+
+def sns_key(operation, kwargs):
+    """Recording key of an SNS call; batch entry ids are left out, they only number the entries."""
+    if operation == "publish_batch":
+        kwargs = dict(kwargs, PublishBatchRequestEntries=[
+            {name: value for name, value in entry.items() if name != "Id"}
+            for entry in kwargs.get("PublishBatchRequestEntries") or []
+        ])
+    return hashlib.sha256(_canonical([operation, kwargs]).encode()).hexdigest()
+
+
+def encode_bytes(payload):
+    """JSON-safe form of a response body: text when it is UTF-8, else base64."""
+    try:
+        return {"text": payload.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"base64": base64.b64encode(payload).decode("ascii")}
+
+
+def decode_bytes(encoded):
+    if "base64" in encoded:
+        return base64.b64decode(encoded["base64"])
+    return encoded["text"].encode("utf-8")
+
+
+def open_recording(path, mode="rt"):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8")
+    return open(path, mode.replace("t", ""), encoding="utf-8")
+
+
+def read_recording(path):
+    """Yield the entries of a recording in the order they were written."""
+    with open_recording(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class RecordingWriter:
+    """
+    Thread-safe writer of a recording file.
+
+    Args:
+        path (str): Output file; gzipped when it ends in ``.gz``
+        agent (str): Agent being recorded
+    """
+    def __init__(self, path, agent):
+        self.path = path
+        self.agent = agent
+        self.file = open_recording(path, "wt")
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.batches = 0
+        self.write("header", version=RECORDING_VERSION, agent=agent, started_at=int(time.time() * 1000))
+
+    def elapsed_ms(self):
+        return (time.monotonic() - self.started) * 1000
+
+    def write(self, kind, t=None, **fields):
+        line = _canonical(dict(fields, kind=kind, t=round(self.elapsed_ms() if t is None else t, 3)))
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(line + "\n")
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def input(self, messages, event, entry, t, ms):
+        """
+        Record a batch once its handler has finished.
+
+        Args:
+            messages (list): The consumed Kafka messages
+            event (list): The connector-shaped event built from them
+            entry (str): Handler function that ran the batch
+            t (float): When the batch was handed to the handler (``elapsed_ms()``)
+            ms (float): Time the handler took, including its retries
+        """
+        with self.lock:
+            batch = self.batches
+            self.batches += 1
+        self.write(
+            "input",
+            t=t,
+            batch=batch,
+            entry=entry,
+            ms=round(ms, 3),
+            topic=messages[0].topic(),
+            partition=messages[0].partition(),
+            offsets=[messages[0].offset(), messages[-1].offset()],
+            event=event,
+        )
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        print(f"Recorded {self.counts} to {self.path}")
+
+
+class _Body:
+    """Re-readable stand-in for the botocore StreamingBody the recorder consumed."""
+    def __init__(self, payload):
+        self._payload = payload
+
+    def read(self, *args):
+        return self._payload
+
+
+class RecordingBedrockRuntime:
+    """bedrock-runtime proxy recording every ``invoke_model``; other attributes are passed through."""
+    def __init__(self, client, writer):
+        self.client = client
+        self.writer = writer
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def invoke_model(self, **kwargs):
+        started = time.monotonic()
+        t = self.writer.elapsed_ms()
+        response = self.client.invoke_model(**kwargs)
+        payload = response["body"].read()
+        headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+        self.writer.write(
+            "bedrock",
+            t=t,
+            key=bedrock_key(kwargs.get("modelId"), kwargs.get("body")),
+            model_id=kwargs.get("modelId"),
+            ms=round((time.monotonic() - started) * 1000, 3),
+            content_type=response.get("contentType"),
+            headers={name: value for name, value in headers.items() if name.startswith("x-amzn-bedrock-")},
+            body=encode_bytes(payload),
+        )
+        return dict(response, body=_Body(payload))
+
+
+class RecordingCollection:
+    """Collection proxy recording the results of reads (``MONGO_READS``)."""
+    def __init__(self, collection, db_name, collection_name, writer):
+        self.collection = collection
+        self.db_name = db_name
+        self.collection_name = collection_name
+        self.writer = writer
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+        if name not in MONGO_READS:
+            return method
+
+        def recorded(*args, **kwargs):
+            started = time.monotonic()
+            t = self.writer.elapsed_ms()
+            result = method(*args, **kwargs)
+            if name in ("find", "aggregate"):
+                result = list(result)
+            self.writer.write(
+                "mongo",
+                t=t,
+                key=mongo_key(self.db_name, self.collection_name, name, args, kwargs),
+                operation=f"{self.collection_name}.{name}",
+                ms=round((time.monotonic() - started) * 1000, 3),
+                result=result,
+            )
+            return iter(result) if name == "aggregate" else result
+        return recorded
+
+
+class RecordingDatabase:
+    def __init__(self, database, db_name, writer):
+        self.database = database
+        self.db_name = db_name
+        self.writer = writer
+
+    def __getattr__(self, name):
+        return getattr(self.database, name)
+
+    def __getitem__(self, collection_name):
+        return RecordingCollection(self.database[collection_name], self.db_name, collection_name, self.writer)
+
+    def get_collection(self, collection_name, **kwargs):
+        return RecordingCollection(
+            self.database.get_collection(collection_name, **kwargs), self.db_name, collection_name, self.writer
+        )
+
+
+class RecordingMongoClient:
+    """MongoClient proxy whose ``client[db][collection]`` reads are recorded."""
+    def __init__(self, client, writer):
+        self.client = client
+        self.writer = writer
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def __getitem__(self, db_name):
+        return RecordingDatabase(self.client[db_name], db_name, self.writer)
+
+    def get_database(self, db_name, **kwargs):
+        return RecordingDatabase(self.client.get_database(db_name, **kwargs), db_name, self.writer)
+
+
+class RecordingSNS:
+    """SNS proxy recording ``publish`` and ``publish_batch``."""
+    def __init__(self, client, writer):
+        self.client = client
+        self.writer = writer
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _call(self, operation, kwargs):
+        started = time.monotonic()
+        t = self.writer.elapsed_ms()
+        response = getattr(self.client, operation)(**kwargs)
+        self.writer.write(
+            "sns",
+            t=t,
+            key=sns_key(operation, kwargs),
+            operation=operation,
+            # Entry ids of the request, to map the recorded results onto a replayed batch
+            ids=[entry["Id"] for entry in kwargs.get("PublishBatchRequestEntries") or []],
+            ms=round((time.monotonic() - started) * 1000, 3),
+            response={name: value for name, value in response.items() if name != "ResponseMetadata"},
+        )
+        return response
+
+    def publish(self, **kwargs):
+        return self._call("publish", kwargs)
+
+    def publish_batch(self, **kwargs):
+        return self._call("publish_batch", kwargs)
+
+
+class RecordingSerializer:
+    """Avro serializer proxy recording each serialized record as an ``output``."""
+    def __init__(self, serializer, to_dict, writer):
+        self.serializer = serializer
+        self.to_dict = to_dict
+        self.writer = writer
+
+    def __call__(self, obj, ctx=None):
+        record = self.to_dict(obj, ctx) if self.to_dict else obj
+        self.writer.write("output", topic=getattr(ctx, "topic", None), value=record)
+        return self.serializer(obj, ctx)
+
+
+def install_recorder(writer, agent_backends):
+    """
+    Wrap the client factories of an agent's ``backends`` module with recorders.
+
+    Args:
+        writer (RecordingWriter): Where the calls are recorded
+        agent_backends (module): The agent's ``backends`` module; only the
+            factories it defines are wrapped
+    """
+    factories = dict(agent_backends._factories)
+
+    def bedrock_runtime(region_name=None, config=None):
+        return RecordingBedrockRuntime(factories["bedrock_runtime"](region_name=region_name, config=config), writer)
+
+    def avro_serializer(schema_registry_client, schema_str, to_dict=None):
+        serializer = factories["avro_serializer"](schema_registry_client, schema_str, to_dict)
+        return RecordingSerializer(serializer, to_dict, writer)
+
+    recorders = {
+        "bedrock_runtime": bedrock_runtime,
+        "mongo_client": lambda uri: RecordingMongoClient(factories["mongo_client"](uri), writer),
+        "sns_client": lambda: RecordingSNS(factories["sns_client"](), writer),
+        "avro_serializer": avro_serializer,
+    }
+    agent_backends.configure(**{name: recorder for name, recorder in recorders.items() if name in factories})